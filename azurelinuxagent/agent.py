@@ -26,6 +26,7 @@ from __future__ import print_function
 import json
 import os
 import re
+import signal
 import subprocess
 import sys
 import threading
@@ -94,7 +95,8 @@ class Agent(object):
         # Init log
         verbose = verbose or conf.get_logs_verbose()
         level = logger.LogLevel.VERBOSE if verbose else logger.LogLevel.INFO
-        logger.add_logger_appender(logger.AppenderType.FILE, level, path=conf.get_agent_log_file())
+        logger.add_logger_appender(logger.AppenderType.BUFFERED_FILE, level, path=conf.get_agent_log_file())
+        self.__reopen_log_files_on_sighup()
 
         # echo the log to /dev/console if the machine will be provisioned
         if conf.get_logs_console() and not ProvisionHandler.is_provisioned():
@@ -127,6 +129,14 @@ class Agent(object):
         event.init_event_logger(event_dir)
         event.enable_unhandled_err_dump("WALA")
 
+    @staticmethod
+    def __reopen_log_files_on_sighup():
+        # The log file is kept open; logrotate (or the administrator) can send SIGHUP to make the agent reopen it
+        try:
+            signal.signal(signal.SIGHUP, lambda *_: logger.reopen_log_files())
+        except ValueError as e:  # signal handlers can be set only on the main thread
+            logger.warn("Cannot reopen the log file on SIGHUP: {0}", ustr(e))
+
     def __add_console_appender(self, level):
         logger.add_logger_appender(logger.AppenderType.CONSOLE, level, path="/dev/console")
 
@@ -240,7 +250,7 @@ class Agent(object):
                 sys.exit(logcollector.INVALID_CGROUPS_ERRCODE)
 
         try:
-            log_collector = LogCollector(is_full_mode)
+            log_collector = LogCollector(is_full_mode, is_incremental=CollectLogsHandler.is_enabled_incremental_collection())
             # Running log collector resource monitoring only if agent starts the log collector.
             # If Log collector start by any other means, then it will not be monitored.
             if CollectLogsHandler.is_enabled_monitor_cgroups_check():
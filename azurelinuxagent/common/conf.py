@@ -148,6 +148,10 @@ __SWITCH_OPTIONS__ = {
     "Debug.EnableFastTrack": True,
     "Debug.EnableGAVersioning": True,
     "Debug.EnableCgroupV2ResourceLimiting": False,
+    "Debug.EnableCgroupPressureThrottling": False,
+    "Debug.EnableIncrementalLogCollection": False,
+    "Debug.EnableExtensionOutputStreaming": False,
+    "Debug.EnableAgentHandover": False,
     "Debug.EnableExtensionPolicy": False
 }
 
@@ -195,6 +199,7 @@ __INTEGER_OPTIONS__ = {
     # versions of the Agent.
     #
     "Debug.CgroupCheckPeriod": 300,
+    "Debug.CgroupSamplingPeriod": 15,
     "Debug.AgentCpuQuota": 50,
     "Debug.AgentCpuThrottledTimeThreshold": 120,
     "Debug.AgentMemoryQuota": 30 * 1024 ** 2,
@@ -202,7 +207,12 @@ __INTEGER_OPTIONS__ = {
     "Debug.AutoUpdateHotfixFrequency": 14400,
     "Debug.AutoUpdateNormalFrequency": 86400,
     "Debug.FirewallRulesLogPeriod": 86400,
-    "Debug.LogCollectorInitialDelay": 5 * 60
+    "Debug.LogCollectorInitialDelay": 5 * 60,
+    "Debug.LogCollectorCompressionLevel": 6,
+    "Debug.LogCollectorFullCollectionPeriod": 24 * 60 * 60,
+    "Debug.ExtensionsMaxParallelism": 1,
+    "Debug.MaxGoalStatePeriod": 30,
+    "Debug.StatusHeartbeatPeriod": 60
 }
 
 
@@ -405,6 +415,28 @@ def get_goal_state_period(conf=__conf__):
     return conf.get_int("Extensions.GoalStatePeriod", 6)
 
 
+def get_max_goal_state_period(conf=__conf__):
+    """
+    Once all the extensions in the goal state reach a terminal state, the agent gradually increases the time between
+    goal state checks, up to this value (in seconds). The goal state period is used again as soon as a change is
+    detected.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.MaxGoalStatePeriod", 30)
+
+
+def get_status_heartbeat_period(conf=__conf__):
+    """
+    If the VM status has not changed since the last time it was uploaded, the agent skips uploading it again until this
+    period (in seconds) has elapsed; the timestamp in the status is used as a heartbeat of the agent. A value of 0
+    makes the agent upload the status on every goal state check.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.StatusHeartbeatPeriod", 60)
+
+
 def get_initial_goal_state_period(conf=__conf__):
     return conf.get_int("Extensions.InitialGoalStatePeriod", default_value=lambda: get_goal_state_period(conf=conf))
 
@@ -557,6 +589,16 @@ def get_cgroup_check_period(conf=__conf__):
     return conf.get_int("Debug.CgroupCheckPeriod", 300)
 
 
+def get_cgroup_sampling_period(conf=__conf__):
+    """
+    How often to sample the CPU and memory usage of the tracked cgroups (in seconds). The samples taken during each
+    cgroup check period are summarized (min, max, avg and p95) and reported as metrics. A value of 0 disables sampling.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.CgroupSamplingPeriod", 15)
+
+
 def get_cgroup_log_metrics(conf=__conf__):
     """
     If True, resource usage metrics are written to the local log
@@ -685,6 +727,16 @@ def get_enable_cgroup_v2_resource_limiting(conf=__conf__):
     return conf.get_switch("Debug.EnableCgroupV2ResourceLimiting", False)
 
 
+def get_enable_cgroup_pressure_throttling(conf=__conf__):
+    """
+    If True, the agent adjusts the CPUQuota of the extensions according to the CPU pressure of the system (see
+    CpuQuotaPolicy).
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableCgroupPressureThrottling", False)
+
+
 def get_log_collector_initial_delay(conf=__conf__):
     """
     Determine the initial delay at service start before the first periodic log collection.
@@ -692,3 +744,66 @@ def get_log_collector_initial_delay(conf=__conf__):
     NOTE: This option is experimental and may be removed in later versions of the Agent.
     """
     return conf.get_int("Debug.LogCollectorInitialDelay", 5 * 60)
+
+
+def get_log_collector_compression_level(conf=__conf__):
+    """
+    Determine the zlib compression level (0-9) used by the log collector; 0 stores the files without compression.
+    Values outside that range are replaced by the default.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    level = conf.get_int("Debug.LogCollectorCompressionLevel", 6)
+    return level if 0 <= level <= 9 else 6
+
+
+def get_enable_incremental_log_collection(conf=__conf__):
+    """
+    If True, the periodic log collection archives only the data added to each file since the previous upload (see
+    get_log_collector_full_collection_period()).
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableIncrementalLogCollection", False)
+
+
+def get_log_collector_full_collection_period(conf=__conf__):
+    """
+    Determine the period (in seconds) at which the incremental log collection does a full collection.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.LogCollectorFullCollectionPeriod", 24 * 60 * 60)
+
+
+def get_enable_extension_output_streaming(conf=__conf__):
+    """
+    If True, the output of extension commands is captured through pipes instead of temporary files: only its head and
+    tail are kept in memory, and the full output is streamed to the extension's log directory.
+    Processes forked by a command (e.g. daemons started by an extension) inherit the pipes; if they still hold them
+    when the command completes, the agent keeps draining them into the same (rotated) log, but once the agent exits
+    those processes get EPIPE/SIGPIPE if they write to the pipes.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableExtensionOutputStreaming", False)
+
+
+def get_enable_agent_handover(conf=__conf__):
+    """
+    If True, when the ExtHandler exits to update the agent the daemon launches the new agent while the previous one is
+    still shutting down; the new agent waits for the previous one to exit before initializing the goal state and firewall.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_switch("Debug.EnableAgentHandover", False)
+
+
+def get_extensions_max_parallelism(conf=__conf__):
+    """
+    Maximum number of extension handlers within the same dependency level that are processed concurrently. A value of
+    1 (the default) processes all the extensions sequentially.
+
+    NOTE: This option is experimental and may be removed in later versions of the Agent.
+    """
+    return conf.get_int("Debug.ExtensionsMaxParallelism", 1)
@@ -22,7 +22,6 @@ import platform
 import re
 import sys
 import threading
-import time
 import traceback
 from datetime import datetime
 
@@ -36,6 +35,7 @@ from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.telemetryevent import TelemetryEventParam, TelemetryEvent, CommonTelemetryEventSchema, \
     GuestAgentGenericLogsSchema, GuestAgentExtensionEventsSchema, GuestAgentPerfCounterEventsSchema
 from azurelinuxagent.common.utils import fileutil, textutil
+from azurelinuxagent.common.utils.spoolutil import SegmentedSpool
 from azurelinuxagent.common.utils.textutil import parse_doc, findall, find, getattrib, str_to_encoded_ustr
 from azurelinuxagent.common.version import CURRENT_VERSION, CURRENT_AGENT, AGENT_NAME, DISTRO_NAME, DISTRO_VERSION, DISTRO_CODE_NAME, AGENT_EXECUTION_MODE
 from azurelinuxagent.common.protocol.imds import get_imds_client
@@ -61,6 +61,20 @@ MAX_NUMBER_OF_EVENTS = 1000
 AGENT_EVENT_FILE_EXTENSION = '.waagent.tld'
 EVENT_FILE_REGEX = re.compile(r'(?P<agent_event>\.waagent)?\.tld$')
 
+# The agent saves its events to a segmented spool in the events directory (see SegmentedSpool); the files in the
+# events directory matching EVENT_FILE_REGEX are events from previous versions of the agent and from extensions.
+AGENT_EVENT_SPOOL_EXTENSION = '.waagent.spool'
+MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT = 100
+
+
+def create_event_spool(event_dir):
+    return SegmentedSpool(
+        event_dir,
+        AGENT_EVENT_SPOOL_EXTENSION,
+        max_records_per_segment=MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT,
+        max_segments=MAX_NUMBER_OF_EVENTS // MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT)
+
+
 def send_logs_to_telemetry():
     return SEND_LOGS_TO_TELEMETRY
 
@@ -86,10 +100,12 @@ class WALAEventOperation:
     Downgrade = "Downgrade"
     Download = "Download"
     Enable = "Enable"
+    ExtensionCommandWait = "ExtensionCommandWait"
     ExtensionHandlerManifest = "ExtensionHandlerManifest"
     ExtensionPolicy = "ExtensionPolicy"
     ExtensionProcessing = "ExtensionProcessing"
     ExtensionTelemetryEventProcessing = "ExtensionTelemetryEventProcessing"
+    ExtHandlerRestart = "ExtHandlerRestart"
     FetchGoalState = "FetchGoalState"
     Firewall = "Firewall"
     GoalState = "GoalState"
@@ -129,6 +145,7 @@ class WALAEventOperation:
     Restart = "Restart"
     SetCGroupsLimits = "SetCGroupsLimits"
     SkipUpdate = "SkipUpdate"
+    StartupProfile = "StartupProfile"
     StatusProcessing = "StatusProcessing"
     UnhandledError = "UnhandledError"
     UnInstall = "UnInstall"
@@ -340,6 +357,15 @@ class CollectOrReportEventDebugInfo(object):
     def update_op_error(self, op_err):
         self.__op_error_count = self._update_errors_and_get_count(self.__op_error_count, self.__op_errors, op_err)
 
+    def update_dropped_events(self, count, reason):
+        """
+        Accounts for events that were dropped without an error (e.g. the oldest events are dropped to limit disk usage)
+        """
+        if count > 0:
+            self.__op_error_count += count
+            if len(self.__op_errors) < CollectOrReportEventDebugInfo.__MAX_ERRORS_TO_REPORT:
+                self.__op_errors.add(ustr(reason))
+
     def get_error_count(self):
         return self.__op_error_count + self.__unicode_error_count
 
@@ -349,6 +375,8 @@ class EventLogger(object):
         self.event_dir = None
         self.periodic_events = {}
         self.protocol = None
+        self._event_spool = None
+        self._event_spool_lock = threading.Lock()
 
         #
         # All events should have these parameters.
@@ -443,6 +471,9 @@ class EventLogger(object):
             logger.warn("Failed to get IMDS info; will be missing from telemetry: {0}", ustr(e))
 
     def save_event(self, data):
+        self.save_events([data])
+
+    def save_events(self, data_list):
         if self.event_dir is None:
             logger.warn("Cannot save event -- Event reporter is not initialized.")
             return
@@ -454,25 +485,14 @@ class EventLogger(object):
             raise EventError(msg)
 
         try:
-            existing_events = os.listdir(self.event_dir)
-            if len(existing_events) >= MAX_NUMBER_OF_EVENTS:
-                logger.periodic_warn(logger.EVERY_MINUTE, "[PERIODIC] Too many files under: {0}, current count:  {1}, "
-                                                          "removing oldest event files".format(self.event_dir,
-                                                                                               len(existing_events)))
-                existing_events.sort()
-                oldest_files = existing_events[:-999]
-                for event_file in oldest_files:
-                    os.remove(os.path.join(self.event_dir, event_file))
-        except (IOError, OSError) as e:
-            msg = "Failed to remove old events from events folder {0}. Error: {1}".format(self.event_dir, ustr(e))
-            raise EventError(msg)
-
-        filename = os.path.join(self.event_dir,
-                                ustr(int(time.time() * 1000000)))
-        try:
-            with open(filename + ".tmp", 'wb+') as hfile:
-                hfile.write(data.encode("utf-8"))
-            os.rename(filename + ".tmp", filename + AGENT_EVENT_FILE_EXTENSION)
+            # event_dir can be changed after initialization, so we re-create the spool as needed
+            with self._event_spool_lock:
+                if self._event_spool is None or self._event_spool.directory != self.event_dir:
+                    if self._event_spool is not None:
+                        self._event_spool.close()
+                    self._event_spool = create_event_spool(self.event_dir)
+                event_spool = self._event_spool
+            event_spool.append_all([data.encode("utf-8") for data in data_list])
         except (IOError, OSError) as e:
             msg = "Failed to write events to file: {0}".format(e)
             raise EventError(msg)
@@ -538,14 +558,34 @@ class EventLogger(object):
             message = "Metric {0}/{1} [{2}] = {3}".format(category, counter, instance, value)
             _log_event(AGENT_NAME, "METRIC", message, 0)
 
+        self.report_or_save_event(self._create_metric_event(category, counter, instance, value))
+
+    def add_metrics(self, metrics, log_event=False):
+        """
+        Create the telemetry events for the given metrics and save all of them in a single write.
+
+        :param metrics: List of (category, counter, instance, value) tuples; see add_metric() for a description of each item
+        :param bool log_event: If true, log the collected metrics in the agent log
+        """
+        data = []
+        for category, counter, instance, value in metrics:
+            if log_event:
+                message = "Metric {0}/{1} [{2}] = {3}".format(category, counter, instance, value)
+                _log_event(AGENT_NAME, "METRIC", message, 0)
+            data.append(json.dumps(get_properties(self._create_metric_event(category, counter, instance, value))))
+        try:
+            self.save_events(data)
+        except EventError as e:
+            logger.periodic_error(logger.EVERY_FIFTEEN_MINUTES, "[PERIODIC] {0}".format(ustr(e)))
+
+    def _create_metric_event(self, category, counter, instance, value):
         event = TelemetryEvent(TELEMETRY_METRICS_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID)
         event.parameters.append(TelemetryEventParam(GuestAgentPerfCounterEventsSchema.Category, str_to_encoded_ustr(category)))
         event.parameters.append(TelemetryEventParam(GuestAgentPerfCounterEventsSchema.Counter, str_to_encoded_ustr(counter)))
         event.parameters.append(TelemetryEventParam(GuestAgentPerfCounterEventsSchema.Instance, str_to_encoded_ustr(instance)))
         event.parameters.append(TelemetryEventParam(GuestAgentPerfCounterEventsSchema.Value, float(value)))
         self.add_common_event_parameters(event, datetime.utcnow())
-
-        self.report_or_save_event(event)
+        return event
 
     def report_or_save_event(self, event, flush=False):
         """
@@ -686,6 +726,31 @@ def report_metric(category, counter, instance, value, log_event=False, reporter=
                                                      "{0}/{1} [{2}] = {3}".format(category, counter, instance, value))
 
 
+def report_metrics(metrics, log_event=False, reporter=__event_logger__):
+    """
+    Send a batch of telemetry events reporting performance counters; the events are saved with a single write.
+    :param metrics: List of metrics; each item must have 'category', 'counter', 'instance' and 'value' attributes (see
+                    report_metric() for a description of each of them)
+    :param bool log_event: If True, log the metrics in the agent log as well
+    :param EventLogger reporter: The EventLogger instance to which metric events should be sent
+    """
+    if reporter.event_dir is None:
+        logger.warn("Cannot report metric events -- Event reporter is not initialized.")
+        for metric in metrics:
+            message = "Metric {0}/{1} [{2}] = {3}".format(metric.category, metric.counter, metric.instance, metric.value)
+            _log_event(AGENT_NAME, "METRIC", message, 0)
+        return
+    batch = []
+    for metric in metrics:
+        try:
+            batch.append((metric.category, metric.counter, metric.instance, float(metric.value)))
+        except ValueError:
+            logger.periodic_warn(logger.EVERY_HALF_HOUR, "[PERIODIC] Cannot cast the metric value. Details of the Metric - "
+                                                         "{0}/{1} [{2}] = {3}".format(metric.category, metric.counter, metric.instance, metric.value))
+    if len(batch) > 0:
+        reporter.add_metrics(batch, log_event)
+
+
 def initialize_event_logger_vminfo_common_parameters_and_protocol(protocol, reporter=__event_logger__):
     # Initialize protocal for event logger to directly send events to wireserver
     reporter.protocol = protocol
@@ -17,7 +17,11 @@
 """
 Log utils
 """
+import atexit
+import fcntl
+import os
 import sys
+import threading
 from datetime import datetime, timedelta
 from threading import current_thread
 
@@ -31,6 +35,9 @@ EVERY_HALF_HOUR = timedelta(minutes=30)
 EVERY_FIFTEEN_MINUTES = timedelta(minutes=15)
 EVERY_MINUTE = timedelta(minutes=1)
 
+# Number of times reopen_log_files() has been called; buffered appenders reopen their log file when this changes
+_log_files_generation = 0
+
 
 class Logger(object):
     """
@@ -40,6 +47,10 @@ class Logger(object):
     # This format is based on ISO-8601, Z represents UTC (Zero offset)
     LogTimeFormatInUTC = u'%Y-%m-%dT%H:%M:%S.%fZ'
 
+    # Formatting the timestamp is one of the most expensive parts of logging a message; since the agent logs several
+    # messages per second when it is busy, we cache the formatted date and time up to (and including) the seconds
+    _timestamp_cache = (None, None)
+
     def __init__(self, logger=None, prefix=None):
         self.appenders = []
         self.logger = self if logger is None else logger
@@ -135,7 +146,7 @@ class Logger(object):
             msg = msg_format.format(*args)
         else:
             msg = msg_format
-        time = datetime.utcnow().strftime(Logger.LogTimeFormatInUTC)
+        time = Logger._format_time(datetime.utcnow())
         level_str = LogLevel.STRINGS[level]
         thread_name = current_thread().name
         if self.prefix is not None:
@@ -165,6 +176,18 @@ class Logger(object):
                 # TODO: call write_log instead (see comment above)
                 #
 
+    @staticmethod
+    def _format_time(now):
+        """
+        Equivalent to now.strftime(Logger.LogTimeFormatInUTC)
+        """
+        seconds = now.replace(microsecond=0)
+        cached_seconds, formatted_seconds = Logger._timestamp_cache
+        if seconds != cached_seconds:
+            formatted_seconds = seconds.strftime(u'%Y-%m-%dT%H:%M:%S')
+            Logger._timestamp_cache = (seconds, formatted_seconds)
+        return u"{0}.{1:06d}Z".format(formatted_seconds, now.microsecond)
+
     def add_appender(self, appender_type, level, path):
         appender = _create_logger_appender(appender_type, level, path)
         self.appenders.append(appender)
@@ -219,6 +242,94 @@ class FileAppender(Appender):
                 pass
 
 
+class BufferedFileAppender(FileAppender):
+    """
+    Appends to the log file using a file descriptor that is kept open, instead of opening the file for each message.
+
+    Messages are buffered and written when a WARNING or ERROR is logged, when the buffer reaches 'max_buffer_size'
+    characters, or 'flush_interval' seconds after the first message in the buffer was logged. Before writing, the
+    appender checks whether the log file was rotated (renamed or removed) and, if so, it opens a new file. Calling
+    reopen_log_files() (e.g. when the agent receives SIGHUP) also forces the log file to be reopened.
+
+    The appender can be used concurrently by all the agent's threads.
+    """
+    def __init__(self, level, path, flush_interval=1.0, max_buffer_size=64 * 1024):
+        super(BufferedFileAppender, self).__init__(level, path)
+        self._flush_interval = flush_interval
+        self._max_buffer_size = max_buffer_size
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffer_size = 0
+        self._timer = None
+        self._fd = None
+        self._generation = _log_files_generation
+        atexit.register(self.flush)
+
+    def write(self, level, msg):
+        if self.level <= level:
+            with self._lock:
+                self._buffer.append(msg)
+                self._buffer_size += len(msg)
+                if level >= LogLevel.WARNING or self._buffer_size >= self._max_buffer_size or self._generation != _log_files_generation:
+                    self._flush()
+                elif self._timer is None:
+                    self._timer = threading.Timer(self._flush_interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.name = "LogFlush"
+                    self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._close()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self._buffer) == 0:
+            return
+        data = u"".join(self._buffer).encode("utf-8")
+        self._buffer = []
+        self._buffer_size = 0
+        try:
+            if self._fd is None or self._generation != _log_files_generation or self._is_rotated():
+                self._close()
+                self._open()
+            while len(data) > 0:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        except (IOError, OSError):
+            # same as FileAppender, errors are ignored (and the buffered messages are lost); the file is reopened on the next write
+            self._close()
+
+    def _open(self):
+        self._generation = _log_files_generation
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # do not leak the descriptor to the processes started by the agent
+        fcntl.fcntl(self._fd, fcntl.F_SETFD, fcntl.fcntl(self._fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    def _close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def _is_rotated(self):
+        try:
+            path_stat = os.stat(self.path)
+        except OSError:
+            return True
+        fd_stat = os.fstat(self._fd)
+        return (path_stat.st_dev, path_stat.st_ino) != (fd_stat.st_dev, fd_stat.st_ino)
+
+
 class StdoutAppender(Appender):
     def __init__(self, level):  # pylint: disable=W0235
         super(StdoutAppender, self).__init__(level)
@@ -266,6 +377,7 @@ class AppenderType(object):
     CONSOLE = 1
     STDOUT = 2
     TELEMETRY = 3
+    BUFFERED_FILE = 4
 
 
 def add_logger_appender(appender_type, level=LogLevel.INFO, path=None):
@@ -284,6 +396,24 @@ def reset_periodic():
     DEFAULT_LOGGER.reset_periodic()
 
 
+def reopen_log_files():
+    """
+    Makes the buffered file appenders reopen their log files before writing again (e.g. after the logs were rotated).
+    It only updates a counter, so it is safe to call from a signal handler.
+    """
+    global _log_files_generation  # pylint: disable=W0603
+    _log_files_generation += 1
+
+
+def flush():
+    """
+    Writes any messages buffered by the appenders of the default logger
+    """
+    for appender in DEFAULT_LOGGER.appenders:
+        if isinstance(appender, BufferedFileAppender):
+            appender.flush()
+
+
 def set_prefix(prefix):
     DEFAULT_LOGGER.set_prefix(prefix)
 
@@ -349,6 +479,8 @@ def _create_logger_appender(appender_type, level=LogLevel.INFO, path=None):
         return StdoutAppender(level)
     elif appender_type == AppenderType.TELEMETRY:
         return TelemetryAppender(level, path)
+    elif appender_type == AppenderType.BUFFERED_FILE:
+        return BufferedFileAppender(level, path)
     else:
         raise ValueError("Unknown appender type")
 
@@ -56,7 +56,7 @@ from azurelinuxagent.common.utils import textutil
 
 from azurelinuxagent.common.future import ustr, array_to_bytes
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
-from azurelinuxagent.common.utils.networkutil import RouteEntry, NetworkInterfaceCard
+from azurelinuxagent.common.utils.networkutil import RouteEntry, NetworkInterfaceCard, get_interface_addresses
 from azurelinuxagent.common.utils.shellutil import CommandError
 
 __RULES_FILES__ = ["/lib/udev/rules.d/75-persistent-net-generator.rules",
@@ -84,6 +84,26 @@ IFNAMSIZ = 16
 
 IP_COMMAND_OUTPUT = re.compile(r'^\d+:\s+(\w+):\s+(.*)$')
 
+PROC_MEMINFO = '/proc/meminfo'
+MEMINFO_LINE = re.compile(r'^(\S+):\s+(\d+)(\s+kB)?\s*$')
+PROC_PRESSURE = '/proc/pressure'
+
+NET_SYSFS_PATH = '/sys/class/net'
+IFF_UP = 0x1
+# Device flags (see netdevice(7)), in the order they are displayed by "ip link"; UP is displayed after the other flags
+NET_DEVICE_FLAGS = [
+    (0x8, "LOOPBACK"),
+    (0x2, "BROADCAST"),
+    (0x10, "POINTOPOINT"),
+    (0x1000, "MULTICAST"),
+    (0x80, "NOARP"),
+    (0x200, "ALLMULTI"),
+    (0x100, "PROMISC"),
+    (0x400, "MASTER"),
+    (0x800, "SLAVE"),
+    (IFF_UP, "UP")
+]
+
 STORAGE_DEVICE_PATH = '/sys/bus/vmbus/devices/'
 GEN2_DEVICE_ID = 'f8b3781a-1e82-4818-a1c3-63d806ec15bb'
 
@@ -1245,10 +1265,67 @@ class DefaultOSUtil(object):
                     break
         return system_cpu
 
+    @staticmethod
+    def get_memory_info():
+        """
+        Parses /proc/meminfo.
+
+        :return: A dictionary with the fields in /proc/meminfo (e.g. "MemTotal", "MemAvailable"); fields given in kB
+                 are converted to bytes, other fields (e.g. "HugePages_Total") are returned as-is
+        """
+        memory_info = {}
+        for line in fileutil.read_file(PROC_MEMINFO).splitlines():
+            # Sample lines:
+            #     MemTotal:        8144672 kB
+            #     HugePages_Total:       0
+            match = MEMINFO_LINE.match(line)
+            if match is not None:
+                value = int(match.group(2))
+                memory_info[match.group(1)] = value * 1024 if match.group(3) is not None else value
+        return memory_info
+
+    @staticmethod
+    def get_pressure_stall_information(resource):
+        """
+        Parses /proc/pressure/<resource> ("cpu", "memory" or "io"), e.g.
+
+            some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+            full avg10=0.00 avg60=0.00 avg300=0.00 total=0
+
+        :return: A dictionary with the "some" and "full" lines (when present) as keys, each of them a dictionary with
+                 the averages (float percentages) and the total stall time (int microseconds); None if the kernel does
+                 not support Pressure Stall Information (PSI)
+        """
+        try:
+            contents = fileutil.read_file(os.path.join(PROC_PRESSURE, resource))
+        except (IOError, OSError) as e:
+            # The file does not exist on kernels older than 4.20, and reading it fails with EOPNOTSUPP if PSI is disabled
+            if e.errno in (errno.ENOENT, errno.EOPNOTSUPP):
+                return None
+            raise
+        return DefaultOSUtil.parse_pressure_stall_information(contents)
+
+    @staticmethod
+    def parse_pressure_stall_information(contents):
+        """
+        Parses the contents of a PSI file (/proc/pressure/<resource> or <resource>.pressure in a cgroup v2 directory);
+        see get_pressure_stall_information() for the format of the return value.
+        """
+        pressure = {}
+        for line in contents.splitlines():
+            fields = line.split()
+            if len(fields) > 1:
+                values = {}
+                for name, value in (f.split("=", 1) for f in fields[1:]):
+                    values[name] = int(value) if name == "total" else float(value)
+                pressure[fields[0]] = values
+        return pressure
+
     @staticmethod
     def get_used_and_available_system_memory():
         """
-        Get the contents of free -b in bytes.
+        Get the used and available memory, computed from /proc/meminfo as done by free(1). If /proc/meminfo cannot be
+        read, falls back to the output of free -b:
         # free -b
         #              total        used        free      shared  buff/cache   available
         # Mem:     8340144128   619352064  5236809728     1499136  2483982336  7426314240
@@ -1256,6 +1333,24 @@ class DefaultOSUtil(object):
 
         :return: used and available memory in megabytes
         """
+        try:
+            memory_info = DefaultOSUtil.get_memory_info()
+            total_mem = memory_info["MemTotal"]
+            free_mem = memory_info["MemFree"]
+        except (IOError, OSError, KeyError) as e:
+            logger.verbose("Could not read {0}, will use free: {1}", PROC_MEMINFO, ustr(e))
+            return DefaultOSUtil._get_used_and_available_system_memory_from_free()
+
+        buff_cache_mem = memory_info.get("Buffers", 0) + memory_info.get("Cached", 0) + memory_info.get("SReclaimable", 0)
+        used_mem = total_mem - free_mem - buff_cache_mem
+        if used_mem < 0:
+            used_mem = total_mem - free_mem
+        # MemAvailable is not reported by kernels older than 3.14
+        available_mem = memory_info.get("MemAvailable", free_mem)
+        return used_mem/(1024 ** 2), available_mem/(1024 ** 2)
+
+    @staticmethod
+    def _get_used_and_available_system_memory_from_free():
         used_mem = available_mem = 0
         free_cmd = ["free", "-b"]
         memory = shellutil.run_command(free_cmd)
@@ -1270,10 +1365,19 @@ class DefaultOSUtil(object):
         """
         Capture NIC state (IPv4 and IPv6 addresses plus link state).
 
+        By default the state is read from /sys/class/net and from the kernel (using netlink); if that fails, or if
+        as_string is True, it is taken from the output of the ip command.
+
         :return: By default returns a dictionary of NIC state objects, with the NIC name as key. If as_string is True
                  returns the state as a string
         :rtype: dict(str,NetworkInformationCard)
         """
+        if not as_string:
+            try:
+                return self._get_nic_state_from_kernel()
+            except Exception as e:
+                logger.verbose("Could not fetch NIC state from the kernel, will use the ip command: {0}", ustr(e))
+
         state = {}
 
         all_command = ["ip", "-a", "-o", "link"]
@@ -1303,6 +1407,54 @@ class DefaultOSUtil(object):
             self._update_nic_state(state, inet6_command, NetworkInterfaceCard.add_ipv6, "an IPv6 address")
             return state
 
+    @staticmethod
+    def _get_nic_state_from_kernel():
+        state = {}
+        names_by_index = {}
+        for name in os.listdir(NET_SYSFS_PATH):
+            index, link_info = DefaultOSUtil._get_nic_link_info(name)
+            state[name] = NetworkInterfaceCard(name, link_info)
+            names_by_index[index] = name
+
+        for address in get_interface_addresses():
+            name = names_by_index.get(address.index)
+            if name is None:
+                logger.verbose("Interface with index {0} has address {1} but no link state", address.index, address)
+            elif address.family == socket.AF_INET:
+                state[name].add_ipv4(str(address))
+            else:
+                state[name].add_ipv6(str(address))
+        return state
+
+    @staticmethod
+    def _get_nic_link_info(name):
+        """
+        Reads the link state of the given NIC from /sys/class/net.
+
+        :return: A tuple with the index of the NIC and its link info, formatted similarly to the output of "ip link",
+                 e.g. "<BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 state UP link 00:0d:3a:30:c3:5a"
+        """
+        def read(attribute):
+            return fileutil.read_file(os.path.join(NET_SYSFS_PATH, name, attribute)).strip()
+
+        index = int(read("ifindex"))
+        flags = int(read("flags"), 16)
+        flag_names = [flag_name for flag_value, flag_name in NET_DEVICE_FLAGS if flags & flag_value]
+        if flags & IFF_UP:
+            try:
+                carrier = read("carrier") == "1"
+            except (IOError, OSError):  # reading the carrier fails with EINVAL if the interface is down
+                carrier = False
+            flag_names.append("LOWER_UP" if carrier else "NO-CARRIER")
+        link_info = "<{0}> mtu {1} state {2}".format(",".join(flag_names), read("mtu"), read("operstate").upper())
+        try:
+            address = read("address")
+        except (IOError, OSError):
+            address = ""
+        if address != "":
+            link_info += " link {0}".format(address)
+        return index, link_info
+
     @staticmethod
     def _update_nic_state_all(state, command_output):
         for entry in command_output.splitlines():
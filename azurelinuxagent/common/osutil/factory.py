@@ -19,27 +19,6 @@
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.version import DISTRO_NAME, DISTRO_CODE_NAME, DISTRO_VERSION, DISTRO_FULL_NAME
 from azurelinuxagent.common.utils.distro_version import DistroVersion
-from .alpine import AlpineOSUtil
-from .arch import ArchUtil
-from .bigip import BigIpOSUtil
-from .clearlinux import ClearLinuxUtil
-from .coreos import CoreOSUtil
-from .debian import DebianOSBaseUtil, DebianOSModernUtil
-from .default import DefaultOSUtil
-from .devuan import DevuanOSUtil
-from .freebsd import FreeBSDOSUtil
-from .gaia import GaiaOSUtil
-from .iosxe import IosxeOSUtil
-from .mariner import MarinerOSUtil
-from .nsbsd import NSBSDOSUtil
-from .openbsd import OpenBSDOSUtil
-from .openwrt import OpenWRTOSUtil
-from .redhat import RedhatOSUtil, Redhat6xOSUtil, RedhatOSModernUtil
-from .suse import SUSEOSUtil, SUSE11OSUtil
-from .photonos import PhotonOSUtil
-from .ubuntu import UbuntuOSUtil, Ubuntu12OSUtil, Ubuntu14OSUtil, \
-    UbuntuSnappyOSUtil, Ubuntu16OSUtil, Ubuntu18OSUtil
-from .fedora import FedoraOSUtil
 
 
 def get_osutil(distro_name=DISTRO_NAME,
@@ -54,52 +33,69 @@ def get_osutil(distro_name=DISTRO_NAME,
 
 
 def _get_osutil(distro_name, distro_code_name, distro_version, distro_full_name):
+    # The distro-specific modules are imported only when selected, to avoid loading all of them on startup
 
     if distro_name == "photonos":
+        from .photonos import PhotonOSUtil
         return PhotonOSUtil()
 
     if distro_name == "arch":
+        from .arch import ArchUtil
         return ArchUtil()
 
     if "Clear Linux" in distro_full_name:
+        from .clearlinux import ClearLinuxUtil
         return ClearLinuxUtil()
 
     if distro_name == "ubuntu":
         ubuntu_version = DistroVersion(distro_version)
         if ubuntu_version in [DistroVersion("12.04"), DistroVersion("12.10")]:
+            from .ubuntu import Ubuntu12OSUtil
             return Ubuntu12OSUtil()
         if ubuntu_version in [DistroVersion("14.04"), DistroVersion("14.10")]:
+            from .ubuntu import Ubuntu14OSUtil
             return Ubuntu14OSUtil()
         if ubuntu_version in [DistroVersion('16.04'), DistroVersion('16.10'), DistroVersion('17.04')]:
+            from .ubuntu import Ubuntu16OSUtil
             return Ubuntu16OSUtil()
         if DistroVersion('18.04') <= ubuntu_version <= DistroVersion('24.04'):
+            from .ubuntu import Ubuntu18OSUtil
             return Ubuntu18OSUtil()
         if distro_full_name == "Snappy Ubuntu Core":
+            from .ubuntu import UbuntuSnappyOSUtil
             return UbuntuSnappyOSUtil()
 
+        from .ubuntu import UbuntuOSUtil
         return UbuntuOSUtil()
 
     if distro_name == "alpine":
+        from .alpine import AlpineOSUtil
         return AlpineOSUtil()
 
     if distro_name == "kali":
+        from .debian import DebianOSBaseUtil
         return DebianOSBaseUtil()
 
     if distro_name in ("flatcar", "coreos") or distro_code_name in ("flatcar", "coreos"):
+        from .coreos import CoreOSUtil
         return CoreOSUtil()
 
     if distro_name in ("suse", "sle-micro", "sle_hpc", "sles", "opensuse"):
         if distro_full_name == 'SUSE Linux Enterprise Server' \
                 and DistroVersion(distro_version) < DistroVersion('12') \
                 or distro_full_name == 'openSUSE' and DistroVersion(distro_version) < DistroVersion('13.2'):
+            from .suse import SUSE11OSUtil
             return SUSE11OSUtil()
 
+        from .suse import SUSEOSUtil
         return SUSEOSUtil()
 
     if distro_name == "debian":
         if "sid" in distro_version or DistroVersion(distro_version) > DistroVersion("7"):
+            from .debian import DebianOSModernUtil
             return DebianOSModernUtil()
 
+        from .debian import DebianOSBaseUtil
         return DebianOSBaseUtil()
 
     # Devuan support only works with v4+ 
@@ -109,50 +105,66 @@ def _get_osutil(distro_name, distro_code_name, distro_version, distro_full_name)
     # is able to distinguish between the two.
 
     if distro_name == "devuan" and DistroVersion(distro_version) >= DistroVersion("4"):
+        from .devuan import DevuanOSUtil
         return DevuanOSUtil()
         
     if distro_name in ("redhat", "rhel", "centos", "oracle", "almalinux",
                        "cloudlinux", "rocky"):
         if DistroVersion(distro_version) < DistroVersion("7"):
+            from .redhat import Redhat6xOSUtil
             return Redhat6xOSUtil()
 
         if DistroVersion(distro_version) >= DistroVersion("8.6"):
+            from .redhat import RedhatOSModernUtil
             return RedhatOSModernUtil()
 
+        from .redhat import RedhatOSUtil
         return RedhatOSUtil()
 
     if distro_name == "euleros":
+        from .redhat import RedhatOSUtil
         return RedhatOSUtil()
 
     if distro_name == "uos":
+        from .redhat import RedhatOSUtil
         return RedhatOSUtil()
 
     if distro_name == "freebsd":
+        from .freebsd import FreeBSDOSUtil
         return FreeBSDOSUtil()
 
     if distro_name == "openbsd":
+        from .openbsd import OpenBSDOSUtil
         return OpenBSDOSUtil()
 
     if distro_name == "bigip":
+        from .bigip import BigIpOSUtil
         return BigIpOSUtil()
 
     if distro_name == "gaia":
+        from .gaia import GaiaOSUtil
         return GaiaOSUtil()
 
     if distro_name == "iosxe":
+        from .iosxe import IosxeOSUtil
         return IosxeOSUtil()
 
     if distro_name in ["mariner", "azurelinux"]:
+        from .mariner import MarinerOSUtil
         return MarinerOSUtil()
 
     if distro_name == "nsbsd":
+        from .nsbsd import NSBSDOSUtil
         return NSBSDOSUtil()
 
     if distro_name == "openwrt":
+        from .openwrt import OpenWRTOSUtil
         return OpenWRTOSUtil()
 
     if distro_name == "fedora":
+        from .fedora import FedoraOSUtil
         return FedoraOSUtil()
 
     logger.warn("Unable to load distro implementation for {0}. Using default distro implementation instead.", distro_name)
+    from .default import DefaultOSUtil
     return DefaultOSUtil()
@@ -16,11 +16,14 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 import datetime
+import hashlib
 import os
 import re
 import time
 import json
 
+from collections import namedtuple
+
 from azurelinuxagent.common import conf
 from azurelinuxagent.common import logger
 from azurelinuxagent.common.AgentGlobals import AgentGlobals
@@ -47,6 +50,14 @@ TRANSPORT_PRV_FILE_NAME = "TransportPrivate.pem"
 
 _GET_GOAL_STATE_MAX_ATTEMPTS = 6
 
+# The most recent goal state fetched from the WireServer (see GoalState._fetch_goal_state)
+_FetchedGoalState = namedtuple('_FetchedGoalState', ['xml_text', 'incarnation', 'xml_doc', 'container_id', 'role_config_name'])
+_NO_FETCHED_GOAL_STATE = _FetchedGoalState(None, None, None, None, None)
+
+# The results of the last decryption of the certificates (see Certificates._load_from_cache)
+_DecryptedCertificates = namedtuple('_DecryptedCertificates', ['lib_dir', 'digest', 'summary', 'thumbprints', 'warnings'])
+_NO_DECRYPTED_CERTIFICATES = _DecryptedCertificates(None, None, [], [], [])
+
 
 class GoalStateProperties(object):
     """
@@ -168,17 +179,19 @@ class GoalState(object):
         """
         return self._fetch_manifest("agent", "waagent.{0}".format(family_name), uris)
 
-    def fetch_extension_manifest(self, extension_name, uris):
+    def fetch_extension_manifest(self, extension_name, uris, wire_client=None):
         """
         This is a convenience method that wraps WireClient.fetch_manifest(), but adds the required 'use_verify_header' parameter and saves
-        the manifest to the history folder.
+        the manifest to the history folder. The manifest is fetched using 'wire_client' if given (e.g. the client of a thread other than
+        the one that fetched the goal state), or the client that fetched the goal state otherwise.
         """
-        return self._fetch_manifest("extension", extension_name, uris)
+        return self._fetch_manifest("extension", extension_name, uris, wire_client=wire_client)
 
-    def _fetch_manifest(self, manifest_type, name, uris):
+    def _fetch_manifest(self, manifest_type, name, uris, wire_client=None):
         try:
             is_fast_track = self.extensions_goal_state.source == GoalStateSource.FastTrack
-            xml_text = self._wire_client.fetch_manifest(manifest_type, uris, use_verify_header=is_fast_track)
+            client = self._wire_client if wire_client is None else wire_client
+            xml_text = client.fetch_manifest(manifest_type, uris, use_verify_header=is_fast_track)
             if self._save_to_history:
                 self._history.save_manifest(name, xml_text)
             return ExtensionManifest(xml_text)
@@ -341,6 +354,10 @@ class GoalState(object):
         if self._save_to_history:
             self._history.save(data, file_name)
 
+    # The most recent goal state fetched from the WireServer. The goal state is fetched every few seconds and it seldom changes, so this is
+    # used to skip parsing it when it has not changed.
+    _last_fetched_goal_state = _NO_FETCHED_GOAL_STATE
+
     @staticmethod
     def _fetch_goal_state(wire_client):
         """
@@ -353,11 +370,25 @@ class GoalState(object):
         incarnation = "unknown"
         for _ in range(0, _GET_GOAL_STATE_MAX_ATTEMPTS):
             xml_text = wire_client.fetch_config(uri, wire_client.get_header())
+
+            last_fetched = GoalState._last_fetched_goal_state
+            if last_fetched.xml_text is not None and last_fetched.xml_text == xml_text:
+                incarnation = last_fetched.incarnation
+                xml_doc = last_fetched.xml_doc
+                container_id = last_fetched.container_id
+                role_config_name = last_fetched.role_config_name
+                break
+
             xml_doc = parse_doc(xml_text)
             incarnation = findtext(xml_doc, "Incarnation")
 
             role_instance = find(xml_doc, "RoleInstance")
             if role_instance:
+                container = find(xml_doc, "Container")
+                container_id = findtext(container, "ContainerId")
+                role_config = find(role_instance, "Configuration")
+                role_config_name = findtext(role_config, "ConfigName")
+                GoalState._last_fetched_goal_state = _FetchedGoalState(xml_text, incarnation, xml_doc, container_id, role_config_name)
                 break
             time.sleep(0.5)
         else:
@@ -365,11 +396,6 @@ class GoalState(object):
 
         # Telemetry and the HostGAPlugin depend on the container id/role config; keep them up-to-date each time we fetch the goal state
         # (note that these elements can change even if the incarnation of the goal state does not change)
-        container = find(xml_doc, "Container")
-        container_id = findtext(container, "ContainerId")
-        role_config = find(role_instance, "Configuration")
-        role_config_name = findtext(role_config, "ConfigName")
-
         AgentGlobals.update_container_id(container_id)  # Telemetry uses this global to pick up the container id
 
         wire_client.update_host_plugin(container_id, role_config_name)
@@ -512,6 +538,11 @@ class SharedConfig(object):
 
 
 class Certificates(object):
+    # Results of the last decryption (the digest is that of the certificates XML). The certificates rarely change across
+    # goal states, so when the XML is the same and the .crt/.prv files produced by the previous decryption are still on
+    # disk we can skip invoking openssl again.
+    _cache = _NO_DECRYPTED_CERTIFICATES
+
     def __init__(self, xml_text, my_logger):
         self.cert_list = CertList()
         self.summary = []  # debugging info
@@ -521,6 +552,10 @@ class Certificates(object):
         local_file = os.path.join(conf.get_lib_dir(), CERTS_FILE_NAME)
         fileutil.write_file(local_file, xml_text)
 
+        digest = hashlib.sha256(xml_text.encode("utf-8")).hexdigest()
+        if self._load_from_cache(digest):
+            return
+
         # Separate the certificates into individual files.
         xml_doc = parse_doc(xml_text)
         data = findtext(xml_doc, "Data")
@@ -560,7 +595,8 @@ class Certificates(object):
         v1_cert_list = []
 
         # Ensure pem_file exists before read the certs data since decrypt_p7m may clear the pem_file wen decryption fails
-        if os.path.exists(pem_file):
+        decrypted = os.path.exists(pem_file)
+        if decrypted:
             with open(pem_file) as pem:
                 for line in pem.readlines():
                     buf.append(line)
@@ -606,6 +642,34 @@ class Certificates(object):
             set_properties("certs", cert, v1_cert)
             self.cert_list.certificates.append(cert)
 
+        # Cache only successful decryptions, so that a failure (e.g. a transient error in openssl) is retried on the next goal state
+        if decrypted and len(v1_cert_list) > 0:
+            Certificates._cache = _DecryptedCertificates(conf.get_lib_dir(), digest, list(self.summary), [c["thumbprint"] for c in v1_cert_list], list(self.warnings))
+        else:
+            Certificates._cache = _NO_DECRYPTED_CERTIFICATES
+
+    def _load_from_cache(self, digest):
+        """
+        Populates the certificates from the results of the previous decryption if the certificates XML has not changed
+        and the files for all the certificates are still present; returns True on success.
+        """
+        cache = Certificates._cache
+        lib_dir = conf.get_lib_dir()
+        if cache.digest is None or cache.lib_dir != lib_dir or cache.digest != digest:
+            return False
+        for item in cache.summary:
+            if not os.path.isfile(os.path.join(lib_dir, "{0}.crt".format(item["thumbprint"]))):
+                return False
+            if item["hasPrivateKey"] and not os.path.isfile(os.path.join(lib_dir, "{0}.prv".format(item["thumbprint"]))):
+                return False
+        self.summary = [dict(item) for item in cache.summary]
+        self.warnings = list(cache.warnings)
+        for thumbprint in cache.thumbprints:
+            cert = Cert()
+            set_properties("certs", cert, {"name": None, "thumbprint": thumbprint})
+            self.cert_list.certificates.append(cert)
+        return True
+
     @staticmethod
     def _write_to_tmp_file(index, suffix, buf):
         file_name = os.path.join(conf.get_lib_dir(), "{0}.{1}".format(index, suffix))
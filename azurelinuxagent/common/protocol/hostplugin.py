@@ -258,7 +258,8 @@ class HostPluginProtocol(object):
     def put_vm_log(self, content):
         """
         Try to upload VM logs, a compressed zip file, via the host plugin /vmAgentLog channel.
-        :param content: the binary content of the zip file to upload
+        :param content: the binary content of the zip file to upload, or the zip file itself (a file object opened in
+                        binary mode, which is streamed from its current position)
         """
         if not self.ensure_initialized():
             raise ProtocolError("HostGAPlugin: HostGAPlugin is not available")
@@ -328,44 +329,45 @@ class HostPluginProtocol(object):
         status_size = int((len(status) + 511) / 512) * 512
         status = bytearray(status_blob.data.ljust(status_size), encoding='utf-8')
 
+        # Upload only the pages that changed since the last upload, if possible
+        create, ranges = status_blob.get_page_blob_ranges(sas_url, status, MAXIMUM_PAGEBLOB_PAGE_SIZE)
+        if not create and len(ranges) == 0:
+            logger.verbose("HostGAPlugin: The PageBlob has not changed")
+            return
+
+        status_blob.set_uploaded_page_blob(sas_url, None)
+
         # First, initialize an empty blob
-        response = restutil.http_put(url,
-                                     data=self._build_status_data(
-                                         sas_url,
-                                         status_blob.get_page_blob_create_headers(status_size)),
-                                     headers=self._build_status_headers())
+        if create:
+            response = restutil.http_put(url,
+                                         data=self._build_status_data(
+                                             sas_url,
+                                             status_blob.get_page_blob_create_headers(status_size)),
+                                         headers=self._build_status_headers())
+
+            if restutil.request_failed(response):
+                error_response = restutil.read_response_error(response)
+                is_healthy = not restutil.request_failed_at_hostplugin(response)
+                self.report_status_health(is_healthy=is_healthy, response=error_response)
+                raise HttpError("HostGAPlugin: Failed PageBlob clean-up: {0}"
+                                .format(error_response))
+            else:
+                self.report_status_health(is_healthy=True)
+                logger.verbose("HostGAPlugin: PageBlob clean-up succeeded")
 
-        if restutil.request_failed(response):
-            error_response = restutil.read_response_error(response)
-            is_healthy = not restutil.request_failed_at_hostplugin(response)
-            self.report_status_health(is_healthy=is_healthy, response=error_response)
-            raise HttpError("HostGAPlugin: Failed PageBlob clean-up: {0}"
-                            .format(error_response))
-        else:
-            self.report_status_health(is_healthy=True)
-            logger.verbose("HostGAPlugin: PageBlob clean-up succeeded")
-        
         # Then, upload the blob in pages
         if sas_url.count("?") <= 0:
-            sas_url = "{0}?comp=page".format(sas_url)
+            page_sas_url = "{0}?comp=page".format(sas_url)
         else:
-            sas_url = "{0}&comp=page".format(sas_url)
-
-        start = 0
-        end = 0
-        while start < len(status):
-            # Create the next page
-            end = start + min(len(status) - start, MAXIMUM_PAGEBLOB_PAGE_SIZE)
-            page_size = int((end - start + 511) / 512) * 512
-            buf = bytearray(page_size)
-            buf[0: end - start] = status[start: end]
+            page_sas_url = "{0}&comp=page".format(sas_url)
 
+        for start, end in ranges:
             # Send the page
             response = restutil.http_put(url,
                                          data=self._build_status_data(
-                                             sas_url,
+                                             page_sas_url,
                                              status_blob.get_page_blob_page_headers(start, end),
-                                             buf),
+                                             status[start:end]),
                                          headers=self._build_status_headers())
 
             if restutil.request_failed(response):
@@ -376,9 +378,10 @@ class HostPluginProtocol(object):
                     "HostGAPlugin Error: Put PageBlob bytes "
                     "[{0},{1}]: {2}".format(start, end, error_response))
 
-            # Advance to the next page (if any)
-            start = end
-        
+        if not create:
+            self.report_status_health(is_healthy=True)
+        status_blob.set_uploaded_page_blob(sas_url, status)
+
     def _build_status_data(self, sas_url, blob_headers, content=None):
         headers = []
         for name in iter(blob_headers.keys()):
@@ -16,6 +16,8 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 
+import base64
+import hashlib
 import json
 import os
 import random
@@ -23,7 +25,6 @@ import shutil
 import time
 import zipfile
 
-from collections import defaultdict
 from datetime import datetime, timedelta
 from xml.sax import saxutils
 
@@ -137,8 +138,8 @@ class WireProtocol(DataContract):
         self.client.status_blob.set_vm_status(vm_status)
         self.client.upload_status_blob()
 
-    def report_event(self, events_iterator, flush=False):
-        return self.client.report_event(events_iterator, flush)
+    def report_event(self, events_iterator, flush=False, acknowledge=None):
+        return self.client.report_event(events_iterator, flush, acknowledge)
 
     def upload_logs(self, logs):
         self.client.upload_logs(logs)
@@ -394,12 +395,54 @@ def vm_status_to_v1(vm_status):
     return v1_vm_status
 
 
+def get_vm_status_digest(v1_vm_status):
+    """
+    Returns a digest of the given status (as returned by vm_status_to_v1) that ignores the timestamps set to the time
+    the status was created, so that the digest changes only when the actual content of the status changes.
+    """
+    status = dict(v1_vm_status)
+    status.pop('timestampUTC', None)
+    aggregate_status = dict(status['aggregateStatus'])
+    handler_status_list = []
+    for handler_status in aggregate_status['handlerAggregateStatus']:
+        if 'runtimeSettingsStatus' in handler_status:
+            handler_status = dict(handler_status)
+            runtime_settings_status = dict(handler_status['runtimeSettingsStatus'])
+            settings_status = dict(runtime_settings_status['settingsStatus'])
+            settings_status.pop('timestampUTC', None)
+            runtime_settings_status['settingsStatus'] = settings_status
+            handler_status['runtimeSettingsStatus'] = runtime_settings_status
+        handler_status_list.append(handler_status)
+    aggregate_status['handlerAggregateStatus'] = handler_status_list
+    status['aggregateStatus'] = aggregate_status
+    return hashlib.sha256(json.dumps(status, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+
+def _create_md5_hash():
+    # MD5 is used only to detect corrupted downloads (as Azure Storage does with Content-MD5), not for security; it may be unavailable
+    # (e.g. when OpenSSL is in FIPS mode), in which case the downloads are not verified using Content-MD5
+    try:
+        try:
+            return hashlib.md5(usedforsecurity=False)  # Python 3.9+
+        except TypeError:
+            return hashlib.md5()
+    except Exception as exception:
+        logger.verbose("MD5 is not available; cannot verify Content-MD5: {0}", ustr(exception))
+        return None
+
+
 class StatusBlob(object):
+    PAGE_SIZE = 512
+
     def __init__(self, client):
         self.vm_status = None
         self.client = client
         self.type = None
         self.data = None
+        self.digest = None
+        # URL and content of the last page blob uploaded successfully; used to upload only the pages that changed
+        self._uploaded_page_blob = None
 
     def set_vm_status(self, vm_status):
         validate_param("vmAgent", vm_status, VMStatus)
@@ -413,7 +456,9 @@ class StatusBlob(object):
 
     def prepare(self, blob_type):
         logger.verbose("Prepare status blob")
-        self.data = self.to_json()
+        report = vm_status_to_v1(self.vm_status)
+        self.data = json.dumps(report)
+        self.digest = get_vm_status_digest(report)
         self.type = blob_type
 
     def upload(self, url):
@@ -466,73 +511,188 @@ class StatusBlob(object):
             "x-ms-version": self.__class__.__storage_version__
         }
 
+    def get_page_blob_ranges(self, url, content, max_range_size):
+        """
+        Returns the byte ranges of the given page blob content (a bytearray whose size is a multiple of PAGE_SIZE) that
+        need to be uploaded, as a list of (start, end) tuples, together with a flag indicating whether the blob needs to
+        be (re)created first. If the last successful upload was to the same URL and had the same size, only the pages
+        that changed are returned (possibly none); otherwise, the ranges cover the entire content.
+
+        Contiguous pages are merged into a single range of up to max_range_size bytes.
+        """
+        previous = None
+        if self._uploaded_page_blob is not None:
+            uploaded_url, uploaded_content = self._uploaded_page_blob
+            if uploaded_url == url and len(uploaded_content) == len(content):
+                if uploaded_content == content:
+                    return False, []
+                previous = uploaded_content
+
+        ranges = []
+        start = None
+        for offset in range(0, len(content), StatusBlob.PAGE_SIZE):
+            end = offset + StatusBlob.PAGE_SIZE
+            if previous is None or content[offset:end] != previous[offset:end]:
+                if start is None:
+                    start = offset
+                elif offset - start >= max_range_size:
+                    ranges.append((start, offset))
+                    start = offset
+            elif start is not None:
+                ranges.append((start, offset))
+                start = None
+        if start is not None:
+            ranges.append((start, len(content)))
+
+        return previous is None, ranges
+
+    def set_uploaded_page_blob(self, url, content):
+        """
+        Records the content of the last successful page blob upload; content should be None if the upload failed, since
+        the state of the blob is unknown in that case.
+        """
+        self._uploaded_page_blob = None if content is None else (url, bytes(content))
+
     def put_page_blob(self, url, data):
         logger.verbose("Put page blob")
 
         # Convert string into bytes and align to 512 bytes
         data = bytearray(data, encoding='utf-8')
         page_blob_size = int((len(data) + 511) / 512) * 512
+        data.extend(bytearray(page_blob_size - len(data)))
 
-        headers = self.get_page_blob_create_headers(page_blob_size)
-        resp = self.client.call_storage_service(restutil.http_put, url, "", headers)
-        if resp.status != httpclient.CREATED:
-            raise UploadError(
-                "Failed to clean up page blob: {0}".format(resp.status))
+        page_max = 4 * 1024 * 1024  # Max page size: 4MB
+        create, ranges = self.get_page_blob_ranges(url, data, page_max)
+        if not create and len(ranges) == 0:
+            logger.verbose("The page blob has not changed")
+            return
+
+        self.set_uploaded_page_blob(url, None)
+
+        if create:
+            headers = self.get_page_blob_create_headers(page_blob_size)
+            resp = self.client.call_storage_service(restutil.http_put, url, "", headers)
+            if resp.status != httpclient.CREATED:
+                raise UploadError(
+                    "Failed to clean up page blob: {0}".format(resp.status))
 
         if url.count("?") <= 0:
-            url = "{0}?comp=page".format(url)
+            page_url = "{0}?comp=page".format(url)
         else:
-            url = "{0}&comp=page".format(url)
+            page_url = "{0}&comp=page".format(url)
 
-        logger.verbose("Upload page blob")
-        page_max = 4 * 1024 * 1024  # Max page size: 4MB
-        start = 0
-        end = 0
-        while end < len(data):
-            end = min(len(data), start + page_max)
-            content_size = end - start
-            # Align to 512 bytes
-            page_end = int((end + 511) / 512) * 512
-            buf_size = page_end - start
-            buf = bytearray(buf_size)
-            buf[0: content_size] = data[start: end]
-            headers = self.get_page_blob_page_headers(start, page_end)
+        logger.verbose("Upload page blob ({0} ranges)", len(ranges))
+        for start, end in ranges:
+            headers = self.get_page_blob_page_headers(start, end)
             resp = self.client.call_storage_service(
                 restutil.http_put,
-                url,
-                bytebuffer(buf),
+                page_url,
+                bytebuffer(data[start:end]),
                 headers)
             if resp is None or resp.status != httpclient.CREATED:
                 raise UploadError(
                     "Failed to upload page blob: {0}".format(resp.status))
-            start = end
+
+        self.set_uploaded_page_blob(url, data)
+
+
+# Type attribute ('T') of the parameters in the v1 telemetry format, indexed by the type of the parameter's value
+_V1_PARAM_TYPES = {
+    int: ustr(' T="mt:uint64" />'),
+    str: ustr(' T="mt:wstr" />'),
+    ustr: ustr(' T="mt:wstr" />'),
+    bool: ustr(' T="mt:bool" />'),
+    float: ustr(' T="mt:float64" />')
+}
+_V1_PARAM_UNKNOWN_TYPE = ustr(' T="" />')
+
+# Cache for the start of the v1 encoding of a parameter ('<Param Name="..." Value='); parameter names come from the
+# telemetry schemas, so the number of distinct names is small, but we limit the size of the cache anyway since names
+# in legacy events are not validated
+_V1_PARAM_PREFIXES = {}
+_MAX_V1_PARAM_PREFIXES = 256
+
+# Cache for the v1 encoding of parameters with short values; most of the parameters common to all events (VM name,
+# OS version, etc.) do not change during the lifetime of the agent, and escaping their values is the most expensive
+# part of encoding an event. The cache is cleared when it reaches its maximum size.
+_V1_PARAMS = {}
+_MAX_V1_PARAMS = 4096
+_MAX_V1_CACHED_VALUE_LENGTH = 128
+
+
+def _get_v1_param_prefix(name):
+    prefix = _V1_PARAM_PREFIXES.get(name)
+    if prefix is None:
+        prefix = ustr('<Param Name="{0}" Value=').format(name)
+        if len(_V1_PARAM_PREFIXES) < _MAX_V1_PARAM_PREFIXES:
+            _V1_PARAM_PREFIXES[name] = prefix
+    return prefix
+
+
+def _encode_v1_param(name, value, value_type):
+    return ustr('').join([_get_v1_param_prefix(name), saxutils.quoteattr(ustr(value)), _V1_PARAM_TYPES.get(value_type, _V1_PARAM_UNKNOWN_TYPE)])
+
+
+def _append_v1_param(param, parts):
+    value = param.value
+    value_type = type(value)
+    if value_type is int or value_type is bool:
+        cacheable = True
+    elif value_type is str or value_type is ustr:
+        cacheable = len(value) <= _MAX_V1_CACHED_VALUE_LENGTH
+    else:
+        cacheable = False
+    if not cacheable:
+        parts.append(_encode_v1_param(param.name, value, value_type))
+        return
+    # the type is part of the key since, for example, True == 1
+    key = (param.name, value_type, value)
+    encoded = _V1_PARAMS.get(key)
+    if encoded is None:
+        encoded = _encode_v1_param(param.name, value, value_type)
+        if len(_V1_PARAMS) >= _MAX_V1_PARAMS:
+            _V1_PARAMS.clear()
+        _V1_PARAMS[key] = encoded
+    parts.append(encoded)
 
 
 def event_param_to_v1(param):
-    param_format = ustr('<Param Name="{0}" Value={1} T="{2}" />')
-    param_type = type(param.value)
-    attr_type = ""
-    if param_type is int:
-        attr_type = 'mt:uint64'
-    elif param_type is str:
-        attr_type = 'mt:wstr'
-    elif ustr(param_type).count("'unicode'") > 0:
-        attr_type = 'mt:wstr'
-    elif param_type is bool:
-        attr_type = 'mt:bool'
-    elif param_type is float:
-        attr_type = 'mt:float64'
-    return param_format.format(param.name,
-                               saxutils.quoteattr(ustr(param.value)),
-                               attr_type)
+    parts = []
+    _append_v1_param(param, parts)
+    return ustr('').join(parts)
 
 
 def event_to_v1_encoded(event, encoding='utf-8'):
-    params = ""
+    parts = [ustr('<Event id="{0}"><![CDATA[').format(event.eventId)]
     for param in event.parameters:
-        params += event_param_to_v1(param)
-    event_str = ustr('<Event id="{0}"><![CDATA[{1}]]></Event>').format(event.eventId, params)
-    return event_str.encode(encoding)
+        _append_v1_param(param, parts)
+    parts.append(ustr(']]></Event>'))
+    return ustr('').join(parts).encode(encoding)
+
+
+class _TelemetryBatch(object):
+    """
+    Accumulates the encoded events of a telemetry provider. The encoded events are kept as a list of chunks that is
+    joined only once, when the batch is sent, instead of concatenating them as they are added.
+    """
+    def __init__(self):
+        self.events = []
+        self._chunks = []
+        self._size = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def can_add(self, event_str):
+        return self._size + len(event_str) < MAX_EVENT_BUFFER_SIZE
+
+    def add(self, event, event_str):
+        self.events.append(event)
+        self._chunks.append(event_str)
+        self._size += len(event_str)
+
+    def get_data(self):
+        return b"".join(self._chunks)
 
 
 class WireClient(object):
@@ -543,6 +703,8 @@ class WireClient(object):
         self._goal_state = None
         self._host_plugin = None
         self.status_blob = StatusBlob(self)
+        # URL, blob type, digest and time of the last successful status upload
+        self._last_status_upload = None
 
     def get_endpoint(self):
         return self._endpoint
@@ -618,6 +780,9 @@ class WireClient(object):
         Downloads the ZIP package specified in 'uris' (which is a list of alternate locations for the ZIP), saving it to 'target_file' and then expanding
         its contents to 'target_directory'. Deletes the target file after it has been expanded.
 
+        The package is verified before it is expanded: the download fails if it is incomplete or if it does not match the Content-MD5 header of the
+        response (see stream()), in which case the next URI or channel is tried.
+
         The 'package_type' is only used in log messages and has no other semantics. It should specify the contents of the ZIP, e.g. "extension package"
         or "agent package"
 
@@ -701,20 +866,42 @@ class WireClient(object):
 
     def stream(self, uri, destination, headers=None, use_proxy=None):
         """
-        Downloads the content of the given 'uri' and saves it to the 'destination' file.
+        Downloads the content of the given 'uri' and saves it to the 'destination' file. Raises an exception (and deletes the file) if the size
+        of the content does not match the Content-Length of the response or, if the response includes a Content-MD5 header (Azure Storage
+        returns it for blobs that have an MD5 hash), if the MD5 hash of the content does not match it.
         """
         try:
             logger.verbose("Fetch [{0}] with headers [{1}] to file [{2}]", uri, headers, destination)
 
+            digest = _create_md5_hash()
             response = self._fetch_response(uri, headers, use_proxy)
             if response is not None and not restutil.request_failed(response):
                 chunk_size = 1024 * 1024  # 1MB buffer
+                size = 0
                 with open(destination, 'wb', chunk_size) as destination_fh:
                     complete = False
                     while not complete:
                         chunk = response.read(chunk_size)
                         destination_fh.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        size += len(chunk)
                         complete = len(chunk) < chunk_size
+
+                content_length = None
+                content_md5 = None
+                for name, value in response.getheaders():
+                    if name.lower() == "content-length":
+                        content_length = int(value)
+                    elif name.lower() == "content-md5":
+                        content_md5 = value.strip()
+                if content_length is not None and size != content_length:
+                    raise ProtocolError("Incomplete download from [{0}]: received {1} bytes, expected {2}".format(uri, size, content_length))
+                if content_md5 is not None and digest is not None:
+                    md5 = base64.b64encode(digest.digest()).decode('ascii')
+                    if md5 != content_md5:
+                        raise ProtocolError("The MD5 hash of the content downloaded from [{0}] does not match its Content-MD5 header; got {1}, expected {2}".format(uri, md5, content_md5))
+
             return ""
         except:
             if os.path.exists(destination):  # delete the destination file, in case we did a partial download
@@ -959,6 +1146,10 @@ class WireClient(object):
         except Exception as e:
             raise ProtocolError("Exception creating status blob: {0}".format(ustr(e)))
 
+        if self._is_status_upload_redundant(extensions_goal_state.status_upload_blob, blob_type):
+            logger.verbose("The VM status has not changed since the last upload; skipping upload")
+            return
+
         # Swap the order of use for the HostPlugin vs. the "direct" route.
         # Prefer the use of HostPlugin. If HostPlugin fails fall back to the
         # direct route.
@@ -971,6 +1162,7 @@ class WireClient(object):
         try:
             host = self.get_host_plugin()
             host.put_vm_status(self.status_blob, extensions_goal_state.status_upload_blob, extensions_goal_state.status_upload_blob_type)
+            self._set_last_status_upload(extensions_goal_state.status_upload_blob, blob_type)
             return
         except ResourceGoneError:
             # refresh the host plugin client and try again on the next iteration of the main loop
@@ -983,6 +1175,7 @@ class WireClient(object):
 
         try:
             if self.status_blob.upload(extensions_goal_state.status_upload_blob):
+                self._set_last_status_upload(extensions_goal_state.status_upload_blob, blob_type)
                 return
         except Exception as e:
             msg = "Exception uploading status blob: {0}".format(ustr(e))
@@ -990,6 +1183,23 @@ class WireClient(object):
 
         raise ProtocolError("Failed to upload status blob via either channel")
 
+    def _is_status_upload_redundant(self, url, blob_type):
+        """
+        Returns True if the status blob prepared for upload has the same content as the last status uploaded to the
+        given blob and that upload happened less than the status heartbeat period ago. The status is uploaded at least
+        once per heartbeat period even if it did not change, since its timestamp indicates that the agent is alive.
+        """
+        if self._last_status_upload is None:
+            return False
+        last_url, last_blob_type, last_digest, last_upload_time = self._last_status_upload
+        if last_url != url or last_blob_type != blob_type or last_digest != self.status_blob.digest:
+            return False
+        elapsed = time.time() - last_upload_time
+        return 0 <= elapsed < conf.get_status_heartbeat_period()
+
+    def _set_last_status_upload(self, url, blob_type):
+        self._last_status_upload = (url, blob_type, self.status_blob.digest, time.time())
+
     def report_role_prop(self, thumbprint):
         goal_state = self.get_goal_state()
         role_prop = _build_role_properties(goal_state.container_id,
@@ -1047,7 +1257,7 @@ class WireClient(object):
         data_format_footer = ustr('</Provider></TelemetryData>').encode(encoding)
         # Event string should already be encoded by the time it gets here, to avoid double encoding,
         # dividing it into parts.
-        data = data_format_header + event_str + data_format_footer
+        data = b"".join([data_format_header, event_str, data_format_footer])
         try:
             header = self.get_header_for_xml_content()
             # NOTE: The call to wireserver requests utf-8 encoding in the headers, but the body should not
@@ -1066,14 +1276,32 @@ class WireClient(object):
             raise ProtocolError(
                 "Failed to send events:{0}".format(resp.status))
 
-    def report_event(self, events_iterator, flush=False):
-        buf = {}
+    def report_event(self, events_iterator, flush=False, acknowledge=None):
+        """
+        Sends the given events to the WireServer, batching them by provider.
+
+        If 'acknowledge' is given, it is invoked with the list of events in each batch that is sent successfully, as
+        well as with the events that are dropped because they can never be sent (e.g. they are too large); the events
+        that are not acknowledged can be sent again later.
+
+        Returns True if all the events were sent successfully.
+        """
+        batches = {}
         debug_info = CollectOrReportEventDebugInfo(operation=CollectOrReportEventDebugInfo.OP_REPORT)
-        events_per_provider = defaultdict(int)
+
+        def _acknowledge(events):
+            if acknowledge is not None and len(events) > 0:
+                try:
+                    acknowledge(events)
+                except Exception as error:
+                    logger.warn("Unexpected error when acknowledging events: {0}", textutil.format_exception(error))
 
         def _send_event(provider_id, debug_info, flush):
+            batch = batches.pop(provider_id)
+            logger.verbose("No of events this request = {0}".format(len(batch)))
             try:
-                self._send_encoded_event(provider_id, buf[provider_id], flush)
+                self._send_encoded_event(provider_id, batch.get_data(), flush)
+                _acknowledge(batch.events)
             except UnicodeError as uni_error:
                 debug_info.update_unicode_error(uni_error)
             except Exception as error:
@@ -1082,8 +1310,6 @@ class WireClient(object):
         # Group events by providerId
         for event in events_iterator:
             try:
-                if event.providerId not in buf:
-                    buf[event.providerId] = b""
                 event_str = event_to_v1_encoded(event)
 
                 if len(event_str) >= MAX_EVENT_BUFFER_SIZE:
@@ -1095,27 +1321,25 @@ class WireClient(object):
                     logger.periodic_warn(logger.EVERY_HALF_HOUR,
                                          "Single event too large: {0}, with the length: {1} more than the limit({2})"
                                          .format(str(details_of_event), len(event_str), MAX_EVENT_BUFFER_SIZE))
+                    _acknowledge([event])
                     continue
 
-                # If buffer is full, send out the events in buffer and reset buffer
-                if len(buf[event.providerId] + event_str) >= MAX_EVENT_BUFFER_SIZE:
-                    logger.verbose("No of events this request = {0}".format(events_per_provider[event.providerId]))
+                # If the batch is full, send out its events and start a new batch
+                if event.providerId in batches and not batches[event.providerId].can_add(event_str):
                     _send_event(event.providerId, debug_info, flush)
-                    buf[event.providerId] = b""
-                    events_per_provider[event.providerId] = 0
 
-                # Add encoded events to the buffer
-                buf[event.providerId] = buf[event.providerId] + event_str
-                events_per_provider[event.providerId] += 1
+                if event.providerId not in batches:
+                    batches[event.providerId] = _TelemetryBatch()
+                batches[event.providerId].add(event, event_str)
 
             except Exception as error:
                 logger.warn("Unexpected error when generating Events:{0}", textutil.format_exception(error))
+                # the event cannot be encoded, so there is no point in sending it again
+                _acknowledge([event])
 
-        # Send out all events left in buffer.
-        for provider_id in list(buf.keys()):
-            if buf[provider_id]:
-                logger.verbose("No of events this request = {0}".format(events_per_provider[provider_id]))
-                _send_event(provider_id, debug_info, flush)
+        # Send out all events left in the batches.
+        for provider_id in list(batches.keys()):
+            _send_event(provider_id, debug_info, flush)
 
         debug_info.report_debug_info()
 
@@ -18,6 +18,7 @@
 #
 
 import base64
+import binascii
 import errno
 import struct
 import os.path
@@ -32,6 +33,26 @@ import azurelinuxagent.common.utils.shellutil as shellutil
 
 DECRYPT_SECRET_CMD = "{0} cms -decrypt -inform DER -inkey {1} -in /dev/stdin"
 
+# The cryptography module is optional; if it is available public keys and thumbprints are computed in-process
+# instead of invoking openssl
+try:
+    from cryptography import x509  # pylint: disable=import-error
+    from cryptography.hazmat.backends import default_backend  # pylint: disable=import-error
+    from cryptography.hazmat.primitives import hashes, serialization  # pylint: disable=import-error
+    _CRYPTOGRAPHY_AVAILABLE = True
+except Exception:
+    _CRYPTOGRAPHY_AVAILABLE = False
+
+
+def _read_pem_file(file_name):
+    with open(file_name, "rb") as pem_file:
+        return pem_file.read()
+
+
+def _public_key_to_pem(public_key):
+    # Same format as the output of 'openssl rsa/pkey/x509 ... -pubout'
+    return ustr(public_key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo), encoding="ascii")
+
 
 class CryptUtil(object):
     def __init__(self, openssl_cmd):
@@ -54,6 +75,13 @@ class CryptUtil(object):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
 
+        if _CRYPTOGRAPHY_AVAILABLE:
+            try:
+                private_key = serialization.load_pem_private_key(_read_pem_file(file_name), password=None, backend=default_backend())
+                return _public_key_to_pem(private_key.public_key())
+            except Exception as e:
+                logger.verbose("Failed to get the public key from {0} using the cryptography module, will use openssl: {1}", file_name, ustr(e))
+
         # OpenSSL's pkey command may not be available on older versions so try 'rsa' first.
         try:
             command = [self.openssl_cmd, "rsa", "-in", file_name, "-pubout"]
@@ -73,6 +101,13 @@ class CryptUtil(object):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
         else:
+            if _CRYPTOGRAPHY_AVAILABLE:
+                try:
+                    certificate = x509.load_pem_x509_certificate(_read_pem_file(file_name), default_backend())
+                    return _public_key_to_pem(certificate.public_key())
+                except Exception as e:
+                    logger.verbose("Failed to get the public key from {0} using the cryptography module, will use openssl: {1}", file_name, ustr(e))
+
             cmd = [self.openssl_cmd, "x509", "-in", file_name, "-pubkey", "-noout"]
             pub = shellutil.run_command(cmd, log_error=True)
             return pub
@@ -81,6 +116,14 @@ class CryptUtil(object):
         if not os.path.exists(file_name):
             raise IOError(errno.ENOENT, "File not found", file_name)
         else:
+            if _CRYPTOGRAPHY_AVAILABLE:
+                try:
+                    certificate = x509.load_pem_x509_certificate(_read_pem_file(file_name), default_backend())
+                    # Same as 'openssl x509 -fingerprint', which uses SHA1
+                    return ustr(binascii.hexlify(certificate.fingerprint(hashes.SHA1())), encoding="ascii").upper()
+                except Exception as e:
+                    logger.verbose("Failed to get the thumbprint of {0} using the cryptography module, will use openssl: {1}", file_name, ustr(e))
+
             cmd = [self.openssl_cmd, "x509", "-in", file_name, "-fingerprint", "-noout"]
             thumbprint = shellutil.run_command(cmd)
             thumbprint = thumbprint.rstrip().split('=')[1].replace(':', '').upper()
@@ -0,0 +1,143 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import time
+
+from azurelinuxagent.common import logger
+from azurelinuxagent.common.future import ustr
+
+# Flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events that indicate that the content of a file in the directory may have changed. Extensions usually write their
+# status files in place (IN_MODIFY/IN_CLOSE_WRITE) or write a temporary file and rename it (IN_MOVED_TO).
+_DIRECTORY_CHANGE_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_libc = None
+
+
+def _get_libc():
+    global _libc  # pylint: disable=W0603
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        # Raises AttributeError if the C library does not implement inotify
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+class InotifyDirectoryWatcher(object):
+    """
+    Watches a directory using inotify; wait() returns as soon as any file in the directory is created, modified,
+    renamed into it or deleted.
+    """
+    def __init__(self, path):
+        libc = _get_libc()
+        self._path = path
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1 failed: {0}".format(os.strerror(err)))
+        if libc.inotify_add_watch(self._fd, path.encode("utf-8"), _DIRECTORY_CHANGE_MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            self._fd = None
+            raise OSError(err, "inotify_add_watch failed for {0}: {1}".format(path, os.strerror(err)))
+
+    def wait(self, timeout):
+        """
+        Waits until a change is detected in the directory or the timeout (in seconds) expires. Returns True if there
+        was a change, False on timeout.
+        """
+        try:
+            readable, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not readable:
+            return False
+        self._drain()
+        return True
+
+    def _drain(self):
+        # The specific events are not needed by the callers, so the buffer is just discarded
+        while True:
+            try:
+                if not os.read(self._fd, 4096):
+                    return
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class PollingDirectoryWatcher(object):
+    """
+    Fallback for systems without inotify; wait() simply sleeps for the given timeout, so callers end up polling.
+    """
+    def __init__(self, path):
+        self._path = path
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def create_directory_watcher(path):
+    """
+    Returns an InotifyDirectoryWatcher for the given directory, or a PollingDirectoryWatcher if inotify is not
+    available (e.g. older kernels or C libraries, or the directory does not exist)
+    """
+    try:
+        return InotifyDirectoryWatcher(path)
+    except Exception as e:
+        logger.verbose("Cannot watch {0} using inotify, will fall back to polling: {1}", path, ustr(e))
+        return PollingDirectoryWatcher(path)
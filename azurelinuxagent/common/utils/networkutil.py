@@ -15,6 +15,119 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import os
+import socket
+import struct
+
+# Netlink constants; see netlink(7) and rtnetlink(7)
+_NETLINK_ROUTE = 0
+_NLMSG_ERROR = 2
+_NLMSG_DONE = 3
+_RTM_NEWADDR = 20
+_RTM_GETADDR = 22
+_NLM_F_REQUEST = 0x1
+_NLM_F_DUMP = 0x300
+_IFA_ADDRESS = 1
+_IFA_LOCAL = 2
+
+_NLMSG_HEADER = struct.Struct("=IHHII")  # length, type, flags, sequence, pid
+_IFADDRMSG = struct.Struct("=BBBBI")     # family, prefix length, flags, scope, interface index
+_RTATTR = struct.Struct("=HH")           # length, type
+
+_SCOPE_NAMES = {0: "global", 200: "site", 253: "link", 254: "host", 255: "nowhere"}
+
+
+def _netlink_align(length):
+    return (length + 3) & ~3
+
+
+class InterfaceAddress(object):
+    """
+    Represents an IP address assigned to a network interface, as reported by an RTM_NEWADDR netlink message.
+    """
+
+    def __init__(self, index, family, address, prefix_length, scope):
+        self.index = index
+        self.family = family
+        self.address = address
+        self.prefix_length = prefix_length
+        self.scope = scope
+
+    def __str__(self):
+        # Same format used by "ip address", e.g. "inet 10.145.187.220/26 scope global"
+        return "{0} {1}/{2} scope {3}".format(
+            "inet" if self.family == socket.AF_INET else "inet6",
+            self.address,
+            self.prefix_length,
+            _SCOPE_NAMES.get(self.scope, self.scope))
+
+
+def parse_netlink_address_messages(buffer):
+    """
+    Parses the RTM_NEWADDR messages in the given buffer (the data returned by a single recv() on a NETLINK_ROUTE
+    socket).
+
+    Returns a tuple with the list of InterfaceAddress in the buffer and a boolean indicating whether the buffer
+    included the message ending the dump (NLMSG_DONE).
+    """
+    addresses = []
+    offset = 0
+    while offset + _NLMSG_HEADER.size <= len(buffer):
+        length, message_type, _, _, _ = _NLMSG_HEADER.unpack_from(buffer, offset)
+        if length < _NLMSG_HEADER.size or offset + length > len(buffer):
+            raise ValueError("Invalid netlink message at offset {0} (length: {1}, buffer size: {2})".format(offset, length, len(buffer)))
+        payload = offset + _NLMSG_HEADER.size
+        if message_type == _NLMSG_DONE:
+            return addresses, True
+        if message_type == _NLMSG_ERROR:
+            error = struct.unpack_from("=i", buffer, payload)[0]
+            raise OSError(-error, "Netlink request failed: {0}".format(os.strerror(-error)))
+        if message_type == _RTM_NEWADDR:
+            family, prefix_length, _, scope, index = _IFADDRMSG.unpack_from(buffer, payload)
+            attributes = {}
+            attribute_offset = payload + _IFADDRMSG.size
+            while attribute_offset + _RTATTR.size <= offset + length:
+                attribute_length, attribute_type = _RTATTR.unpack_from(buffer, attribute_offset)
+                if attribute_length < _RTATTR.size:
+                    break
+                attributes[attribute_type] = buffer[attribute_offset + _RTATTR.size:attribute_offset + attribute_length]
+                attribute_offset += _netlink_align(attribute_length)
+            # For IPv4, IFA_LOCAL is the address of the interface and IFA_ADDRESS may be the peer address on
+            # point-to-point links; IPv6 addresses include only IFA_ADDRESS
+            address = attributes.get(_IFA_LOCAL, attributes.get(_IFA_ADDRESS))
+            if address is not None and family in (socket.AF_INET, socket.AF_INET6):
+                addresses.append(InterfaceAddress(index, family, socket.inet_ntop(family, address), prefix_length, scope))
+        offset += _netlink_align(length)
+    return addresses, False
+
+
+def get_interface_addresses(timeout=5):
+    """
+    Returns the IPv4 and IPv6 addresses of all the network interfaces (as a list of InterfaceAddress), querying the
+    kernel with a RTM_GETADDR netlink dump instead of running "ip address".
+
+    Raises socket.error/OSError/ValueError if the kernel cannot be queried or its response cannot be parsed.
+    """
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, _NETLINK_ROUTE)
+    try:
+        sock.settimeout(timeout)
+        sock.bind((0, 0))
+        request = _NLMSG_HEADER.pack(_NLMSG_HEADER.size + _IFADDRMSG.size, _RTM_GETADDR, _NLM_F_REQUEST | _NLM_F_DUMP, 1, 0) + \
+            _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        sock.sendall(request)
+        addresses = []
+        done = False
+        while not done:
+            buffer = sock.recv(65536)
+            if len(buffer) == 0:
+                raise ValueError("The netlink socket was closed before the end of the address dump")
+            messages, done = parse_netlink_address_messages(buffer)
+            addresses.extend(messages)
+        return addresses
+    finally:
+        sock.close()
+
+
 
 class RouteEntry(object):
     """
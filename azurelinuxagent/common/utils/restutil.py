@@ -17,6 +17,8 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
+import fcntl
 import os
 import re
 import threading
@@ -318,11 +320,156 @@ def redact_sas_tokens_in_urls(url):
     return SAS_TOKEN_RETRIEVAL_REGEX.sub(r"\1" + REDACTED_TEXT + r"\3", url)
 
 
+class _HttpConnectionPool(object):
+    """
+    Keeps the connections used by _http_request open (HTTP keep-alive) so that subsequent requests to the same
+    server (WireServer, HostGAPlugin, storage, etc.) can reuse them instead of doing a new TCP/TLS handshake.
+
+    Connections are added to the pool as soon as the response is received, but they are reused only after the caller
+    has read the entire response; connections that are idle for more than IDLE_TIMEOUT seconds are closed (the pool is
+    swept on each acquire and release, so idle connections to servers that are no longer used are closed as well).
+    The sockets of the pooled connections are marked close-on-exec, so that they are not inherited by the processes
+    started by the agent (e.g. extensions).
+    """
+    IDLE_TIMEOUT = 30  # seconds
+    MAX_IDLE_CONNECTIONS_PER_KEY = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}  # key -> list of [connection, response, time the connection was released]
+
+    def acquire(self, key):
+        """
+        Returns a connection for the given key, or None if there are no connections available
+        """
+        with self._lock:
+            self._sweep()
+            entries = self._connections.get(key, [])
+            # use the most recently released connections first; they are the least likely to have been closed by the server
+            for entry in reversed(entries[:]):
+                connection, response, _ = entry
+                if response.isclosed():
+                    entries.remove(entry)
+                    return connection
+            return None
+
+    def release(self, key, connection, response):
+        # The connection cannot be reused if the server indicated it will close it (or if the response is not a real
+        # HTTPResponse, as in the case of tests)
+        if getattr(response, "will_close", True) is not False:
+            return
+        _HttpConnectionPool._set_close_on_exec(connection)
+        with self._lock:
+            self._sweep()
+            entries = self._connections.setdefault(key, [])
+            entries.append([connection, response, time.time()])
+            while len(entries) > _HttpConnectionPool.MAX_IDLE_CONNECTIONS_PER_KEY:
+                connection, response, _ = entries.pop(0)
+                if response.isclosed():
+                    _HttpConnectionPool._close(connection)
+
+    def _sweep(self):
+        """
+        Removes the connections that have been idle for more than IDLE_TIMEOUT seconds, across all keys. Must be called
+        while holding the lock.
+        """
+        now = time.time()
+        for key in list(self._connections.keys()):
+            entries = self._connections[key]
+            for entry in entries[:]:
+                connection, response, released = entry
+                if now - released > _HttpConnectionPool.IDLE_TIMEOUT:
+                    entries.remove(entry)
+                    # If the caller did not read the entire response it still owns the connection, so just stop tracking it
+                    if response.isclosed():
+                        _HttpConnectionPool._close(connection)
+            if len(entries) == 0:
+                del self._connections[key]
+
+    def clear(self):
+        with self._lock:
+            for entries in self._connections.values():
+                for connection, response, _ in entries:
+                    if response.isclosed():
+                        _HttpConnectionPool._close(connection)
+            self._connections = {}
+
+    @staticmethod
+    def _set_close_on_exec(connection):
+        try:
+            sock = connection.sock
+            if sock is not None:
+                fd = sock.fileno()
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        except Exception as e:
+            logger.verbose("Error setting FD_CLOEXEC on HTTP connection: {0}", ustr(e))
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception as e:
+            logger.verbose("Error closing HTTP connection: {0}", ustr(e))
+
+
+_CONNECTION_POOL = _HttpConnectionPool()
+
+
+def reset_connection_pool():
+    """
+    Closes all the idle connections in the pool used by the http_* functions
+    """
+    _CONNECTION_POOL.clear()
+
+
+_IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def _is_stale_connection_error(e):
+    """
+    Returns True if the exception indicates that the server closed a persistent connection while it was idle in the pool
+    """
+    if isinstance(e, httpclient.BadStatusLine):  # includes RemoteDisconnected (Python 3.5+)
+        return True
+    return isinstance(e, (IOError, socket.error)) and getattr(e, "errno", None) in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+def _create_connection(host, port, timeout, secure, proxy_host, proxy_port):
+    use_proxy = proxy_host is not None and proxy_port is not None
+
+    conn_host, conn_port = (proxy_host, proxy_port) if use_proxy else (host, port)
+
+    if secure:
+        conn = httpclient.HTTPSConnection(conn_host,
+                                          conn_port,
+                                          timeout=timeout)
+        if use_proxy:
+            conn.set_tunnel(host, port)
+    else:
+        conn = httpclient.HTTPConnection(conn_host,
+                                         conn_port,
+                                         timeout=timeout)
+    return conn
+
+
+def _is_file_body(data):
+    # The body of a request can be a file object opened in binary mode; httplib sends it in fixed-size blocks, so
+    # the file is never read entirely into memory
+    return data is not None and hasattr(data, "read")
+
+
 def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=False,
                   headers=None, proxy_host=None, proxy_port=None, redact_data=False):
 
     headers = {} if headers is None else headers
-    headers['Connection'] = 'close'
+
+    # File bodies are sent from their current position, which is restored if the request needs to be sent again
+    body_position = None
+    if _is_file_body(data):
+        body_position = data.tell()
+        if 'Content-Length' not in headers:
+            # Without an explicit length, some versions of httplib would use a chunked transfer encoding
+            headers['Content-Length'] = str(os.fstat(data.fileno()).st_size - body_position)
 
     use_proxy = proxy_host is not None and proxy_port is not None
 
@@ -333,27 +480,16 @@ def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=F
         headers['User-Agent'] = HTTP_USER_AGENT
 
     if use_proxy:
-        conn_host, conn_port = proxy_host, proxy_port
         scheme = "https" if secure else "http"
         url = "{0}://{1}:{2}{3}".format(scheme, host, port, rel_uri)
     else:
-        conn_host, conn_port = host, port
         url = rel_uri
 
-    if secure:
-        conn = httpclient.HTTPSConnection(conn_host,
-                                          conn_port,
-                                          timeout=timeout)
-        if use_proxy:
-            conn.set_tunnel(host, port)
-    else:
-        conn = httpclient.HTTPConnection(conn_host,
-                                         conn_port,
-                                         timeout=timeout)
-
     payload = data
     if redact_data:
         payload = "[REDACTED]"
+    elif body_position is not None:
+        payload = "[FILE {0}]".format(getattr(data, "name", ""))
 
     # Logger requires the msg to be a ustr to log properly, ensuring that the data string that we log is always ustr
     logger.verbose("HTTP connection [{0}] [{1}] [{2}] [{3}]",
@@ -362,8 +498,38 @@ def _http_request(method, host, rel_uri, timeout, port=None, data=None, secure=F
                    textutil.str_to_encoded_ustr(payload),
                    headers)
 
+    pool_key = (host, port, secure, proxy_host, proxy_port)
+
+    conn = _CONNECTION_POOL.acquire(pool_key)
+    if conn is not None:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        request_sent = False
+        try:
+            conn.request(method=method, url=url, body=data, headers=headers)
+            request_sent = True
+            resp = conn.getresponse()
+            _CONNECTION_POOL.release(pool_key, conn, resp)
+            return resp
+        except Exception as e:
+            conn.close()
+            if not _is_stale_connection_error(e):
+                raise
+            # The server most likely closed the connection while it was idle in the pool, so retry once on a new
+            # connection. If the entire request was sent, though, the server may have processed it before closing the
+            # connection, so in that case only idempotent requests are retried.
+            if request_sent and method not in _IDEMPOTENT_METHODS:
+                raise
+            logger.verbose("HTTP connection to {0}:{1} was closed by the server, retrying on a new connection: {2}", host, port, ustr(e))
+            if body_position is not None:
+                data.seek(body_position)
+
+    conn = _create_connection(host, port, timeout, secure, proxy_host, proxy_port)
     conn.request(method=method, url=url, body=data, headers=headers)
-    return conn.getresponse()
+    resp = conn.getresponse()
+    _CONNECTION_POOL.release(pool_key, conn, resp)
+    return resp
 
 
 def http_request(method,
@@ -429,6 +595,7 @@ def http_request(method,
     attempt = 0
     delay = 0
     was_throttled = False
+    body_position = data.tell() if _is_file_body(data) else None
 
     while attempt < max_retry:
         if attempt > 0:
@@ -453,6 +620,9 @@ def http_request(method,
 
         attempt += 1
 
+        if body_position is not None:
+            data.seek(body_position)
+
         try:
             resp = _http_request(method,
                                  host,
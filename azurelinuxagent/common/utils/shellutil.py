@@ -17,10 +17,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 import os
+import select
 import subprocess
 import sys
 import tempfile
 import threading
+import time
 
 if sys.version_info[0] == 2:
     # TimeoutExpired was introduced on Python 3; define a dummy class for Python 2
@@ -405,6 +407,56 @@ def _on_command_completed(pid):
         _running_commands.remove(pid)
 
 
+# When pidfds are not available, wait_for_process_exit() polls the process at intervals that start at _MIN_POLL_INTERVAL
+# and double up to _MAX_POLL_INTERVAL (seconds)
+_MIN_POLL_INTERVAL = 0.01
+_MAX_POLL_INTERVAL = 1.0
+
+
+def _open_pidfd(process):
+    # pidfds are available on Python 3.9+ and Linux 5.3+; the process must not have been reaped yet, since its pid
+    # could have been reused
+    if not hasattr(os, "pidfd_open") or process.returncode is not None:
+        return None
+    try:
+        return os.pidfd_open(process.pid)
+    except Exception:
+        return None
+
+
+def wait_for_process_exit(process, timeout, wakeup_fd=None):
+    """
+    Waits up to 'timeout' seconds (indefinitely if 'timeout' is None) for the given process (a subprocess.Popen) to exit
+    and returns its exit code, or None if it is still running. The exit is detected as soon as it happens using a pidfd
+    (which becomes readable when the process exits); if pidfds are not available, the process is polled.
+    If 'wakeup_fd' is given, the wait also ends as soon as that file descriptor becomes readable.
+    """
+    wakeup_fds = [wakeup_fd] if wakeup_fd is not None else []
+
+    pidfd = _open_pidfd(process)
+    if pidfd is not None:
+        try:
+            select.select([pidfd] + wakeup_fds, [], [], None if timeout is None else max(timeout, 0))
+        finally:
+            os.close(pidfd)
+        return process.poll()
+
+    interval = _MIN_POLL_INTERVAL
+    while True:
+        return_code = process.poll()
+        if return_code is not None or (timeout is not None and timeout <= 0):
+            return return_code
+        delay = interval if timeout is None else min(interval, timeout)
+        if wakeup_fds:
+            if select.select(wakeup_fds, [], [], delay)[0]:
+                return process.poll()
+        else:
+            time.sleep(delay)
+        if timeout is not None:
+            timeout -= delay
+        interval = min(interval * 2, _MAX_POLL_INTERVAL)
+
+
 def get_running_commands():
     """
     Returns the commands started by run/run_get_output/run_command/run_pipe that are currently running.
@@ -0,0 +1,275 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import errno
+import fcntl
+import os
+import struct
+import threading
+import time
+import zlib
+
+from azurelinuxagent.common import logger
+
+# Each record is stored as <length><crc32><payload>; length and crc32 are 32-bit unsigned integers in network order
+_RECORD_HEADER = struct.Struct(">II")
+
+# Suffix added to a segment once it has been claimed by a reader
+CLAIMED_SEGMENT_SUFFIX = ".collecting"
+
+# Suffix of the file that stores the offset (number of records) up to which a claimed segment has been processed
+SEGMENT_OFFSET_SUFFIX = ".offset"
+
+
+def _crc32(data):
+    # On Python 2 zlib.crc32 returns a signed integer
+    return zlib.crc32(data) & 0xffffffff
+
+
+def encode_record(data):
+    return _RECORD_HEADER.pack(len(data), _crc32(data)) + data
+
+
+def decode_records(buffer):
+    """
+    Decodes the records in the given buffer. Decoding stops at the first incomplete or corrupt record (e.g. the tail of
+    a segment that was being written when the process crashed).
+
+    Returns a tuple with the list of records and the number of bytes that could not be decoded.
+    """
+    records = []
+    offset = 0
+    while offset + _RECORD_HEADER.size <= len(buffer):
+        length, crc = _RECORD_HEADER.unpack_from(buffer, offset)
+        start = offset + _RECORD_HEADER.size
+        end = start + length
+        if end > len(buffer) or _crc32(buffer[start:end]) != crc:
+            break
+        records.append(buffer[start:end])
+        offset = end
+    return records, len(buffer) - offset
+
+
+def read_segment(segment_path):
+    """
+    Reads all the records in the given (claimed) segment with a single read. Waits for any append that may be in
+    progress on the segment before reading it.
+
+    Returns a tuple with the list of records and the number of bytes that could not be decoded.
+    """
+    with open(segment_path, "rb") as segment:
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX)
+        try:
+            buffer = segment.read()
+        finally:
+            fcntl.flock(segment.fileno(), fcntl.LOCK_UN)
+    return decode_records(buffer)
+
+
+def read_segment_offset(segment_path):
+    """
+    Returns the offset saved by write_segment_offset() for the given segment, or 0 if there is no valid offset
+    """
+    try:
+        with open(segment_path + SEGMENT_OFFSET_SUFFIX, "r") as offset_file:
+            return max(0, int(offset_file.read().strip()))
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def write_segment_offset(segment_path, offset):
+    """
+    Saves the number of records of the given (claimed) segment that have been processed, so that they can be skipped
+    if the segment needs to be read again (e.g. after a restart)
+    """
+    offset_path = segment_path + SEGMENT_OFFSET_SUFFIX
+    with open(offset_path + ".tmp", "w") as offset_file:
+        offset_file.write(str(offset))
+    os.rename(offset_path + ".tmp", offset_path)
+
+
+def remove_segment(segment_path):
+    """
+    Removes the given (claimed) segment and its offset
+    """
+    for path in (segment_path, segment_path + SEGMENT_OFFSET_SUFFIX):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
+class SegmentedSpool(object):
+    """
+    Append-only spool of length-prefixed records stored in a directory as a sequence of segment files.
+
+    Each writer (process) appends to its own segment and starts a new one once the current segment reaches
+    'max_records_per_segment' records or 'max_segment_size' bytes; when the number of segments in the directory reaches
+    'max_segments' the oldest ones are removed.
+
+    Readers take ownership of the segments using claim_segments(), which renames them; a writer that finds its current
+    segment was claimed simply starts a new one. The writer holds an exclusive lock on the segment while appending to
+    it, and read_segment() takes the same lock, so a reader never sees a partially written record unless the writer
+    crashed in the middle of an append (in which case the corrupt tail of the segment is skipped).
+    """
+    def __init__(self, directory, extension, max_records_per_segment=100, max_segment_size=1024 * 1024, max_segments=10):
+        self.directory = directory
+        self._extension = extension
+        self._max_records_per_segment = max_records_per_segment
+        self._max_segment_size = max_segment_size
+        self._max_segments = max_segments
+        self._lock = threading.Lock()
+        self._segment_fd = None
+        self._segment_path = None
+        self._segment_records = 0
+        self._segment_size = 0
+
+    def append(self, data):
+        """
+        Appends the given data (bytes) to the spool as a single record
+        """
+        self.append_all([data])
+
+    def append_all(self, data_list):
+        """
+        Appends each item in the given list (of bytes) to the spool as a record; the records that fit in the current
+        segment are written with a single write.
+        """
+        records = [encode_record(data) for data in data_list]
+        trimmed = 0
+        with self._lock:
+            start = 0
+            while start < len(records):
+                if self._segment_fd is None or self._is_segment_full():
+                    count = self._max_records_per_segment
+                else:
+                    count = self._max_records_per_segment - self._segment_records
+                end = start + max(1, count)
+                trimmed += self._append(b"".join(records[start:end]), len(records[start:end]))
+                start = end
+        # Log outside the lock, since the logger may in turn append to the spool (e.g. if logs are sent to telemetry)
+        if trimmed > 0:
+            logger.periodic_warn(logger.EVERY_MINUTE, "[PERIODIC] Too many segments under: {0}, removed the oldest {1} "
+                                                      "segment(s)".format(self.directory, trimmed))
+
+    def _append(self, records, count):
+        trimmed = 0
+        # The segment can be claimed by a reader between the time we open it and the time we lock it, so we may need to
+        # create a new segment; more than a couple of attempts indicates something is really wrong.
+        for _ in range(3):
+            if self._segment_fd is None or self._is_segment_full():
+                self._close_segment()
+                trimmed += self._trim()
+                self._open_segment()
+            fd = self._segment_fd
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if self._is_segment_current(fd):
+                    try:
+                        os.write(fd, records)
+                    except (IOError, OSError):
+                        # The segment may end with a partial record now; do not append anything else to it
+                        self._close_segment()
+                        raise
+                    self._segment_records += count
+                    self._segment_size += len(records)
+                    return trimmed
+            finally:
+                if self._segment_fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            self._close_segment()
+        raise IOError(errno.EAGAIN, "Could not append to the spool at {0}; its segments were claimed repeatedly".format(self.directory))
+
+    def claim_segments(self):
+        """
+        Takes ownership of all the segments in the spool, including the segments claimed previously and not removed
+        (e.g. because the reader crashed). Returns the paths of the claimed segments, oldest first.
+        """
+        claimed = []
+        for name in self._list_segments(include_claimed=True):
+            path = os.path.join(self.directory, name)
+            if name.endswith(CLAIMED_SEGMENT_SUFFIX):
+                claimed.append(path)
+                continue
+            try:
+                os.rename(path, path + CLAIMED_SEGMENT_SUFFIX)
+            except OSError as e:
+                if e.errno == errno.ENOENT:  # removed by a writer trimming the spool
+                    continue
+                raise
+            claimed.append(path + CLAIMED_SEGMENT_SUFFIX)
+        return claimed
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+    def _is_segment_full(self):
+        return self._segment_records >= self._max_records_per_segment or self._segment_size >= self._max_segment_size
+
+    def _open_segment(self):
+        # Segment names sort in creation order; the pid avoids collisions between processes writing to the same spool
+        path = os.path.join(self.directory, "{0}-{1}{2}".format(int(time.time() * 1000000), os.getpid(), self._extension))
+        self._segment_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+        self._segment_path = path
+        self._segment_records = 0
+        self._segment_size = 0
+
+    def _is_segment_current(self, fd):
+        # The segment is no longer ours if a reader renamed (claimed) it
+        try:
+            path_stat = os.stat(self._segment_path)
+        except OSError:
+            return False
+        fd_stat = os.fstat(fd)
+        return (path_stat.st_dev, path_stat.st_ino) == (fd_stat.st_dev, fd_stat.st_ino)
+
+    def _close_segment(self):
+        if self._segment_fd is not None:
+            try:
+                os.close(self._segment_fd)
+            except OSError:
+                pass
+            self._segment_fd = None
+            self._segment_path = None
+
+    def _trim(self):
+        """
+        Removes the oldest segments to make room for a new one; returns the number of segments removed
+        """
+        segments = self._list_segments(include_claimed=False)
+        if len(segments) < self._max_segments:
+            return 0
+        removed = 0
+        for name in segments[:len(segments) - self._max_segments + 1]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+            except OSError as e:
+                if e.errno != errno.ENOENT:  # may have been claimed by a reader
+                    raise
+        return removed
+
+    def _list_segments(self, include_claimed):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self._extension) or (include_claimed and name.endswith(self._extension + CLAIMED_SEGMENT_SUFFIX)):
+                segments.append(name)
+        segments.sort()
+        return segments
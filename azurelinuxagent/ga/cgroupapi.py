@@ -14,6 +14,7 @@
 # limitations under the License.
 #
 # Requires Python 2.6+ and Openssl 1.0+
+import errno
 import json
 import os
 import re
@@ -31,7 +32,7 @@ from azurelinuxagent.common.conf import get_agent_pid_file_path
 from azurelinuxagent.common.exception import CGroupsException, ExtensionErrorCodes, ExtensionError, \
     ExtensionOperationError
 from azurelinuxagent.common.future import ustr
-from azurelinuxagent.common.osutil import systemd
+from azurelinuxagent.common.osutil import get_osutil, systemd
 from azurelinuxagent.common.utils import fileutil, shellutil
 from azurelinuxagent.ga.extensionprocessutil import handle_process_completion, read_output, \
     TELEMETRY_MESSAGE_MAX_LEN
@@ -747,6 +748,22 @@ class CgroupV2(Cgroup):
 
         return controllers
 
+    def get_pressure_stall_information(self, resource):
+        """
+        Returns the Pressure Stall Information (PSI) of the cgroup for the given resource ("cpu", "memory" or "io"),
+        as parsed by DefaultOSUtil.parse_pressure_stall_information(), or None if it is not available (e.g. if the
+        kernel does not support PSI or the cgroup does not exist).
+        """
+        if self._cgroup_path == "":
+            return None
+        try:
+            contents = fileutil.read_file(os.path.join(self._cgroup_path, "{0}.pressure".format(resource)))
+        except (IOError, OSError) as e:
+            if e.errno in (errno.ENOENT, errno.EOPNOTSUPP):
+                return None
+            raise
+        return get_osutil().parse_pressure_stall_information(contents)
+
     def get_procs_path(self):
         if self._cgroup_path != "":
             return os.path.join(self._cgroup_path, "cgroup.procs")
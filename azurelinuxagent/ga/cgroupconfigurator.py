@@ -26,12 +26,13 @@ from azurelinuxagent.common import logger
 from azurelinuxagent.ga.cgroupcontroller import AGENT_NAME_TELEMETRY, MetricsCounter
 from azurelinuxagent.ga.cgroupapi import SystemdRunError, EXTENSION_SLICE_PREFIX, CGroupUtil, SystemdCgroupApiv2, \
     log_cgroup_info, log_cgroup_warning, create_cgroup_api, InvalidCgroupMountpointException
+from azurelinuxagent.ga.cgrouppressure import CpuQuotaPolicy, get_pressure_metrics
 from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
 from azurelinuxagent.ga.cpucontroller import _CpuController
 from azurelinuxagent.ga.memorycontroller import _MemoryController
 from azurelinuxagent.common.exception import ExtensionErrorCodes, CGroupsException, AgentMemoryExceededException
 from azurelinuxagent.common.future import ustr
-from azurelinuxagent.common.osutil import systemd
+from azurelinuxagent.common.osutil import get_osutil, systemd
 from azurelinuxagent.common.version import get_distro
 from azurelinuxagent.common.utils import shellutil, fileutil
 from azurelinuxagent.ga.extensionprocessutil import handle_process_completion
@@ -110,6 +111,90 @@ class DisableCgroups(object):
     EXTENSIONS = "extensions"
 
 
+class ProcessSnapshot(object):
+    """
+    Snapshot of the /proc data used to check the processes in the agent's cgroup. Each /proc/<pid>/stat and
+    /proc/<pid>/cmdline is read at most once (on first use), and the ancestry lookups are memoized, so the cost of a
+    check is proportional to the number of distinct processes involved instead of the number of processes times the
+    depth of their process trees.
+
+    A snapshot is meant to be used for a single check; create a new one for the next check.
+    """
+    def __init__(self, proc_root="/proc"):
+        self._proc_root = proc_root
+        self._stat = {}  # pid -> (ppid, comm, state), or None if the process does not exist
+        self._cmdline = {}
+        self._ancestry = {}  # frozenset of ancestors -> {pid: whether the pid is one of those ancestors or a descendant of one}
+
+    def _get_stat(self, pid):
+        if pid not in self._stat:
+            stat = None
+            try:
+                with open(os.path.join(self._proc_root, str(pid), "stat"), "r") as stat_file:
+                    contents = stat_file.read()
+                # The format is "<pid> (<comm>) <state> <ppid> ..."; comm can include spaces and parentheses, so use the
+                # last closing parenthesis to find its end, e.g. 18171 (python3) S 18103 18103 18103 0 -1 4194624 57736
+                start = contents.index("(")
+                end = contents.rindex(")")
+                fields = contents[end + 1:].split()
+                stat = (int(fields[1]), contents[start + 1:end], fields[0])
+            except Exception:
+                pass
+            self._stat[pid] = stat
+        return self._stat[pid]
+
+    def get_parent(self, pid):
+        """
+        Returns the parent of the given process. If the parent cannot be determined returns 0 (which is the PID for the scheduler)
+        """
+        stat = self._get_stat(pid)
+        return stat[0] if stat is not None else 0
+
+    def get_command(self, pid):
+        stat = self._get_stat(pid)
+        return stat[1] if stat is not None else "UNKNOWN"
+
+    def is_zombie(self, pid):
+        stat = self._get_stat(pid)
+        return stat is not None and stat[2] == 'Z'
+
+    def get_cmdline(self, pid):
+        """
+        Returns the command line of the given process (arguments separated by nulls), or None if it cannot be read
+        """
+        if pid not in self._cmdline:
+            cmdline = None
+            try:
+                with open(os.path.join(self._proc_root, str(pid), "cmdline"), "r") as cmdline_file:
+                    cmdline = cmdline_file.read()
+            except Exception:
+                pass
+            self._cmdline[pid] = cmdline
+        return self._cmdline[pid]
+
+    def is_descendant_of_any(self, pid, ancestors):
+        """
+        Returns True if the given process is one of the given ancestors (a set of PIDs) or a descendant of one of them
+        """
+        cache = self._ancestry.setdefault(frozenset(ancestors), {})
+        chain = []
+        current = pid
+        while current != 0 and current not in cache:
+            if current in ancestors:
+                result = True
+                break
+            if current in chain:  # guard against loops caused by PIDs reused while the snapshot was being taken
+                result = False
+                break
+            chain.append(current)
+            current = self.get_parent(current)
+        else:
+            result = cache[current] if current != 0 else False
+        for p in chain:
+            cache[p] = result
+        return result
+
+
 class CGroupConfigurator(object):
     """
     This class implements the high-level operations on CGroups (e.g. initialization, creation, etc)
@@ -129,6 +214,12 @@ class CGroupConfigurator(object):
             self._agent_memory_metrics = None
             self._check_cgroups_lock = threading.RLock()  # Protect the check_cgroups which is called from Monitor thread and main loop.
             self._unexpected_processes = {}
+            self._pressure_cgroups = None
+            # CPUQuota of the extension units, indexed by unit name; each item is a list with the configured quota and
+            # the quota currently set by the CpuQuotaPolicy
+            self._cpu_quotas = {}
+            self._cpu_quotas_lock = threading.RLock()  # Protect the quotas, which are updated by the Monitor thread and the main loop
+            self._cpu_quota_policy = CpuQuotaPolicy()
 
         def initialize(self):
             try:
@@ -474,6 +565,8 @@ class CGroupConfigurator(object):
                     self.reset_extension_quota(extension_name=extension)
                     self.reset_extension_services_quota(extension_services[extension])
                 CGroupsTelemetry.reset()
+                with self._cpu_quotas_lock:
+                    self._cpu_quotas.clear()
                 self._agent_cgroups_enabled = False
                 self._extensions_cgroups_enabled = False
             elif disable_cgroups == DisableCgroups.AGENT:  # disable agent
@@ -607,26 +700,26 @@ class CGroupConfigurator(object):
                 agent_commands.update(shellutil.get_running_commands())
                 systemd_run_commands.update(self._cgroups_api.get_systemd_run_commands())
 
+                snapshot = ProcessSnapshot()
+
                 for process in agent_cgroup_proccesses:
-                    agent_cgroup_proc_names.append(self._format_process(process))
+                    agent_cgroup_proc_names.append(self._format_process(process, snapshot))
                     # Note that the agent uses systemd-run to start extensions; systemd-run belongs to the agent cgroup, though the extensions don't.
                     if process in (daemon, extension_handler) or process in systemd_run_commands:
                         continue
                     # check shell systemd_run process if above process check didn't catch it
-                    if self._check_systemd_run_process(process):
+                    if self._check_systemd_run_process(process, snapshot):
                         continue
                     # systemd_run_commands contains the shell that started systemd-run, so we also need to check for the parent
-                    if self._get_parent(process) in systemd_run_commands and self._get_command(
-                            process) == 'systemd-run':
+                    if snapshot.get_parent(process) in systemd_run_commands and snapshot.get_command(process) == 'systemd-run':
                         continue
                     # check if the process is a command started by the agent or a descendant of one of those commands
-                    current = process
-                    while current != 0 and current not in agent_commands:
-                        current = self._get_parent(current)
+                    if snapshot.is_descendant_of_any(process, agent_commands):
+                        continue
                     # Verify if Process started by agent based on the marker found in process environment or process is in Zombie state.
                     # If so, consider it as valid process in agent cgroup.
-                    if current == 0 and not (self._is_process_descendant_of_the_agent(process) or self._is_zombie_process(process)):
-                        current_unexpected[process] = self._format_process(process)
+                    if not (self._is_process_descendant_of_the_agent(process) or snapshot.is_zombie(process)):
+                        current_unexpected[process] = self._format_process(process, snapshot)
                 if report_immediately:
                     report = current_unexpected.values()
                 else:
@@ -660,28 +753,13 @@ class CGroupConfigurator(object):
             return logcollector_properties
 
         @staticmethod
-        def _get_command(pid):
-            try:
-                with open('/proc/{0}/comm'.format(pid), "r") as file_:
-                    comm = file_.read()
-                    if comm and comm[-1] == '\x00':  # if null-terminated, remove the null
-                        comm = comm[:-1]
-                    return comm.rstrip()
-            except Exception:
-                return "UNKNOWN"
-
-        @staticmethod
-        def _format_process(pid):
+        def _format_process(pid, snapshot):
             """
             Formats the given PID as a string containing the PID and the corresponding command line truncated to 64 chars
             """
-            try:
-                cmdline = '/proc/{0}/cmdline'.format(pid)
-                if os.path.exists(cmdline):
-                    with open(cmdline, "r") as cmdline_file:
-                        return "[PID: {0}] {1:64.64}".format(pid, cmdline_file.read())
-            except Exception:
-                pass
+            cmdline = snapshot.get_cmdline(pid)
+            if cmdline is not None:
+                return "[PID: {0}] {1:64.64}".format(pid, cmdline)
             return "[PID: {0}] UNKNOWN".format(pid)
 
         @staticmethod
@@ -703,41 +781,14 @@ class CGroupConfigurator(object):
             return False
 
         @staticmethod
-        def _is_zombie_process(pid):
-            """
-            Returns True if process is in Zombie state otherwise False.
-
-            Ex: cat /proc/18171/stat
-            18171 (python3) S 18103 18103 18103 0 -1 4194624 57736 64902 0 3
-            """
-            try:
-                stat = '/proc/{0}/stat'.format(pid)
-                if os.path.exists(stat):
-                    with open(stat, "r") as stat_file:
-                        return stat_file.read().split()[2] == 'Z'
-            except Exception:
-                pass
-            return False
-
-        @staticmethod
-        def _check_systemd_run_process(process):
+        def _check_systemd_run_process(process, snapshot):
             """
             Returns True if process is shell systemd-run process started by agent otherwise False.
 
             Ex: sh,7345 -c systemd-run --unit=enable_7c5cab19-eb79-4661-95d9-9e5091bd5ae0 --scope --slice=azure-vmextensions-Microsoft.OSTCExtensions.VMAccessForLinux_1.5.11.slice /var/lib/waagent/Microsoft.OSTCExtensions.VMAccessForLinux-1.5.11/processes.sh
             """
-            try:
-                process_name = "UNKNOWN"
-                cmdline = '/proc/{0}/cmdline'.format(process)
-                if os.path.exists(cmdline):
-                    with open(cmdline, "r") as cmdline_file:
-                        process_name = "{0}".format(cmdline_file.read())
-                match = re.search(r'systemd-run.*--unit=.*--scope.*--slice=azure-vmextensions.*', process_name)
-                if match is not None:
-                    return True
-            except Exception:
-                pass
-            return False
+            cmdline = snapshot.get_cmdline(process)
+            return cmdline is not None and re.search(r'systemd-run.*--unit=.*--scope.*--slice=azure-vmextensions.*', cmdline) is not None
 
         @staticmethod
         def _report_agent_cgroups_procs(agent_cgroup_proc_names, unexpected):
@@ -766,20 +817,6 @@ class CGroupConfigurator(object):
                 if current_usage > conf.get_agent_memory_quota():
                     raise AgentMemoryExceededException("The agent memory limit {0} bytes exceeded. The current reported usage is {1} bytes.".format(conf.get_agent_memory_quota(), current_usage))
 
-        @staticmethod
-        def _get_parent(pid):
-            """
-            Returns the parent of the given process. If the parent cannot be determined returns 0 (which is the PID for the scheduler)
-            """
-            try:
-                stat = '/proc/{0}/stat'.format(pid)
-                if os.path.exists(stat):
-                    with open(stat, "r") as stat_file:
-                        return int(stat_file.read().split()[3])
-            except Exception:
-                pass
-            return 0
-
         def start_tracking_unit_cgroups(self, unit_name):
             if self.enabled():
                 try:
@@ -908,6 +945,8 @@ class CGroupConfigurator(object):
                         log_cgroup_info("Setting up the resource properties: {0} for {1}".format(properties_to_update, extension_slice))
                         systemd.set_unit_run_time_properties(extension_slice, properties_to_update, properties_values)
 
+                    self._set_configured_cpu_quota(extension_slice, cpu_quota)
+
                 except Exception as exception:
                     log_cgroup_warning("Failed to set the extension {0} slice and quotas: {1}".format(extension_slice,
                                         ustr(exception)))
@@ -921,7 +960,9 @@ class CGroupConfigurator(object):
             TODO: reset memory quotas
             """
             if self.enabled():
-                self._reset_cpu_quota(CGroupUtil.get_extension_slice_name(extension_name))
+                extension_slice = CGroupUtil.get_extension_slice_name(extension_name)
+                self._set_configured_cpu_quota(extension_slice, "infinity")
+                self._reset_cpu_quota(extension_slice)
 
         def set_extension_services_cpu_memory_quota(self, services_list):
             """
@@ -952,16 +993,19 @@ class CGroupConfigurator(object):
                         cpu_quota = "{0}%".format(cpu_quota) if cpu_quota is not None else "infinity"  # following systemd convention for no-quota (infinity)
                         properties_to_update, properties_values = self._get_unit_properties_requiring_update(service_name, cpu_quota)
                         # If systemd is unaware of extension services and not loaded in the system yet, we get error while setting quotas. Hence, added unit loaded check.
-                        if systemd.is_unit_loaded(service_name) and len(properties_to_update) > 0:
-                            if cpu_quota != "infinity":
-                                log_cgroup_info("Setting {0}'s CPUQuota to {1}".format(service_name, cpu_quota))
-                            else:
-                                log_cgroup_info("CPUQuota not set for {0}".format(service_name))
-                            log_cgroup_info("Setting up resource properties: {0} for {1}" .format(properties_to_update, service_name))
-                            try:
-                                systemd.set_unit_run_time_properties(service_name, properties_to_update, properties_values)
-                            except Exception as exception:
-                                log_cgroup_warning("Failed to set the quotas for {0}: {1}".format(service_name, ustr(exception)))
+                        if systemd.is_unit_loaded(service_name):
+                            if len(properties_to_update) > 0:
+                                if cpu_quota != "infinity":
+                                    log_cgroup_info("Setting {0}'s CPUQuota to {1}".format(service_name, cpu_quota))
+                                else:
+                                    log_cgroup_info("CPUQuota not set for {0}".format(service_name))
+                                log_cgroup_info("Setting up resource properties: {0} for {1}" .format(properties_to_update, service_name))
+                                try:
+                                    systemd.set_unit_run_time_properties(service_name, properties_to_update, properties_values)
+                                except Exception as exception:
+                                    log_cgroup_warning("Failed to set the quotas for {0}: {1}".format(service_name, ustr(exception)))
+                                    continue
+                            self._set_configured_cpu_quota(service_name, cpu_quota)
 
         def reset_extension_services_quota(self, services_list):
             """
@@ -977,6 +1021,7 @@ class CGroupConfigurator(object):
                     for service in services_list:
                         service_name = service.get('name', None)
                         if service_name is not None and systemd.is_unit_loaded(service_name):
+                            self._set_configured_cpu_quota(service_name, "infinity")
                             self._reset_cpu_quota(service_name)
                 except Exception as exception:
                     log_cgroup_warning('Failed to reset for {0} : {1}'.format(service_name, ustr(exception)))
@@ -1001,6 +1046,63 @@ class CGroupConfigurator(object):
                     if service_name is not None:
                         self.start_tracking_unit_cgroups(service_name)
 
+        def _set_configured_cpu_quota(self, unit_name, cpu_quota):
+            """
+            Records the CPUQuota ("<n>%" or "infinity") configured for an extension unit; units with a quota are
+            subject to the CpuQuotaPolicy.
+            """
+            with self._cpu_quotas_lock:
+                if cpu_quota == "infinity":
+                    self._cpu_quotas.pop(unit_name, None)
+                else:
+                    quota = int(float(cpu_quota.rstrip("%")))
+                    self._cpu_quotas[unit_name] = [quota, quota]
+
+        def check_pressure(self):
+            """
+            Returns the Pressure Stall Information (PSI) of the agent's cgroup and of the extensions slice as a list of
+            metrics (cgroup v2 only).
+
+            If Debug.EnableCgroupPressureThrottling is set, it also adjusts the CPUQuota of the extensions according
+            to the CPU pressure of the system (see CpuQuotaPolicy).
+            """
+            metrics = []
+            try:
+                if self.using_cgroup_v2():
+                    if self._pressure_cgroups is None:
+                        self._pressure_cgroups = [
+                            (AGENT_NAME_TELEMETRY, self._cgroups_api.get_unit_cgroup(systemd.get_agent_unit_name(), AGENT_NAME_TELEMETRY)),
+                            (_VMEXTENSIONS_SLICE, self._cgroups_api.get_cgroup_from_relative_path(_AZURE_VMEXTENSIONS_SLICE, _VMEXTENSIONS_SLICE))
+                        ]
+                    for cgroup_name, cgroup in self._pressure_cgroups:
+                        metrics.extend(get_pressure_metrics(cgroup_name, cgroup))
+            except Exception as exception:
+                log_cgroup_warning("Failed to collect the pressure stall information of the agent and extensions: {0}".format(ustr(exception)), send_event=False)
+
+            if conf.get_enable_cgroup_pressure_throttling() and self.enabled():
+                try:
+                    cpu_pressure = get_osutil().get_pressure_stall_information("cpu")
+                    if cpu_pressure is not None:
+                        self._apply_cpu_quota_policy(cpu_pressure["some"]["avg10"])
+                except Exception as exception:
+                    log_cgroup_warning("Failed to adjust the CPUQuota of the extensions: {0}".format(ustr(exception)))
+
+            return metrics
+
+        def _apply_cpu_quota_policy(self, cpu_pressure):
+            with self._cpu_quotas_lock:
+                for unit_name, quotas in self._cpu_quotas.items():
+                    configured_quota, current_quota = quotas
+                    new_quota = self._cpu_quota_policy.get_cpu_quota(configured_quota, current_quota, cpu_pressure)
+                    if new_quota != current_quota:
+                        log_cgroup_info("CPU pressure is {0}%; changing {1}'s CPUQuota from {2}% to {3}% (configured: {4}%)".format(
+                            cpu_pressure, unit_name, current_quota, new_quota, configured_quota))
+                        try:
+                            systemd.set_unit_run_time_property(unit_name, "CPUQuota", "{0}%".format(new_quota))
+                            quotas[1] = new_quota
+                        except Exception as exception:
+                            log_cgroup_warning("Failed to set the CPUQuota of {0}: {1}".format(unit_name, ustr(exception)))
+
         @staticmethod
         def get_extension_services_list():
             """
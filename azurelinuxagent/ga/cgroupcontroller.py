@@ -14,6 +14,7 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 
+import contextlib
 import errno
 import os
 from datetime import timedelta
@@ -70,6 +71,7 @@ class MetricValue(object):
 class MetricsCategory(object):
     MEMORY_CATEGORY = "Memory"
     CPU_CATEGORY = "CPU"
+    IO_CATEGORY = "IO"
 
 
 class MetricsCounter(object):
@@ -83,6 +85,24 @@ class MetricsCounter(object):
     MEM_THROTTLED = "Total Memory Throttled Events"
     AVAILABLE_MEM = "Available Memory (MB)"
     USED_MEM = "Used Memory (MB)"
+    PRESSURE_SOME = "Pressure Some (%)"
+    PRESSURE_FULL = "Pressure Full (%)"
+
+
+def parse_stat_file(contents):
+    """
+    Parses the contents of a flat-keyed cgroup file (e.g. cpu.stat, memory.stat, memory.events), which consists of
+    lines of the form "<counter> <value>", and returns a dictionary of counter names to integer values.
+    """
+    counters = {}
+    for line in contents.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            try:
+                counters[fields[0]] = int(fields[1])
+            except ValueError:
+                pass
+    return counters
 
 
 class _CgroupController(object):
@@ -95,6 +115,8 @@ class _CgroupController(object):
         """
         self.name = name
         self.path = cgroup_path
+        self._snapshot = None
+        self._snapshot_depth = 0
 
     def __str__(self):
         return "{0} [{1}]".format(self.name, self.path)
@@ -114,6 +136,36 @@ class _CgroupController(object):
 
         return fileutil.read_file(parameter_file)
 
+    @contextlib.contextmanager
+    def snapshot(self):
+        """
+        Within this context each stat file of the controller (cpu.stat, memory.stat, etc) is read and parsed only once,
+        and all the counters taken from the file are consistent with each other. Contexts can be nested.
+        """
+        if self._snapshot_depth == 0:
+            self._snapshot = {}
+        self._snapshot_depth += 1
+        try:
+            yield
+        finally:
+            self._snapshot_depth -= 1
+            if self._snapshot_depth == 0:
+                self._snapshot = None
+
+    def _get_stat_file(self, file_name):
+        """
+        Returns the counters in the given flat-keyed file as a dictionary of counter names to values (see
+        parse_stat_file). When invoked within snapshot(), the file is read only on the first call.
+
+        Raises the same exceptions as _get_file_contents().
+        """
+        if self._snapshot is not None and file_name in self._snapshot:
+            return self._snapshot[file_name]
+        counters = parse_stat_file(self._get_file_contents(file_name))
+        if self._snapshot is not None:
+            self._snapshot[file_name] = counters
+        return counters
+
     def _get_parameters(self, parameter_name, first_line_only=False):
         """
         Retrieve the values of a parameter from a controller.
@@ -168,6 +220,14 @@ class _CgroupController(object):
         """
         raise NotImplementedError()
 
+    def get_sampled_metrics(self):
+        """
+        Retrieves the current value of the metrics sampled at high resolution for this controller/cgroup (see
+        CGroupsTelemetry.sample_all_tracked()) and returns them as an array. Sampling must not change the values
+        returned by get_tracked_metrics().
+        """
+        return []
+
     def get_unit_properties(self):
         """
         Returns a list of the unit properties to collect for the controller.
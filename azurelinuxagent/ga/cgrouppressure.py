@@ -0,0 +1,72 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+from azurelinuxagent.ga.cgroupcontroller import MetricValue, MetricsCategory, MetricsCounter
+
+# Resources for which the kernel reports Pressure Stall Information (PSI), and the category used to report their metrics
+PRESSURE_RESOURCES = [
+    ("cpu", MetricsCategory.CPU_CATEGORY),
+    ("memory", MetricsCategory.MEMORY_CATEGORY),
+    ("io", MetricsCategory.IO_CATEGORY)
+]
+
+
+def get_pressure_metrics(cgroup_name, cgroup):
+    """
+    Returns the PSI of the given cgroup (a CgroupV2) as a list of metrics: the share of time (avg60) in which some
+    (or all, for "full") of the tasks in the cgroup were stalled waiting for each resource. 'cgroup_name' is used as
+    the instance of the metrics.
+    """
+    metrics = []
+    for resource, category in PRESSURE_RESOURCES:
+        pressure = cgroup.get_pressure_stall_information(resource)
+        if pressure is None:
+            continue
+        for line, counter in (("some", MetricsCounter.PRESSURE_SOME), ("full", MetricsCounter.PRESSURE_FULL)):
+            # "full" is not reported for the cpu of non-root cgroups on older kernels
+            if line in pressure and "avg60" in pressure[line]:
+                metrics.append(MetricValue(category, counter, cgroup_name, pressure[line]["avg60"]))
+    return metrics
+
+
+class CpuQuotaPolicy(object):
+    """
+    Computes the CPUQuota of an extension unit from the CPU pressure of the system (the "some" avg10 of
+    /proc/pressure/cpu, i.e. the share of time in which runnable tasks were waiting for a CPU):
+
+        * when the pressure is at or above 'high_pressure', the quota is multiplied by 'tighten_factor', down to
+          'min_quota_fraction' of the configured quota
+        * when the pressure is at or below 'low_pressure', the quota is multiplied by 'relax_factor', up to the
+          configured quota
+        * otherwise the quota is not changed
+
+    Quotas are percentages of 1 CPU, as in the CPUQuota property of systemd units.
+    """
+    def __init__(self, high_pressure=40.0, low_pressure=10.0, tighten_factor=0.5, relax_factor=1.5, min_quota_fraction=0.2):
+        self.high_pressure = high_pressure
+        self.low_pressure = low_pressure
+        self.tighten_factor = tighten_factor
+        self.relax_factor = relax_factor
+        self.min_quota_fraction = min_quota_fraction
+
+    def get_cpu_quota(self, configured_quota, current_quota, cpu_pressure):
+        if cpu_pressure >= self.high_pressure:
+            quota = max(current_quota * self.tighten_factor, configured_quota * self.min_quota_fraction)
+        elif cpu_pressure <= self.low_pressure:
+            quota = min(current_quota * self.relax_factor, configured_quota)
+        else:
+            quota = current_quota
+        return max(1, int(round(quota)))
@@ -14,19 +14,64 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 import errno
+import array
+import math
 import threading
 
 from azurelinuxagent.common import logger
+from azurelinuxagent.ga.cgroupcontroller import MetricValue
 from azurelinuxagent.ga.cpucontroller import _CpuController
 from azurelinuxagent.common.future import ustr
 
 
+class MetricTimeSeries(object):
+    """
+    Fixed-size, array-backed ring buffer with the samples of a metric taken since the last call to summarize(). Once
+    the buffer is full, new samples overwrite the oldest ones.
+    """
+    def __init__(self, capacity):
+        self._samples = array.array('d', [0.0]) * capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, value):
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % len(self._samples)
+        self._count = min(self._count + 1, len(self._samples))
+
+    def summarize(self):
+        """
+        Returns a tuple with the min, max, avg and p95 (nearest-rank) of the samples and clears the buffer; returns None
+        if there are no samples.
+        """
+        if self._count == 0:
+            return None
+        # after a clear, samples are added starting at index 0, so the valid samples are always the first self._count
+        samples = sorted(self._samples[:self._count])
+        count = len(samples)
+        p95 = samples[int(math.ceil(0.95 * count)) - 1]
+        summary = samples[0], samples[-1], round(sum(samples) / count, 3), p95
+        self._next = 0
+        self._count = 0
+        return summary
+
+
 class CGroupsTelemetry(object):
     """
     """
     _tracked = {}
     _rlock = threading.RLock()
 
+    # Samples taken by sample_all_tracked(), indexed by the path of the controller and then by (category, counter,
+    # instance). Memory is bounded by the number of samples per metric and the maximum number of metrics.
+    _time_series = {}
+    _TIME_SERIES_CAPACITY = 128
+    _MAX_TIME_SERIES = 512
+    _SUMMARY_STATISTICS = ["Min", "Max", "Avg", "P95"]
+
     @staticmethod
     def track_cgroup_controller(cgroup_controller):
         """
@@ -72,13 +117,7 @@ class CGroupsTelemetry(object):
                 try:
                     metrics.extend(controller.get_tracked_metrics())
                 except Exception as e:
-                    # There can be scenarios when the CGroup has been deleted by the time we are fetching the values
-                    # from it. This would raise IOError with file entry not found (ERRNO: 2). We do not want to log
-                    # every occurrences of such case as it would be very verbose. We do want to log all the other
-                    # exceptions which could occur, which is why we do a periodic log for all the other errors.
-                    if not isinstance(e, (IOError, OSError)) or e.errno != errno.ENOENT:  # pylint: disable=E1101
-                        logger.periodic_warn(logger.EVERY_HOUR, '[PERIODIC] Could not collect metrics for cgroup '
-                                                                '{0}. Error : {1}'.format(controller.name, ustr(e)))
+                    CGroupsTelemetry._log_metrics_error(controller, e)
                 if not controller.is_active():
                     inactive_controllers.append(controller)
             for inactive_controller in inactive_controllers:
@@ -86,7 +125,65 @@ class CGroupsTelemetry(object):
 
         return metrics
 
+    @staticmethod
+    def sample_all_tracked():
+        """
+        Samples the metrics of the tracked controllers (see _CgroupController.get_sampled_metrics()) and adds them to
+        their time series; the time series are summarized by summarize_time_series().
+        """
+        with CGroupsTelemetry._rlock:
+            for controller in CGroupsTelemetry._tracked.values():
+                try:
+                    samples = controller.get_sampled_metrics()
+                except Exception as e:
+                    CGroupsTelemetry._log_metrics_error(controller, e)
+                    continue
+                time_series = CGroupsTelemetry._time_series.setdefault(controller.path, {})
+                for metric in samples:
+                    key = (metric.category, metric.counter, metric.instance)
+                    if key not in time_series:
+                        if CGroupsTelemetry._get_time_series_count() >= CGroupsTelemetry._MAX_TIME_SERIES:
+                            logger.periodic_warn(logger.EVERY_HOUR, "[PERIODIC] Too many metrics are being sampled; will not sample "
+                                                                    "{0}/{1} [{2}]".format(metric.category, metric.counter, metric.instance))
+                            continue
+                        time_series[key] = MetricTimeSeries(CGroupsTelemetry._TIME_SERIES_CAPACITY)
+                    time_series[key].add(metric.value)
+
+    @staticmethod
+    def summarize_time_series():
+        """
+        Returns the min, max, avg and p95 of the samples taken since the previous call as a list of metrics (for
+        example, the p95 of "% Processor Time" is reported as "% Processor Time - P95"), and clears the time series.
+        The time series of controllers that are no longer tracked are removed after they are summarized.
+        """
+        summaries = []
+        with CGroupsTelemetry._rlock:
+            for path in list(CGroupsTelemetry._time_series.keys()):
+                for (category, counter, instance), samples in CGroupsTelemetry._time_series[path].items():
+                    summary = samples.summarize()
+                    if summary is not None:
+                        for statistic, value in zip(CGroupsTelemetry._SUMMARY_STATISTICS, summary):
+                            summaries.append(MetricValue(category, "{0} - {1}".format(counter, statistic), instance, value))
+                if path not in CGroupsTelemetry._tracked:
+                    del CGroupsTelemetry._time_series[path]
+        return summaries
+
+    @staticmethod
+    def _get_time_series_count():
+        return sum(len(time_series) for time_series in CGroupsTelemetry._time_series.values())
+
+    @staticmethod
+    def _log_metrics_error(controller, e):
+        # There can be scenarios when the CGroup has been deleted by the time we are fetching the values
+        # from it. This would raise IOError with file entry not found (ERRNO: 2). We do not want to log
+        # every occurrences of such case as it would be very verbose. We do want to log all the other
+        # exceptions which could occur, which is why we do a periodic log for all the other errors.
+        if not isinstance(e, (IOError, OSError)) or e.errno != errno.ENOENT:  # pylint: disable=E1101
+            logger.periodic_warn(logger.EVERY_HOUR, '[PERIODIC] Could not collect metrics for cgroup '
+                                                    '{0}. Error : {1}'.format(controller.name, ustr(e)))
+
     @staticmethod
     def reset():
         with CGroupsTelemetry._rlock:
-            CGroupsTelemetry._tracked.clear()  # emptying the dictionary
\ No newline at end of file
+            CGroupsTelemetry._tracked.clear()  # emptying the dictionary
+            CGroupsTelemetry._time_series.clear()
\ No newline at end of file
@@ -84,6 +84,7 @@ class CollectLogsHandler(ThreadHandlerInterface):
 
     _THREAD_NAME = "CollectLogsHandler"
     __CGROUPS_FLAG_ENV_VARIABLE = "_AZURE_GUEST_AGENT_LOG_COLLECTOR_MONITOR_CGROUPS_"
+    __INCREMENTAL_FLAG_ENV_VARIABLE = "_AZURE_GUEST_AGENT_LOG_COLLECTOR_INCREMENTAL_"
 
     @staticmethod
     def get_thread_name():
@@ -104,6 +105,22 @@ class CollectLogsHandler(ThreadHandlerInterface):
             return os.environ[CollectLogsHandler.__CGROUPS_FLAG_ENV_VARIABLE] == "1"
         return False
 
+    @staticmethod
+    def enable_incremental_collection():
+        os.environ[CollectLogsHandler.__INCREMENTAL_FLAG_ENV_VARIABLE] = "1"
+
+    @staticmethod
+    def disable_incremental_collection():
+        if CollectLogsHandler.__INCREMENTAL_FLAG_ENV_VARIABLE in os.environ:
+            del os.environ[CollectLogsHandler.__INCREMENTAL_FLAG_ENV_VARIABLE]
+
+    @staticmethod
+    def is_enabled_incremental_collection():
+        # Only the periodic collection is incremental, since it is the only one that uploads the archive
+        if CollectLogsHandler.__INCREMENTAL_FLAG_ENV_VARIABLE in os.environ:
+            return os.environ[CollectLogsHandler.__INCREMENTAL_FLAG_ENV_VARIABLE] == "1"
+        return False
+
     def __init__(self):
         self.protocol = None
         self.protocol_util = None
@@ -155,6 +172,8 @@ class CollectLogsHandler(ThreadHandlerInterface):
 
         try:
             CollectLogsHandler.enable_monitor_cgroups_check()
+            if conf.get_enable_incremental_log_collection():
+                CollectLogsHandler.enable_incremental_collection()
             if self.protocol_util is None or self.protocol is None:
                 self.init_protocols()
 
@@ -170,6 +189,7 @@ class CollectLogsHandler(ThreadHandlerInterface):
             logger.error("An error occurred in the log collection thread; will exit the thread.\n{0}", ustr(e))
         finally:
             CollectLogsHandler.disable_monitor_cgroups_check()
+            CollectLogsHandler.disable_incremental_collection()
 
     def collect_and_send_logs(self):
         if self._collect_logs():
@@ -246,9 +266,9 @@ class CollectLogsHandler(ThreadHandlerInterface):
         msg = None
         success = False
         try:
+            # The archive is streamed from disk, to avoid reading it entirely into memory
             with open(COMPRESSED_ARCHIVE_PATH, "rb") as fh:
-                archive_content = fh.read()
-                self.protocol.upload_logs(archive_content)
+                self.protocol.upload_logs(fh)
                 msg = "Successfully uploaded logs."
                 logger.info(msg)
 
@@ -265,6 +285,12 @@ class CollectLogsHandler(ThreadHandlerInterface):
                 message=msg,
                 log_event=False)
 
+        if success:
+            try:
+                logcollector.commit_incremental_state()
+            except Exception as e:
+                logger.warn("Failed to save the state of the incremental log collection: {0}", ustr(e))
+
 
 def get_log_collector_monitor_handler(controllers):
     return LogCollectorMonitorHandler(controllers)
@@ -380,4 +406,6 @@ class LogCollectorMonitorHandler(ThreadHandlerInterface):
             add_event(name=AGENT_NAME, version=CURRENT_VERSION, op=WALAEventOperation.LogCollection, message=msg)
 
         if mem_limit_exceeded:
+            # os._exit() skips the atexit handlers, so flush the buffered log messages (including the reason for exiting) first
+            logger.flush()
             os._exit(GRACEFUL_KILL_ERRCODE)
@@ -29,15 +29,18 @@ from azurelinuxagent.common import conf
 from azurelinuxagent.common.agent_supported_feature import get_supported_feature_by_name, SupportedFeatureNames
 from azurelinuxagent.common.event import EVENTS_DIRECTORY, TELEMETRY_LOG_EVENT_ID, \
     TELEMETRY_LOG_PROVIDER_ID, add_event, WALAEventOperation, add_log_event, get_event_logger, \
-    CollectOrReportEventDebugInfo, EVENT_FILE_REGEX, parse_event
+    CollectOrReportEventDebugInfo, EVENT_FILE_REGEX, parse_event, create_event_spool, MAX_NUMBER_OF_EVENTS, \
+    MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT
 from azurelinuxagent.common.exception import InvalidExtensionEventError, ServiceStoppedError, EventError
 from azurelinuxagent.common.future import ustr, is_file_not_found_error
 from azurelinuxagent.ga.interfaces import ThreadHandlerInterface
 from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam, \
     GuestAgentGenericLogsSchema, GuestAgentExtensionEventsSchema
 from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils.spoolutil import read_segment, read_segment_offset, write_segment_offset, \
+    remove_segment
 from azurelinuxagent.ga.exthandlers import HANDLER_NAME_PATTERN
-from azurelinuxagent.ga.periodic_operation import PeriodicOperation
+from azurelinuxagent.ga.periodic_operation import PeriodicOperation, get_periodic_operation_scheduler
 
 # Event file specific retries and delays.
 NUM_OF_EVENT_FILE_RETRIES = 3
@@ -94,7 +97,7 @@ class _ProcessExtensionEvents(PeriodicOperation):
                                         not callable(getattr(ExtensionEventSchema, attr)) and not attr.startswith("__")]
 
     def __init__(self, send_telemetry_events_handler):
-        super(_ProcessExtensionEvents, self).__init__(_ProcessExtensionEvents._EXTENSION_EVENT_COLLECTION_PERIOD)
+        super(_ProcessExtensionEvents, self).__init__(_ProcessExtensionEvents._EXTENSION_EVENT_COLLECTION_PERIOD, blocking=True)
         self._send_telemetry_events_handler = send_telemetry_events_handler
 
     def _operation(self):
@@ -412,17 +415,123 @@ class _ProcessExtensionEvents(PeriodicOperation):
             event.parameters.append(TelemetryEventParam(param_name, replace_or_add_params[param_name]))
 
 
+class _PendingEvents(object):
+    """
+    Tracks the delivery of the events read from a spool segment or from an event file. The file is removed once all its
+    events have been acknowledged by the WireServer. For spool segments, the number of leading events acknowledged is
+    saved as the offset of the segment, so that if the agent restarts only the events after that offset are sent again.
+    """
+    _NOT_SENT = 0
+    _SENDING = 1
+    _DONE = 2
+
+    def __init__(self, path, events, is_spool_segment, offset=0):
+        """
+        'events' are the events read from the file starting at 'offset'; events that could not be parsed should be
+        None, since there is nothing to send for them.
+        """
+        self.path = path
+        self._events = events
+        self._is_spool_segment = is_spool_segment
+        self._offset = offset
+        self._saved_offset = offset
+        self._state = [_PendingEvents._DONE if e is None else _PendingEvents._NOT_SENT for e in events]
+        # Number of leading events that have been acknowledged, number of events not acknowledged yet and number of
+        # events being sent; these are kept up to date as the events complete to avoid scanning the entire state
+        self._acknowledged = 0
+        self._not_done = len([s for s in self._state if s != _PendingEvents._DONE])
+        self._sending = 0
+        self._removed = False
+        self._lock = threading.Lock()
+        if self._not_done == 0:
+            self._remove()
+        else:
+            self._advance_acknowledged()
+
+    def is_removed(self):
+        return self._removed
+
+    def get_events_to_send(self):
+        """
+        Returns the (index, event) pairs of the events that have not been sent yet
+        """
+        with self._lock:
+            return [(i, self._events[i]) for i in range(len(self._events)) if self._state[i] == _PendingEvents._NOT_SENT]
+
+    def start_sending(self, index):
+        with self._lock:
+            if self._state[index] == _PendingEvents._NOT_SENT:
+                self._state[index] = _PendingEvents._SENDING
+                self._sending += 1
+
+    def complete(self, index, sent):
+        """
+        Records the result of sending the event at 'index'. The file is removed once all its events are acknowledged;
+        otherwise, the offset of a spool segment is saved when none of its events are being sent anymore (i.e. once the
+        batches carrying them completed) or when an event could not be sent, rather than on each acknowledgement.
+        """
+        with self._lock:
+            if self._removed or self._state[index] != _PendingEvents._SENDING:
+                return
+            self._sending -= 1
+            if sent:
+                self._state[index] = _PendingEvents._DONE
+                self._not_done -= 1
+                if self._not_done == 0:
+                    self._remove()
+                    return
+                self._advance_acknowledged()
+            else:
+                self._state[index] = _PendingEvents._NOT_SENT
+            if not sent or self._sending == 0:
+                self._save_offset()
+
+    def _advance_acknowledged(self):
+        while self._acknowledged < len(self._state) and self._state[self._acknowledged] == _PendingEvents._DONE:
+            self._acknowledged += 1
+
+    def _save_offset(self):
+        if self._is_spool_segment and self._offset + self._acknowledged > self._saved_offset:
+            write_segment_offset(self.path, self._offset + self._acknowledged)
+            self._saved_offset = self._offset + self._acknowledged
+
+    def drop(self):
+        """
+        Removes the file without waiting for its events to be acknowledged; returns the number of events dropped
+        """
+        with self._lock:
+            if self._removed:
+                return 0
+            self._remove()
+            return self._not_done
+
+    def _remove(self):
+        if self._is_spool_segment:
+            remove_segment(self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self._removed = True
+
+
 class _CollectAndEnqueueEvents(PeriodicOperation):
     """
     Periodic operation to collect telemetry events located in the events folder and enqueue them for the
     SendTelemetryHandler thread.
+
+    The files are removed only after their events are acknowledged by the WireServer; events that could not be sent
+    are enqueued again on the next run.
     """
 
     _EVENT_COLLECTION_PERIOD = datetime.timedelta(minutes=1)
 
+    # Maximum number of spool segments waiting to be sent; if the WireServer cannot be reached for a while the oldest
+    # segments are dropped.
+    _MAX_PENDING_SPOOL_SEGMENTS = MAX_NUMBER_OF_EVENTS // MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT
+
     def __init__(self, send_telemetry_events_handler):
-        super(_CollectAndEnqueueEvents, self).__init__(_CollectAndEnqueueEvents._EVENT_COLLECTION_PERIOD)
+        super(_CollectAndEnqueueEvents, self).__init__(_CollectAndEnqueueEvents._EVENT_COLLECTION_PERIOD, blocking=True)
         self._send_telemetry_events_handler = send_telemetry_events_handler
+        self._pending_events = {}  # path of the event file or spool segment -> _PendingEvents
 
     def _operation(self):
         """
@@ -440,20 +549,101 @@ class _CollectAndEnqueueEvents(PeriodicOperation):
 
     def process_events(self):
         """
-        Returns a list of events that need to be sent to the telemetry pipeline and deletes the corresponding files
-        from the events directory.
+        Enqueues the events in the events directory that need to be sent to the telemetry pipeline, along with the
+        events collected on previous runs that could not be sent.
         """
         event_directory_full_path = os.path.join(conf.get_lib_dir(), EVENTS_DIRECTORY)
-        event_files = os.listdir(event_directory_full_path)
         debug_info = CollectOrReportEventDebugInfo(operation=CollectOrReportEventDebugInfo.OP_COLLECT)
 
-        for event_file in event_files:
+        for path in [p for p, pending in self._pending_events.items() if pending.is_removed()]:
+            del self._pending_events[path]
+
+        self._collect_event_spool(event_directory_full_path, debug_info)
+
+        # Event files from previous versions of the agent and from extensions
+        self._collect_event_files(event_directory_full_path, debug_info)
+
+        try:
+            for path in sorted(self._pending_events.keys()):
+                pending = self._pending_events[path]
+                for index, event in pending.get_events_to_send():
+                    pending.start_sending(index)
+                    try:
+                        self._send_telemetry_events_handler.enqueue_event(
+                            event, on_complete=lambda sent, p=pending, i=index: p.complete(i, sent))
+                    except Exception:
+                        pending.complete(index, False)
+                        raise
+        except ServiceStoppedError as stopped_error:
+            logger.error(
+                "Unable to enqueue events as service stopped: {0}, skipping events collection".format(
+                    ustr(stopped_error)))
+        except Exception as error:
+            debug_info.update_op_error(error)
+
+        debug_info.report_debug_info()
+
+    def _collect_event_spool(self, event_directory, debug_info):
+        """
+        Reads the segments of the agent's event spool; each segment is read in a single operation.
+        """
+        segments = create_event_spool(event_directory).claim_segments()
+
+        # Bound the disk usage if the events cannot be sent (e.g. the WireServer is unreachable) by dropping the oldest segments
+        drop_count = max(0, len(segments) - self._MAX_PENDING_SPOOL_SEGMENTS)
+        for segment in segments[:drop_count]:
+            try:
+                pending = self._pending_events.pop(segment, None)
+                if pending is not None:
+                    dropped = pending.drop()
+                else:
+                    records, _ = read_segment(segment)
+                    dropped = max(0, len(records) - read_segment_offset(segment))
+                    remove_segment(segment)
+                debug_info.update_dropped_events(dropped, "Too many pending segments in the event spool; dropped {0}".format(segment))
+            except Exception as error:
+                debug_info.update_op_error(error)
+
+        for segment in segments[drop_count:]:
+            if segment in self._pending_events:
+                continue
+            try:
+                logger.verbose("Processing event spool segment: {0}", segment)
+                records, corrupted_bytes = read_segment(segment)
+                offset = read_segment_offset(segment)
+            except Exception as error:
+                debug_info.update_op_error(error)
+                remove_segment(segment)
+                continue
+
+            if corrupted_bytes > 0:
+                debug_info.update_op_error(EventError("Skipped {0} corrupted bytes at the end of {1}".format(corrupted_bytes, segment)))
+
+            events = []
+            for record in records[offset:]:
+                event = None
+                try:
+                    event = parse_event(record.decode("utf-8"))
+                except UnicodeError as uni_err:
+                    debug_info.update_unicode_error(uni_err)
+                except Exception as error:
+                    debug_info.update_op_error(error)
+                events.append(event)
+
+            pending = _PendingEvents(segment, events, is_spool_segment=True, offset=offset)
+            if not pending.is_removed():
+                self._pending_events[segment] = pending
+
+    def _collect_event_files(self, event_directory, debug_info):
+        for event_file in os.listdir(event_directory):
             try:
                 match = EVENT_FILE_REGEX.search(event_file)
                 if match is None:
                     continue
 
-                event_file_path = os.path.join(event_directory_full_path, event_file)
+                event_file_path = os.path.join(event_directory, event_file)
+                if event_file_path in self._pending_events:
+                    continue
 
                 try:
                     logger.verbose("Processing event file: {0}", event_file_path)
@@ -477,24 +667,17 @@ class _CollectAndEnqueueEvents(PeriodicOperation):
                             _CollectAndEnqueueEvents._update_legacy_agent_event(event,
                                                                                 event_file_creation_time)
 
-                    self._send_telemetry_events_handler.enqueue_event(event)
-                finally:
-                    # Todo: We should delete files after ensuring that we sent the data to Wireserver successfully
-                    # from our end rather than deleting first and sending later. This is to ensure the data reliability
-                    # of the agent telemetry pipeline.
+                    self._pending_events[event_file_path] = _PendingEvents(event_file_path, [event], is_spool_segment=False)
+                except Exception:
+                    # The file cannot be parsed, so there is no point in keeping it around
                     if os.path.exists(event_file_path):
                         os.remove(event_file_path)
-            except ServiceStoppedError as stopped_error:
-                logger.error(
-                    "Unable to enqueue events as service stopped: {0}, skipping events collection".format(
-                        ustr(stopped_error)))
+                    raise
             except UnicodeError as uni_err:
                 debug_info.update_unicode_error(uni_err)
             except Exception as error:
                 debug_info.update_op_error(error)
 
-        debug_info.report_debug_info()
-
     @staticmethod
     def _read_and_parse_event_file(event_file_path):
         """
@@ -573,10 +756,10 @@ class CollectTelemetryEventsHandler(ThreadHandlerInterface):
 
     _THREAD_NAME = "TelemetryEventsCollector"
 
-    def __init__(self, send_telemetry_events_handler):
+    def __init__(self, send_telemetry_events_handler, scheduler=None):
         self.should_run = True
-        self.thread = None
         self._send_telemetry_events_handler = send_telemetry_events_handler
+        self._scheduler = scheduler if scheduler is not None else get_periodic_operation_scheduler()
 
     @staticmethod
     def get_thread_name():
@@ -587,26 +770,23 @@ class CollectTelemetryEventsHandler(ThreadHandlerInterface):
         self.start()
 
     def is_alive(self):
-        return self.thread is not None and self.thread.is_alive()
+        return self._scheduler.is_registered(self.get_thread_name())
 
     def start(self):
-        self.thread = threading.Thread(target=self.daemon)
-        self.thread.daemon = True
-        self.thread.name = CollectTelemetryEventsHandler.get_thread_name()
-        self.thread.start()
+        self.should_run = True
+        self._scheduler.register(self.get_thread_name(), self._create_periodic_operations)
 
     def stop(self):
         """
-        Stop server communication and join the thread to main thread.
+        Stop the periodic operations and wait for the current one, if any, to complete.
         """
         self.should_run = False
-        if self.is_alive():
-            self.thread.join()
+        self._scheduler.unregister(self.get_thread_name())
 
     def stopped(self):
         return not self.should_run
 
-    def daemon(self):
+    def _create_periodic_operations(self):
         periodic_operations = [
             _CollectAndEnqueueEvents(self._send_telemetry_events_handler)
         ]
@@ -617,17 +797,7 @@ class CollectTelemetryEventsHandler(ThreadHandlerInterface):
             periodic_operations.append(_ProcessExtensionEvents(self._send_telemetry_events_handler))
 
         logger.info("Successfully started the {0} thread".format(self.get_thread_name()))
-        while not self.stopped():
-            try:
-                for periodic_op in periodic_operations:
-                    periodic_op.run()
-
-            except Exception as error:
-                logger.warn(
-                    "An error occurred in the Telemetry Extension thread main loop; will skip the current iteration.\n{0}",
-                    ustr(error))
-            finally:
-                PeriodicOperation.sleep_until_next_operation(periodic_operations)
+        return periodic_operations
 
     @staticmethod
     def add_common_params_to_telemetry_event(event, event_time):
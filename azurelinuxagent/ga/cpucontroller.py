@@ -15,7 +15,6 @@
 # Requires Python 2.6+ and Openssl 1.0+
 
 import errno
-import os
 import re
 
 from azurelinuxagent.common.exception import CGroupsException
@@ -25,7 +24,6 @@ from azurelinuxagent.common.utils import fileutil
 from azurelinuxagent.ga.cgroupcontroller import _CgroupController, MetricValue, MetricsCategory, MetricsCounter
 
 re_v1_user_system_times = re.compile(r'user (\d+)\nsystem (\d+)\n')
-re_v2_usage_time = re.compile(r'[\s\S]*usage_usec (\d+)[\s\S]*')
 
 
 class _CpuController(_CgroupController):
@@ -39,37 +37,34 @@ class _CpuController(_CgroupController):
         self._current_system_cpu = None
         self._previous_throttled_time = None
         self._current_throttled_time = None
+        self._sampled_cgroup_cpu = None
+        self._sampled_system_cpu = None
 
     def _get_cpu_stat_counter(self, counter_name):
         """
         Gets the value for the provided counter in cpu.stat
         """
+        #
+        # Sample file v1:
+        #   # cat cpu.stat
+        #   nr_periods  51660
+        #   nr_throttled 19461
+        #   throttled_time 1529590856339
+        #
+        # Sample file v2
+        #   # cat cpu.stat
+        #   usage_usec 200161503
+        #   user_usec 199388368
+        #   system_usec 773134
+        #   core_sched.force_idle_usec 0
+        #   nr_periods 40059
+        #   nr_throttled 40022
+        #   throttled_usec 3565247992
+        #   nr_bursts 0
+        #   burst_usec 0
+        #
         try:
-            with open(os.path.join(self.path, 'cpu.stat')) as cpu_stat:
-                #
-                # Sample file v1:
-                #   # cat cpu.stat
-                #   nr_periods  51660
-                #   nr_throttled 19461
-                #   throttled_time 1529590856339
-                #
-                # Sample file v2
-                #   # cat cpu.stat
-                #   usage_usec 200161503
-                #   user_usec 199388368
-                #   system_usec 773134
-                #   core_sched.force_idle_usec 0
-                #   nr_periods 40059
-                #   nr_throttled 40022
-                #   throttled_usec 3565247992
-                #   nr_bursts 0
-                #   burst_usec 0
-                #
-                for line in cpu_stat:
-                    match = re.match(r'{0}\s+(\d+)'.format(counter_name), line)
-                    if match is not None:
-                        return int(match.groups()[0])
-                raise Exception("Cannot find {0}".format(counter_name))
+            cpu_stat = self._get_stat_file('cpu.stat')
         except (IOError, OSError) as e:
             if e.errno == errno.ENOENT:
                 return 0
@@ -77,6 +72,10 @@ class _CpuController(_CgroupController):
         except Exception as e:
             raise CGroupsException("Failed to read cpu.stat: {0}".format(ustr(e)))
 
+        if counter_name not in cpu_stat:
+            raise CGroupsException("Failed to read cpu.stat: Cannot find {0}".format(counter_name))
+        return cpu_stat[counter_name]
+
     def _cpu_usage_initialized(self):
         """
         Returns True if cpu usage has been initialized, False otherwise.
@@ -100,6 +99,19 @@ class _CpuController(_CgroupController):
         """
         raise NotImplementedError()
 
+    def _get_cpu_counters(self):
+        """
+        Returns a tuple with the CPU time consumed by the cgroup and the CPU time of the system, in the units expected
+        by _compute_cpu_usage()
+        """
+        raise NotImplementedError()
+
+    def _compute_cpu_usage(self, cgroup_delta, system_delta):
+        """
+        Computes the CPU usage (see get_cpu_usage()) from the deltas of the values returned by _get_cpu_counters()
+        """
+        raise NotImplementedError()
+
     def get_cpu_throttled_time(self, read_previous_throttled_time=True):
         """
         Computes the throttled time (in seconds) since the last call to this function.
@@ -108,15 +120,33 @@ class _CpuController(_CgroupController):
         """
         raise NotImplementedError()
 
+    def get_sampled_metrics(self):
+        # The CPU usage is computed since the previous sample; this uses its own counters, so it does not change the
+        # values returned by get_cpu_usage()
+        with self.snapshot():
+            cgroup_cpu, system_cpu = self._get_cpu_counters()
+
+        previous_cgroup_cpu, previous_system_cpu = self._sampled_cgroup_cpu, self._sampled_system_cpu
+        self._sampled_cgroup_cpu, self._sampled_system_cpu = cgroup_cpu, system_cpu
+        if previous_cgroup_cpu is None:
+            return []
+
+        cpu_usage = self._compute_cpu_usage(cgroup_cpu - previous_cgroup_cpu, system_cpu - previous_system_cpu)
+        if cpu_usage < float(0):
+            return []
+        return [MetricValue(MetricsCategory.CPU_CATEGORY, MetricsCounter.PROCESSOR_PERCENT_TIME, self.name, cpu_usage)]
+
     def get_tracked_metrics(self):
         # Note: If the current cpu usage is less than the previous usage (metric is negative), then an empty array will
         # be returned and the agent won't track the metrics.
         tracked = []
-        cpu_usage = self.get_cpu_usage()
+        with self.snapshot():
+            cpu_usage = self.get_cpu_usage()
+            throttled_time = self.get_cpu_throttled_time()
+
         if cpu_usage >= float(0):
             tracked.append(MetricValue(MetricsCategory.CPU_CATEGORY, MetricsCounter.PROCESSOR_PERCENT_TIME, self.name, cpu_usage))
 
-        throttled_time = self.get_cpu_throttled_time()
         if cpu_usage >= float(0) and throttled_time >= float(0):
             tracked.append(MetricValue(MetricsCategory.CPU_CATEGORY, MetricsCounter.THROTTLED_TIME, self.name, throttled_time))
 
@@ -175,12 +205,15 @@ class CpuControllerV1(_CpuController):
 
         self._previous_cgroup_cpu = self._current_cgroup_cpu
         self._previous_system_cpu = self._current_system_cpu
-        self._current_cgroup_cpu = self._get_cpu_ticks()
-        self._current_system_cpu = self._osutil.get_total_cpu_ticks_since_boot()
+        self._current_cgroup_cpu, self._current_system_cpu = self._get_cpu_counters()
 
-        cgroup_delta = self._current_cgroup_cpu - self._previous_cgroup_cpu
-        system_delta = max(1, self._current_system_cpu - self._previous_system_cpu)
+        return self._compute_cpu_usage(self._current_cgroup_cpu - self._previous_cgroup_cpu, self._current_system_cpu - self._previous_system_cpu)
 
+    def _get_cpu_counters(self):
+        return self._get_cpu_ticks(), self._osutil.get_total_cpu_ticks_since_boot()
+
+    def _compute_cpu_usage(self, cgroup_delta, system_delta):
+        system_delta = max(1, system_delta)
         return round(100.0 * self._osutil.get_processor_cores() * float(cgroup_delta) / float(system_delta), 3)
 
     def get_cpu_throttled_time(self, read_previous_throttled_time=True):
@@ -236,7 +269,7 @@ class CpuControllerV2(_CpuController):
         returns 0; this is useful when the function can be called before the cgroup has been created.
         """
         try:
-            cpu_stat = self._get_file_contents('cpu.stat')
+            cpu_stat = self._get_stat_file('cpu.stat')
         except Exception as e:
             if not isinstance(e, (IOError, OSError)) or e.errno != errno.ENOENT:  # pylint: disable=E1101
                 raise CGroupsException("Failed to read cpu.stat: {0}".format(ustr(e)))
@@ -260,10 +293,9 @@ class CpuControllerV2(_CpuController):
             #     nr_bursts 0
             #     burst_usec 0
             #
-            match = re_v2_usage_time.match(cpu_stat)
-            if not match:
+            if 'usage_usec' not in cpu_stat:
                 raise CGroupsException("The contents of {0} are invalid: {1}".format(self._get_cgroup_file('cpu.stat'), cpu_stat))
-            cpu_time = int(match.groups()[0]) / 1E6
+            cpu_time = cpu_stat['usage_usec'] / 1E6
 
         return cpu_time
 
@@ -273,12 +305,15 @@ class CpuControllerV2(_CpuController):
 
         self._previous_cgroup_cpu = self._current_cgroup_cpu
         self._previous_system_cpu = self._current_system_cpu
-        self._current_cgroup_cpu = self._get_cpu_time()
-        self._current_system_cpu = self._get_system_usage()
+        self._current_cgroup_cpu, self._current_system_cpu = self._get_cpu_counters()
+
+        return self._compute_cpu_usage(self._current_cgroup_cpu - self._previous_cgroup_cpu, self._current_system_cpu - self._previous_system_cpu)
 
-        cgroup_delta = self._current_cgroup_cpu - self._previous_cgroup_cpu
-        system_delta = max(1.0, self._current_system_cpu - self._previous_system_cpu)
+    def _get_cpu_counters(self):
+        return self._get_cpu_time(), self._get_system_usage()
 
+    def _compute_cpu_usage(self, cgroup_delta, system_delta):
+        system_delta = max(1.0, system_delta)
         return round(100.0 * float(cgroup_delta) / float(system_delta), 3)
 
     def get_cpu_throttled_time(self, read_previous_throttled_time=True):
@@ -19,7 +19,6 @@
 import datetime
 import re
 import socket
-import threading
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
@@ -33,7 +32,7 @@ from azurelinuxagent.ga.interfaces import ThreadHandlerInterface
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.protocol.util import get_protocol_util
 from azurelinuxagent.common.version import AGENT_NAME
-from azurelinuxagent.ga.periodic_operation import PeriodicOperation
+from azurelinuxagent.ga.periodic_operation import PeriodicOperation, get_periodic_operation_scheduler
 
 CACHE_PATTERNS = [
     re.compile(r"^(.*)\.(\d+)\.(agentsManifest)$", re.IGNORECASE),
@@ -59,7 +58,7 @@ class RemovePersistentNetworkRules(PeriodicOperation):
 
 class MonitorDhcpClientRestart(PeriodicOperation):
     def __init__(self, osutil):
-        super(MonitorDhcpClientRestart, self).__init__(conf.get_monitor_dhcp_client_restart_period())
+        super(MonitorDhcpClientRestart, self).__init__(conf.get_monitor_dhcp_client_restart_period(), blocking=True)
         self.osutil = osutil
         self.dhcp_handler = get_dhcp_handler()
         self.dhcp_handler.conf_routes()
@@ -101,7 +100,7 @@ class MonitorDhcpClientRestart(PeriodicOperation):
 
 class EnableFirewall(PeriodicOperation):
     def __init__(self, wire_server_address):
-        super(EnableFirewall, self).__init__(conf.get_enable_firewall_period())
+        super(EnableFirewall, self).__init__(conf.get_enable_firewall_period(), blocking=True)
         self._wire_server_address = wire_server_address
         self._firewall_manager = None  # initialized on demand in the _operation method
         self._message_count = 0
@@ -175,6 +174,9 @@ class EnvHandler(ThreadHandlerInterface):
 
     Monitor scsi disk.
     If new scsi disk found, set timeout
+
+    The operations run on the shared PeriodicOperationScheduler; get_thread_name() is the name of the group of
+    operations in the scheduler.
     """
 
     _THREAD_NAME = "EnvHandler"
@@ -183,10 +185,9 @@ class EnvHandler(ThreadHandlerInterface):
     def get_thread_name():
         return EnvHandler._THREAD_NAME
 
-    def __init__(self):
+    def __init__(self, scheduler=None):
         self.stopped = True
-        self.hostname = None
-        self.env_thread = None
+        self._scheduler = scheduler if scheduler is not None else get_periodic_operation_scheduler()
 
     def run(self):
         if not self.stopped:
@@ -198,49 +199,37 @@ class EnvHandler(ThreadHandlerInterface):
         self.start()
 
     def is_alive(self):
-        return self.env_thread.is_alive()
+        return self._scheduler.is_registered(self.get_thread_name())
 
     def start(self):
-        self.env_thread = threading.Thread(target=self.daemon)
-        self.env_thread.daemon = True
-        self.env_thread.name = self.get_thread_name()
-        self.env_thread.start()
+        self._scheduler.register(self.get_thread_name(), self._create_periodic_operations)
 
-    def daemon(self):
-        try:
-            # The initialization of the protocol needs to be done within the environment thread itself rather
-            # than initializing it in the ExtHandler thread. This is done to avoid any concurrency issues as each
-            # thread would now have its own ProtocolUtil object as per the SingletonPerThread model.
-            protocol_util = get_protocol_util()
-            protocol = protocol_util.get_protocol()
-            osutil = get_osutil()
-
-            periodic_operations = [
-                RemovePersistentNetworkRules(osutil),
-                MonitorDhcpClientRestart(osutil),
-            ]
-
-            if conf.enable_firewall():
-                periodic_operations.append(EnableFirewall(protocol.get_endpoint()))
-            if conf.get_root_device_scsi_timeout() is not None:
-                periodic_operations.append(SetRootDeviceScsiTimeout(osutil))
-            if conf.get_monitor_hostname():
-                periodic_operations.append(MonitorHostNameChanges(osutil))
-            while not self.stopped:
-                try:
-                    for op in periodic_operations:
-                        op.run()
-                except Exception as e:
-                    logger.error("An error occurred in the environment thread main loop; will skip the current iteration.\n{0}", ustr(e))
-                finally:
-                    PeriodicOperation.sleep_until_next_operation(periodic_operations)
-        except Exception as e:
-            logger.error("An error occurred in the environment thread; will exit the thread.\n{0}", ustr(e))
+    @staticmethod
+    def _create_periodic_operations():
+        # The scheduler invokes this function on a thread dedicated to this group, rather than on the ExtHandler thread or
+        # on a thread shared with other groups. This is done to avoid any concurrency issues, since the group gets its own
+        # ProtocolUtil object as per the SingletonPerThread model.
+        protocol_util = get_protocol_util()
+        protocol = protocol_util.get_protocol()
+        osutil = get_osutil()
+
+        periodic_operations = [
+            RemovePersistentNetworkRules(osutil),
+            MonitorDhcpClientRestart(osutil),
+        ]
+
+        if conf.enable_firewall():
+            periodic_operations.append(EnableFirewall(protocol.get_endpoint()))
+        if conf.get_root_device_scsi_timeout() is not None:
+            periodic_operations.append(SetRootDeviceScsiTimeout(osutil))
+        if conf.get_monitor_hostname():
+            periodic_operations.append(MonitorHostNameChanges(osutil))
+
+        return periodic_operations
 
     def stop(self):
         """
-        Stop server communication and join the thread to main thread.
+        Stop the periodic operations and wait for the current one, if any, to complete.
         """
         self.stopped = True
-        if self.env_thread is not None:
-            self.env_thread.join()
+        self._scheduler.unregister(self.get_thread_name())
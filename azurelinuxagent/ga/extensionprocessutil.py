@@ -17,9 +17,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
+import fcntl
 import os
 import re
 import signal
+import threading
 import time
 
 from azurelinuxagent.common import conf
@@ -27,34 +30,63 @@ from azurelinuxagent.common import logger
 from azurelinuxagent.common.event import WALAEventOperation, add_event
 from azurelinuxagent.common.exception import ExtensionErrorCodes, ExtensionOperationError, ExtensionError
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.utils import shellutil
 
 TELEMETRY_MESSAGE_MAX_LEN = 3200
 
+# Time (in seconds) given to the processes forked by a command to start after the command exits
+_FORKED_PROCESSES_GRACE_PERIOD = 1
 
-def wait_for_process_completion_or_timeout(process, timeout, cpu_controller):
+# Maximum time (in seconds) to wait for the output of a command to be drained from its pipes after the command exits;
+# the wait ends earlier if no data is read during _OUTPUT_DRAIN_INTERVAL (e.g. because the pipes are held open by a
+# process forked by the command)
+_OUTPUT_DRAIN_TIMEOUT = 5
+_OUTPUT_DRAIN_INTERVAL = 0.05
+
+
+def _is_process_group_alive(pgid):
+    try:
+        os.killpg(pgid, 0)
+        return True
+    except OSError as e:
+        return e.errno != errno.ESRCH
+
+
+def wait_for_process_completion_or_timeout(process, timeout, cpu_controller, wait_stats=None):
     """
     Utility function that waits for the process to complete within the given time frame. This function will terminate
     the process if when the given time frame elapses.
     :param process: Reference to a running process
     :param timeout: Number of seconds to wait for the process to complete before killing it
-    :return: Two parameters: boolean for if the process timed out and the return code of the process (None if timed out)
+    :param wait_stats: If given, a dictionary where the time spent after the process exited is stored as 'overhead_ms'
+    :return: Three parameters: boolean for if the process timed out, the return code of the process (None if timed out)
+             and the CPU throttled time (only if timed out)
     """
-    while timeout > 0 and process.poll() is None:
-        time.sleep(1)
-        timeout -= 1
+    try:
+        pgid = os.getpgid(process.pid)  # the process is a zombie at worst, since we have not reaped it yet
+    except Exception:
+        pgid = None
 
     return_code = None
     throttled_time = 0
 
-    if timeout == 0:
+    timed_out = shellutil.wait_for_process_exit(process, timeout) is None
+
+    if timed_out:
         throttled_time = get_cpu_throttled_time(cpu_controller)
         os.killpg(os.getpgid(process.pid), signal.SIGKILL)
     else:
-        # process completed or forked; sleep 1 sec to give the child process (if any) a chance to start
-        time.sleep(1)
+        exit_time = time.time()
         return_code = process.wait()
+        # The command may have forked processes that keep running (e.g. an extension that starts a daemon); give them
+        # a chance to start. Commands started on their own process group (as extension commands are) that did not
+        # leave any processes behind do not need to wait.
+        if pgid is None or pgid != process.pid or _is_process_group_alive(pgid):
+            time.sleep(_FORKED_PROCESSES_GRACE_PERIOD)
+        if wait_stats is not None:
+            wait_stats["overhead_ms"] = int((time.time() - exit_time) * 1000)
 
-    return timeout == 0, return_code, throttled_time
+    return timed_out, return_code, throttled_time
 
 
 def handle_process_completion(process, command, timeout, stdout, stderr, error_code, cpu_controller=None):
@@ -65,16 +97,25 @@ def handle_process_completion(process, command, timeout, stdout, stderr, error_c
     :param process: Reference to a running process
     :param command: The extension command to run
     :param timeout: Number of seconds to wait before killing the process
-    :param stdout: Must be a file since we seek on it when parsing the subprocess output
-    :param stderr: Must be a file since we seek on it when parsing the subprocess outputs
+    :param stdout: Must be a file (since we seek on it when parsing the subprocess output) or an ExtensionOutputCapture
+    :param stderr: Must be a file (since we seek on it when parsing the subprocess output) or an ExtensionOutputCapture
     :param error_code: The error code to set if we raise an ExtensionError
     :param cpu_controller: References the cpu controller for the cgroup
     :return:
     """
     # Wait for process completion or timeout
-    timed_out, return_code, throttled_time = wait_for_process_completion_or_timeout(process, timeout, cpu_controller)
+    wait_stats = {}
+    timed_out, return_code, throttled_time = wait_for_process_completion_or_timeout(process, timeout, cpu_controller, wait_stats=wait_stats)
+    for stream in (stdout, stderr):
+        if isinstance(stream, ExtensionOutputCapture):
+            stream.finish(_OUTPUT_DRAIN_TIMEOUT)
     process_output = read_output(stdout, stderr)
 
+    if "overhead_ms" in wait_stats:
+        add_event(op=WALAEventOperation.ExtensionCommandWait,
+                  message="Command: {0}; exit code: {1}; wait overhead: {2} ms".format(command, return_code, wait_stats["overhead_ms"]),
+                  log_event=False)
+
     if timed_out:
         if cpu_controller is not None: # Report CPUThrottledTime when timeout happens
             raise ExtensionError("Timeout({0});CPUThrottledTime({1}secs): {2}\n{3}".format(timeout, throttled_time, command, process_output),
@@ -140,24 +181,185 @@ def _check_noexec():
     return None
 
 
+class ExtensionOutputCapture(object):
+    """
+    Captures one of the output streams (stdout or stderr) of an extension command through a pipe, as an alternative to
+    redirecting it to a temporary file.
+
+    Only the first and last 'buffer_size' bytes of the output are kept in memory; if 'log_file' is given, the full
+    output is also appended to that file, which is rotated (to '<log_file>.1') when it exceeds 'log_max_size' bytes.
+    The pipe is drained by a background thread, so the command never blocks writing its output. If processes forked by
+    the command (e.g. a daemon started by the extension) still hold the pipe when the capture finishes, the thread keeps
+    draining it for as long as the agent runs, writing to the same rotated log file (so the disk usage remains bounded);
+    see finish().
+
+    Instances can be passed as the stdout/stderr of subprocess.Popen (they implement fileno()) and, after the command
+    completes, as the stdout/stderr of handle_process_completion(). seek() and read() operate on the first bytes of
+    the output, as they would on a file, while read_tail() returns the last bytes.
+    """
+    def __init__(self, log_file=None, buffer_size=TELEMETRY_MESSAGE_MAX_LEN, log_max_size=10 * 1024 * 1024):
+        self._log_file = log_file
+        self._buffer_size = buffer_size
+        self._log_max_size = log_max_size
+        self._log = None
+        self._lock = threading.RLock()
+        self._write_fd = None
+        self._reader = None
+        self._position = 0
+        self._head = b''
+        self._tail = b''
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def fileno(self):
+        """
+        Returns the write end of the pipe, creating it (and starting the thread that reads it) if needed.
+        """
+        with self._lock:
+            if self._write_fd is None:
+                read_fd, self._write_fd = os.pipe()
+                # do not let other commands inherit the pipe (Popen duplicates the write end onto the stdout/stderr of
+                # the command, so the command itself still gets it)
+                for fd in (read_fd, self._write_fd):
+                    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+                self._reader = threading.Thread(target=self._read, args=(read_fd,))
+                self._reader.daemon = True
+                self._reader.name = "ExtensionOutputCapture"
+                self._reader.start()
+            return self._write_fd
+
+    def finish(self, timeout):
+        """
+        Closes the write end of the pipe (the command must have already been started) and waits up to 'timeout' seconds
+        for the output to be drained. If any processes forked by the command still hold the pipe, this method returns
+        without waiting for them and the reader thread keeps draining the pipe in the background.
+
+        NOTE: The read end of the pipe is closed when the agent exits, so processes that still hold the pipe at that
+        point get EPIPE (or SIGPIPE) on their next write; extensions that start daemons should redirect their output.
+        """
+        self.close()
+        reader = self._reader
+        if reader is None:
+            return
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            size = self.size
+            reader.join(_OUTPUT_DRAIN_INTERVAL)
+            if not reader.is_alive() or self.size == size:
+                break
+        if reader.is_alive():
+            logger.info("The output of an extension command is held by processes it forked; it will continue to be {0} in the background",
+                        "written to {0}".format(self._log_file) if self._log_file is not None else "discarded")
+
+    def close(self):
+        with self._lock:
+            if self._write_fd is not None:
+                os.close(self._write_fd)
+                self._write_fd = None
+
+    @property
+    def size(self):
+        """
+        Total number of bytes written to the stream
+        """
+        with self._lock:
+            return self._size
+
+    def seek(self, position):
+        with self._lock:
+            self._position = position
+
+    def read(self, size=-1):
+        with self._lock:
+            end = len(self._head) if size < 0 else self._position + size
+            data = self._head[self._position:end]
+            self._position += len(data)
+            return data
+
+    def read_tail(self):
+        with self._lock:
+            return self._tail
+
+    def truncate(self, size=0):
+        if size != 0:
+            raise ValueError("Output captures can only be truncated to 0 bytes")
+        with self._lock:
+            self._position = 0
+            self._head = b''
+            self._tail = b''
+            self._size = 0
+
+    def _read(self, read_fd):
+        try:
+            while True:
+                data = os.read(read_fd, 64 * 1024)
+                if not data:
+                    break
+                self._append(data)
+        except Exception as e:
+            logger.warn("Error reading the output of an extension command: {0}", ustr(e))
+        finally:
+            os.close(read_fd)
+            with self._lock:
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+
+    def _append(self, data):
+        with self._lock:
+            if len(self._head) < self._buffer_size:
+                self._head += data[:self._buffer_size - len(self._head)]
+            self._tail = (self._tail + data)[-self._buffer_size:]
+            self._size += len(data)
+            if self._log_file is not None:
+                self._write_log(data)
+
+    def _write_log(self, data):
+        try:
+            if self._log is None:
+                self._log = open(self._log_file, "ab")
+            if self._log.tell() > 0 and self._log.tell() + len(data) > self._log_max_size:
+                self._log.close()
+                self._log = None
+                os.rename(self._log_file, self._log_file + ".1")
+                self._log = open(self._log_file, "ab")
+            self._log.write(data)
+            self._log.flush()
+        except Exception as e:
+            logger.warn("Error writing the output of an extension command to {0}: {1}", self._log_file, ustr(e))
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            self._log_file = None  # do not keep trying
+
+
 SAS_TOKEN_RE = re.compile(r'(https://\S+\?)((sv|st|se|sr|sp|sip|spr|sig)=\S+)+', flags=re.IGNORECASE)
 
 
 def read_output(stdout, stderr):
     """
     Read the output of the process sent to stdout and stderr and trim them to the max appropriate length.
-    :param stdout: File containing the stdout of the process
-    :param stderr: File containing the stderr of the process
+    :param stdout: File (or ExtensionOutputCapture) containing the stdout of the process
+    :param stderr: File (or ExtensionOutputCapture) containing the stderr of the process
     :return: Returns the formatted concatenated stdout and stderr of the process
     """
-    try:
-        stdout.seek(0)
-        stderr.seek(0)
+    def read_stream(stream):
+        # the output captures keep the tail of the output, which is more relevant than its head
+        if isinstance(stream, ExtensionOutputCapture):
+            data = stream.read_tail()
+        else:
+            stream.seek(0)
+            data = stream.read(TELEMETRY_MESSAGE_MAX_LEN)
+        return ustr(data, encoding='utf-8', errors='backslashreplace')
 
-        stdout = ustr(stdout.read(TELEMETRY_MESSAGE_MAX_LEN), encoding='utf-8',
-                      errors='backslashreplace')
-        stderr = ustr(stderr.read(TELEMETRY_MESSAGE_MAX_LEN), encoding='utf-8',
-                      errors='backslashreplace')
+    try:
+        stdout = read_stream(stdout)
+        stderr = read_stream(stderr)
 
         def redact(s):
             # redact query strings that look like SAS tokens
@@ -25,6 +25,7 @@ import re
 import shutil
 import stat
 import tempfile
+import threading
 import time
 import zipfile
 from collections import defaultdict
@@ -39,6 +40,7 @@ from azurelinuxagent.common import event
 from azurelinuxagent.common.agent_supported_feature import get_agent_supported_features_list_for_extensions, \
     SupportedFeatureNames, get_supported_feature_by_name, get_agent_supported_features_list_for_crp
 from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator
+from azurelinuxagent.ga.extensionprocessutil import ExtensionOutputCapture
 from azurelinuxagent.common.datacontract import get_properties, set_properties
 from azurelinuxagent.common.errorstate import ErrorState
 from azurelinuxagent.common.event import add_event, elapsed_milliseconds, WALAEventOperation, \
@@ -46,13 +48,15 @@ from azurelinuxagent.common.event import add_event, elapsed_milliseconds, WALAEv
 from azurelinuxagent.common.exception import ExtensionDownloadError, ExtensionError, ExtensionErrorCodes, \
     ExtensionOperationError, ExtensionUpdateError, ProtocolError, ProtocolNotFoundError, ExtensionsGoalStateError, \
     GoalStateAggregateStatusCodes, MultiConfigExtensionEnableError
-from azurelinuxagent.common.future import ustr, is_file_not_found_error
+from azurelinuxagent.common.future import ustr, is_file_not_found_error, OrderedDict, Queue, Empty
 from azurelinuxagent.common.protocol.extensions_goal_state import GoalStateSource
+from azurelinuxagent.common.protocol.wire import WireProtocol
 from azurelinuxagent.common.protocol.restapi import ExtensionStatus, ExtensionSubStatus, Extension, ExtHandlerStatus, \
     VMStatus, GoalStateAggregateStatus, ExtensionState, ExtensionRequestedState, ExtensionSettings
 from azurelinuxagent.common.utils import textutil
 from azurelinuxagent.common.utils.archive import ARCHIVE_DIRECTORY_NAME
 from azurelinuxagent.common.utils.flexible_version import FlexibleVersion
+from azurelinuxagent.common.utils.inotifyutil import create_directory_watcher
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
 
 _HANDLER_NAME_PATTERN = r'^([^-]+)'
@@ -83,6 +87,9 @@ _TRUNCATED_SUFFIX = u" ... [TRUNCATED]"
 _NUM_OF_STATUS_FILE_RETRIES = 5
 _STATUS_FILE_RETRY_DELAY = 2  # seconds
 
+# Max interval between checks of the status of an extension that other extensions depend on
+_STATUS_CHECK_INTERVAL = 5  # seconds
+
 # This is the default sequence number we use when there are no settings available for Handlers
 _DEFAULT_SEQ_NO = "0"
 
@@ -468,6 +475,30 @@ class ExtHandlersHandler(object):
 
         return all_extensions
 
+    @staticmethod
+    def __get_extension_batches_by_dependency_level(all_extensions):
+        """
+        Groups the (already sorted) extensions by dependency level and, within each level, by handler. Extensions of the
+        same handler (i.e. multi-config extensions) are kept in the same batch since they share the handler directory
+        and state, and need to be processed sequentially.
+
+        Returns a list of levels, each level being a list of batches of (extension, handler) tuples.
+        """
+        levels = []
+        current_dep_level = None
+        batches = OrderedDict()
+        for extension, ext_handler in all_extensions:
+            dep_level = ExtHandlersHandler.__get_dependency_level((extension, ext_handler))
+            if len(levels) == 0 or current_dep_level != dep_level:
+                current_dep_level = dep_level
+                batches = OrderedDict()
+                levels.append(batches)
+            if ext_handler.name not in batches:
+                batches[ext_handler.name] = []
+            batches[ext_handler.name].append((extension, ext_handler))
+
+        return [list(level.values()) for level in levels]
+
     def handle_ext_handlers(self, goal_state_id):
         if not self.ext_handlers:
             logger.info("No extension handlers found, not processing anything.")
@@ -481,10 +512,75 @@ class ExtHandlersHandler(object):
 
         depends_on_err_msg = None
         extensions_enabled = conf.get_extensions_enabled()
+        max_parallelism = conf.get_extensions_max_parallelism()
+
+        for batches in self.__get_extension_batches_by_dependency_level(all_extensions):
+            # Handlers within the same dependency level do not depend on each other, so they can be processed
+            # concurrently (if enabled). If a previous level failed, or extensions are disabled, the extensions are
+            # only reported as skipped, so there is no need to use the worker pool.
+            if max_parallelism > 1 and len(batches) > 1 and extensions_enabled and depends_on_err_msg is None:
+                depends_on_err_msg = self.__handle_ext_handler_batches_in_parallel(batches, goal_state_id, wait_until, max_dep_level, max_parallelism)
+            else:
+                for batch in batches:
+                    depends_on_err_msg = self.__handle_ext_handler_batch(batch, goal_state_id, wait_until, max_dep_level, extensions_enabled, depends_on_err_msg)
 
-        for extension, ext_handler in all_extensions:
+    def __handle_ext_handler_batches_in_parallel(self, batches, goal_state_id, wait_until, max_dep_level, max_parallelism):
+        """
+        Processes the given batches on a pool of at most max_parallelism worker threads and waits for all of them to
+        complete. Returns the depends-on error message of the first batch (in processing order) that failed, or None if
+        all of them succeeded.
+        """
+        pending = Queue()
+        for index, batch in enumerate(batches):
+            pending.put((index, batch))
+        results = [None] * len(batches)
+
+        # The protocol objects are not thread-safe, so each worker uses its own WireProtocol (created on the worker thread) to download
+        # the manifests and packages of its extensions. The goal state being processed is shared by the workers; it is not updated while
+        # the main thread waits for them to complete.
+        goal_state = self.protocol.get_goal_state()
+        endpoint = self.protocol.get_endpoint()
+
+        def worker():
+            protocol = WireProtocol(endpoint)
+            while True:
+                try:
+                    index, batch = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[index] = self.__handle_ext_handler_batch(batch, goal_state_id, wait_until, max_dep_level, True, None, protocol=protocol, goal_state=goal_state)
+                except Exception as e:
+                    results[index] = "Unexpected error processing extensions in parallel: {0}".format(textutil.format_exception(e))
+                    logger.warn(results[index])
+
+        workers = []
+        for i in range(min(max_parallelism, len(batches))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.name = "ExtHandlerWorker-{0}".format(i)
+            workers.append(thread)
+
+        logger.info("Processing {0} extension handlers using {1} worker threads", len(batches), len(workers))
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        for depends_on_err_msg in results:
+            if depends_on_err_msg is not None:
+                return depends_on_err_msg
+        return None
 
-            handler_i = ExtHandlerInstance(ext_handler, self.protocol, extension=extension)
+    def __handle_ext_handler_batch(self, batch, goal_state_id, wait_until, max_dep_level, extensions_enabled, depends_on_err_msg, protocol=None, goal_state=None):
+        """
+        Sequentially processes the extensions in the given batch and returns the depends-on error message (if any) to
+        propagate to the extensions processed afterwards. The 'protocol' and 'goal_state' are those used by the worker
+        threads (see __handle_ext_handler_batches_in_parallel); by default, the extensions use self.protocol.
+        """
+        for extension, ext_handler in batch:
+
+            handler_i = ExtHandlerInstance(ext_handler, self.protocol if protocol is None else protocol, extension=extension, goal_state=goal_state)
 
             # In case of extensions disabled, we skip processing extensions. But CRP is still waiting for some status
             # back for the skipped extensions. In order to propagate the status back to CRP, we will report status back
@@ -555,6 +651,8 @@ class ExtHandlersHandler(object):
                               is_success=False,
                               message=depends_on_err_msg)
 
+        return depends_on_err_msg
+
     @staticmethod
     def wait_for_handler_completion(handler_i, wait_until, extension=None):
         """
@@ -571,12 +669,15 @@ class ExtHandlersHandler(object):
         try:
             ext_completed, status = False, None
 
-            # Keep polling for the extension status until it succeeds or times out
-            while datetime.datetime.utcnow() <= wait_until:
-                ext_completed, status = handler_i.is_ext_handling_complete(extension)
-                if ext_completed:
-                    break
-                time.sleep(5)
+            # Keep checking the extension status until it succeeds or times out. The status is re-checked as soon as
+            # a file in the status directory changes, or every _STATUS_CHECK_INTERVAL seconds if that cannot be
+            # detected (and also as a safeguard against missed notifications)
+            with create_directory_watcher(handler_i.get_status_dir()) as watcher:
+                while datetime.datetime.utcnow() <= wait_until:
+                    ext_completed, status = handler_i.is_ext_handling_complete(extension)
+                    if ext_completed:
+                        break
+                    watcher.wait(_STATUS_CHECK_INTERVAL)
 
         except Exception as e:
             msg = "Failed to wait for Handler completion due to unknown error. Marking the dependent extension as failed: {0}, {1}".format(
@@ -1016,9 +1117,12 @@ class ExtHandlersHandler(object):
 
 class ExtHandlerInstance(object):
 
-    def __init__(self, ext_handler, protocol, execution_log_max_size=(10 * 1024 * 1024), extension=None):
+    def __init__(self, ext_handler, protocol, execution_log_max_size=(10 * 1024 * 1024), extension=None, goal_state=None):
         self.ext_handler = ext_handler
         self.protocol = protocol
+        # the goal state being processed, if it is not the goal state of the protocol (e.g. when the extension is
+        # processed by a worker thread with its own protocol)
+        self._goal_state = goal_state
         self.operation = None
         self.pkg = None
         self.pkg_file = None
@@ -1029,6 +1133,9 @@ class ExtHandlerInstance(object):
     def supports_multi_config(self):
         return self.ext_handler.supports_multi_config
 
+    def _get_goal_state(self):
+        return self._goal_state if self._goal_state is not None else self.protocol.get_goal_state()
+
     @property
     def extensions(self):
         return self.ext_handler.settings
@@ -1107,7 +1214,9 @@ class ExtHandlerInstance(object):
     def decide_version(self, target_state, extension, gs_activity_id):
         self.logger.verbose("Decide which version to use")
         try:
-            manifest = self.protocol.get_goal_state().fetch_extension_manifest(self.ext_handler.name, self.ext_handler.manifest_uris)
+            # if the goal state is not that of our protocol, fetch the manifest using our own client
+            wire_client = self.protocol.client if self._goal_state is not None else None
+            manifest = self._get_goal_state().fetch_extension_manifest(self.ext_handler.name, self.ext_handler.manifest_uris, wire_client=wire_client)
             pkg_list = manifest.pkg_list
         except ProtocolError as e:
             raise ExtensionError("Failed to get ext handler pkgs", e)
@@ -1270,7 +1379,7 @@ class ExtHandlerInstance(object):
                 self.logger.info("The existing extension package is invalid, will ignore it.")
 
         if not package_exists:
-            is_fast_track_goal_state = self.protocol.get_goal_state().extensions_goal_state.source == GoalStateSource.FastTrack
+            is_fast_track_goal_state = self._get_goal_state().extensions_goal_state.source == GoalStateSource.FastTrack
             self.protocol.client.download_zip_package("extension package", self.pkg.uris, package_file, self.get_base_dir(), use_verify_header=is_fast_track_goal_state)
             self.report_event(message="Download succeeded", duration=elapsed_milliseconds(begin_utc))
 
@@ -1856,8 +1965,8 @@ class ExtHandlerInstance(object):
 
         base_dir = self.get_base_dir()
 
-        with tempfile.TemporaryFile(dir=base_dir, mode="w+b") as stdout:
-            with tempfile.TemporaryFile(dir=base_dir, mode="w+b") as stderr:
+        with self._create_command_output(extension, "stdout") as stdout:
+            with self._create_command_output(extension, "stderr") as stderr:
                 if env is None:
                     env = {}
 
@@ -1923,6 +2032,19 @@ class ExtHandlerInstance(object):
 
                 return process_output
 
+    def _create_command_output(self, extension, stream_name):
+        """
+        Returns the object that captures the given output stream of a command: a temporary file in the extension's
+        directory or, if output streaming is enabled, an ExtensionOutputCapture that streams the output to
+        <log_dir>/CommandExecution[_<extension>]_<stream_name>.log
+        """
+        if not conf.get_enable_extension_output_streaming():
+            return tempfile.TemporaryFile(dir=self.get_base_dir(), mode="w+b")
+
+        log_file_name = "CommandExecution_{0}.log".format(stream_name) if not self.should_perform_multi_config_op(
+            extension) else "CommandExecution_{0}_{1}.log".format(extension.name, stream_name)
+        return ExtensionOutputCapture(log_file=os.path.join(self.get_log_dir(), log_file_name))
+
     def load_manifest(self):
         man_file = self.get_manifest_file()
         try:
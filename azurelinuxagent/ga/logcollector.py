@@ -18,17 +18,20 @@
 #
 
 import glob
+import json
 import logging
 import os
+import shutil
 import subprocess
 import time
-import zipfile
 from datetime import datetime
 from heapq import heappush, heappop
 
-from azurelinuxagent.common.conf import get_lib_dir, get_ext_log_dir, get_agent_log_file
+from azurelinuxagent.common.conf import get_lib_dir, get_ext_log_dir, get_agent_log_file, get_log_collector_compression_level, \
+    get_log_collector_full_collection_period
 from azurelinuxagent.common.event import initialize_event_logger_vminfo_common_parameters_and_protocol, add_event, WALAEventOperation
 from azurelinuxagent.common.future import ustr
+from azurelinuxagent.ga.logcollector_archive import compress_member, compress_members, ZipArchiveWriter
 from azurelinuxagent.ga.logcollector_manifests import MANIFEST_NORMAL, MANIFEST_FULL
 
 # Please note: be careful when adding agent dependencies in this module.
@@ -41,11 +44,17 @@ _AGENT_LIB_DIR = get_lib_dir()
 _AGENT_LOG = get_agent_log_file()
 
 _LOG_COLLECTOR_DIR = os.path.join(_AGENT_LIB_DIR, "logcollector")
+# Previous versions of the log collector kept copies of the truncated files in this directory; it is removed if it exists
 _TRUNCATED_FILES_DIR = os.path.join(_LOG_COLLECTOR_DIR, "truncated")
 
 OUTPUT_RESULTS_FILE_PATH = os.path.join(_LOG_COLLECTOR_DIR, "results.txt")
 COMPRESSED_ARCHIVE_PATH = os.path.join(_LOG_COLLECTOR_DIR, "logs.zip")
 
+# State of the files collected by the last incremental collection that was uploaded, and by the last incremental
+# collection (which becomes the former once its archive is uploaded; see commit_incremental_state())
+INCREMENTAL_STATE_PATH = os.path.join(_LOG_COLLECTOR_DIR, "incremental_state.json")
+PENDING_INCREMENTAL_STATE_PATH = os.path.join(_LOG_COLLECTOR_DIR, "incremental_state.pending.json")
+
 CGROUPS_UNIT = "collect-logs.scope"
 
 GRACEFUL_KILL_ERRCODE = 3
@@ -63,16 +72,33 @@ _MUST_COLLECT_FILES = [
 _FILE_SIZE_LIMIT = 30 * 1024 * 1024  # 30 MB
 _UNCOMPRESSED_ARCHIVE_SIZE_LIMIT = 150 * 1024 * 1024  # 150 MB
 
+# Number of threads used to compress the files added to the archive
+_COMPRESSION_THREADS = 2
+
 _LOGGER = logging.getLogger(__name__)
 
 
+def commit_incremental_state():
+    """
+    Must be called after the archive produced by an incremental collection has been uploaded; the next incremental
+    collection will include only the data added to the files after that archive was created.
+    """
+    if os.path.exists(PENDING_INCREMENTAL_STATE_PATH):
+        os.rename(PENDING_INCREMENTAL_STATE_PATH, INCREMENTAL_STATE_PATH)
+
+
 class LogCollector(object):
 
     _TRUNCATED_FILE_PREFIX = "truncated_"
 
-    def __init__(self, is_full_mode=False):
+    def __init__(self, is_full_mode=False, is_incremental=False):
         self._is_full_mode = is_full_mode
+        # The full mode is used for troubleshooting and always collects the entire files
+        self._is_incremental = is_incremental and not is_full_mode
         self._manifest = MANIFEST_FULL if is_full_mode else MANIFEST_NORMAL
+        self._last_full_collection = None
+        self._previous_files = None  # inode -> state of the file in the previous collection
+        self._unchanged_files = {}
         self._must_collect_files = self._expand_must_collect_files()
         self._create_base_dirs()
         self._set_logger()
@@ -90,7 +116,6 @@ class LogCollector(object):
     @staticmethod
     def _create_base_dirs():
         LogCollector._mkdir(_LOG_COLLECTOR_DIR)
-        LogCollector._mkdir(_TRUNCATED_FILES_DIR)
 
     @staticmethod
     def _set_logger():
@@ -175,31 +200,21 @@ class LogCollector(object):
         return file_paths
 
     @staticmethod
-    def _convert_file_name_to_archive_name(file_name):
+    def _convert_file_name_to_archive_name(file_name, truncated=False):
         # File name is the name of the file on disk, whereas archive name is the name of that same file in the archive.
         # For non-truncated files: /var/log/waagent.log on disk becomes var/log/waagent.log in archive
-        # (leading separator is removed by the archive).
-        # For truncated files: /var/lib/waagent/logcollector/truncated/var/log/syslog.1 on disk becomes
-        # truncated_var_log_syslog.1 in the archive.
-        if file_name.startswith(_TRUNCATED_FILES_DIR):
-            original_file_path = file_name[len(_TRUNCATED_FILES_DIR):].lstrip(os.path.sep)
-            archive_file_name = LogCollector._TRUNCATED_FILE_PREFIX + original_file_path.replace(os.path.sep, "_")
-            return archive_file_name
-        else:
-            return file_name.lstrip(os.path.sep)
+        # (leading separator is removed).
+        # For truncated files: /var/log/syslog.1 on disk becomes truncated__var_log_syslog.1 in the archive.
+        if truncated:
+            return LogCollector._TRUNCATED_FILE_PREFIX + file_name.replace(os.path.sep, "_")
+        return file_name.lstrip(os.path.sep)
 
     @staticmethod
-    def _remove_uncollected_truncated_files(files_to_collect):
-        # After log collection is completed, see if there are any old truncated files which were not collected
-        # and remove them since they probably won't be collected in the future. This is possible when the
-        # original file got deleted, so there is no need to keep its truncated version anymore.
-        truncated_files = os.listdir(_TRUNCATED_FILES_DIR)
-
-        for file_path in truncated_files:
-            full_path = os.path.join(_TRUNCATED_FILES_DIR, file_path)
-            if full_path not in files_to_collect:
-                if os.path.isfile(full_path):
-                    os.remove(full_path)
+    def _remove_truncated_files_dir():
+        # Large files are now archived directly from their tail; remove the truncated copies made by previous versions
+        # of the log collector, since they won't be used anymore.
+        if os.path.isdir(_TRUNCATED_FILES_DIR):
+            shutil.rmtree(_TRUNCATED_FILES_DIR, ignore_errors=True)
 
     @staticmethod
     def _expand_parameters(manifest_data):
@@ -246,36 +261,6 @@ class LogCollector(object):
 
         return files_to_collect
 
-    @staticmethod
-    def _truncate_large_file(file_path):
-        # Truncate large file to size limit (keep freshest entries of the file), copy file to a temporary location
-        # and update file path in list of files to collect
-        try:
-            # Binary files cannot be truncated, don't include large binary files
-            ext = os.path.splitext(file_path)[1]
-            if ext in [".gz", ".zip", ".xz"]:
-                _LOGGER.warning("Discarding large binary file %s", file_path)
-                return None
-
-            truncated_file_path = os.path.join(_TRUNCATED_FILES_DIR, file_path.replace(os.path.sep, "_"))
-            if os.path.exists(truncated_file_path):
-                original_file_mtime = os.path.getmtime(file_path)
-                truncated_file_mtime = os.path.getmtime(truncated_file_path)
-
-                # If the original file hasn't been updated since the truncated file, it means there were no changes
-                # and we don't need to truncate it again.
-                if original_file_mtime < truncated_file_mtime:
-                    return truncated_file_path
-
-            # Get the last N bytes of the file
-            with open(truncated_file_path, "w+") as fh:
-                LogCollector._run_shell_command(["tail", "-c", str(_FILE_SIZE_LIMIT), file_path], stdout=fh)
-
-            return truncated_file_path
-        except OSError as e:
-            _LOGGER.error("Failed to truncate large file: %s", ustr(e))
-            return None
-
     def _get_file_priority(self, file_entry):
         # The sooner the file appears in the must collect list, the bigger its priority.
         # Priority is higher the lower the number (0 is highest priority).
@@ -297,7 +282,10 @@ class LogCollector(object):
 
     def _get_final_list_for_archive(self, priority_file_queue):
         # Given a priority queue of files to collect, add one by one while the archive size is under the size limit.
-        # If a single file is over the file size limit, truncate it before adding it to the archive.
+        # If a single file is over the file size limit, only its last _FILE_SIZE_LIMIT bytes are added to the archive.
+        # In incremental mode, only the data added to the file since the previous collection is added to the archive.
+        # Each item in the returned list is a tuple (file path, archive name, maximum size, offset) for
+        # compress_members().
         _LOGGER.info("### Preparing list of files to add to archive ###")
         total_uncompressed_size = 0
         final_files_to_collect = []
@@ -305,22 +293,32 @@ class LogCollector(object):
         while priority_file_queue:
             try:
                 file_path = heappop(priority_file_queue)[1]  # (priority, file_path)
-                file_size = min(os.path.getsize(file_path), _FILE_SIZE_LIMIT)
+                offset = self._get_incremental_offset(file_path)
+                if offset is None:
+                    _LOGGER.info("Skipping file %s, it has not changed since the previous collection", file_path)
+                    continue
+                new_data_size = os.path.getsize(file_path) - offset
+                file_size = min(new_data_size, _FILE_SIZE_LIMIT)
 
                 if total_uncompressed_size + file_size > _UNCOMPRESSED_ARCHIVE_SIZE_LIMIT:
                     _LOGGER.warning("Archive too big, done with adding files.")
                     break
 
-                if os.path.getsize(file_path) <= _FILE_SIZE_LIMIT:
-                    final_files_to_collect.append(file_path)
+                if new_data_size <= _FILE_SIZE_LIMIT:
+                    final_files_to_collect.append((file_path, self._convert_file_name_to_archive_name(file_path), None, offset))
                     total_uncompressed_size += file_size
-                    _LOGGER.info("Adding file %s, size %s b", file_path, file_size)
+                    if offset > 0:
+                        _LOGGER.info("Adding file %s from offset %s, size %s b", file_path, offset, file_size)
+                    else:
+                        _LOGGER.info("Adding file %s, size %s b", file_path, file_size)
+                elif os.path.splitext(file_path)[1] in [".gz", ".zip", ".xz"]:
+                    # Binary files cannot be truncated, don't include large binary files
+                    _LOGGER.warning("Discarding large binary file %s", file_path)
                 else:
-                    truncated_file_path = self._truncate_large_file(file_path)
-                    if truncated_file_path:
-                        _LOGGER.info("Adding truncated file %s, size %s b", truncated_file_path, file_size)
-                        final_files_to_collect.append(truncated_file_path)
-                        total_uncompressed_size += file_size
+                    archive_file_name = self._convert_file_name_to_archive_name(file_path, truncated=True)
+                    _LOGGER.info("Adding truncated file %s as %s, size %s b", file_path, archive_file_name, file_size)
+                    final_files_to_collect.append((file_path, archive_file_name, _FILE_SIZE_LIMIT, offset))
+                    total_uncompressed_size += file_size
             except IOError as e:
                 if e.errno == 2:    # [Errno 2] No such file or directory
                     _LOGGER.warning("File %s does not exist, skipping collection for this file", file_path)
@@ -331,6 +329,78 @@ class LogCollector(object):
 
         return final_files_to_collect, total_uncompressed_size
 
+    def _get_incremental_offset(self, file_path):
+        # Returns the offset from which the file needs to be collected (0 for the entire file), or None if the file has
+        # not changed since the previous collection. Files are matched by inode, so logs that were rotated by renaming
+        # them (e.g. waagent.log -> waagent.log.1) are not collected again. The size and modification time saved by the
+        # previous collection are used to detect files that were replaced (e.g. recreated reusing the same inode), which
+        # are collected in full.
+        if self._previous_files is None:
+            return 0
+        stat = os.stat(file_path)
+        previous = self._previous_files.get(stat.st_ino)
+        if previous is None:  # new file
+            return 0
+        if stat.st_size < previous["offset"] or stat.st_size < previous.get("size", 0):  # truncated since the previous collection
+            return 0
+        if stat.st_mtime < previous["mtime"]:  # the modification time went backwards, so this is not the same file
+            return 0
+        if stat.st_size == previous["offset"]:
+            if stat.st_mtime != previous["mtime"]:  # rewritten since the previous collection
+                return 0
+            self._unchanged_files[file_path] = previous
+            return None
+        return previous["offset"]
+
+    def _load_incremental_state(self):
+        # Loads the state of the files collected by the last incremental collection that was uploaded. If there is no
+        # such state, or the last full collection is older than the full collection period, this is a full collection.
+        self._last_full_collection = None
+        self._previous_files = None
+        self._unchanged_files = {}
+        try:
+            with open(INCREMENTAL_STATE_PATH, "r") as state_file:
+                state = json.load(state_file)
+            last_full_collection = float(state["last_full_collection"])
+            files = state["files"]
+            previous_files = dict((f["inode"], f) for f in files.values())
+        except (IOError, OSError) as e:
+            _LOGGER.info("Doing a full collection; there is no incremental state: %s", ustr(e))
+            return
+        except Exception as e:
+            _LOGGER.warning("Doing a full collection; the incremental state is invalid: %s", ustr(e))
+            return
+
+        elapsed = time.time() - last_full_collection
+        if elapsed < 0 or elapsed >= get_log_collector_full_collection_period():
+            _LOGGER.info("Doing a full collection; the last full collection was %s seconds ago", int(elapsed))
+            return
+
+        _LOGGER.info("Doing an incremental collection; the last full collection was %s seconds ago", int(elapsed))
+        self._last_full_collection = last_full_collection
+        self._previous_files = previous_files
+
+    def _save_incremental_state(self, collected_members):
+        # Saves the state of the files in the archive (and of the files that did not change since the previous
+        # collection) as pending; it becomes the state used by the next collection once the archive is uploaded.
+        files = {}
+        for file_path, state in self._unchanged_files.items():
+            files[file_path] = state
+        for file_path, member in collected_members:
+            files[file_path] = {
+                "inode": member.inode,
+                "size": member.file_size,
+                "mtime": member.mtime,
+                "offset": member.offset + member.size
+            }
+        state = {
+            "last_full_collection": self._last_full_collection if self._last_full_collection is not None else time.time(),
+            "files": files
+        }
+        with open(PENDING_INCREMENTAL_STATE_PATH + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.rename(PENDING_INCREMENTAL_STATE_PATH + ".tmp", PENDING_INCREMENTAL_STATE_PATH)
+
     def _create_list_of_files_to_collect(self):
         # The final list of files to be collected by zip is created in three steps:
         # 1) Parse given manifest file, expanding wildcards and keeping a list of files that exist on disk
@@ -358,6 +428,12 @@ class LogCollector(object):
             _LOGGER.info("Starting log collection at %s", start_time.strftime("%Y-%m-%dT%H:%M:%SZ"))
             _LOGGER.info("Using log collection mode %s", "full" if self._is_full_mode else "normal")
 
+            # A pending state is left only if the archive of the previous collection was not uploaded
+            if os.path.exists(PENDING_INCREMENTAL_STATE_PATH):
+                os.remove(PENDING_INCREMENTAL_STATE_PATH)
+            if self._is_incremental:
+                self._load_incremental_state()
+
             files_to_collect, total_uncompressed_size = self._create_list_of_files_to_collect()
             _LOGGER.info("### Creating compressed archive ###")
 
@@ -371,17 +447,31 @@ class LogCollector(object):
                     _LOGGER.warning("Failed to add file %s to the archive: %s", file_to_collect, ustr(exception))
                 return error_count
 
+            compression_level = get_log_collector_compression_level()
+
             try:
-                compressed_archive = zipfile.ZipFile(COMPRESSED_ARCHIVE_PATH, "w", compression=zipfile.ZIP_DEFLATED)
+                # The files are compressed in parallel into temporary files and then appended to the archive, in
+                # the order of the list
+                compressed_archive = ZipArchiveWriter(COMPRESSED_ARCHIVE_PATH)
 
                 max_errors = 8
                 error_count = 0
+                collected_members = []
 
-                for file_to_collect in files_to_collect:
+                for entry, member, error in compress_members(files_to_collect, max_workers=_COMPRESSION_THREADS,
+                                                              compression_level=compression_level,
+                                                              temp_dir=_LOG_COLLECTOR_DIR):
+                    file_to_collect = entry[0]
                     try:
-                        archive_file_name = LogCollector._convert_file_name_to_archive_name(file_to_collect)
-                        compressed_archive.write(file_to_collect.encode("utf-8"), arcname=archive_file_name)
-                    except IOError as e:
+                        if error is not None:
+                            raise error
+                        compressed_archive.add(member)
+                        collected_members.append((file_to_collect, member))
+                        if entry[3] > 0 and member.offset > 0:
+                            # Mark the members that contain only the data added to their files since the previous collection
+                            _LOGGER.info("Incremental member %s: contains the data of %s from offset %s; the data before that offset was in a previous archive",
+                                         member.name, file_to_collect, member.offset)
+                    except (IOError, OSError) as e:
                         if e.errno == 2:    # [Errno 2] No such file or directory
                             _LOGGER.warning("File %s does not exist, skipping collection for this file",
                                             file_to_collect)
@@ -390,20 +480,24 @@ class LogCollector(object):
                     except Exception as e:
                         error_count = handle_add_file_to_archive_error(error_count, max_errors, file_to_collect, e)
 
-                compressed_archive_size = os.path.getsize(COMPRESSED_ARCHIVE_PATH)
-                _LOGGER.info("Successfully compressed files. Compressed archive size is %s b", compressed_archive_size)
-
                 end_time = datetime.utcnow()
                 duration = end_time - start_time
                 elapsed_ms = int(((duration.days * 24 * 60 * 60 + duration.seconds) * 1000) + (duration.microseconds / 1000.0))
+                # results.txt is added last, so this is the size of the members collected before it
+                _LOGGER.info("Successfully compressed files (compression level: %s). Compressed archive size is %s b", compression_level, compressed_archive.size)
                 _LOGGER.info("Finishing log collection at %s", end_time.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"))
                 _LOGGER.info("Elapsed time: %s ms", elapsed_ms)
 
-                compressed_archive.write(OUTPUT_RESULTS_FILE_PATH.encode("utf-8"), arcname="results.txt")
+                compressed_archive.add(compress_member(OUTPUT_RESULTS_FILE_PATH, "results.txt",
+                                                       compression_level=compression_level,
+                                                       temp_dir=_LOG_COLLECTOR_DIR))
             finally:
                 if compressed_archive is not None:
                     compressed_archive.close()
 
+            if self._is_incremental:
+                self._save_incremental_state(collected_members)
+
             return COMPRESSED_ARCHIVE_PATH, total_uncompressed_size
         except Exception as e:
             msg = "Failed to collect logs: {0}".format(ustr(e))
@@ -411,4 +505,4 @@ class LogCollector(object):
 
             raise
         finally:
-            self._remove_uncollected_truncated_files(files_to_collect)
+            self._remove_truncated_files_dir()
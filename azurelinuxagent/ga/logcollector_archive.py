@@ -0,0 +1,252 @@
+# Microsoft Azure Linux Agent
+#
+# Copyright 2020 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+"""
+Streaming creation of the zip archive produced by the log collector.
+
+The members of the archive are compressed by a small pool of threads (zlib releases the GIL while compressing) into
+temporary files, and then written to the archive in order, so the log collector does not need to keep more than a
+few chunks of each file in memory. Large files are archived starting at a given offset (i.e. only their tail) by
+reading them directly, without making a truncated copy first.
+"""
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from azurelinuxagent.common.future import Queue
+
+# Compression methods (see the ZIP File Format Specification)
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Extensions of files that are already compressed; they are stored as-is, since compressing them again only wastes CPU
+_COMPRESSED_FILE_EXTENSIONS = [".gz", ".zip", ".xz"]
+
+_CHUNK_SIZE = 256 * 1024
+
+_LOCAL_FILE_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_DIRECTORY_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+_LOCAL_FILE_HEADER_SIGNATURE = 0x04034b50
+_CENTRAL_DIRECTORY_HEADER_SIGNATURE = 0x02014b50
+_END_OF_CENTRAL_DIRECTORY_SIGNATURE = 0x06054b50
+_VERSION = 20  # 2.0: deflate compression
+_CREATE_SYSTEM_UNIX = 3
+_UTF8_FLAG = 0x800
+_ZIP32_LIMIT = 0xffffffff
+_MAX_ENTRIES = 0xffff
+
+
+class ArchiveMember(object):
+    """
+    A member of the archive, already compressed into a temporary file (see compress_member())
+    """
+    def __init__(self, name, method, crc, compressed_size, size, mtime, mode, data, offset=0, inode=None, file_size=None):
+        self.name = name
+        self.method = method
+        self.crc = crc
+        self.compressed_size = compressed_size
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.data = data
+        self.offset = offset  # position in the original file of the first byte in the member
+        self.inode = inode
+        self.file_size = file_size  # size of the original file when it was archived
+
+    def close(self):
+        self.data.close()
+
+
+def compress_member(file_path, name, max_size=None, offset=0, compression_level=6, temp_dir=None):
+    """
+    Compresses the given file into a temporary file and returns the corresponding ArchiveMember. Only the data after
+    'offset' is archived (the entire file if it is now smaller than 'offset', i.e. it was truncated); if 'max_size' is
+    given and that data is larger than that, only its last 'max_size' bytes are archived. Files that are already
+    compressed, and all files if 'compression_level' is 0, are stored without compression.
+
+    The size of the file is taken when this function starts, so data appended to the file while it is being archived
+    (e.g. to the agent's log) is not included.
+    """
+    stat = os.stat(file_path)
+    if offset > stat.st_size:
+        offset = 0
+    if max_size is not None:
+        offset = max(offset, stat.st_size - max_size)
+    remaining = stat.st_size - offset
+
+    compress = compression_level > 0 and os.path.splitext(file_path)[1] not in _COMPRESSED_FILE_EXTENSIONS
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -zlib.MAX_WBITS) if compress else None
+
+    data = tempfile.TemporaryFile(dir=temp_dir)
+    try:
+        crc = 0
+        size = 0
+        with open(file_path, "rb") as source:
+            source.seek(offset)
+            while remaining > 0:
+                chunk = source.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:  # the file was truncated while we were reading it
+                    break
+                remaining -= len(chunk)
+                size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+                data.write(compressor.compress(chunk) if compressor is not None else chunk)
+        if compressor is not None:
+            data.write(compressor.flush())
+        compressed_size = data.tell()
+        data.seek(0)
+    except Exception:
+        data.close()
+        raise
+
+    return ArchiveMember(name, ZIP_DEFLATED if compressor is not None else ZIP_STORED, crc & 0xffffffff, compressed_size,
+                         size, stat.st_mtime, stat.st_mode, data, offset=offset, inode=stat.st_ino,
+                         file_size=stat.st_size)
+
+
+def compress_members(entries, max_workers=2, **kwargs):
+    """
+    Compresses the given entries using a pool of 'max_workers' threads. 'entries' is a list of tuples with the
+    positional arguments for compress_member() (file path, name and, optionally, max_size and offset); 'kwargs' are
+    passed to all the calls to compress_member().
+
+    This is a generator: it yields a tuple (entry, member, error) for each entry, in the order of the list, where
+    either 'member' is an ArchiveMember or 'error' is the exception raised when compressing the entry. To bound the
+    disk space used by the temporary files, only a few entries are compressed ahead of the one being consumed.
+    """
+    results = [None] * len(entries)
+    done = [threading.Event() for _ in entries]
+    work = Queue()
+
+    def worker():
+        while True:
+            index = work.get()
+            if index is None:
+                return
+            try:
+                results[index] = (compress_member(*entries[index], **kwargs), None)
+            except Exception as e:
+                results[index] = (None, e)
+            done[index].set()
+
+    window = max_workers * 2
+    workers = []
+    for i in range(min(max_workers, len(entries))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.name = "LogCollectorCompression-{0}".format(i)
+        thread.start()
+        workers.append(thread)
+
+    try:
+        for index in range(min(window, len(entries))):
+            work.put(index)
+        for index, entry in enumerate(entries):
+            done[index].wait()
+            if index + window < len(entries):
+                work.put(index + window)
+            member, error = results[index]
+            results[index] = None
+            yield entry, member, error
+    finally:
+        # Stop the workers and clean up the members that were compressed but not consumed (e.g. if the caller stopped
+        # iterating because of an error)
+        for _ in workers:
+            work.put(None)
+        for thread in workers:
+            thread.join()
+        for result in results:
+            if result is not None and result[0] is not None:
+                result[0].close()
+
+
+def _get_dos_date_time(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:  # the earliest date that can be represented in a zip file
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipArchiveWriter(object):
+    """
+    Writes a zip archive incrementally from members compressed by compress_member(). ZIP64 is not supported; archives
+    are limited to 4 GB and 65535 members, which is well beyond the limits of the log collector.
+    """
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._entries = []
+
+    @property
+    def size(self):
+        """
+        Size of the members written so far (the central directory is written by close())
+        """
+        return self._file.tell()
+
+    def add(self, member):
+        """
+        Appends the given member to the archive and closes it
+        """
+        try:
+            if len(self._entries) >= _MAX_ENTRIES:
+                raise Exception("Too many members in the archive ({0})".format(len(self._entries)))
+            offset = self._file.tell()
+            if offset + member.compressed_size > _ZIP32_LIMIT or member.size > _ZIP32_LIMIT:
+                raise Exception("The archive exceeds the maximum size of a zip file without ZIP64 extensions")
+
+            name, flags = self._encode_name(member.name)
+            dos_time, dos_date = _get_dos_date_time(member.mtime)
+            self._file.write(_LOCAL_FILE_HEADER.pack(_LOCAL_FILE_HEADER_SIGNATURE, _VERSION, flags, member.method, dos_time, dos_date,
+                                                     member.crc, member.compressed_size, member.size, len(name), 0))
+            self._file.write(name)
+            shutil.copyfileobj(member.data, self._file, _CHUNK_SIZE)
+            self._entries.append((member, name, flags, dos_time, dos_date, offset))
+        finally:
+            member.close()
+
+    def close(self):
+        """
+        Writes the central directory and closes the archive
+        """
+        try:
+            central_directory_offset = self._file.tell()
+            for member, name, flags, dos_time, dos_date, offset in self._entries:
+                self._file.write(_CENTRAL_DIRECTORY_HEADER.pack(
+                    _CENTRAL_DIRECTORY_HEADER_SIGNATURE, (_CREATE_SYSTEM_UNIX << 8) | _VERSION, _VERSION, flags, member.method,
+                    dos_time, dos_date, member.crc, member.compressed_size, member.size, len(name), 0, 0, 0, 0,
+                    (member.mode & 0xffff) << 16, offset))
+                self._file.write(name)
+            central_directory_size = self._file.tell() - central_directory_offset
+            self._file.write(_END_OF_CENTRAL_DIRECTORY.pack(_END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, len(self._entries), len(self._entries),
+                                                            central_directory_size, central_directory_offset, 0))
+        finally:
+            self._file.close()
+
+    @staticmethod
+    def _encode_name(name):
+        if isinstance(name, bytes):
+            return name, 0
+        try:
+            return name.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return name.encode("utf-8"), _UTF8_FLAG
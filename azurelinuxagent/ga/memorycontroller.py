@@ -15,8 +15,6 @@
 # Requires Python 2.6+ and Openssl 1.0+
 
 import errno
-import os
-import re
 
 from azurelinuxagent.common import logger
 from azurelinuxagent.common.exception import CGroupsException
@@ -34,38 +32,33 @@ class _MemoryController(_CgroupController):
         """
         Gets the value for the provided counter in memory.stat
         """
+        #
+        # Sample file v1:
+        #   # cat memory.stat
+        #   cache 0
+        #   rss 0
+        #   rss_huge 0
+        #   shmem 0
+        #   mapped_file 0
+        #   dirty 0
+        #   writeback 0
+        #   swap 0
+        #   ...
+        #
+        # Sample file v2
+        #   # cat memory.stat
+        #   anon 0
+        #   file 147140608
+        #   kernel 1421312
+        #   kernel_stack 0
+        #   pagetables 0
+        #   sec_pagetables 0
+        #   percpu 130752
+        #   sock 0
+        #   ...
+        #
         try:
-            with open(os.path.join(self.path, 'memory.stat')) as memory_stat:
-                #
-                # Sample file v1:
-                #   # cat memory.stat
-                #   cache 0
-                #   rss 0
-                #   rss_huge 0
-                #   shmem 0
-                #   mapped_file 0
-                #   dirty 0
-                #   writeback 0
-                #   swap 0
-                #   ...
-                #
-                # Sample file v2
-                #   # cat memory.stat
-                #   anon 0
-                #   file 147140608
-                #   kernel 1421312
-                #   kernel_stack 0
-                #   pagetables 0
-                #   sec_pagetables 0
-                #   percpu 130752
-                #   sock 0
-                #   ...
-                #
-                for line in memory_stat:
-                    re_memory_counter = r'{0}\s+(\d+)'.format(counter_name)
-                    match = re.match(re_memory_counter, line)
-                    if match is not None:
-                        return int(match.groups()[0])
+            memory_stat = self._get_stat_file('memory.stat')
         except (IOError, OSError) as e:
             if e.errno == errno.ENOENT:
                 raise
@@ -73,7 +66,9 @@ class _MemoryController(_CgroupController):
         except Exception as e:
             raise CGroupsException("Failed to read memory.stat: {0}".format(ustr(e)))
 
-        raise CounterNotFound("Cannot find counter: {0}".format(counter_name))
+        if counter_name not in memory_stat:
+            raise CounterNotFound("Cannot find counter: {0}".format(counter_name))
+        return memory_stat[counter_name]
 
     def get_memory_usage(self):
         """
@@ -103,18 +98,30 @@ class _MemoryController(_CgroupController):
         """
         raise NotImplementedError()
 
+    def get_sampled_metrics(self):
+        with self.snapshot():
+            anon_mem_usage, cache_mem_usage = self.get_memory_usage()
+        return [
+            MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE, self.name, anon_mem_usage + cache_mem_usage),
+            MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.ANON_MEM_USAGE, self.name, anon_mem_usage),
+            MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.CACHE_MEM_USAGE, self.name, cache_mem_usage)
+        ]
+
     def get_tracked_metrics(self, **_):
         # The log collector monitor tracks anon and cache memory separately.
-        anon_mem_usage, cache_mem_usage = self.get_memory_usage()
+        with self.snapshot():
+            anon_mem_usage, cache_mem_usage = self.get_memory_usage()
+            max_mem_usage = self.get_max_memory_usage()
+            swap_mem_usage = self.try_swap_memory_usage()
         total_mem_usage = anon_mem_usage + cache_mem_usage
         return [
             MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE, self.name, total_mem_usage),
             MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.ANON_MEM_USAGE, self.name, anon_mem_usage),
             MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.CACHE_MEM_USAGE, self.name, cache_mem_usage),
             MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MAX_MEM_USAGE, self.name,
-                        self.get_max_memory_usage(), _REPORT_EVERY_HOUR),
+                        max_mem_usage, _REPORT_EVERY_HOUR),
             MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.SWAP_MEM_USAGE, self.name,
-                        self.try_swap_memory_usage(), _REPORT_EVERY_HOUR)
+                        swap_mem_usage, _REPORT_EVERY_HOUR)
         ]
 
     def get_unit_properties(self):
@@ -166,22 +173,18 @@ class MemoryControllerV2(_MemoryController):
         :return: Number of memory throttling events for the cgroup
         :rtype: int
         """
+        #
+        # Sample file:
+        #   # cat memory.events
+        #   low 0
+        #   high 0
+        #   max 0
+        #   oom 0
+        #   oom_kill 0
+        #   oom_group_kill 0
+        #
         try:
-            with open(os.path.join(self.path, 'memory.events')) as memory_events:
-                #
-                # Sample file:
-                #   # cat memory.events
-                #   low 0
-                #   high 0
-                #   max 0
-                #   oom 0
-                #   oom_kill 0
-                #   oom_group_kill 0
-                #
-                for line in memory_events:
-                    match = re.match(r'high\s+(\d+)', line)
-                    if match is not None:
-                        return int(match.groups()[0])
+            memory_events = self._get_stat_file('memory.events')
         except (IOError, OSError) as e:
             if e.errno == errno.ENOENT:
                 raise
@@ -189,7 +192,9 @@ class MemoryControllerV2(_MemoryController):
         except Exception as e:
             raise CGroupsException("Failed to read memory.events: {0}".format(ustr(e)))
 
-        raise CounterNotFound("Cannot find memory.events counter: high")
+        if 'high' not in memory_events:
+            raise CounterNotFound("Cannot find memory.events counter: high")
+        return memory_events['high']
 
     def try_swap_memory_usage(self):
         # In v2, swap memory is reported in memory.swap.current
@@ -216,8 +221,9 @@ class MemoryControllerV2(_MemoryController):
         return usage
 
     def get_tracked_metrics(self, **_):
-        metrics = super(MemoryControllerV2, self).get_tracked_metrics()
-        throttled_value = MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MEM_THROTTLED, self.name,
-                                      self.get_memory_throttled_events())
+        with self.snapshot():
+            metrics = super(MemoryControllerV2, self).get_tracked_metrics()
+            throttled_value = MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.MEM_THROTTLED, self.name,
+                                          self.get_memory_throttled_events())
         metrics.append(throttled_value)
         return metrics
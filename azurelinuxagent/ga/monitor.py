@@ -17,7 +17,6 @@
 
 import datetime
 import os
-import threading
 
 import azurelinuxagent.common.conf as conf
 import azurelinuxagent.common.logger as logger
@@ -26,7 +25,7 @@ from azurelinuxagent.ga.cgroupcontroller import MetricValue, MetricsCategory, Me
 from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator
 from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
 from azurelinuxagent.common.errorstate import ErrorState
-from azurelinuxagent.common.event import add_event, WALAEventOperation, report_metric
+from azurelinuxagent.common.event import add_event, WALAEventOperation, report_metric, report_metrics
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.ga.interfaces import ThreadHandlerInterface
 from azurelinuxagent.common.osutil import get_osutil
@@ -36,7 +35,7 @@ from azurelinuxagent.common.protocol.util import get_protocol_util
 from azurelinuxagent.common.utils.restutil import IOErrorCounter
 from azurelinuxagent.common.utils.textutil import hash_strings
 from azurelinuxagent.common.version import AGENT_NAME, CURRENT_VERSION
-from azurelinuxagent.ga.periodic_operation import PeriodicOperation
+from azurelinuxagent.ga.periodic_operation import PeriodicOperation, get_periodic_operation_scheduler
 
 
 def get_monitor_handler():
@@ -58,15 +57,54 @@ class PollResourceUsage(PeriodicOperation):
     def _operation(self):
         tracked_metrics = CGroupsTelemetry.poll_all_tracked()
 
+        metrics_to_report = []
         for metric in tracked_metrics:
             key = metric.category + metric.counter + metric.instance
             if key not in self.__periodic_metrics or (self.__periodic_metrics[key] + metric.report_period) <= datetime.datetime.now():
-                report_metric(metric.category, metric.counter, metric.instance, metric.value, log_event=self.__log_metrics)
+                metrics_to_report.append(metric)
                 self.__periodic_metrics[key] = datetime.datetime.now()
 
+        # The summaries of the samples taken by SampleResourceUsage since the previous report are reported together
+        # with the tracked metrics
+        metrics_to_report.extend(CGroupsTelemetry.summarize_time_series())
+        if len(metrics_to_report) > 0:
+            report_metrics(metrics_to_report, log_event=self.__log_metrics)
+
         CGroupConfigurator.get_instance().check_cgroups(tracked_metrics)
 
 
+class SampleResourceUsage(PeriodicOperation):
+    """
+    Periodic operation to sample the resource usage of the tracked cgroups at a higher rate than PollResourceUsage;
+    PollResourceUsage reports the summary of the samples.
+    """
+    def __init__(self):
+        super(SampleResourceUsage, self).__init__(conf.get_cgroup_sampling_period())
+
+    def _operation(self):
+        CGroupsTelemetry.sample_all_tracked()
+
+
+class PollCgroupPressure(PeriodicOperation):
+    """
+    Periodic operation to check the Pressure Stall Information (PSI) of the agent and extensions cgroups, which may in
+    turn adjust the CPUQuota of the extensions (see CGroupConfigurator.check_pressure()). The PSI metrics are reported
+    at most once per cgroup check period.
+    """
+    def __init__(self):
+        super(PollCgroupPressure, self).__init__(datetime.timedelta(minutes=1))
+        self.__log_metrics = conf.get_cgroup_log_metrics()
+        self.__report_period = datetime.timedelta(seconds=conf.get_cgroup_check_period())
+        self.__next_report_time = datetime.datetime.now()
+
+    def _operation(self):
+        metrics = CGroupConfigurator.get_instance().check_pressure()
+
+        if len(metrics) > 0 and self.__next_report_time <= datetime.datetime.now():
+            report_metrics(metrics, log_event=self.__log_metrics)
+            self.__next_report_time = datetime.datetime.now() + self.__report_period
+
+
 class PollSystemWideResourceUsage(PeriodicOperation):
     def __init__(self):
         super(PollSystemWideResourceUsage, self).__init__(datetime.timedelta(hours=1))
@@ -164,7 +202,7 @@ class SendHostPluginHeartbeat(PeriodicOperation):
     plugin at least once in the last _HOST_PLUGIN_HEALTH_PERIOD.
     """
     def __init__(self, protocol, health_service):
-        super(SendHostPluginHeartbeat, self).__init__(SendHostPluginHeartbeat._HOST_PLUGIN_HEARTBEAT_PERIOD)
+        super(SendHostPluginHeartbeat, self).__init__(SendHostPluginHeartbeat._HOST_PLUGIN_HEARTBEAT_PERIOD, blocking=True, jitter=5)
         self.protocol = protocol
         self.health_service = health_service
         self.host_plugin_error_state = ErrorState(min_timedelta=SendHostPluginHeartbeat._HOST_PLUGIN_HEALTH_PERIOD)
@@ -217,7 +255,7 @@ class SendImdsHeartbeat(PeriodicOperation):
     a response in the last _IMDS_HEALTH_PERIOD.
     """
     def __init__(self, health_service):
-        super(SendImdsHeartbeat, self).__init__(SendImdsHeartbeat._IMDS_HEARTBEAT_PERIOD)
+        super(SendImdsHeartbeat, self).__init__(SendImdsHeartbeat._IMDS_HEARTBEAT_PERIOD, blocking=True, jitter=5)
         self.health_service = health_service
         self.imds_client = get_imds_client()
         self.imds_error_state = ErrorState(min_timedelta=SendImdsHeartbeat._IMDS_HEALTH_PERIOD)
@@ -252,69 +290,58 @@ class SendImdsHeartbeat(PeriodicOperation):
 
 
 class MonitorHandler(ThreadHandlerInterface):
+    """
+    Executes the monitor's periodic operations (resource usage, heartbeats, etc.). The operations run on the shared
+    PeriodicOperationScheduler; get_thread_name() is the name of the group of operations in the scheduler.
+    """
     _THREAD_NAME = "MonitorHandler"
 
     @staticmethod
     def get_thread_name():
         return MonitorHandler._THREAD_NAME
 
-    def __init__(self):
-        self.monitor_thread = None
-        self.should_run = True
+    def __init__(self, scheduler=None):
+        self._scheduler = scheduler if scheduler is not None else get_periodic_operation_scheduler()
 
     def run(self):
         self.start()
 
     def stop(self):
-        self.should_run = False
-        if self.is_alive():
-            self.join()
-
-    def join(self):
-        self.monitor_thread.join()
-
-    def stopped(self):
-        return not self.should_run
+        self._scheduler.unregister(self.get_thread_name())
 
     def is_alive(self):
-        return self.monitor_thread is not None and self.monitor_thread.is_alive()
+        return self._scheduler.is_registered(self.get_thread_name())
 
     def start(self):
-        self.monitor_thread = threading.Thread(target=self.daemon)
-        self.monitor_thread.daemon = True
-        self.monitor_thread.name = self.get_thread_name()
-        self.monitor_thread.start()
+        self._scheduler.register(self.get_thread_name(), self._create_periodic_operations)
 
-    def daemon(self):
-        try:
-            # The protocol needs to be instantiated in the monitor thread itself (to avoid concurrency issues with the protocol object each
-            # thread uses a different instance as per the SingletonPerThread model.
-            protocol_util = get_protocol_util()
-            protocol = protocol_util.get_protocol()
-            health_service = HealthService(protocol.get_endpoint())
-            periodic_operations = [
-                ResetPeriodicLogMessages(),
-                ReportNetworkErrors(),
-                PollResourceUsage(),
-                PollSystemWideResourceUsage(),
-                SendHostPluginHeartbeat(protocol, health_service),
-                SendImdsHeartbeat(health_service)
-            ]
-
-            report_network_configuration_changes = ReportNetworkConfigurationChanges()
-            if conf.get_monitor_network_configuration_changes():
-                periodic_operations.append(report_network_configuration_changes)
-            else:
-                logger.info("Monitor.NetworkConfigurationChanges is disabled.")
-                report_network_configuration_changes.log_network_configuration()
-
-            while not self.stopped():
-                try:
-                    for op in periodic_operations:
-                        op.run()
-                finally:
-                    PeriodicOperation.sleep_until_next_operation(periodic_operations)
-        except Exception as e:
-            logger.error("An error occurred in the monitor thread; will exit the thread.\n{0}", ustr(e))
+    @staticmethod
+    def _create_periodic_operations():
+        # The scheduler invokes this function on a thread dedicated to this group, so the protocol (a SingletonPerThread) is not shared
+        # with the operations of the other groups, which may run concurrently with the operations of the monitor.
+        protocol_util = get_protocol_util()
+        protocol = protocol_util.get_protocol()
+        health_service = HealthService(protocol.get_endpoint())
+        periodic_operations = [
+            ResetPeriodicLogMessages(),
+            ReportNetworkErrors(),
+            PollResourceUsage(),
+            PollCgroupPressure(),
+            PollSystemWideResourceUsage(),
+            SendHostPluginHeartbeat(protocol, health_service),
+            SendImdsHeartbeat(health_service)
+        ]
+
+        if conf.get_cgroup_sampling_period() > 0:
+            periodic_operations.append(SampleResourceUsage())
+        else:
+            logger.info("Debug.CgroupSamplingPeriod is 0; sampling of the tracked cgroups is disabled.")
 
+        report_network_configuration_changes = ReportNetworkConfigurationChanges()
+        if conf.get_monitor_network_configuration_changes():
+            periodic_operations.append(report_network_configuration_changes)
+        else:
+            logger.info("Monitor.NetworkConfigurationChanges is disabled.")
+            report_network_configuration_changes.log_network_configuration()
 
+        return periodic_operations
@@ -16,10 +16,14 @@
 #
 
 import datetime
+import heapq
+import random
+import threading
 import time
+from collections import namedtuple
 
 from azurelinuxagent.common import logger
-from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.future import ustr, Queue
 
 
 class PeriodicOperation(object):
@@ -28,14 +32,21 @@ class PeriodicOperation(object):
     time period has elapsed.
 
     NOTE: the run() method catches any exceptions raised by the operation and logs them as warnings.
+
+    When executed by the PeriodicOperationScheduler, operations that may block for a significant amount of time (e.g.
+    network requests or external commands) should set 'blocking' so that they are executed by a worker thread instead of
+    the scheduler thread; 'jitter' (a timedelta or a number of seconds) adds a random delay of up to the given value
+    to each run, to avoid operations on many VMs running in lockstep.
     '''
 
     # To prevent flooding the log with error messages we report failures at most every hour
     _LOG_WARNING_PERIOD = datetime.timedelta(minutes=60)
 
-    def __init__(self, period):
+    def __init__(self, period, blocking=False, jitter=0):
         self._name = self.__class__.__name__
         self._period = period if isinstance(period, datetime.timedelta) else datetime.timedelta(seconds=period)
+        self._blocking = blocking
+        self._jitter = jitter if isinstance(jitter, datetime.timedelta) else datetime.timedelta(seconds=jitter)
         self._next_run_time = datetime.datetime.utcnow()
         self._last_warning = None
         self._last_warning_time = None
@@ -58,6 +69,18 @@ class PeriodicOperation(object):
     def next_run_time(self):
         return self._next_run_time
 
+    def name(self):
+        return self._name
+
+    def period(self):
+        return self._period
+
+    def is_blocking(self):
+        return self._blocking
+
+    def jitter(self):
+        return self._jitter
+
     def _operation(self):
         """
         Derived classes must override this with the definition of the operation they need to perform
@@ -72,10 +95,324 @@ class PeriodicOperation(object):
         """
         next_operation_time = min(op.next_run_time() for op in operations)
 
-        sleep_timedelta = next_operation_time - datetime.datetime.utcnow()
-        # timedelta.total_seconds() is not available on Python 2.6, do the computation manually
-        sleep_seconds = ((sleep_timedelta.days * 24 * 3600 + sleep_timedelta.seconds) * 10.0 ** 6 + sleep_timedelta.microseconds) / 10.0 ** 6
+        sleep_seconds = _total_seconds(next_operation_time - datetime.datetime.utcnow())
 
         if sleep_seconds > 0:
             time.sleep(sleep_seconds)
 
+
+def _total_seconds(delta):
+    # timedelta.total_seconds() is not available on Python 2.6, do the computation manually
+    return ((delta.days * 24 * 3600 + delta.seconds) * 10.0 ** 6 + delta.microseconds) / 10.0 ** 6
+
+
+
+OperationStatistics = namedtuple('OperationStatistics', ['group', 'operation', 'runs', 'average_time', 'max_time', 'max_delay', 'overruns'])
+
+
+class _ScheduledOperation(object):
+    """
+    An operation registered with the PeriodicOperationScheduler, along with its runtime statistics
+    """
+    def __init__(self, group, operation):
+        self.group = group
+        self.operation = operation
+        self.due = operation.next_run_time()
+        self.runs = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.max_delay = 0.0
+        self.overruns = 0
+
+    def schedule(self, start_time, end_time):
+        next_run_time = self.operation.next_run_time()
+        # if run() did not update the next run time (e.g. it was overridden by a derived class) wait for a full period
+        # rather than running the operation again immediately
+        self.due = next_run_time if next_run_time > start_time else end_time + self.operation.period()
+        jitter = _total_seconds(self.operation.jitter())
+        if jitter > 0:
+            self.due += datetime.timedelta(seconds=random.uniform(0, jitter))
+
+    def record_run(self, start_time, end_time):
+        runtime = _total_seconds(end_time - start_time)
+        self.runs += 1
+        self.total_time += runtime
+        self.max_time = max(self.max_time, runtime)
+        self.max_delay = max(self.max_delay, _total_seconds(start_time - self.due))
+        if end_time - start_time > self.operation.period():
+            self.overruns += 1
+
+    def get_statistics(self):
+        average_time = self.total_time / self.runs if self.runs > 0 else 0.0
+        return OperationStatistics(self.group.name, self.operation.name(), self.runs, average_time, self.max_time, self.max_delay, self.overruns)
+
+
+class _OperationGroup(object):
+    def __init__(self, name, create_operations):
+        self.name = name
+        self.create_operations = create_operations
+        self.operations = None  # created by the scheduler, on a thread named after the group
+        self.failed = False  # True if create_operations() failed
+        self.active = True  # False once the group is unregistered
+        self.running = False  # True while one of the operations of the group is being executed
+        self.deferred = []  # operations that became due while another operation of the group was running
+
+
+class PeriodicOperationScheduler(object):
+    """
+    Executes the PeriodicOperations of several components (e.g. the MonitorHandler and the EnvHandler) on a single
+    thread, instead of each component running its own thread and sleeping until its next operation is due.
+
+    Components register a group of operations using register(). The operations of each group are created on a thread
+    named after the group (some components create per-thread objects, such as the protocol, for their operations, and
+    each group needs its own instances since the operations of different groups may run concurrently) and each operation is
+    executed once its next_run_time() (plus a random jitter, if the operation has one) is reached. Blocking operations
+    are executed by a small pool of worker threads, so that they do not delay the rest. The operations of a group never
+    run concurrently with each other, as was the case when each component had its own thread.
+
+    The scheduler keeps statistics about the runtime and the delay of each operation, and the number of overruns (runs
+    that took longer than the period of the operation); the statistics are logged every _STATISTICS_PERIOD.
+    """
+
+    _THREAD_NAME = "PeriodicOperationScheduler"
+    _WORKER_THREAD_NAME = "PeriodicOperationWorker"
+    _STATISTICS_PERIOD = datetime.timedelta(hours=1)
+
+    @staticmethod
+    def get_thread_name():
+        return PeriodicOperationScheduler._THREAD_NAME
+
+    def __init__(self, max_workers=2):
+        self._max_workers = max_workers
+        self._condition = threading.Condition()
+        self._queue = []  # heap of (due time, sequence number, _ScheduledOperation)
+        self._sequence = 0
+        self._groups = {}
+        self._work_queue = Queue()
+        self._workers = []
+        self._thread = None
+        self._should_run = False
+        self._next_statistics_time = datetime.datetime.utcnow() + PeriodicOperationScheduler._STATISTICS_PERIOD
+
+    def register(self, name, create_operations):
+        """
+        Registers a group of operations and starts the scheduler if it is not running. 'create_operations' is a
+        function that returns the list of operations in the group; it is invoked on a thread named after the group. Registering a
+        group with the name of an existing group replaces the existing group.
+        """
+        with self._condition:
+            previous = self._groups.get(name)
+            if previous is not None:
+                previous.active = False
+            self._groups[name] = _OperationGroup(name, create_operations)
+            self._should_run = True
+            if not self._is_alive():
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.name = self.get_thread_name()
+                self._thread.start()
+            self._condition.notify_all()
+
+    def unregister(self, name):
+        """
+        Removes the given group and waits for its current operation, if any, to complete
+        """
+        with self._condition:
+            group = self._groups.pop(name, None)
+            if group is None:
+                return
+            group.active = False
+            self._condition.notify_all()
+            # an operation unregistering its own group cannot wait for itself
+            if threading.current_thread() is self._thread or threading.current_thread() in self._workers:
+                return
+            while group.running and self._is_alive():
+                self._condition.wait(1)
+
+    def is_registered(self, name):
+        """
+        Returns True if the scheduler is running and the given group is registered and its operations could be created
+        """
+        with self._condition:
+            group = self._groups.get(name)
+            return group is not None and not group.failed and self._is_alive()
+
+    def is_alive(self):
+        with self._condition:
+            return self._is_alive()
+
+    def stop(self):
+        """
+        Stops the scheduler and its workers (but does not unregister the operations; the scheduler can be restarted
+        by registering a group)
+        """
+        with self._condition:
+            self._should_run = False
+            thread = self._thread
+            workers = self._workers
+            self._workers = []
+            self._condition.notify_all()
+        for _ in workers:
+            self._work_queue.put(None)
+        for t in [thread] + workers:
+            if t is not None and t is not threading.current_thread():
+                t.join()
+
+    def get_statistics(self):
+        """
+        Returns a list of OperationStatistics with the runtime statistics of the registered operations; times are in seconds
+        """
+        with self._condition:
+            statistics = []
+            for group in self._groups.values():
+                if group.operations is not None:
+                    statistics.extend([scheduled.get_statistics() for scheduled in group.operations])
+            return statistics
+
+    def _is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _push(self, scheduled):
+        self._sequence += 1
+        heapq.heappush(self._queue, (scheduled.due, self._sequence, scheduled))
+
+    def _run(self):
+        logger.info("Started the {0} thread", self.get_thread_name())
+        while True:
+            try:
+                with self._condition:
+                    if not self._should_run:
+                        return
+                    new_groups = [group for group in self._groups.values() if group.operations is None and not group.failed]
+                for group in new_groups:
+                    self._create_operations(group)
+                for scheduled in self._wait_for_ready_operations():
+                    if scheduled.operation.is_blocking():
+                        self._start_workers()
+                        self._work_queue.put(scheduled)
+                    else:
+                        self._execute(scheduled)
+                self._report_statistics()
+            except Exception as e:
+                logger.error("An error occurred in the {0} thread main loop; will skip the current iteration.\n{1}", self.get_thread_name(), ustr(e))
+                time.sleep(1)
+
+    def _create_operations(self, group):
+        # Components create objects that are SingletonPerThread (e.g. the protocol) for their operations. Since the
+        # operations of different groups can run concurrently on the worker threads, each group is created on its own
+        # thread, named after the group, so that the group gets its own instances. (The operations of a group never run
+        # concurrently with each other, so they can share those instances.)
+        result = {}
+
+        def create_operations():
+            try:
+                result["operations"] = group.create_operations()
+            except Exception as exception:
+                result["error"] = exception
+
+        thread = threading.Thread(target=create_operations)
+        thread.daemon = True
+        thread.name = group.name
+        thread.start()
+        thread.join()
+
+        operations = result.get("operations")
+        if operations is None:
+            error = result.get("error", Exception("the operations were not created"))
+            logger.error("An error occurred creating the periodic operations of {0}; they will not be executed.\n{1}", group.name, ustr(error))
+            with self._condition:
+                group.failed = True
+            return
+        with self._condition:
+            group.operations = [_ScheduledOperation(group, op) for op in operations]
+            if group.active:
+                for scheduled in group.operations:
+                    self._push(scheduled)
+
+    def _wait_for_ready_operations(self):
+        """
+        Returns the operations that are due, waiting for the next one if none is; returns an empty list if the state of
+        the scheduler changes while waiting
+        """
+        with self._condition:
+            now = datetime.datetime.utcnow()
+            ready = []
+            while len(self._queue) > 0 and self._queue[0][0] <= now:
+                scheduled = heapq.heappop(self._queue)[2]
+                group = scheduled.group
+                if not group.active:
+                    continue
+                if group.running:
+                    group.deferred.append(scheduled)
+                    continue
+                group.running = True
+                ready.append(scheduled)
+            if len(ready) == 0 and self._should_run:
+                next_time = self._next_statistics_time
+                if len(self._queue) > 0:
+                    next_time = min(next_time, self._queue[0][0])
+                self._condition.wait(max(0, _total_seconds(next_time - now)))
+            return ready
+
+    def _execute(self, scheduled):
+        start_time = datetime.datetime.utcnow()
+        try:
+            scheduled.operation.run()
+        except Exception as e:  # run() handles the errors of the operation, so this is not expected
+            logger.warn("Error executing {0}: {1}", scheduled.operation.name(), ustr(e))
+        finally:
+            end_time = datetime.datetime.utcnow()
+            with self._condition:
+                scheduled.record_run(start_time, end_time)
+                group = scheduled.group
+                group.running = False
+                if group.active:
+                    scheduled.schedule(start_time, end_time)
+                    self._push(scheduled)
+                    for deferred in group.deferred:
+                        self._push(deferred)
+                group.deferred = []
+                self._condition.notify_all()
+
+    def _start_workers(self):
+        with self._condition:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self._max_workers:
+                worker = threading.Thread(target=self._run_worker)
+                worker.daemon = True
+                worker.name = "{0}-{1}".format(PeriodicOperationScheduler._WORKER_THREAD_NAME, len(self._workers))
+                worker.start()
+                self._workers.append(worker)
+
+    def _run_worker(self):
+        while True:
+            scheduled = self._work_queue.get()
+            if scheduled is None:
+                return
+            self._execute(scheduled)
+
+    def _report_statistics(self):
+        now = datetime.datetime.utcnow()
+        if now < self._next_statistics_time:
+            return
+        self._next_statistics_time = now + PeriodicOperationScheduler._STATISTICS_PERIOD
+        statistics = self.get_statistics()
+        if len(statistics) > 0:
+            logger.info("Periodic operations [runs, average/max runtime (ms), max delay (ms), overruns]: {0}", "; ".join(
+                ["{0}.{1} [{2}, {3:.1f}/{4:.1f}, {5:.1f}, {6}]".format(s.group, s.operation, s.runs, s.average_time * 1000, s.max_time * 1000, s.max_delay * 1000, s.overruns)
+                 for s in statistics]))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_periodic_operation_scheduler():
+    """
+    Returns the scheduler shared by the components of the agent that execute PeriodicOperations
+    """
+    global _scheduler  # pylint: disable=W0603
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PeriodicOperationScheduler()
+        return _scheduler
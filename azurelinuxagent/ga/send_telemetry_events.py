@@ -89,7 +89,12 @@ class SendTelemetryEventsHandler(ThreadHandlerInterface):
     def stopped(self):
         return not self.should_run
 
-    def enqueue_event(self, event):
+    def enqueue_event(self, event, on_complete=None):
+        """
+        Adds the event to the queue of events to send. If given, 'on_complete' is invoked once the event has been
+        processed: with True if the event was acknowledged by the WireServer (or dropped because it can never be sent),
+        or with False if it could not be sent and should be enqueued again later.
+        """
         # Add event to queue and set event
         if self.stopped():
             raise ServiceStoppedError("{0} is stopped, not accepting anymore events".format(self.get_thread_name()))
@@ -100,7 +105,7 @@ class SendTelemetryEventsHandler(ThreadHandlerInterface):
         # Todo: Queue.put() will only raise a Full exception if a maxsize is set for the Queue. Once some size
         # limitations are set for the Queue, ensure to handle that correctly here.
         try:
-            self._queue.put(event, timeout=SendTelemetryEventsHandler._MAX_TIMEOUT)
+            self._queue.put((event, on_complete), timeout=SendTelemetryEventsHandler._MAX_TIMEOUT)
         except Exception as error:
             raise ServiceStoppedError(
                 "Unable to enqueue due to: {0}, stopping any more enqueuing until the next run".format(ustr(error)))
@@ -150,8 +155,35 @@ class SendTelemetryEventsHandler(ThreadHandlerInterface):
             logger.verbose("Waiting for events to batch. Total events so far: {0}, Time elapsed: {1} secs",
                            self._queue.qsize()+1, (datetime.datetime.utcnow() - start_time).seconds)
             time.sleep(1)
-        # Delete files after sending the data rather than deleting and sending
-        self._protocol.report_event(self._get_events_in_queue(first_event))
+        # The completion callbacks of the events being sent, indexed by the id of the event. The events are kept in the
+        # dictionary as well, so that their ids are not reused while the batch is in progress.
+        pending = {}
+
+        def get_events():
+            for event, on_complete in self._get_events_in_queue(first_event):
+                if on_complete is not None:
+                    pending[id(event)] = (event, on_complete)
+                yield event
+
+        def acknowledge(events):
+            for event in events:
+                _, on_complete = pending.pop(id(event), (None, None))
+                if on_complete is not None:
+                    SendTelemetryEventsHandler._complete_event(on_complete, True)
+
+        try:
+            self._protocol.report_event(get_events(), acknowledge=acknowledge)
+        finally:
+            # Events that were not acknowledged were not sent; their owners will enqueue them again later
+            for _, on_complete in pending.values():
+                SendTelemetryEventsHandler._complete_event(on_complete, False)
+
+    @staticmethod
+    def _complete_event(on_complete, sent):
+        try:
+            on_complete(sent)
+        except Exception as error:
+            logger.warn("Error completing telemetry event: {0}", textutil.format_exception(error))
 
     def _get_events_in_queue(self, first_event):
         yield first_event
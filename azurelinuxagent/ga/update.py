@@ -16,15 +16,18 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import fcntl
 import glob
 import os
 import platform
 import re
+import select
 import shutil
 import signal
 import stat
 import subprocess
 import sys
+import threading
 import time
 import uuid
 from datetime import datetime, timedelta
@@ -80,6 +83,24 @@ AGENT_SENTINEL_FILE = "current_version"
 # the goal state.
 INITIAL_GOAL_STATE_FILE = "initial_goal_state"
 
+# This file is created by the ExtHandler before it exits to upgrade (or downgrade) the agent; its contents are the reason
+# for the upgrade. The daemon uses it to tell the upgrade from other exits and relaunch the new agent without delay.
+AGENT_UPGRADE_EXIT_FILE = "agent_upgrade_exit"
+
+# When handovers are enabled (see conf.get_enable_agent_handover()), the daemon passes the ExtHandler the write end of a
+# pipe (its file descriptor is given by _HANDOVER_FD_ENV_VARIABLE). Before exiting to update the agent, the ExtHandler
+# writes HANDOVER_REQUEST to the pipe; the daemon then launches the new agent right away, passing the PID of the previous
+# ExtHandler in _HANDOVER_PID_ENV_VARIABLE. While the previous agent exits, the new agent does only read-only work (loading
+# its modules, collecting the OS info); it then waits for the previous agent (see _wait_for_previous_agent()) before it
+# initializes the protocol, goal state and firewall, since the previous agent (or its threads) may still be updating them.
+# Note that the goal state bookkeeping of the previous agent (last incarnation, last extensions goal state, extensions
+# summary) is not handed over: the new agent needs to run the extension handlers once to load them before it can report
+# their status, same as on any other restart.
+HANDOVER_REQUEST = b"handover"
+HANDOVER_POLL_INTERVAL = 0.1
+_HANDOVER_FD_ENV_VARIABLE = "_AZURE_GUEST_AGENT_HANDOVER_FD_"
+_HANDOVER_PID_ENV_VARIABLE = "_AZURE_GUEST_AGENT_HANDOVER_PID_"
+
 READONLY_FILE_GLOBS = [
     "*.crt",
     "*.p7m",
@@ -116,6 +137,74 @@ class ExtensionsSummary(object):
         return ustr(self.summary)
 
 
+class GoalStatePollScheduler(object):
+    """
+    Computes the time the main loop waits before checking for a new goal state. The goal state period is used while a
+    goal state is being processed or extensions are transitioning; once all the extensions reach a terminal state, the
+    period doubles on each iteration (up to conf.get_max_goal_state_period()), and it goes back to the goal state
+    period as soon as any change is detected.
+    """
+    def __init__(self):
+        self._period = None
+
+    def get_next_period(self, goal_state_period, converged, changed):
+        if self._period is None or changed or not converged:
+            self._period = goal_state_period
+        else:
+            max_period = max(goal_state_period, conf.get_max_goal_state_period())
+            self._period = min(self._period * 2, max_period)
+        return self._period
+
+
+class StartupProfile(object):
+    """
+    Keeps track of the time spent in each phase of the startup of the agent, from the start of the process (which
+    includes loading the agent's modules) to the completion of the first goal state. The profile is reported as a
+    telemetry event and to the local log.
+    """
+    def __init__(self):
+        self._phases = []
+        self._last_mark = time.time()
+        self._start = self._last_mark
+        process_age = StartupProfile._get_process_age()
+        if process_age is not None:
+            self._start -= process_age
+            self._phases.append(("load", process_age))
+
+    @staticmethod
+    def _get_process_age():
+        """
+        Returns the number of seconds since the current process started, or None if it cannot be determined
+        """
+        try:
+            proc_stat = fileutil.read_file("/proc/self/stat")
+            # the start time is the 22nd field (in clock ticks since boot); fields are counted after the command name,
+            # which is enclosed in parenthesis and can include spaces
+            start_time = float(proc_stat[proc_stat.rindex(")") + 2:].split()[19]) / os.sysconf("SC_CLK_TCK")
+            uptime = float(fileutil.read_file("/proc/uptime").split()[0])
+            return max(uptime - start_time, 0)
+        except Exception:
+            return None
+
+    def mark(self, phase):
+        """
+        Records the time elapsed since the previous mark as the duration of the given phase
+        """
+        now = time.time()
+        self._phases.append((phase, now - self._last_mark))
+        self._last_mark = now
+
+    def get_phases(self):
+        return self._phases[:]
+
+    def report(self):
+        message = u"Startup profile: {0}; time to first goal state: {1} ms".format(
+            ", ".join(u"{0}: {1} ms".format(phase, int(duration * 1000)) for phase, duration in self._phases),
+            int((time.time() - self._start) * 1000))
+        logger.info(message)
+        add_event(AGENT_NAME, op=WALAEventOperation.StartupProfile, message=message, log_event=False)
+
+
 def get_update_handler():
     return UpdateHandler()
 
@@ -136,6 +225,11 @@ class UpdateHandler(object):
         self.child_launch_time = None
         self.child_launch_attempts = 0
         self.child_process = None
+        self._child_exit_time = None
+        self._child_exit_reason = None
+        self._child_handover = False
+        self._handover_pid = None  # PID of the ExtHandler that requested a handover (while the daemon launches the new agent)
+        self._handover_fd = None  # write end of the pipe used by the ExtHandler to request a handover from the daemon
 
         self.signal_handler = None
 
@@ -171,6 +265,8 @@ class UpdateHandler(object):
 
         self._extensions_summary = ExtensionsSummary()
 
+        self._goal_state_poll_scheduler = GoalStatePollScheduler()
+
         self._is_initial_goal_state = not os.path.exists(self._initial_goal_state_file_path())
 
         if not conf.get_extensions_enabled():
@@ -214,6 +310,7 @@ class UpdateHandler(object):
         if child_args is not None:
             agent_cmd = "{0} {1}".format(agent_cmd, child_args)
 
+        handover_fd = None
         try:
 
             # Launch the correct Python version for python-based agents
@@ -224,33 +321,51 @@ class UpdateHandler(object):
 
             self._evaluate_agent_health(latest_agent)
 
-            self.child_process = subprocess.Popen(
-                cmds,
-                cwd=agent_dir,
-                stdout=sys.stdout,
-                stderr=sys.stderr,
-                env=os.environ)
+            env = os.environ
+            popen_kwargs = {}
+            handover_write_fd = None
+            if self._handover_pid is not None or conf.get_enable_agent_handover():
+                env = dict(os.environ)
+                if self._handover_pid is not None:
+                    env[_HANDOVER_PID_ENV_VARIABLE] = ustr(self._handover_pid)
+                    self._handover_pid = None
+                if conf.get_enable_agent_handover():
+                    handover_fd, handover_write_fd = os.pipe()
+                    env[_HANDOVER_FD_ENV_VARIABLE] = ustr(handover_write_fd)
+                    if sys.version_info >= (3, 2):  # on earlier versions file descriptors are inherited by default
+                        popen_kwargs["pass_fds"] = (handover_write_fd,)
 
-            logger.verbose(u"Agent {0} launched with command '{1}'", agent_name, agent_cmd)
+            try:
+                self.child_process = subprocess.Popen(
+                    cmds,
+                    cwd=agent_dir,
+                    stdout=sys.stdout,
+                    stderr=sys.stderr,
+                    env=env,
+                    **popen_kwargs)
+            finally:
+                if handover_write_fd is not None:
+                    os.close(handover_write_fd)
 
-            # Setting the poll interval to poll every second to reduce the agent provisioning time;
-            # The daemon shouldn't wait for 60secs before starting the ext-handler in case the
-            # ext-handler kills itself during agent-update during the first 15 mins (CHILD_HEALTH_INTERVAL)
-            poll_interval = 1
-
-            ret = None
-            start_time = time.time()
-            while (time.time() - start_time) < CHILD_HEALTH_INTERVAL:
-                time.sleep(poll_interval)
-                try:
-                    ret = self.child_process.poll()
-                except OSError:
-                    # if child_process has terminated, calling poll could raise an exception
-                    ret = -1
-                if ret is not None:
-                    break
+            logger.verbose(u"Agent {0} launched with command '{1}'", agent_name, agent_cmd)
+            self._report_child_restart(agent_name, agent_version)
 
-            if ret is None or ret <= 0:
+            # Wait for the child to exit during the first 15 mins (CHILD_HEALTH_INTERVAL); the exit is detected as soon
+            # as it happens, so that the daemon does not delay the restart of the ext-handler in case it kills itself
+            # during agent-update
+            try:
+                ret, handover = self._wait_for_child(CHILD_HEALTH_INTERVAL, handover_fd)
+            except OSError:
+                # if child_process has terminated, calling poll could raise an exception
+                ret, handover = -1, False
+            if handover:
+                self._on_child_handover(agent_name)
+            elif ret is not None:
+                self._on_child_exit(agent_name)
+
+            # If the child exited (or is exiting) to update the agent, return right away so that the daemon launches
+            # the new agent
+            if self._child_exit_reason is None and (ret is None or ret <= 0):
                 msg = u"Agent {0} launched with command '{1}' is successfully running".format(
                     agent_name,
                     agent_cmd)
@@ -265,14 +380,22 @@ class UpdateHandler(object):
 
                 if ret is None:
                     # Wait for the process to exit
-                    if self.child_process.wait() > 0:
+                    if handover_fd is None:
+                        ret, handover = self.child_process.wait(), False
+                    else:
+                        ret, handover = self._wait_for_child(None, handover_fd)
+                    if handover:
+                        self._on_child_handover(agent_name)
+                    else:
+                        self._on_child_exit(agent_name)
+                    if self._child_exit_reason is None and ret > 0:
                         msg = u"ExtHandler process {0} launched with command '{1}' exited with return code: {2}".format(
                             agent_name,
                             agent_cmd,
                             ret)
                         logger.warn(msg)
 
-            else:
+            elif self._child_exit_reason is None:
                 msg = u"Agent {0} launched with command '{1}' failed with return code: {2}".format(
                     agent_name,
                     agent_cmd,
@@ -301,16 +424,168 @@ class UpdateHandler(object):
                     message=detailed_message)
                 if latest_agent is not None:
                     latest_agent.mark_failure(is_fatal=True, reason=detailed_message)
+        finally:
+            if handover_fd is not None:
+                os.close(handover_fd)
 
         self.child_process = None
         return
 
+    def _wait_for_child(self, timeout, handover_fd):
+        """
+        Waits up to 'timeout' seconds (indefinitely if None) for the child process to exit or to request a handover on
+        the given pipe. Returns a tuple with the exit code of the child (None if it is still running) and a boolean
+        indicating whether it requested a handover.
+        """
+        if handover_fd is None:
+            return shellutil.wait_for_process_exit(self.child_process, timeout), False
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            ret = shellutil.wait_for_process_exit(self.child_process, remaining, wakeup_fd=handover_fd)
+            if ret is not None or not select.select([handover_fd], [], [], 0)[0]:
+                return ret, False
+            request = os.read(handover_fd, 64)
+            if request.strip() == HANDOVER_REQUEST:
+                return None, True
+            if not request:
+                # the child closed the pipe without requesting a handover; keep waiting for it to exit
+                remaining = None if deadline is None else max(deadline - time.time(), 0)
+                return shellutil.wait_for_process_exit(self.child_process, remaining), False
+
+    def _on_child_exit(self, agent_name):
+        self._child_exit_time = time.time()
+        self._child_exit_reason = self._pop_agent_upgrade_exit_reason()
+        self._child_handover = False
+        if self._child_exit_reason is not None:
+            logger.info(u"Agent {0} exited to update the agent ({1}); relaunching", agent_name, self._child_exit_reason)
+
+    def _on_child_handover(self, agent_name):
+        previous_child = self.child_process
+        self._handover_pid = previous_child.pid
+        self._child_exit_time = time.time()
+        self._child_exit_reason = self._pop_agent_upgrade_exit_reason() or "handover requested"
+        self._child_handover = True
+        logger.info(u"Agent {0} (PID {1}) requested a handover to update the agent ({2}); launching the new agent while it exits",
+                    agent_name, previous_child.pid, self._child_exit_reason)
+
+        # reap the previous child when it exits
+        reaper = threading.Thread(target=previous_child.wait)
+        reaper.daemon = True
+        reaper.name = "HandoverReaper"
+        reaper.start()
+
+    def _report_child_restart(self, agent_name, agent_version):
+        """
+        Reports the time elapsed between the exit of the previous ext-handler process and the launch of the new one
+        """
+        if self._child_exit_time is None:
+            return
+        restart_latency = int((time.time() - self._child_exit_time) * 1000)
+        if self._child_exit_reason is not None:
+            msg = u"Agent {0} launched {1} ms after the previous ext-handler {2} to update the agent ({3})".format(
+                agent_name, restart_latency, "requested a handover" if self._child_handover else "exited", self._child_exit_reason)
+            add_event(AGENT_NAME, version=agent_version, op=WALAEventOperation.AgentUpgrade, message=msg, log_event=False)
+        else:
+            msg = u"Agent {0} launched {1} ms after the previous ext-handler exited".format(agent_name, restart_latency)
+            add_event(AGENT_NAME, version=agent_version, op=WALAEventOperation.ExtHandlerRestart, message=msg, log_event=False)
+        logger.info(msg)
+        self._child_exit_time = None
+        self._child_exit_reason = None
+        self._child_handover = False
+
+    @staticmethod
+    def _agent_upgrade_exit_file_path():
+        return os.path.join(conf.get_lib_dir(), AGENT_UPGRADE_EXIT_FILE)
+
+    @staticmethod
+    def _get_handover_fd():
+        handover_fd = os.environ.pop(_HANDOVER_FD_ENV_VARIABLE, None)
+        if handover_fd is None:
+            return None
+        try:
+            handover_fd = int(handover_fd)
+            # do not let extensions inherit the pipe
+            fcntl.fcntl(handover_fd, fcntl.F_SETFD, fcntl.fcntl(handover_fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            return handover_fd
+        except Exception as e:
+            logger.warn(u"Invalid handover file descriptor ({0}): {1}", handover_fd, ustr(e))
+            return None
+
+    @staticmethod
+    def _get_handover_pid():
+        handover_pid = os.environ.pop(_HANDOVER_PID_ENV_VARIABLE, None)
+        if handover_pid is None:
+            return None
+        try:
+            return int(handover_pid)
+        except ValueError:
+            logger.warn(u"Invalid handover PID: {0}", handover_pid)
+            return None
+
+    def _request_handover(self):
+        """
+        Asks the daemon to launch the new agent without waiting for this process to exit. This is a no-op if the daemon
+        did not enable handovers.
+        """
+        if self._handover_fd is None:
+            return
+        try:
+            os.write(self._handover_fd, HANDOVER_REQUEST + b"\n")
+            logger.info(u"Requested a handover to the new agent")
+        except Exception as e:
+            logger.warn(u"Failed to request a handover to the new agent: {0}", ustr(e))
+        finally:
+            os.close(self._handover_fd)
+            self._handover_fd = None
+
+    def _wait_for_previous_agent(self, previous_pid):
+        """
+        Waits for the agent that requested the handover (see _request_handover()) to exit and reports the time the new
+        agent waited for it
+        """
+        wait_start = time.time()
+        self._ensure_no_orphans(orphan_poll_interval=HANDOVER_POLL_INTERVAL)
+        wait_time = int((time.time() - wait_start) * 1000)
+        msg = u"Completed the handover from the previous agent (PID {0}); waited {1} ms for it to exit".format(previous_pid, wait_time)
+        logger.info(msg)
+        add_event(AGENT_NAME, op=WALAEventOperation.AgentUpgrade, message=msg, log_event=False)
+
+    def _set_agent_upgrade_exit_reason(self, reason):
+        try:
+            fileutil.write_file(self._agent_upgrade_exit_file_path(), reason)
+        except Exception as e:
+            logger.warn(u"Exception writing {0}: {1}", self._agent_upgrade_exit_file_path(), ustr(e))
+
+    def _pop_agent_upgrade_exit_reason(self):
+        """
+        Returns the reason written by the ext-handler when it exits to update the agent (None if it exited for any other
+        reason) and removes the file that contains it
+        """
+        path = self._agent_upgrade_exit_file_path()
+        if not os.path.exists(path):
+            return None
+        try:
+            reason = fileutil.read_file(path)
+            os.remove(path)
+            return reason
+        except Exception as e:
+            logger.warn(u"Exception reading {0}: {1}", path, ustr(e))
+            return None
+
     def run(self, debug=False):
         """
         This is the main loop which watches for agent and extension updates.
         """
 
         try:
+            # remove the handover info from the environment, so that it is not inherited by extensions
+            self._handover_fd = UpdateHandler._get_handover_fd()
+            handover_pid = UpdateHandler._get_handover_pid()
+
+            startup_profile = StartupProfile()
+
             logger.info("{0} (Goal State Agent version {1})", AGENT_LONG_NAME, AGENT_VERSION)
             logger.info("OS: {0} {1}", DISTRO_NAME, DISTRO_VERSION)
             logger.info("Python: {0}.{1}.{2}", PY_VERSION_MAJOR, PY_VERSION_MINOR, PY_VERSION_MICRO)
@@ -318,44 +593,42 @@ class UpdateHandler(object):
             vm_arch = self.osutil.get_vm_arch()
             logger.info("CPU Arch: {0}", vm_arch)
 
-            os_info_msg = u"Distro: {dist_name}-{dist_ver}; "\
-                u"OSUtil: {util_name}; "\
-                u"AgentService: {service_name}; "\
-                u"Python: {py_major}.{py_minor}.{py_micro}; "\
-                u"Arch: {vm_arch}; "\
-                u"systemd: {systemd}; "\
-                u"systemd_version: {systemd_version}; "\
-                u"LISDrivers: {lis_ver}; "\
-                u"logrotate: {has_logrotate};".format(
-                    dist_name=DISTRO_NAME, dist_ver=DISTRO_VERSION,
-                    util_name=type(self.osutil).__name__,
-                    service_name=self.osutil.service_name,
-                    py_major=PY_VERSION_MAJOR, py_minor=PY_VERSION_MINOR,
-                    py_micro=PY_VERSION_MICRO, vm_arch=vm_arch, systemd=systemd.is_systemd(),
-                    systemd_version=systemd.get_version(),
-                    lis_ver=get_lis_version(), has_logrotate=has_logrotate()
-                )
-            logger.info(os_info_msg)
+            os_info_msg = None
+            if handover_pid is not None:
+                # The previous agent may still be writing the goal state, certificates and firewall rules, so the new agent
+                # waits for it to exit before initializing them; meanwhile, it collects the OS-specific info, which only
+                # runs commands that do not change the state of the VM.
+                os_info_msg = self._get_os_info_message(vm_arch)
+                self._wait_for_previous_agent(handover_pid)
+                startup_profile.mark("handover")
 
             #
             # Initialize the goal state; some components depend on information provided by the goal state and this
             # call ensures the required info is initialized (e.g. telemetry depends on the container ID.)
             #
             protocol = self.protocol_util.get_protocol(save_to_history=True)
+            startup_profile.mark("protocol")
 
             self._initialize_goal_state(protocol)
+            startup_profile.mark("goal_state")
 
             # Initialize the common parameters for telemetry events
             initialize_event_logger_vminfo_common_parameters_and_protocol(protocol)
 
-            # Send telemetry for the OS-specific info.
+            # Send telemetry for the OS-specific info. Collecting this info requires running several commands, so
+            # (unless it was collected during a handover) it is done once the goal state has been initialized.
+            if os_info_msg is None:
+                os_info_msg = self._get_os_info_message(vm_arch)
+            logger.info(os_info_msg)
             add_event(AGENT_NAME, op=WALAEventOperation.OSInfo, message=os_info_msg)
             self._log_openssl_info()
+            startup_profile.mark("os_info")
 
             #
             # Perform initialization tasks
             #
             self._initialize_firewall(protocol.get_endpoint())
+            startup_profile.mark("firewall")
 
             from azurelinuxagent.ga.exthandlers import get_exthandlers_handler, migrate_handler_state
             exthandlers_handler = get_exthandlers_handler(protocol)
@@ -365,8 +638,12 @@ class UpdateHandler(object):
             remote_access_handler = get_remote_access_handler(protocol)
 
             agent_update_handler = get_agent_update_handler(protocol)
+            startup_profile.mark("handlers")
+
+            if handover_pid is None:
+                self._ensure_no_orphans()
+                startup_profile.mark("orphans")
 
-            self._ensure_no_orphans()
             self._emit_restart_event()
             self._emit_changes_in_default_configuration()
             self._ensure_readonly_files()
@@ -388,20 +665,29 @@ class UpdateHandler(object):
 
             # Launch all monitoring threads
             self._start_threads(all_thread_handlers)
+            startup_profile.mark("initialization")
 
             logger.info("Goal State Period: {0} sec. This indicates how often the agent checks for new goal states and reports status.", self._goal_state_period)
 
             while self.is_running:
                 self._check_daemon_running(debug)
                 self._check_threads_running(all_thread_handlers)
+                goal_state_summary = self._get_goal_state_summary()
                 self._process_goal_state(exthandlers_handler, remote_access_handler, agent_update_handler)
+                if startup_profile is not None:
+                    startup_profile.mark("first_goal_state")
+                    startup_profile.report()
+                    startup_profile = None
                 self._send_heartbeat_telemetry(agent_update_handler)
                 self._check_agent_memory_usage()
-                time.sleep(self._goal_state_period)
+                time.sleep(self._goal_state_poll_scheduler.get_next_period(
+                    self._goal_state_period, self._extensions_summary.converged, goal_state_summary != self._get_goal_state_summary()))
 
         except AgentUpgradeExitException as exitException:
             add_event(op=WALAEventOperation.AgentUpgrade, message=exitException.reason, log_event=False)
             logger.info(exitException.reason)
+            self._set_agent_upgrade_exit_reason(exitException.reason)
+            self._request_handover()
         except ExitException as exitException:
             logger.info(exitException.reason)
         except Exception as error:
@@ -416,6 +702,25 @@ class UpdateHandler(object):
         self._shutdown()
         sys.exit(0)
 
+    def _get_os_info_message(self, vm_arch):
+        return u"Distro: {dist_name}-{dist_ver}; "\
+            u"OSUtil: {util_name}; "\
+            u"AgentService: {service_name}; "\
+            u"Python: {py_major}.{py_minor}.{py_micro}; "\
+            u"Arch: {vm_arch}; "\
+            u"systemd: {systemd}; "\
+            u"systemd_version: {systemd_version}; "\
+            u"LISDrivers: {lis_ver}; "\
+            u"logrotate: {has_logrotate};".format(
+                dist_name=DISTRO_NAME, dist_ver=DISTRO_VERSION,
+                util_name=type(self.osutil).__name__,
+                service_name=self.osutil.service_name,
+                py_major=PY_VERSION_MAJOR, py_minor=PY_VERSION_MINOR,
+                py_micro=PY_VERSION_MICRO, vm_arch=vm_arch, systemd=systemd.is_systemd(),
+                systemd_version=systemd.get_version(),
+                lis_ver=get_lis_version(), has_logrotate=has_logrotate()
+            )
+
     @staticmethod
     def _log_openssl_info():
         try:
@@ -586,6 +891,12 @@ class UpdateHandler(object):
                     return False
         return True
 
+    def _get_goal_state_summary(self):
+        """
+        Returns a tuple that changes whenever a new goal state is processed or the status of any extension changes
+        """
+        return self._last_incarnation, self._last_extensions_gs_id, self._extensions_summary.summary
+
     def _processing_new_incarnation(self):
         """
         True if we are currently processing a new incarnation (i.e. WireServer goal state)
@@ -827,15 +1138,16 @@ class UpdateHandler(object):
         except Exception as e:
             logger.warn("Failed to log changes in configuration: {0}", ustr(e))
 
-    def _ensure_no_orphans(self, orphan_wait_interval=ORPHAN_WAIT_INTERVAL):
+    def _ensure_no_orphans(self, orphan_wait_interval=ORPHAN_WAIT_INTERVAL, orphan_poll_interval=ORPHAN_POLL_INTERVAL):
         pid_files, ignored = self._write_pid_file()  # pylint: disable=W0612
         for pid_file in pid_files:
             try:
                 pid = fileutil.read_file(pid_file)
                 wait_interval = orphan_wait_interval
+                logged = False
 
                 while self.osutil.check_pid_alive(pid):
-                    wait_interval -= ORPHAN_POLL_INTERVAL
+                    wait_interval -= orphan_poll_interval
                     if wait_interval <= 0:
                         logger.warn(
                             u"{0} forcibly terminated orphan process {1}",
@@ -844,11 +1156,14 @@ class UpdateHandler(object):
                         os.kill(pid, signal.SIGKILL)
                         break
 
-                    logger.info(
-                        u"{0} waiting for orphan process {1} to terminate",
-                        CURRENT_AGENT,
-                        pid)
-                    time.sleep(ORPHAN_POLL_INTERVAL)
+                    # with short poll intervals (handovers) log only once
+                    if orphan_poll_interval >= ORPHAN_POLL_INTERVAL or not logged:
+                        logged = True
+                        logger.info(
+                            u"{0} waiting for orphan process {1} to terminate",
+                            CURRENT_AGENT,
+                            pid)
+                    time.sleep(orphan_poll_interval)
 
                 os.remove(pid_file)
 
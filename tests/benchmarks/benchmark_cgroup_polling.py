@@ -0,0 +1,106 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+"""
+Micro-benchmark for CGroupsTelemetry.poll_all_tracked().
+
+Usage: python -m tests.benchmarks.benchmark_cgroup_polling [number_of_cgroups] [number_of_polls]
+
+The benchmark creates the given number of extension cgroups (200 by default) in a temporary directory, using the v2
+sample files under tests/data/cgroups, tracks their CPU and memory controllers and polls them the given number of times
+(10 by default). It prints the time per poll and the number of files read per poll, both with stat file snapshots and
+without them (i.e. reading the stat file once per counter, as done before snapshots were introduced).
+"""
+from __future__ import print_function
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.ga.cgroupcontroller import _CgroupController
+from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
+from azurelinuxagent.ga.cpucontroller import CpuControllerV2
+from azurelinuxagent.ga.memorycontroller import MemoryControllerV2
+from tests.lib.tools import data_dir, patch
+
+_CGROUP_FILES = ["cpu.stat", "memory.stat", "memory.events", "memory.peak", "memory.swap.current"]
+
+
+def _create_cgroup(path):
+    os.makedirs(path)
+    for file_name in _CGROUP_FILES:
+        shutil.copyfile(os.path.join(data_dir, "cgroups", "v2", file_name), os.path.join(path, file_name))
+    with open(os.path.join(path, "cgroup.procs"), "w") as procs:
+        procs.write("{0}\n".format(os.getpid()))
+    return path
+
+
+def _create_cgroups(root, count):
+    # CGroupsTelemetry tracks the controllers by path, so each controller uses a different directory
+    for i in range(count):
+        name = "extension_{0}.service".format(i)
+        CGroupsTelemetry.track_cgroup_controller(CpuControllerV2(name, _create_cgroup(os.path.join(root, "cpu", name))))
+        CGroupsTelemetry.track_cgroup_controller(MemoryControllerV2(name, _create_cgroup(os.path.join(root, "memory", name))))
+
+
+@contextlib.contextmanager
+def _no_snapshot(_):
+    yield
+
+
+def _run(name, polls):
+    original_read_file = fileutil.read_file
+    read_count = [0]
+
+    def read_file(*args, **kwargs):
+        read_count[0] += 1
+        return original_read_file(*args, **kwargs)
+
+    with patch("azurelinuxagent.common.utils.fileutil.read_file", side_effect=read_file):
+        CGroupsTelemetry.poll_all_tracked()  # warm up
+        read_count[0] = 0
+        start = time.time()
+        metrics = 0
+        for _ in range(polls):
+            metrics += len(CGroupsTelemetry.poll_all_tracked())
+        elapsed = time.time() - start
+
+    print("{0:<12} {1:>6} metrics/poll: {2:8.2f} ms/poll, {3:7.1f} files read/poll".format(
+        name, metrics // polls, 1000.0 * elapsed / polls, float(read_count[0]) / polls))
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 200
+    polls = int(argv[2]) if len(argv) > 2 else 10
+
+    root = tempfile.mkdtemp(prefix="cgroups-")
+    try:
+        _create_cgroups(root, count)
+        with patch.object(_CgroupController, "snapshot", _no_snapshot):
+            _run("no snapshot", polls)
+        _run("snapshot", polls)
+    finally:
+        CGroupsTelemetry.reset()
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,119 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+"""
+Startup benchmark for the extension handler (the -run-exthandlers entry point).
+
+Usage: python -m tests.benchmarks.benchmark_startup [number_of_runs]
+
+The benchmark measures
+    * the time to import the modules used by the -run-exthandlers entry point, using a new Python process on each run, and
+    * the time to first goal state, as reported by the startup profile of UpdateHandler.run() (see StartupProfile in
+      azurelinuxagent/ga/update.py), running the agent against the mock WireServer in tests/lib/mock_wire_protocol.py.
+It prints the median of the given number of runs (5 by default) and the per-phase timings of the median run.
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+import azurelinuxagent
+from azurelinuxagent.ga.update import StartupProfile
+from tests.lib.mock_update_handler import mock_update_handler
+from tests.lib.mock_wire_protocol import mock_wire_protocol
+from tests.lib.tools import AgentTestCase, Mock, patch
+from tests.lib.wire_protocol_data import DATA_FILE
+
+_IMPORT_SCRIPT = "import time; start = time.time(); " \
+                 "import azurelinuxagent.agent, azurelinuxagent.ga.update; " \
+                 "print(time.time() - start)"
+
+
+def _measure_import_time():
+    package_root = os.path.dirname(os.path.dirname(azurelinuxagent.__file__))
+    process = subprocess.Popen([sys.executable, "-c", _IMPORT_SCRIPT], cwd=package_root, stdout=subprocess.PIPE)
+    output, _ = process.communicate()
+    if process.returncode != 0:
+        raise Exception("Failed to import the agent's modules (exit code: {0})".format(process.returncode))
+    return float(output.decode().strip())
+
+
+class _StartupBenchmark(AgentTestCase):
+    """
+    AgentTestCase provides the environment needed to run the agent (temporary lib directory, mock osutil, etc)
+    """
+    def runTest(self):
+        profiles = []
+        original_report = StartupProfile.report
+
+        def report(profile):
+            profiles.append(profile.get_phases())
+            original_report(profile)
+
+        # the benchmark process has been running for a while, so do not include the time since it started in the profile
+        with patch("azurelinuxagent.ga.update.StartupProfile._get_process_age", return_value=None):
+            with patch("azurelinuxagent.ga.update.StartupProfile.report", side_effect=report, autospec=True):
+                with patch('azurelinuxagent.ga.update.initialize_event_logger_vminfo_common_parameters_and_protocol'):
+                    with mock_wire_protocol(DATA_FILE) as protocol:
+                        with mock_update_handler(protocol, exthandlers_handler=Mock(), remote_access_handler=Mock()) as update_handler:
+                            update_handler.run()
+
+        if len(profiles) != 1:
+            raise Exception("Expected one startup profile, got {0}".format(len(profiles)))
+        return profiles[0]
+
+
+def _measure_startup():
+    _StartupBenchmark.setUpClass()
+    try:
+        benchmark = _StartupBenchmark()
+        benchmark.setUp()
+        try:
+            return benchmark.runTest()
+        finally:
+            benchmark.tearDown()
+    finally:
+        _StartupBenchmark.tearDownClass()
+
+
+def _median(values):
+    return sorted(values)[len(values) // 2]
+
+
+def main(argv):
+    runs = int(argv[1]) if len(argv) > 1 else 5
+
+    import_times = [_measure_import_time() for _ in range(runs)]
+    print("{0:<28} {1:8.2f} ms".format("import time:", 1000.0 * _median(import_times)))
+
+    profiles = []
+    for _ in range(runs):
+        start = time.time()
+        phases = _measure_startup()
+        profiles.append((time.time() - start, phases))
+    profiles.sort(key=lambda p: p[0])
+    elapsed, phases = profiles[len(profiles) // 2]
+    for phase, duration in phases:
+        print("    {0:<24} {1:8.2f} ms".format(phase + ":", 1000.0 * duration))
+    print("{0:<28} {1:8.2f} ms".format("time to first goal state:", 1000.0 * sum(d for _, d in phases)))
+    print("{0:<28} {1:8.2f} ms".format("total (including shutdown):", 1000.0 * elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
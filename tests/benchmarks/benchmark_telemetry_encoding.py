@@ -0,0 +1,150 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+"""
+Micro-benchmark for the encoding of telemetry events in WireClient.report_event.
+
+Usage: python -m tests.benchmarks.benchmark_telemetry_encoding [number_of_events]
+
+The benchmark encodes the given number of events (10,000 by default) into WireServer batches, both with the current
+implementation and with the previous one (which concatenated byte strings), and prints the throughput of each.
+"""
+from __future__ import print_function
+
+import sys
+import time
+import uuid
+from xml.sax import saxutils
+
+from azurelinuxagent.common.future import ustr
+from azurelinuxagent.common.protocol.wire import WireClient, MAX_EVENT_BUFFER_SIZE
+from azurelinuxagent.common.telemetryevent import TelemetryEvent, TelemetryEventParam, GuestAgentExtensionEventsSchema, \
+    CommonTelemetryEventSchema
+from tests.lib.tools import patch
+
+
+def _create_events(count):
+    events = []
+    for i in range(count):
+        event = TelemetryEvent(1, "69B669B9-4AF8-4C50-BDC4-6006FA76E975")
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Name, "WALinuxAgent"))
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Version, "9.9.9.9"))
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Operation, "Benchmark"))
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.OperationSuccess, True))
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Message, "Event <{0}> & 'message' {1}".format(i, uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Duration, i))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.GAVersion, "WALinuxAgent-9.9.9.9"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.ContainerId, ustr(uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.OpcodeName, "2024-01-01T00:00:00.000000Z"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.EventTid, 0))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.EventPid, 0))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.TaskName, "ExtHandler"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.KeywordName, ""))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.OSVersion, "Linux:ubuntu-22.04-jammy:6.2.0"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.ExecutionMode, "IAAS"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.RAM, 7956))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.Processors, 2))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.TenantName, ustr(uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.RoleName, "benchmark-vm"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.RoleInstanceName, ustr(uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.Location, "westus"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.SubscriptionId, ustr(uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.ResourceGroupName, "benchmark-rg"))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.VMId, ustr(uuid.uuid4())))
+        event.parameters.append(TelemetryEventParam(CommonTelemetryEventSchema.ImageOrigin, 1))
+        events.append(event)
+    return events
+
+
+def _legacy_event_param_to_v1(param):
+    param_format = ustr('<Param Name="{0}" Value={1} T="{2}" />')
+    param_type = type(param.value)
+    attr_type = ""
+    if param_type is int:
+        attr_type = 'mt:uint64'
+    elif param_type is str:
+        attr_type = 'mt:wstr'
+    elif ustr(param_type).count("'unicode'") > 0:
+        attr_type = 'mt:wstr'
+    elif param_type is bool:
+        attr_type = 'mt:bool'
+    elif param_type is float:
+        attr_type = 'mt:float64'
+    return param_format.format(param.name, saxutils.quoteattr(ustr(param.value)), attr_type)
+
+
+def _legacy_event_to_v1_encoded(event, encoding='utf-8'):
+    params = ""
+    for param in event.parameters:
+        params += _legacy_event_param_to_v1(param)
+    event_str = ustr('<Event id="{0}"><![CDATA[{1}]]></Event>').format(event.eventId, params)
+    return event_str.encode(encoding)
+
+
+def _legacy_report_event(events):
+    """
+    Encoding and batching as done before the introduction of _TelemetryBatch: the parameters of each event are
+    formatted and concatenated one at a time, and each event is concatenated to the provider's buffer
+    """
+    buf = {}
+    batches = []
+    for event in events:
+        if event.providerId not in buf:
+            buf[event.providerId] = b""
+        event_str = _legacy_event_to_v1_encoded(event)
+        if len(buf[event.providerId] + event_str) >= MAX_EVENT_BUFFER_SIZE:
+            batches.append(buf[event.providerId])
+            buf[event.providerId] = b""
+        buf[event.providerId] = buf[event.providerId] + event_str
+    for data in buf.values():
+        if data:
+            batches.append(data)
+    return batches
+
+
+def _report_event(events):
+    batches = []
+    client = WireClient("127.0.0.1")
+    with patch.object(WireClient, "_send_encoded_event", side_effect=lambda _, data, *__: batches.append(data)):
+        client.report_event(iter(events))
+    return batches
+
+
+def _run(name, function, events):
+    start = time.time()
+    batches = function(events)
+    elapsed = time.time() - start
+    total_bytes = sum(len(b) for b in batches)
+    print("{0:<10} {1:>8} events in {2:>3} batches: {3:8.3f} secs, {4:10.0f} events/sec, {5:7.2f} MB/sec".format(
+        name, len(events), len(batches), elapsed, len(events) / elapsed, total_bytes / elapsed / (1024 * 1024)))
+    return batches
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    events = _create_events(count)
+
+    legacy = _run("legacy", _legacy_report_event, events)
+    current = _run("current", _report_event, events)
+
+    if legacy != current:
+        print("ERROR: The batches produced by the current implementation do not match the legacy implementation")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -14,6 +14,7 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import errno
 import glob
 import os
 import socket
@@ -653,13 +654,93 @@ Match host 192.168.1.2\n\
         as_string = osutil.DefaultOSUtil().get_nic_state(as_string=True)
         self.assertNotEqual(as_string, '')
 
+    def test_get_nic_state_should_read_the_state_from_the_kernel(self):
+        with patch.object(shellutil, 'run_command') as run_command:
+            state = osutil.DefaultOSUtil().get_nic_state()
+        self.assertEqual(0, run_command.call_count, "The ip command should not have been invoked")
+
+        self.assertIn("lo", state)
+        self.assertTrue(state["lo"].link.startswith("<LOOPBACK,"), "Unexpected link info: {0}".format(state["lo"].link))
+        self.assertIn("inet 127.0.0.1/8 scope host", state["lo"].ipv4)
+
+    def test_get_nic_state_should_use_the_ip_command_when_the_kernel_cannot_be_queried(self):
+        link_output = "1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN\\    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00\n"
+        with patch("azurelinuxagent.common.osutil.default.get_interface_addresses", side_effect=OSError(errno.EPERM, "Operation not permitted")):
+            with patch.object(shellutil, 'run_command', return_value=link_output) as run_command:
+                state = osutil.DefaultOSUtil().get_nic_state()
+
+        self.assertEqual(3, run_command.call_count, "Expected the ip command to be invoked for the link, IPv4 and IPv6 info")
+        self.assertEqual(["lo"], list(state.keys()))
+        self.assertEqual("<LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN\\    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00", state["lo"].link)
+
+    def test_get_nic_link_info_should_format_the_state_in_sysfs(self):
+        net_sysfs_path = os.path.join(self.tmp_dir, "net")
+        for name, attributes in (("eth0", {"ifindex": "2", "flags": "0x1003", "carrier": "1", "mtu": "1500", "operstate": "up", "address": "00:0d:3a:30:c3:5a"}),
+                                 ("eth1", {"ifindex": "3", "flags": "0x1003", "carrier": "0", "mtu": "1500", "operstate": "down", "address": "00:0d:3a:30:c3:5b"}),
+                                 ("eth2", {"ifindex": "4", "flags": "0x1002", "mtu": "1500", "operstate": "down", "address": "00:0d:3a:30:c3:5c"})):
+            os.makedirs(os.path.join(net_sysfs_path, name))
+            for attribute, value in attributes.items():
+                fileutil.write_file(os.path.join(net_sysfs_path, name, attribute), value + "\n")
+
+        with patch("azurelinuxagent.common.osutil.default.NET_SYSFS_PATH", net_sysfs_path):
+            self.assertEqual((2, "<BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 state UP link 00:0d:3a:30:c3:5a"), osutil.DefaultOSUtil._get_nic_link_info("eth0"))
+            self.assertEqual((3, "<BROADCAST,MULTICAST,UP,NO-CARRIER> mtu 1500 state DOWN link 00:0d:3a:30:c3:5b"), osutil.DefaultOSUtil._get_nic_link_info("eth1"))
+            self.assertEqual((4, "<BROADCAST,MULTICAST> mtu 1500 state DOWN link 00:0d:3a:30:c3:5c"), osutil.DefaultOSUtil._get_nic_link_info("eth2"))
+
+    def _create_meminfo(self):
+        meminfo = os.path.join(self.tmp_dir, "meminfo")
+        fileutil.write_file(meminfo, """MemTotal:        8144672 kB
+MemFree:         5114072 kB
+MemAvailable:    7252260 kB
+Buffers:          100000 kB
+Cached:          2225764 kB
+SwapCached:            0 kB
+SReclaimable:     100000 kB
+HugePages_Total:       0
+Hugepagesize:       2048 kB
+""")
+        return meminfo
+
+    def test_get_memory_info(self):
+        with patch("azurelinuxagent.common.osutil.default.PROC_MEMINFO", self._create_meminfo()):
+            memory_info = osutil.DefaultOSUtil.get_memory_info()
+
+        self.assertEqual(8340144128, memory_info["MemTotal"])
+        self.assertEqual(7426314240, memory_info["MemAvailable"])
+        self.assertEqual(0, memory_info["HugePages_Total"])
+        self.assertEqual(2097152, memory_info["Hugepagesize"])
+        self.assertEqual(9, len(memory_info))
+
+    def test_get_pressure_stall_information(self):
+        pressure_dir = os.path.join(self.tmp_dir, "pressure")
+        os.mkdir(pressure_dir)
+        fileutil.write_file(os.path.join(pressure_dir, "memory"), "some avg10=1.50 avg60=0.25 avg300=0.00 total=123456\nfull avg10=0.50 avg60=0.00 avg300=0.00 total=654\n")
+        fileutil.write_file(os.path.join(pressure_dir, "cpu"), "some avg10=3.00 avg60=2.00 avg300=1.00 total=42\n")
+
+        with patch("azurelinuxagent.common.osutil.default.PROC_PRESSURE", pressure_dir):
+            self.assertEqual(
+                {"some": {"avg10": 1.5, "avg60": 0.25, "avg300": 0.0, "total": 123456}, "full": {"avg10": 0.5, "avg60": 0.0, "avg300": 0.0, "total": 654}},
+                osutil.DefaultOSUtil.get_pressure_stall_information("memory"))
+            self.assertEqual({"some": {"avg10": 3.0, "avg60": 2.0, "avg300": 1.0, "total": 42}}, osutil.DefaultOSUtil.get_pressure_stall_information("cpu"))
+            self.assertIsNone(osutil.DefaultOSUtil.get_pressure_stall_information("io"), "PSI should not be available for IO")
+
     def test_get_used_and_available_system_memory(self):
+        with patch("azurelinuxagent.common.osutil.default.PROC_MEMINFO", self._create_meminfo()):
+            with patch.object(shellutil, 'run_command') as run_command:
+                used_mem, available_mem = osutil.DefaultOSUtil().get_used_and_available_system_memory()
+
+        self.assertEqual(0, run_command.call_count, "free should not have been invoked")
+        self.assertEqual(used_mem, 619352064/(1024**2), "The value didn't match")
+        self.assertEqual(available_mem, 7426314240/(1024**2), "The value didn't match")
+
+    def test_get_used_and_available_system_memory_should_use_free_when_meminfo_cannot_be_read(self):
         memory_table = "\
               total        used        free      shared  buff/cache   available \n\
 Mem:     8340144128   619352064  5236809728     1499136  2483982336  7426314240   \n\
 Swap:             0           0           0   \n"
-        with patch.object(shellutil, 'run_command', return_value=memory_table):
-            used_mem, available_mem = osutil.DefaultOSUtil().get_used_and_available_system_memory()
+        with patch("azurelinuxagent.common.osutil.default.PROC_MEMINFO", os.path.join(self.tmp_dir, "no_such_file")):
+            with patch.object(shellutil, 'run_command', return_value=memory_table):
+                used_mem, available_mem = osutil.DefaultOSUtil().get_used_and_available_system_memory()
 
         self.assertEqual(used_mem, 619352064/(1024**2), "The value didn't match")
         self.assertEqual(available_mem, 7426314240/(1024**2), "The value didn't match")
@@ -668,12 +749,13 @@ Swap:             0           0           0   \n"
         msg = 'message'
         exception = shellutil.CommandError("free -d", 1, "", msg)
 
-        with patch.object(shellutil, 'run_command',
-                          side_effect=exception) as patch_run:
-            with self.assertRaises(shellutil.CommandError) as context_manager:
-                osutil.DefaultOSUtil().get_used_and_available_system_memory()
-            self.assertEqual(patch_run.call_count, 1)
-            self.assertEqual(context_manager.exception.returncode, 1)
+        with patch("azurelinuxagent.common.osutil.default.PROC_MEMINFO", os.path.join(self.tmp_dir, "no_such_file")):
+            with patch.object(shellutil, 'run_command',
+                              side_effect=exception) as patch_run:
+                with self.assertRaises(shellutil.CommandError) as context_manager:
+                    osutil.DefaultOSUtil().get_used_and_available_system_memory()
+                self.assertEqual(patch_run.call_count, 1)
+                self.assertEqual(context_manager.exception.returncode, 1)
 
     def test_get_dhcp_pid_should_return_a_list_of_pids(self):
         osutil_get_dhcp_pid_should_return_a_list_of_pids(self, osutil.DefaultOSUtil())
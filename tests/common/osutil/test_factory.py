@@ -15,6 +15,11 @@
 # Requires Python 2.4+ and Openssl 1.0+
 #
 
+import os
+import subprocess
+import sys
+
+import azurelinuxagent
 from azurelinuxagent.common.osutil.alpine import AlpineOSUtil
 from azurelinuxagent.common.osutil.arch import ArchUtil
 from azurelinuxagent.common.osutil.bigip import BigIpOSUtil
@@ -353,3 +358,18 @@ class TestOsUtilFactory(AgentTestCase):
                           distro_full_name="")
         self.assertTrue(isinstance(ret, PhotonOSUtil))
         self.assertEqual(ret.get_service_name(), "waagent")
+
+    def test_get_osutil_should_load_only_the_module_for_the_selected_distro(self):
+        # use a new process, since the current one may have already loaded the modules for other distros
+        script = "import sys; " \
+                 "from azurelinuxagent.common.osutil.factory import _get_osutil; " \
+                 "_get_osutil(distro_name='photonos', distro_code_name='', distro_version='', distro_full_name=''); " \
+                 "print(' '.join(sorted(m for m in sys.modules if m.startswith('azurelinuxagent.common.osutil.'))))"
+        package_root = os.path.dirname(os.path.dirname(azurelinuxagent.__file__))
+        process = subprocess.Popen([sys.executable, "-c", script], cwd=package_root, stdout=subprocess.PIPE)
+        output, _ = process.communicate()
+        self.assertEqual(0, process.returncode)
+
+        self.assertEqual(
+            ["azurelinuxagent.common.osutil.default", "azurelinuxagent.common.osutil.factory", "azurelinuxagent.common.osutil.photonos"],
+            output.decode().split())
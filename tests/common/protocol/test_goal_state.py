@@ -9,15 +9,18 @@ import re
 import time
 
 from azurelinuxagent.common import conf
+from azurelinuxagent.common import logger
 from azurelinuxagent.common.future import httpclient
 from azurelinuxagent.common.protocol.extensions_goal_state import GoalStateSource, GoalStateChannel
 from azurelinuxagent.common.protocol.extensions_goal_state_from_extensions_config import ExtensionsGoalStateFromExtensionsConfig
 from azurelinuxagent.common.protocol.extensions_goal_state_from_vm_settings import ExtensionsGoalStateFromVmSettings
 from azurelinuxagent.common.protocol import hostplugin
-from azurelinuxagent.common.protocol.goal_state import GoalState, _GET_GOAL_STATE_MAX_ATTEMPTS, GoalStateProperties
+from azurelinuxagent.common.protocol.goal_state import GoalState, _GET_GOAL_STATE_MAX_ATTEMPTS, GoalStateProperties, Certificates, \
+    _NO_DECRYPTED_CERTIFICATES
 from azurelinuxagent.common.exception import ProtocolError
-from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils import fileutil, shellutil
 from azurelinuxagent.common.utils.archive import ARCHIVE_DIRECTORY_NAME
+from azurelinuxagent.common.utils.cryptutil import CryptUtil
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
 from tests.lib import wire_protocol_data
 from tests.lib.http_request_predicates import HttpRequestPredicates
@@ -98,6 +101,27 @@ class GoalStateTestCase(AgentTestCase, HttpRequestPredicates):
                     GoalState(protocol.client)
                 self.assertEqual(_GET_GOAL_STATE_MAX_ATTEMPTS, mock_sleep.call_count, "Unexpected number of retries")
 
+    def test_fetch_goal_state_should_not_parse_the_goal_state_when_it_has_not_changed(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            protocol.mock_wire_data.set_incarnation(123)
+            goal_state = GoalState(protocol.client)
+
+            with patch("azurelinuxagent.common.protocol.goal_state.parse_doc") as parse_doc:
+                goal_state.update()
+                self.assertEqual(0, parse_doc.call_count, "The goal state should not have been parsed")
+
+            protocol.mock_wire_data.set_incarnation(456)
+            goal_state.update()
+            self.assertEqual("456", goal_state.incarnation, "The new goal state should have been parsed")
+
+    def test_fetch_goal_state_should_update_the_host_plugin_when_the_goal_state_has_not_changed(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            goal_state = GoalState(protocol.client)
+
+            with patch.object(protocol.client, "update_host_plugin") as update_host_plugin:
+                goal_state.update()
+                self.assertEqual(1, update_host_plugin.call_count, "The HostGAPlugin should have been updated")
+
     def test_fetching_the_goal_state_should_save_the_shared_config(self):
         # SharedConfig.xml is used by other components (Azsec and Singularity/HPC Infiniband); verify that we do not delete it
         with mock_wire_protocol(wire_protocol_data.DATA_FILE_VM_SETTINGS) as protocol:
@@ -453,6 +477,58 @@ class GoalStateTestCase(AgentTestCase, HttpRequestPredicates):
             self.assertEqual(1, http_get_handler.certificate_requests, "There should have been exactly 1 requests for the goal state certificates")
 
 
+    def test_it_should_not_decrypt_the_certificates_when_they_have_not_changed(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            xml_text = protocol.mock_wire_data.certs
+            expected = Certificates(xml_text, logger)
+
+            with patch.object(CryptUtil, "decrypt_p7m", wraps=CryptUtil.decrypt_p7m, autospec=True) as decrypt_p7m:
+                certificates = Certificates(xml_text, logger)
+
+            self.assertEqual(0, decrypt_p7m.call_count, "The certificates should not have been decrypted")
+            self.assertEqual(expected.summary, certificates.summary, "The summary should have been restored from the cache")
+            self.assertEqual(
+                [c.thumbprint for c in expected.cert_list.certificates],
+                [c.thumbprint for c in certificates.cert_list.certificates],
+                "The certificate list should have been restored from the cache")
+
+    def test_it_should_decrypt_the_certificates_when_a_certificate_file_is_missing(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            xml_text = protocol.mock_wire_data.certs
+            certificates = Certificates(xml_text, logger)
+
+            crt_path = os.path.join(self.tmp_dir, certificates.summary[0]["thumbprint"] + ".crt")
+            os.remove(crt_path)
+
+            with patch.object(CryptUtil, "decrypt_p7m", wraps=CryptUtil.decrypt_p7m, autospec=True) as decrypt_p7m:
+                Certificates(xml_text, logger)
+
+            self.assertEqual(1, decrypt_p7m.call_count, "The certificates should have been decrypted")
+            self.assertTrue(os.path.isfile(crt_path), "{0} should have been re-created".format(crt_path))
+
+    def test_it_should_decrypt_the_certificates_again_when_the_previous_decryption_failed(self):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            xml_text = protocol.mock_wire_data.certs
+
+            original_run_pipe = shellutil.run_pipe
+
+            def run_pipe(pipe, *args, **kwargs):
+                if run_pipe.fail:
+                    raise shellutil.CommandError(" | ".join(" ".join(command) for command in pipe), 1, "", "mock decryption error")
+                return original_run_pipe(pipe, *args, **kwargs)
+            run_pipe.fail = True
+
+            Certificates._cache = _NO_DECRYPTED_CERTIFICATES  # the certificates were already decrypted by mock_wire_protocol
+            with patch("azurelinuxagent.common.utils.cryptutil.shellutil.run_pipe", side_effect=run_pipe) as mock_run_pipe:
+                certificates = Certificates(xml_text, logger)
+                self.assertEqual(0, len(certificates.summary), "The decryption should have failed")
+
+                run_pipe.fail = False
+                certificates = Certificates(xml_text, logger)
+
+            self.assertEqual(2, mock_run_pipe.call_count, "The certificates should have been decrypted again")
+            self.assertTrue(len(certificates.summary) > 0, "The certificates should have been decrypted on the second attempt")
+
     def test_it_should_raise_when_goal_state_properties_not_initialized(self):
         with GoalStateTestCase._create_protocol_ws_and_hgap_in_sync() as protocol:
             goal_state = GoalState(
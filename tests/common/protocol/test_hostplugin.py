@@ -527,6 +527,57 @@ class TestHostPlugin(HttpRequestPredicates, AgentTestCase):
                         test_goal_state,
                         exp_method, exp_url, exp_data)
 
+    def test_put_vm_status_should_upload_only_the_pages_that_changed(self):
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            host_client = protocol.client.get_host_plugin()
+
+            status_blob = protocol.client.status_blob
+            status_blob.type = page_blob_type
+            status_blob.vm_status = restapi.VMStatus(message="Ready", status="Ready")
+
+            def get_status_requests(patch_http):
+                return [json.loads(args[2]) for args, _ in patch_http.call_args_list if args[1] == hostplugin_status_url]
+
+            with patch.object(wire.HostPluginProtocol, "get_api_versions", return_value=api_versions):
+                # the status spans 3 pages; the first upload sends the entire blob
+                status_blob.data = "A" * 1200
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                    host_client.put_vm_status(status_blob, sas_url)
+                requests = get_status_requests(patch_http)
+                self.assertEqual(2, len(requests), "Expected a request to create the blob and a request to upload its pages")
+                self.assertIn({'headerName': 'x-ms-range', 'headerValue': 'bytes=0-1535'}, requests[1]['headers'])
+
+                # only the second page changes
+                status_blob.data = "A" * 600 + "B" + "A" * 599
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                    host_client.put_vm_status(status_blob, sas_url)
+                requests = get_status_requests(patch_http)
+                self.assertEqual(1, len(requests), "Expected only a request to upload the page that changed")
+                self.assertIn({'headerName': 'x-ms-range', 'headerValue': 'bytes=512-1023'}, requests[0]['headers'])
+                self.assertEqual(sas_url + "?comp=page", requests[0]['requestUri'])
+
+                # nothing changes
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                    host_client.put_vm_status(status_blob, sas_url)
+                self.assertEqual(0, len(get_status_requests(patch_http)), "No pages should have been uploaded")
+
+                # the size of the blob changes, so it needs to be created again
+                status_blob.data = "A" * 1600
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                    host_client.put_vm_status(status_blob, sas_url)
+                requests = get_status_requests(patch_http)
+                self.assertEqual(2, len(requests), "Expected a request to create the blob and a request to upload its pages")
+                self.assertIn({'headerName': 'x-ms-range', 'headerValue': 'bytes=0-2047'}, requests[1]['headers'])
+
+                # the upload fails, so the next upload sends the entire blob
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.INTERNAL_SERVER_ERROR)):
+                    status_blob.data = "B" * 1600
+                    with self.assertRaises(HttpError):
+                        host_client.put_vm_status(status_blob, sas_url)
+                with patch.object(restutil, "http_request", return_value=MockResponse('', httpclient.OK)) as patch_http:
+                    host_client.put_vm_status(status_blob, sas_url)
+                self.assertEqual(2, len(get_status_requests(patch_http)), "Expected the entire blob to be uploaded after a failure")
+
     def test_validate_http_request_for_put_vm_log(self):
         def http_put_handler(url, *args, **kwargs):  # pylint: disable=inconsistent-return-statements
             if self.is_host_plugin_put_logs_request(url):
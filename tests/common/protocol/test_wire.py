@@ -16,7 +16,9 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import base64
 import contextlib
+import hashlib
 import json
 import os
 import socket
@@ -33,10 +35,11 @@ from azurelinuxagent.common.protocol.extensions_goal_state_from_extensions_confi
 from azurelinuxagent.common.protocol.goal_state import GoalStateProperties
 from azurelinuxagent.common.protocol.hostplugin import HostPluginProtocol
 from azurelinuxagent.common.protocol.wire import WireProtocol, WireClient, \
-    StatusBlob, VMStatus
+    StatusBlob, VMStatus, event_to_v1_encoded
 from azurelinuxagent.common.telemetryevent import GuestAgentExtensionEventsSchema, \
     TelemetryEventParam, TelemetryEvent
 from azurelinuxagent.common.utils import restutil
+from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.version import CURRENT_VERSION, DISTRO_NAME, DISTRO_VERSION
 from azurelinuxagent.ga.exthandlers import get_exthandlers_handler
 from tests.ga.test_monitor import random_generator
@@ -45,7 +48,7 @@ from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
 from tests.lib.http_request_predicates import HttpRequestPredicates
 from tests.lib.wire_protocol_data import DATA_FILE_NO_EXT, DATA_FILE
 from tests.lib.wire_protocol_data import WireProtocolData
-from tests.lib.tools import patch, AgentTestCase, load_bin_data
+from tests.lib.tools import patch, AgentTestCase, load_bin_data, Mock
 
 data_with_bom = b'\xef\xbb\xbfhehe'
 testurl = 'http://foo'
@@ -232,6 +235,66 @@ class TestWireProtocol(AgentTestCase, HttpRequestPredicates):
             urls = protocol.get_tracked_urls()
             self.assertEqual(len(urls), 1, 'Expected one post request to the host: [{0}]'.format(urls))
 
+    def test_upload_status_blob_should_skip_the_upload_when_the_status_has_not_changed(self, *_):
+        def http_put_handler(url, *_, **__):  # pylint: disable=inconsistent-return-statements
+            if protocol.get_endpoint() in url and url.endswith('/status'):
+                return MockHttpResponse(200)
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_put_handler=http_put_handler) as protocol:
+            HostPluginProtocol.is_default_channel = False
+
+            def upload_status(message):
+                del protocol.get_tracked_urls()[:]
+                protocol.client.status_blob.vm_status = VMStatus(message=message, status="Ready")
+                protocol.client.upload_status_blob()
+                return len(protocol.get_tracked_urls())
+
+            self.assertEqual(1, upload_status("Ready"), "The first status should have been uploaded")
+            with patch("azurelinuxagent.common.protocol.wire.time.gmtime", return_value=time.gmtime(time.time() + 1)):  # the timestamp changes
+                self.assertEqual(0, upload_status("Ready"), "A status that did not change should not have been uploaded")
+            self.assertEqual(1, upload_status("Not Ready"), "A status that changed should have been uploaded")
+
+            with patch("azurelinuxagent.common.conf.get_status_heartbeat_period", return_value=0):
+                self.assertEqual(1, upload_status("Not Ready"), "The status should have been uploaded once the heartbeat period elapsed")
+
+    def test_upload_status_blob_should_not_skip_the_upload_after_an_error(self, *_):
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE) as protocol:
+            protocol.client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
+
+            with patch.object(HostPluginProtocol, "put_vm_status", side_effect=Exception("Host plugin failure")) as put_vm_status:
+                with patch.object(StatusBlob, "upload", return_value=False) as upload:
+                    with self.assertRaises(ProtocolError):
+                        protocol.client.upload_status_blob()
+                    self.assertEqual(1, put_vm_status.call_count)
+
+                    with self.assertRaises(ProtocolError):
+                        protocol.client.upload_status_blob()
+                    self.assertEqual(2, put_vm_status.call_count, "The status should have been uploaded again")
+                    self.assertEqual(2, upload.call_count, "The status should have been uploaded again on the direct channel")
+
+    def test_put_page_blob_should_upload_only_the_pages_that_changed(self, *_):
+        status_blob = StatusBlob(Mock())
+        status_blob.client.call_storage_service = Mock(return_value=MockHttpResponse(201))
+
+        def get_range_or_blob_type(args):
+            headers = args[3]
+            return headers.get("x-ms-range", headers.get("x-ms-blob-type"))
+
+        def put_page_blob(data):
+            status_blob.client.call_storage_service.reset_mock()
+            status_blob.put_page_blob("http://blob?sas", data)
+            return [(args[1], get_range_or_blob_type(args)) for args, _ in status_blob.client.call_storage_service.call_args_list]
+
+        # the first upload creates the blob and uploads all its pages
+        self.assertEqual(
+            [("http://blob?sas", "PageBlob"), ("http://blob?sas&comp=page", "bytes=0-2047")],
+            put_page_blob("A" * 2000))
+        # then, only the pages that changed are uploaded; contiguous pages are merged
+        self.assertEqual(
+            [("http://blob?sas&comp=page", "bytes=0-511"), ("http://blob?sas&comp=page", "bytes=1024-2047")],
+            put_page_blob("B" + "A" * 1499 + "B" * 500))
+        self.assertEqual([], put_page_blob("B" + "A" * 1499 + "B" * 500))
+
     def test_upload_status_blob_host_ga_plugin(self, *_):
         with create_mock_protocol() as protocol:
             protocol.client.status_blob.vm_status = VMStatus(message="Ready", status="Ready")
@@ -478,7 +541,52 @@ class TestWireProtocol(AgentTestCase, HttpRequestPredicates):
         client.report_event(self._get_telemetry_events_generator(event_list))
 
         self.assertEqual(patch_send_event.call_count, 0)
-        
+
+    def test_event_to_v1_encoded_should_encode_all_parameter_types(self, *_):
+        event = TelemetryEvent(eventId=1, providerId="69B669B9-4AF8-4C50-BDC4-6006FA76E975")
+        event.parameters.append(TelemetryEventParam("Name", "Test<&>\"'"))
+        event.parameters.append(TelemetryEventParam("Count", 10))
+        event.parameters.append(TelemetryEventParam("IsSuccess", True))
+        event.parameters.append(TelemetryEventParam("Duration", 1.5))
+        event.parameters.append(TelemetryEventParam("Message", u"עברית"))
+        event.parameters.append(TelemetryEventParam("Other", None))
+
+        expected = u'<Event id="1"><![CDATA[' \
+                   u'<Param Name="Name" Value="Test&lt;&amp;&gt;&quot;\'" T="mt:wstr" />' \
+                   u'<Param Name="Count" Value="10" T="mt:uint64" />' \
+                   u'<Param Name="IsSuccess" Value="True" T="mt:bool" />' \
+                   u'<Param Name="Duration" Value="1.5" T="mt:float64" />' \
+                   u'<Param Name="Message" Value="עברית" T="mt:wstr" />' \
+                   u'<Param Name="Other" Value="None" T="" />' \
+                   u']]></Event>'.encode('utf-8')
+
+        # the second iteration uses the cached encodings of the parameters
+        for _ in range(2):
+            self.assertEqual(expected, event_to_v1_encoded(event))
+
+    def test_report_event_should_acknowledge_only_the_batches_that_were_sent(self, *_):
+        # 3 events of this size fit in a single batch
+        batches = [[get_event(message=random_generator(2 ** 14)) for _ in range(3)] for _ in range(3)]
+        too_large = get_event(message=random_generator(2 ** 18))
+        client = WireProtocol(WIRESERVER_URL).client
+
+        def send_encoded_event(*_):
+            send_encoded_event.call_count += 1
+            if send_encoded_event.call_count == 2:
+                raise ProtocolError("Failed to send events:503")
+        send_encoded_event.call_count = 0
+
+        acknowledged = []
+        with patch("azurelinuxagent.common.protocol.wire.WireClient._send_encoded_event", side_effect=send_encoded_event):
+            result = client.report_event(self._get_telemetry_events_generator(batches[0] + [too_large] + batches[1] + batches[2]), acknowledge=acknowledged.append)
+
+        self.assertFalse(result, "report_event should indicate that some events were not sent")
+        self.assertEqual(3, send_encoded_event.call_count, "Unexpected number of batches sent")
+        self.assertIn(batches[0], acknowledged, "The first batch should have been acknowledged")
+        self.assertIn([too_large], acknowledged, "The event that is too large to send should have been acknowledged")
+        self.assertIn(batches[2], acknowledged, "The third batch should have been acknowledged")
+        self.assertEqual(3, len(acknowledged), "The second batch should not have been acknowledged")
+
     @patch("azurelinuxagent.common.utils.restutil._http_request")
     def test_report_event_http_req_should_do_max_retries_on_throttling_error(self, mock_http_request, *args):  # pylint: disable=unused-argument
         mock_http_request.return_value = MockHttpResponse(429)
@@ -681,6 +789,55 @@ class TestWireClient(HttpRequestPredicates, AgentTestCase):
             self.assertFalse(os.path.exists(target_file), "The extension package was downloaded and it shouldn't have")
             self.assertFalse(HostPluginProtocol.is_default_channel, "The host channel should not have been set as the default")
 
+    def test_download_zip_package_should_use_host_channel_when_the_direct_download_is_incomplete(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, "fake_extension.zip")
+        target_directory = os.path.join(self.tmp_dir, "fake_extension")
+        package = load_bin_data("ga/fake_extension.zip")
+
+        def http_get_handler(url, *_, **kwargs):
+            if url == extension_url:
+                return MockHttpResponse(200, body=package[:100], headers=[("Content-Length", str(len(package)))])
+            if self.is_host_plugin_extension_request(url, kwargs, extension_url):
+                return MockHttpResponse(200, body=package, headers=[("Content-Length", str(len(package)))])
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            HostPluginProtocol.is_default_channel = False
+            try:
+                protocol.client.download_zip_package("extension package", [extension_url], target_file, target_directory, use_verify_header=False)
+
+                urls = protocol.get_tracked_urls()
+                self.assertEqual(2, len(urls), "Unexpected number of HTTP requests: [{0}]".format(urls))
+                self.assertTrue(self.is_host_plugin_extension_artifact_request(urls[1]), "The retry attempt should have been over the host channel")
+                self.assertTrue(os.path.exists(target_directory), 'The extension package was not downloaded')
+            finally:
+                HostPluginProtocol.is_default_channel = False
+
+    def test_download_zip_package_should_verify_the_content_md5_before_expanding_the_package(self):
+        extension_url = 'https://fake_host/fake_extension.zip'
+        target_file = os.path.join(self.tmp_dir, "fake_extension.zip")
+        target_directory = os.path.join(self.tmp_dir, "fake_extension")
+        package = load_bin_data("ga/fake_extension.zip")
+        content_md5 = [base64.b64encode(hashlib.md5(b"not the package").digest()).decode('ascii')]
+
+        def http_get_handler(url, *_, **kwargs):
+            if url == extension_url or self.is_host_plugin_extension_request(url, kwargs, extension_url):
+                return MockHttpResponse(200, body=package, headers=[("Content-MD5", content_md5[0])])
+            return None
+
+        with mock_wire_protocol(wire_protocol_data.DATA_FILE, http_get_handler=http_get_handler) as protocol:
+            with patch("azurelinuxagent.common.protocol.wire.WireClient._try_expand_zip_package") as expand_zip_package:
+                with self.assertRaises(ExtensionDownloadError) as context:
+                    protocol.client.download_zip_package("extension package", [extension_url], target_file, target_directory, use_verify_header=False)
+                self.assertIn("Content-MD5", ustr(context.exception))
+                self.assertEqual(0, expand_zip_package.call_count, "The package should not have been expanded")
+                self.assertFalse(os.path.exists(target_file), "The invalid package should have been deleted")
+
+            content_md5[0] = base64.b64encode(hashlib.md5(package).digest()).decode('ascii')
+            protocol.client.download_zip_package("extension package", [extension_url], target_file, target_directory, use_verify_header=False)
+            self.assertTrue(os.path.exists(target_directory), 'The extension package was not downloaded')
+
     def test_invalid_zip_should_raise_an_error(self):
         extension_url = 'https://fake_host/fake_extension.zip'
         target_file = os.path.join(self.tmp_dir, "fake_extension.zip")
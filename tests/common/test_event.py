@@ -29,18 +29,22 @@ from datetime import datetime, timedelta
 
 from mock import MagicMock
 
-from azurelinuxagent.common.utils import textutil, fileutil
+from azurelinuxagent.common.utils import textutil
+from azurelinuxagent.common.utils.spoolutil import SegmentedSpool, CLAIMED_SEGMENT_SUFFIX
 from azurelinuxagent.common import event, logger
 from azurelinuxagent.common.AgentGlobals import AgentGlobals
+from azurelinuxagent.common.datacontract import get_properties
 from azurelinuxagent.common.event import add_event, add_periodic, add_log_event, elapsed_milliseconds, \
-    WALAEventOperation, parse_xml_event, parse_json_event, AGENT_EVENT_FILE_EXTENSION, EVENTS_DIRECTORY, \
+    WALAEventOperation, parse_xml_event, parse_json_event, AGENT_EVENT_SPOOL_EXTENSION, EVENTS_DIRECTORY, \
+    MAX_NUMBER_OF_EVENTS, MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT, \
     TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID, TELEMETRY_LOG_EVENT_ID, TELEMETRY_LOG_PROVIDER_ID, \
     report_metric
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.osutil import get_osutil
 from azurelinuxagent.common.telemetryevent import CommonTelemetryEventSchema, GuestAgentGenericLogsSchema, \
-    GuestAgentExtensionEventsSchema, GuestAgentPerfCounterEventsSchema
+    GuestAgentExtensionEventsSchema, GuestAgentPerfCounterEventsSchema, TelemetryEvent, TelemetryEventParam
 from azurelinuxagent.common.version import CURRENT_AGENT, CURRENT_VERSION, AGENT_EXECUTION_MODE
+from azurelinuxagent.ga.cgroupcontroller import MetricValue
 from azurelinuxagent.ga.collect_telemetry_events import _CollectAndEnqueueEvents
 from tests.lib import wire_protocol_data
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
@@ -104,7 +108,10 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
 
     @staticmethod
     def _collect_events():
-        def append_event(e):
+        def append_event(e, on_complete=None):
+            # acknowledge the event, as the WireServer would do
+            if on_complete is not None:
+                on_complete(True)
             for p in e.parameters:
                 if p.name == 'Operation' and p.value == TestEvent._Operation \
                     or p.name == 'Category' and p.value == TestEvent._Category \
@@ -118,9 +125,15 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
         event_collector.process_events()
         return event_list
 
-    def _collect_event_files(self):
-        files = [os.path.join(self.event_dir, f) for f in os.listdir(self.event_dir)]
-        return [f for f in files if fileutil.findre_in_file(f, TestEvent._Operation)]
+    def _use_empty_event_dir(self):
+        # initializing the event logger creates some events; use an empty directory for tests that depend on the
+        # layout of the event spool
+        self.event_dir = os.path.join(self.tmp_dir, "empty_" + EVENTS_DIRECTORY)
+        os.mkdir(self.event_dir)
+        event.init_event_logger(self.event_dir)
+
+    def _collect_saved_events(self):
+        return [e for e in EventLoggerTools.get_saved_events(self.event_dir) if TestEvent._Operation in e]
 
     @staticmethod
     def _is_guest_extension_event(event):  # pylint: disable=redefined-outer-name
@@ -177,7 +190,7 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
                 add_event('test', message='test event', op=TestEvent._Operation)
 
                 # The event shouldn't have been created
-                self.assertTrue(len(self._collect_event_files()) == 0)
+                self.assertTrue(len(self._collect_saved_events()) == 0)
 
                 # The exception should have been caught and logged
                 args = mock_logger_periodic_error.call_args
@@ -381,7 +394,7 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
         add_event(name='Event1', op=TestEvent._Operation)
         add_event(name='Event3', op=TestEvent._Operation)
 
-        event_files = self._collect_event_files()
+        event_files = self._collect_saved_events()
         self.assertEqual(3, len(event_files), "Did not find all the event files that were created")
 
         event_list = self._collect_events()
@@ -392,12 +405,45 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
 
     def test_save_event(self):
         add_event('test', message='test event', op=TestEvent._Operation)
-        self.assertTrue(len(self._collect_event_files()) == 1)
+        self.assertTrue(len(self._collect_saved_events()) == 1)
 
-        # checking the extension of the file created.
+        # checking the extension of the spool segment created.
         for filename in os.listdir(self.event_dir):
-            self.assertTrue(filename.endswith(AGENT_EVENT_FILE_EXTENSION),
-                'Event file does not have the correct extension ({0}): {1}'.format(AGENT_EVENT_FILE_EXTENSION, filename))
+            self.assertTrue(filename.endswith(AGENT_EVENT_SPOOL_EXTENSION),
+                'Event spool segment does not have the correct extension ({0}): {1}'.format(AGENT_EVENT_SPOOL_EXTENSION, filename))
+
+    def test_save_event_should_append_events_to_the_same_segment(self):
+        self._use_empty_event_dir()
+
+        for i in range(MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT + 1):
+            add_event('test', message='test event {0}'.format(i), op=TestEvent._Operation)
+
+        self.assertEqual(2, len(os.listdir(self.event_dir)), "The events should have been saved to 2 spool segments")
+        self.assertEqual(MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT + 1, len(self._collect_saved_events()))
+
+    def test_save_event_should_start_a_new_segment_when_the_current_one_is_collected(self):
+        add_event('test', message='first event', op=TestEvent._Operation)
+        self.assertEqual(1, len(self._collect_events()), "The first event was not collected")
+
+        add_event('test', message='second event', op=TestEvent._Operation)
+        collected = self._collect_events()
+        self.assertEqual(1, len(collected), "The second event was not collected")
+        self.assertEqual('second event', TestEvent._get_event_message(collected[0]))
+
+    def test_collect_events_should_skip_the_corrupt_tail_of_a_spool_segment(self):
+        add_event('test', message='first event', op=TestEvent._Operation)
+        add_event('test', message='second event', op=TestEvent._Operation)
+
+        # simulate a crash in the middle of an append by truncating the segment
+        segment = os.path.join(self.event_dir, os.listdir(self.event_dir)[0])
+        with open(segment, "rb+") as segment_file:
+            segment_file.truncate(os.path.getsize(segment) - 10)
+
+        collected = self._collect_events()
+
+        self.assertEqual(1, len(collected), "Only the first event should have been collected")
+        self.assertEqual('first event', TestEvent._get_event_message(collected[0]))
+        self.assertFalse(os.path.exists(segment), "The segment should have been deleted")
 
     def test_add_event_flush_immediately(self):
         def http_post_handler(url, body, **__):
@@ -417,7 +463,7 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
                          "The Message in the HTTP request does not match the Message in the add_event")
 
             # If immediate_flush is set, the event should send to wireserver directly and file should not be created
-            self.assertTrue(len(self._collect_event_files()) == 0)
+            self.assertTrue(len(self._collect_saved_events()) == 0)
 
     def test_add_event_flush_fails(self):
         def http_post_handler(url, **__):
@@ -430,7 +476,7 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
             add_event('test', message=expected_message, op=TestEvent._Operation, flush=True)
 
             # In case of failure, the event file should be created
-            self.assertTrue(len(self._collect_event_files()) == 1)
+            self.assertTrue(len(self._collect_saved_events()) == 1)
 
     @staticmethod
     def _get_event_message(evt):
@@ -480,57 +526,141 @@ class TestEvent(HttpRequestPredicates, AgentTestCase):
                 self.assertIn(WALAEventOperation.CollectEventUnicodeErrors, invalid_events,
                               "{0} errors not reported".format(WALAEventOperation.CollectEventUnicodeErrors))
 
+    def _create_event_collector(self, acknowledge):
+        """
+        Returns a collector that acknowledges the events for which acknowledge(event) returns True; the events enqueued
+        are stored in the 'enqueued' attribute of the collector, and the acknowledge function can be changed using the
+        'acknowledge' attribute
+        """
+        def enqueue_event(e, on_complete=None):
+            collector.enqueued.append(e)
+            on_complete(collector.acknowledge(e))
+        send_telemetry_events = MagicMock()
+        send_telemetry_events.enqueue_event = MagicMock(side_effect=enqueue_event)
+        collector = _CollectAndEnqueueEvents(send_telemetry_events)
+        collector.enqueued = []
+        collector.acknowledge = acknowledge
+        return collector
+
+    def _get_test_event_messages(self, event_list):
+        return [TestEvent._get_event_message(e) for e in event_list if any(p.value == TestEvent._Operation for p in e.parameters)]
+
+    def test_collect_events_should_enqueue_again_events_that_were_not_acknowledged(self):
+        for i in range(3):
+            add_event('test', message='event {0}'.format(i), op=TestEvent._Operation)
+
+        collector = self._create_event_collector(lambda e: TestEvent._get_event_message(e) not in ('event 0', 'event 2'))
+        collector.process_events()
+        self.assertEqual(['event 0', 'event 1', 'event 2'], self._get_test_event_messages(collector.enqueued))
+        self.assertEqual(1, len([f for f in os.listdir(self.event_dir) if f.endswith(AGENT_EVENT_SPOOL_EXTENSION + CLAIMED_SEGMENT_SUFFIX)]), "The segment should not have been deleted")
+
+        collector.enqueued = []
+        collector.acknowledge = lambda _: True
+        collector.process_events()
+        self.assertEqual(['event 0', 'event 2'], self._get_test_event_messages(collector.enqueued), "Only the events that were not acknowledged should have been enqueued")
+        self.assertEqual(0, len(os.listdir(self.event_dir)), "The segment should have been deleted")
+
+    def test_collect_events_should_not_enqueue_again_events_before_the_offset_of_the_segment(self):
+        for i in range(3):
+            add_event('test', message='event {0}'.format(i), op=TestEvent._Operation)
+
+        collector = self._create_event_collector(lambda e: TestEvent._get_event_message(e) not in ('event 1', 'event 2'))
+        collector.process_events()
+
+        # a new collector simulates a restart of the agent
+        collector = self._create_event_collector(lambda _: True)
+        collector.process_events()
+        self.assertEqual(['event 1', 'event 2'], self._get_test_event_messages(collector.enqueued))
+        self.assertEqual(0, len(os.listdir(self.event_dir)), "The segment should have been deleted")
+
+    def test_collect_events_should_save_the_offset_of_the_segment_once_per_batch(self):
+        self._create_event_collector(lambda _: True).process_events()  # clean up the events created by the test setup
+
+        for i in range(5):
+            add_event('test', message='event {0}'.format(i), op=TestEvent._Operation)
+
+        # the events are completed after they are all enqueued, as the send thread does for a batch
+        completions = []
+        send_telemetry_events = MagicMock()
+        send_telemetry_events.enqueue_event = MagicMock(side_effect=lambda e, on_complete=None: completions.append((e, on_complete)))
+        collector = _CollectAndEnqueueEvents(send_telemetry_events)
+        collector.process_events()
+        self.assertEqual(5, len(completions))
+
+        with patch("azurelinuxagent.ga.collect_telemetry_events.write_segment_offset") as mock_write_segment_offset:
+            for e, on_complete in completions:
+                on_complete(TestEvent._get_event_message(e) != 'event 4')
+
+        self.assertEqual(1, mock_write_segment_offset.call_count, "The offset should have been saved once for the batch")
+        self.assertEqual(4, mock_write_segment_offset.call_args[0][1], "The offset should point to the event that was not sent")
+
+    def test_collect_events_should_drop_the_oldest_segments_when_events_cannot_be_sent(self):
+        self._create_event_collector(lambda _: True).process_events()  # clean up the events created by the test setup
+
+        spool = SegmentedSpool(self.event_dir, AGENT_EVENT_SPOOL_EXTENSION, max_records_per_segment=1)
+        for i in range(4):
+            test_event = TelemetryEvent(TELEMETRY_EVENT_EVENT_ID, TELEMETRY_EVENT_PROVIDER_ID)
+            test_event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Operation, TestEvent._Operation))
+            test_event.parameters.append(TelemetryEventParam(GuestAgentExtensionEventsSchema.Message, 'event {0}'.format(i)))
+            spool.append(json.dumps(get_properties(test_event)).encode("utf-8"))
+        spool.close()
+
+        with patch("azurelinuxagent.ga.collect_telemetry_events._CollectAndEnqueueEvents._MAX_PENDING_SPOOL_SEGMENTS", 2):
+            with patch("azurelinuxagent.common.event.add_event") as mock_add_event:
+                collector = self._create_event_collector(lambda _: False)
+                collector.process_events()
+
+        self.assertEqual(['event 2', 'event 3'], self._get_test_event_messages(collector.enqueued), "The oldest events should have been dropped")
+        self.assertEqual(2, len(os.listdir(self.event_dir)), "The oldest segments should have been deleted")
+        dropped = [kwargs['message'] for _, kwargs in mock_add_event.call_args_list if kwargs['op'] == WALAEventOperation.CollectEventErrors]
+        self.assertEqual(1, len(dropped), "The dropped events should have been reported")
+        self.assertTrue(dropped[0].startswith("DroppedEventsCount: 2"), "Unexpected dropped events report: {0}".format(dropped[0]))
+
     def test_save_event_rollover(self):
-        # We keep 1000 events only, and the older ones are removed.
+        # We keep 1000 events only; once the limit is reached the oldest spool segment is removed.
+        self._use_empty_event_dir()
 
-        num_of_events = 999
+        num_of_events = MAX_NUMBER_OF_EVENTS - 1
         add_event('test', message='first event')  # this makes number of events to num_of_events + 1.
         for i in range(num_of_events):
             add_event('test', message='test event {0}'.format(i))
 
         num_of_events += 1 # adding the first add_event.
 
-        events = os.listdir(self.event_dir)
-        events.sort()
+        events = EventLoggerTools.get_saved_events(self.event_dir)
         self.assertTrue(len(events) == num_of_events, "{0} is not equal to {1}".format(len(events), num_of_events))
-
-        first_event = os.path.join(self.event_dir, events[0])
-        with open(first_event) as first_fh:
-            first_event_text = first_fh.read()
-            self.assertTrue('first event' in first_event_text)
+        self.assertTrue('first event' in events[0])
 
         add_event('test', message='last event')
-        # Adding the above event displaces the first_event
+        # Adding the above event displaces the first segment, which includes the first_event
 
-        events = os.listdir(self.event_dir)
-        events.sort()
-        self.assertTrue(len(events) == num_of_events,
-                        "{0} events found, {1} expected".format(len(events), num_of_events))
+        events = EventLoggerTools.get_saved_events(self.event_dir)
+        expected = num_of_events - MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT + 1
+        self.assertTrue(len(events) == expected, "{0} events found, {1} expected".format(len(events), expected))
 
-        first_event = os.path.join(self.event_dir, events[0])
-        with open(first_event) as first_fh:
-            first_event_text = first_fh.read()
-            self.assertFalse('first event' in first_event_text, "'first event' not in {0}".format(first_event_text))
-            self.assertTrue('test event 0' in first_event_text)
-
-        last_event = os.path.join(self.event_dir, events[-1])
-        with open(last_event) as last_fh:
-            last_event_text = last_fh.read()
-            self.assertTrue('last event' in last_event_text)
+        self.assertFalse('first event' in events[0], "'first event' not in {0}".format(events[0]))
+        self.assertTrue('test event {0}'.format(MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT - 1) in events[0])
+        self.assertTrue('last event' in events[-1])
 
     def test_save_event_cleanup(self):
-        for i in range(0, 2000):
-            evt = os.path.join(self.event_dir, '{0}.tld'.format(ustr(1491004920536531 + i)))
-            with open(evt, 'w') as fh:
-                fh.write('{0}{1}'.format(TestEvent._Operation, i))
-
-        test_events = self._collect_event_files()
-        self.assertTrue(len(test_events) == 2000, "{0} events found, 2000 expected".format(len(test_events)))
+        self._use_empty_event_dir()
+        max_segments = MAX_NUMBER_OF_EVENTS // MAX_NUMBER_OF_EVENTS_PER_SPOOL_SEGMENT
+
+        # segments created by other processes
+        for i in range(0, 2 * max_segments):
+            segment = os.path.join(self.event_dir, '{0}-1{1}'.format(ustr(1491004920536531 + i), AGENT_EVENT_SPOOL_EXTENSION))
+            with open(segment, 'w'):
+                pass
+        # legacy event files are not removed by the agent
+        legacy_event = os.path.join(self.event_dir, '1491004920536531.tld')
+        with open(legacy_event, 'w') as fh:
+            fh.write(TestEvent._Operation)
 
         add_event('test', message='last event', op=TestEvent._Operation)
 
-        events = os.listdir(self.event_dir)
-        self.assertTrue(len(events) == 1000, "{0} events found, 1000 expected".format(len(events)))
+        segments = [f for f in os.listdir(self.event_dir) if f.endswith(AGENT_EVENT_SPOOL_EXTENSION)]
+        self.assertTrue(len(segments) == max_segments, "{0} segments found, {1} expected".format(len(segments), max_segments))
+        self.assertTrue(os.path.exists(legacy_event), "The legacy event file should not have been removed")
 
     def test_elapsed_milliseconds(self):
         utc_start = datetime.utcnow() + timedelta(days=1)
@@ -896,6 +1026,20 @@ class TestMetrics(AgentTestCase):
         else:
             self.fail("Counter '%idle' not found in event parameters: {0}".format(repr(event_dictionary)))
 
+    @patch('azurelinuxagent.common.event.EventLogger.save_events')
+    def test_report_metrics_should_save_all_the_metrics_in_a_single_batch(self, mock_save_events):
+        metrics = [MetricValue("cpu", "%idle", "_total", 10.0), MetricValue("memory", "used", "_total", "not a number"), MetricValue("memory", "free", "_total", 2)]
+
+        event.report_metrics(metrics)
+
+        self.assertEqual(1, mock_save_events.call_count)
+        counters = []
+        for event_json in mock_save_events.call_args[0][0]:
+            for parameter in json.loads(event_json)["parameters"]:
+                if parameter['name'] == GuestAgentPerfCounterEventsSchema.Counter:
+                    counters.append(parameter['value'])
+        self.assertEqual(["%idle", "free"], counters, "The metric with an invalid value should have been skipped")
+
     def test_cleanup_message(self):
         ev_logger = event.EventLogger()
 
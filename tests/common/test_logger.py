@@ -17,12 +17,14 @@
 
 import os
 import tempfile
+import time
 from datetime import datetime, timedelta
 
 from azurelinuxagent.common.event import __event_logger__, add_log_event, MAX_NUMBER_OF_EVENTS, EVENTS_DIRECTORY
 
 import azurelinuxagent.common.logger as logger
 from azurelinuxagent.common.utils import fileutil
+from tests.lib.event_logger_tools import EventLoggerTools
 from tests.lib.tools import AgentTestCase, MagicMock, patch, skip_if_predicate_true
 
 _MSG_INFO = "This is our test info logging message {0} {1}"
@@ -215,6 +217,13 @@ class TestLogger(AgentTestCase):
 
             self.assertEqual(ts_with_no_ms, time_in_file, "Timestamps dont match")
 
+    def test_format_time_should_be_equivalent_to_strftime(self):
+        timestamps = [datetime(2024, 1, 1), datetime(2024, 1, 1, 0, 0, 0, 1), datetime(2024, 1, 1, 0, 0, 0, 999999),
+                      datetime(2024, 1, 1, 0, 0, 1, 1), datetime(2024, 12, 31, 23, 59, 59, 123456)]
+        # the second iteration uses the cached date and time
+        for timestamp in timestamps + timestamps:
+            self.assertEqual(timestamp.strftime(logger.Logger.LogTimeFormatInUTC), logger.Logger._format_time(timestamp))
+
     def test_telemetry_logger(self):
         mock = MagicMock()
         appender = logger.TelemetryAppender(logger.LogLevel.WARNING, mock)
@@ -374,15 +383,11 @@ class TestLogger(AgentTestCase):
 
         logger.warn('Test Log - Warning')
 
-        event_files = os.listdir(__event_logger__.event_dir)
-        self.assertEqual(1, len(event_files))
-
-        log_file_event = os.path.join(__event_logger__.event_dir, event_files[0])
         try:
-            with open(log_file_event) as logfile:
-                logcontent = logfile.read()
-                # Checking the contents of the event file.
-                self.assertIn("Test Log - Warning", logcontent)
+            saved_events = EventLoggerTools.get_saved_events(__event_logger__.event_dir)
+            self.assertEqual(1, len(saved_events))
+            # Checking the contents of the event.
+            self.assertIn("Test Log - Warning", saved_events[0])
         except Exception as e:
             self.assertFalse(True, "The log file looks like it isn't correctly setup for this test. Take a look. "  # pylint: disable=redundant-unittest-assert
                                    "{0}".format(e))
@@ -437,7 +442,8 @@ class TestLogger(AgentTestCase):
             exception_caught = True
 
         self.assertFalse(exception_caught, msg="Caught a Runtime Error. This should not have been raised.")
-        self.assertEqual(MAX_NUMBER_OF_EVENTS, len(os.listdir(__event_logger__.event_dir)))
+        # the oldest spool segments are removed once the limit is reached
+        self.assertLessEqual(len(EventLoggerTools.get_saved_events(__event_logger__.event_dir)), MAX_NUMBER_OF_EVENTS)
 
         try:
             with open(self.log_file) as logfile:
@@ -450,8 +456,8 @@ class TestLogger(AgentTestCase):
 
                 # Checking the 1001st log entry. We know that 1001st entry would generate a PERIODIC message of too many
                 # events, which should be captured in the log file as well.
-                self.assertRegex(logcontent[1001], r"(.*WARNING\s*{0}\s*\[PERIODIC\]\s*Too many files under:.*{1}, "
-                                                   r"current count\:\s*\d+,\s*removing oldest\s*.*)".format(prefix,
+                self.assertRegex(logcontent[1001], r"(.*WARNING\s*{0}\s*\[PERIODIC\]\s*Too many segments under:.*{1}, "
+                                                   r"removed the oldest\s*\d+\s*segment.*)".format(prefix,
                                                                                                             self.event_dir))
         except Exception as e:
             self.assertFalse(True, "The log file looks like it isn't correctly setup for this test. "  # pylint: disable=redundant-unittest-assert
@@ -541,6 +547,90 @@ class TestAppender(AgentTestCase):
             self.assertRegex(logcontent[1], r"(.*WARNING\s\w+\s*test-warn.*)")
             self.assertRegex(logcontent[2], r"(.*ERROR\s\w+\s*test-error.*)")
 
+    def _read_log_file(self):
+        with open(self.log_file) as log_file:
+            return log_file.readlines()
+
+    def test_buffered_file_appender_should_buffer_info_messages_until_flushed(self):
+        logger.add_logger_appender(logger.AppenderType.BUFFERED_FILE, logger.LogLevel.INFO, path=self.log_file)
+        logger.verbose("test-verbose")
+        logger.info("test-info-1")
+        logger.info("test-info-2")
+
+        self.assertEqual(0, len(self._read_log_file()), "INFO messages should be buffered")
+
+        logger.flush()
+
+        log_content = self._read_log_file()
+        self.assertEqual(2, len(log_content))
+        self.assertRegex(log_content[0], r"(.*INFO\s\w+\s*test-info-1.*)")
+        self.assertRegex(log_content[1], r"(.*INFO\s\w+\s*test-info-2.*)")
+
+    def test_buffered_file_appender_should_write_immediately_warnings_and_errors(self):
+        logger.add_logger_appender(logger.AppenderType.BUFFERED_FILE, logger.LogLevel.INFO, path=self.log_file)
+        logger.info("test-info")
+        logger.warn("test-warn")
+
+        log_content = self._read_log_file()
+        self.assertEqual(2, len(log_content), "The WARNING should have flushed the buffer")
+        self.assertRegex(log_content[0], r"(.*INFO\s\w+\s*test-info.*)")
+        self.assertRegex(log_content[1], r"(.*WARNING\s\w+\s*test-warn.*)")
+
+        logger.error("test-error")
+        self.assertEqual(3, len(self._read_log_file()), "The ERROR should have been written")
+
+    def test_buffered_file_appender_should_flush_after_the_flush_interval(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file, flush_interval=0.01)
+        logger.DEFAULT_LOGGER.appenders.append(appender)
+        logger.info("test-info")
+
+        for _ in range(500):
+            if len(self._read_log_file()) > 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, len(self._read_log_file()), "The message should have been written by the flush timer")
+
+    def test_buffered_file_appender_should_flush_when_the_buffer_is_full(self):
+        appender = logger.BufferedFileAppender(logger.LogLevel.INFO, self.log_file, max_buffer_size=1024)
+        logger.DEFAULT_LOGGER.appenders.append(appender)
+        for i in range(100):
+            logger.info("test-info-{0}", i)
+
+        log_content = self._read_log_file()
+        self.assertTrue(0 < len(log_content) < 100, "Only full buffers should have been written; got {0} lines".format(len(log_content)))
+        logger.flush()
+        self.assertEqual(100, len(self._read_log_file()))
+
+    def test_buffered_file_appender_should_detect_when_the_log_file_is_rotated(self):
+        logger.add_logger_appender(logger.AppenderType.BUFFERED_FILE, logger.LogLevel.INFO, path=self.log_file)
+        logger.warn("test-before-rotation")
+
+        rotated = self.log_file + ".1"
+        os.rename(self.log_file, rotated)
+        logger.warn("test-after-rotation")
+
+        with open(rotated) as log_file:
+            rotated_content = log_file.readlines()
+        self.assertEqual(1, len(rotated_content))
+        self.assertRegex(rotated_content[0], r"test-before-rotation")
+        log_content = self._read_log_file()
+        self.assertEqual(1, len(log_content), "The message should have been written to a new log file")
+        self.assertRegex(log_content[0], r"test-after-rotation")
+
+    def test_buffered_file_appender_should_reopen_the_log_file_when_requested(self):
+        logger.add_logger_appender(logger.AppenderType.BUFFERED_FILE, logger.LogLevel.INFO, path=self.log_file)
+        logger.warn("test-before-reopen")
+
+        with patch("azurelinuxagent.common.logger.os.open", wraps=os.open) as mock_open:
+            logger.warn("test-no-reopen")
+            self.assertEqual(0, mock_open.call_count, "The log file should not have been reopened")
+
+            logger.reopen_log_files()
+            logger.warn("test-after-reopen")
+            self.assertEqual(1, mock_open.call_count, "The log file should have been reopened")
+
+        self.assertEqual(3, len(self._read_log_file()))
+
     @patch("azurelinuxagent.common.event.send_logs_to_telemetry", return_value=True)
     @patch("azurelinuxagent.common.event.EventLogger.add_log_event")
     def test_telemetry_appender(self, mock_add_log_event, *_):
@@ -20,8 +20,9 @@ import unittest
 
 import azurelinuxagent.common.conf as conf
 from azurelinuxagent.common.exception import CryptError
+from azurelinuxagent.common.utils import cryptutil
 from azurelinuxagent.common.utils.cryptutil import CryptUtil
-from tests.lib.tools import AgentTestCase, data_dir, load_data, is_python_version_26, skip_if_predicate_true
+from tests.lib.tools import AgentTestCase, data_dir, load_data, is_python_version_26, skip_if_predicate_true, patch
 
 
 class TestCryptoUtilOperations(AgentTestCase):
@@ -87,5 +88,17 @@ class TestCryptoUtilOperations(AgentTestCase):
         self.assertRaises(IOError, crypto.get_pubkey_from_prv, prv_key)
 
 
+    def test_get_thumbprint_and_pubkey_from_crt_should_match_openssl(self):
+        crypto = CryptUtil(conf.get_openssl_cmd())
+        crt = os.path.join(data_dir, "wire", "trans_cert")
+
+        thumbprint = crypto.get_thumbprint_from_crt(crt)
+        pub_key = crypto.get_pubkey_from_crt(crt)
+
+        with patch.object(cryptutil, "_CRYPTOGRAPHY_AVAILABLE", False):
+            self.assertEqual(crypto.get_thumbprint_from_crt(crt), thumbprint)
+            self.assertEqual(crypto.get_pubkey_from_crt(crt), pub_key)
+
+
 if __name__ == '__main__':
     unittest.main()
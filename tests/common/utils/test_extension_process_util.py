@@ -14,16 +14,21 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import fcntl
 import os
 import shutil
+import signal
 import subprocess
 import tempfile
+import time
 
+from azurelinuxagent.common.event import WALAEventOperation
 from azurelinuxagent.common.exception import ExtensionError, ExtensionErrorCodes
 from azurelinuxagent.common.future import ustr
 from azurelinuxagent.ga.cpucontroller import CpuControllerV1
 from azurelinuxagent.ga.extensionprocessutil import format_stdout_stderr, read_output, \
-    wait_for_process_completion_or_timeout, handle_process_completion
+    wait_for_process_completion_or_timeout, handle_process_completion, ExtensionOutputCapture
+from tests.lib.miscellaneous_tools import wait_for
 from tests.lib.tools import AgentTestCase, patch, data_dir
 
 
@@ -57,7 +62,7 @@ class TestProcessUtils(AgentTestCase):
         self.assertEqual(ret, 0) 
 
     def test_wait_for_process_completion_or_timeout_should_kill_process_on_timeout(self):
-        timeout = 5
+        timeout = 0.5
         process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
             "sleep 1m",
             shell=True,
@@ -69,17 +74,84 @@ class TestProcessUtils(AgentTestCase):
 
         # We don't actually mock the kill, just wrap it so we can assert its call count
         with patch('azurelinuxagent.ga.extensionprocessutil.os.killpg', wraps=os.killpg) as patch_kill:
-            with patch('time.sleep') as mock_sleep:
-                timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=timeout,
-                                                                           cpu_controller=None)
+            start = time.time()
+            timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=timeout,
+                                                                       cpu_controller=None)
+            elapsed = time.time() - start
 
-                # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                # we're "waiting" the correct amount of time before killing the process
-                self.assertEqual(mock_sleep.call_count, timeout) 
+            # make sure we're waiting the correct amount of time before killing the process
+            self.assertTrue(timeout <= elapsed < timeout + 1, "The process should have been killed after the timeout; waited {0} seconds".format(elapsed))
 
-                self.assertEqual(patch_kill.call_count, 1) 
-                self.assertEqual(timed_out, True) 
-                self.assertEqual(ret, None) 
+            self.assertEqual(patch_kill.call_count, 1)
+            self.assertEqual(timed_out, True)
+            self.assertEqual(ret, None)
+
+    def test_wait_for_process_completion_or_timeout_should_kill_process_on_timeout_when_polling(self):
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            "sleep 1m",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid)
+
+        # without pidfds the process is polled with an increasing interval
+        with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+            with patch('azurelinuxagent.ga.extensionprocessutil.time.sleep') as mock_sleep:
+                timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=5, cpu_controller=None)
+
+        delays = [args[0] for args, _ in mock_sleep.call_args_list]
+        self.assertAlmostEqual(5, sum(delays), places=3, msg="The process should have been polled for the duration of the timeout")
+        self.assertEqual(0.01, delays[0])
+        self.assertEqual(1.0, max(delays))
+        self.assertEqual(True, timed_out)
+        self.assertEqual(None, ret)
+
+    def _assert_returns_promptly(self):
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            "date",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=os.setsid)
+
+        wait_stats = {}
+        start = time.time()
+        timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=5, cpu_controller=None, wait_stats=wait_stats)
+        elapsed = time.time() - start
+
+        self.assertEqual(False, timed_out)
+        self.assertEqual(0, ret)
+        self.assertTrue(elapsed < 1, "A command that did not leave any processes behind should not wait for them; waited {0} seconds".format(elapsed))
+        self.assertTrue(wait_stats["overhead_ms"] < 1000, "Unexpected overhead: {0}".format(wait_stats))
+
+    def test_wait_for_process_completion_or_timeout_should_return_promptly_when_the_process_completes(self):
+        self._assert_returns_promptly()
+
+    def test_wait_for_process_completion_or_timeout_should_return_promptly_when_the_process_completes_and_polling(self):
+        with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+            self._assert_returns_promptly()
+
+    def test_wait_for_process_completion_or_timeout_should_give_forked_processes_a_chance_to_start(self):
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            "sleep 2 &",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=subprocess.DEVNULL if hasattr(subprocess, "DEVNULL") else None,
+            stderr=subprocess.DEVNULL if hasattr(subprocess, "DEVNULL") else None,
+            preexec_fn=os.setsid)
+
+        with patch('azurelinuxagent.ga.extensionprocessutil.time.sleep') as mock_sleep:
+            timed_out, ret, _ = wait_for_process_completion_or_timeout(process=process, timeout=5, cpu_controller=None)
+
+        self.assertEqual(False, timed_out)
+        self.assertEqual(0, ret)
+        self.assertEqual([1], [args[0] for args, _ in mock_sleep.call_args_list], "The grace period for the forked processes was not honored")
+        os.killpg(process.pid, signal.SIGKILL)
 
     def test_handle_process_completion_should_return_nonzero_when_process_fails(self):
         process = subprocess.Popen(
@@ -112,29 +184,115 @@ class TestProcessUtils(AgentTestCase):
         expected_output = "[stdout]\ndummy stdout\n\n\n[stderr]\ndummy stderr\n"
         self.assertEqual(process_output, expected_output) 
 
+    def test_handle_process_completion_should_report_the_wait_overhead(self):
+        process = subprocess.Popen(  # pylint: disable=subprocess-popen-preexec-fn
+            "date",
+            shell=True,
+            cwd=self.tmp_dir,
+            env={},
+            stdout=self.stdout,
+            stderr=self.stderr,
+            preexec_fn=os.setsid)
+
+        with patch('azurelinuxagent.ga.extensionprocessutil.add_event') as mock_add_event:
+            handle_process_completion(process=process, command="date", timeout=5, stdout=self.stdout, stderr=self.stderr, error_code=42)
+
+        events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.ExtensionCommandWait]
+        self.assertEqual(1, len(events), "Expected exactly one ExtensionCommandWait event; got {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(events[0]["message"], r"^Command: date; exit code: 0; wait overhead: \d+ ms$")
+
+    def test_extension_output_capture_should_keep_the_head_and_tail_of_the_output_and_rotate_the_log(self):
+        log_file = os.path.join(self.tmp_dir, "output.log")
+        with ExtensionOutputCapture(log_file=log_file, buffer_size=10, log_max_size=100) as stdout:
+            # write the output in chunks, waiting for each chunk to be read, so that the rotation of the log is deterministic
+            chunks = [b"0123456789"] + [b"a" * 10] * 12 + [b"ABCDEFGHIJ"]
+            for chunk in chunks:
+                expected_size = stdout.size + len(chunk)
+                os.write(stdout.fileno(), chunk)
+                while stdout.size < expected_size:
+                    time.sleep(0.001)
+            stdout.finish(5)
+
+            self.assertEqual(140, stdout.size)
+            self.assertEqual(b"ABCDEFGHIJ", stdout.read_tail())
+            stdout.seek(0)
+            self.assertEqual(b"01234", stdout.read(5))
+            self.assertEqual(b"56789", stdout.read())
+
+            with open(log_file + ".1", "rb") as log:
+                rotated = log.read()
+            with open(log_file, "rb") as log:
+                current = log.read()
+            self.assertTrue(len(rotated) <= 100 and len(current) <= 100, "The log was not rotated")
+            self.assertEqual(b"0123456789" + b"a" * 120 + b"ABCDEFGHIJ", rotated + current)
+
+            stdout.truncate(0)
+            self.assertEqual(0, stdout.size)
+            self.assertEqual(b"", stdout.read_tail())
+
+    def test_handle_process_completion_should_not_wait_for_the_output_of_forked_processes(self):
+        command = "echo PARENT; (sleep 60; echo CHILD) &"
+        with ExtensionOutputCapture() as stdout:
+            with ExtensionOutputCapture() as stderr:
+                process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
+                                           shell=True,
+                                           cwd=self.tmp_dir,
+                                           env={},
+                                           stdout=stdout,
+                                           stderr=stderr,
+                                           preexec_fn=os.setsid)
+                try:
+                    start = time.time()
+                    output = handle_process_completion(process=process, command=command, timeout=5, stdout=stdout, stderr=stderr, error_code=42)
+                    elapsed = time.time() - start
+                finally:
+                    os.killpg(process.pid, signal.SIGKILL)
+
+        self.assertEqual("[stdout]\nPARENT\n\n\n[stderr]\n", output)
+        self.assertTrue(elapsed < 3, "handle_process_completion should not wait for the pipes to be closed; waited {0} seconds".format(elapsed))
+
+    def test_extension_output_capture_should_keep_draining_the_output_of_forked_processes_to_the_rotated_log(self):
+        log_file = os.path.join(self.tmp_dir, "output.log")
+        command = "echo PARENT; (sleep 1; echo CHILD; head -c 150 /dev/zero) &"
+        with ExtensionOutputCapture(log_file=log_file, log_max_size=100) as stdout:
+            process = subprocess.Popen(command, shell=True, cwd=self.tmp_dir, env={}, stdout=stdout, stderr=subprocess.PIPE)
+            self.assertTrue(fcntl.fcntl(stdout.fileno(), fcntl.F_GETFD) & fcntl.FD_CLOEXEC, "The pipe should not be inheritable by other commands")
+            process.wait()
+            start = time.time()
+            stdout.finish(5)
+            self.assertTrue(time.time() - start < 3, "finish() should not wait for the forked processes")
+            self.assertEqual(b"PARENT\n", stdout.read_tail())
+
+            self.assertTrue(wait_for(lambda: not stdout._reader.is_alive(), timeout=10), "The reader thread should stop once the forked processes exit")
+
+        with open(log_file + ".1", "rb") as log:
+            self.assertEqual(b"PARENT\nCHILD\n", log.read(), "The output of the forked process should have been written to the log")
+        with open(log_file, "rb") as log:
+            self.assertEqual(b"\0" * 150, log.read(), "The log should have been rotated")
+
     def test_handle_process_completion_should_raise_on_timeout(self):
         command = "sleep 1m"
         timeout = 20
         with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stdout:
             with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stderr:
-                with patch('time.sleep') as mock_sleep:
-                    with self.assertRaises(ExtensionError) as context_manager:
-                        process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
-                                                   shell=True,
-                                                   cwd=self.tmp_dir,
-                                                   env={},
-                                                   stdout=stdout,
-                                                   stderr=stderr,
-                                                   preexec_fn=os.setsid)
-
-                        handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
-                                                  stderr=stderr, error_code=42)
-
-                    # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                    # we're "waiting" the correct amount of time before killing the process and raising an exception
-                    # Due to an extra call to sleep at some point in the call stack which only happens sometimes,
-                    # we are relaxing this assertion to allow +/- 2 sleep calls.
-                    self.assertTrue(abs(mock_sleep.call_count - timeout) <= 2)
+                # Disable pidfds, so that the process is polled using time.sleep()
+                with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+                    with patch('time.sleep') as mock_sleep:
+                        with self.assertRaises(ExtensionError) as context_manager:
+                            process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
+                                                       shell=True,
+                                                       cwd=self.tmp_dir,
+                                                       env={},
+                                                       stdout=stdout,
+                                                       stderr=stderr,
+                                                       preexec_fn=os.setsid)
+
+                            handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
+                                                      stderr=stderr, error_code=42)
+
+                        # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
+                        # we're "waiting" the correct amount of time before killing the process and raising an exception
+                        self.assertAlmostEqual(timeout, sum(args[0] for args, _ in mock_sleep.call_args_list), places=3)
 
                     self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
                     self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
@@ -146,28 +304,28 @@ class TestProcessUtils(AgentTestCase):
         timeout = 20
         with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stdout:
             with tempfile.TemporaryFile(dir=self.tmp_dir, mode="w+b") as stderr:
-                with patch('time.sleep') as mock_sleep:
-                    with self.assertRaises(ExtensionError) as context_manager:
-                        test_file = os.path.join(self.tmp_dir, "cpu.stat")
-                        shutil.copyfile(os.path.join(data_dir, "cgroups", "v1", "cpu.stat_t0"),
-                                        test_file)  # throttled_time = 50
-                        cpu_controller = CpuControllerV1("test", self.tmp_dir)
-                        process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
-                                                   shell=True,
-                                                   cwd=self.tmp_dir,
-                                                   env={},
-                                                   stdout=stdout,
-                                                   stderr=stderr,
-                                                   preexec_fn=os.setsid)
-
-                        handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
-                                                  stderr=stderr, error_code=42, cpu_controller=cpu_controller)
-
-                    # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
-                    # we're "waiting" the correct amount of time before killing the process and raising an exception
-                    # Due to an extra call to sleep at some point in the call stack which only happens sometimes,
-                    # we are relaxing this assertion to allow +/- 2 sleep calls.
-                    self.assertTrue(abs(mock_sleep.call_count - timeout) <= 2)
+                # Disable pidfds, so that the process is polled using time.sleep()
+                with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+                    with patch('time.sleep') as mock_sleep:
+                        with self.assertRaises(ExtensionError) as context_manager:
+                            test_file = os.path.join(self.tmp_dir, "cpu.stat")
+                            shutil.copyfile(os.path.join(data_dir, "cgroups", "v1", "cpu.stat_t0"),
+                                            test_file)  # throttled_time = 50
+                            cpu_controller = CpuControllerV1("test", self.tmp_dir)
+                            process = subprocess.Popen(command,  # pylint: disable=subprocess-popen-preexec-fn
+                                                       shell=True,
+                                                       cwd=self.tmp_dir,
+                                                       env={},
+                                                       stdout=stdout,
+                                                       stderr=stderr,
+                                                       preexec_fn=os.setsid)
+
+                            handle_process_completion(process=process, command=command, timeout=timeout, stdout=stdout,
+                                                      stderr=stderr, error_code=42, cpu_controller=cpu_controller)
+
+                        # We're mocking sleep to avoid prolonging the test execution time, but we still want to make sure
+                        # we're "waiting" the correct amount of time before killing the process and raising an exception
+                        self.assertAlmostEqual(timeout, sum(args[0] for args, _ in mock_sleep.call_args_list), places=3)
 
                     self.assertEqual(context_manager.exception.code, ExtensionErrorCodes.PluginHandlerScriptTimedout)
                     self.assertIn("Timeout({0})".format(timeout), ustr(context_manager.exception))
@@ -0,0 +1,68 @@
+# Copyright 2018 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+
+import os
+import threading
+import time
+import unittest
+
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.common.utils.inotifyutil import create_directory_watcher, InotifyDirectoryWatcher, \
+    PollingDirectoryWatcher
+from tests.lib.tools import AgentTestCase, patch
+
+
+class TestInotifyUtil(AgentTestCase):
+    def test_wait_should_return_as_soon_as_a_file_is_written(self):
+        with create_directory_watcher(self.tmp_dir) as watcher:
+            self.assertIsInstance(watcher, InotifyDirectoryWatcher)
+
+            timer = threading.Timer(0.1, lambda: fileutil.write_file(os.path.join(self.tmp_dir, "0.status"), "{}"))
+            timer.start()
+            try:
+                start = time.time()
+                self.assertTrue(watcher.wait(30), "wait() should have detected the new file")
+                self.assertLess(time.time() - start, 10, "wait() should have returned before the timeout")
+            finally:
+                timer.join()
+
+    def test_wait_should_return_false_on_timeout(self):
+        with create_directory_watcher(self.tmp_dir) as watcher:
+            self.assertFalse(watcher.wait(0.01))
+
+    def test_wait_should_drain_previous_events(self):
+        with create_directory_watcher(self.tmp_dir) as watcher:
+            for i in range(10):
+                fileutil.write_file(os.path.join(self.tmp_dir, "{0}.status".format(i)), "{}")
+            self.assertTrue(watcher.wait(1))
+            self.assertFalse(watcher.wait(0.01), "All the pending events should have been consumed by the previous wait()")
+
+    def test_it_should_fall_back_to_polling_when_the_directory_does_not_exist(self):
+        with create_directory_watcher(os.path.join(self.tmp_dir, "does-not-exist")) as watcher:
+            self.assertIsInstance(watcher, PollingDirectoryWatcher)
+
+    def test_it_should_fall_back_to_polling_when_inotify_is_not_available(self):
+        with patch("azurelinuxagent.common.utils.inotifyutil._get_libc", side_effect=AttributeError("undefined symbol: inotify_init1")):
+            with create_directory_watcher(self.tmp_dir) as watcher:
+                self.assertIsInstance(watcher, PollingDirectoryWatcher)
+                with patch("azurelinuxagent.common.utils.inotifyutil.time.sleep") as mock_sleep:
+                    self.assertFalse(watcher.wait(5))
+                    mock_sleep.assert_called_once_with(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
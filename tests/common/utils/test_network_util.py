@@ -14,6 +14,10 @@
 #
 # Requires Python 2.6+ and Openssl 1.0+
 #
+import errno
+import socket
+import struct
+
 import azurelinuxagent.common.utils.networkutil as networkutil
 from tests.lib.tools import AgentTestCase
 
@@ -60,3 +64,39 @@ class TestNetworkOperations(AgentTestCase):
         self.assertEqual(str(nic), '{ "name": "test0", "link": "link INFO", "ipv4": ["ipv4-1"], "ipv6": ["ipv6-1"] }')
 
 
+
+    @staticmethod
+    def _netlink_message(message_type, payload):
+        return struct.pack("=IHHII", 16 + len(payload), message_type, 0x2, 1, 0) + payload
+
+    @staticmethod
+    def _address_message(family, prefix_length, scope, index, attributes):
+        payload = struct.pack("=BBBBI", family, prefix_length, 0, scope, index)
+        for attribute_type, value in attributes:
+            attribute = struct.pack("=HH", 4 + len(value), attribute_type) + value
+            payload += attribute + b"\0" * ((4 - len(attribute) % 4) % 4)
+        return TestNetworkOperations._netlink_message(20, payload)
+
+    def test_parse_netlink_address_messages(self):
+        buffer = self._address_message(socket.AF_INET, 8, 254, 1, [(1, socket.inet_aton("127.0.0.1")), (2, socket.inet_aton("127.0.0.1")), (3, b"lo\0")]) + \
+            self._address_message(socket.AF_INET, 32, 0, 3, [(1, socket.inet_aton("10.0.0.1")), (2, socket.inet_aton("10.0.0.2"))]) + \
+            self._address_message(socket.AF_INET6, 64, 253, 2, [(1, socket.inet_pton(socket.AF_INET6, "fe80::20d:3aff:fe30:c35a"))])
+
+        addresses, done = networkutil.parse_netlink_address_messages(buffer)
+
+        self.assertFalse(done, "The buffer does not include NLMSG_DONE")
+        self.assertEqual(
+            [(1, "inet 127.0.0.1/8 scope host"), (3, "inet 10.0.0.2/32 scope global"), (2, "inet6 fe80::20d:3aff:fe30:c35a/64 scope link")],
+            [(a.index, str(a)) for a in addresses])
+
+        addresses, done = networkutil.parse_netlink_address_messages(self._netlink_message(3, struct.pack("=i", 0)))
+        self.assertTrue(done, "The buffer includes NLMSG_DONE")
+        self.assertEqual([], addresses)
+
+    def test_parse_netlink_address_messages_should_raise_on_errors(self):
+        with self.assertRaises(OSError) as context_manager:
+            networkutil.parse_netlink_address_messages(self._netlink_message(2, struct.pack("=i", -errno.EPERM) + b"\0" * 16))
+        self.assertEqual(errno.EPERM, context_manager.exception.errno)
+
+        with self.assertRaises(ValueError):
+            networkutil.parse_netlink_address_messages(self._netlink_message(20, b"\0" * 8)[:-4])
@@ -15,7 +15,10 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 
+import errno
+import fcntl
 import os
+import socket
 import unittest
 
 from azurelinuxagent.common.exception import HttpError, ResourceGoneError, InvalidContainerError
@@ -86,6 +89,203 @@ class TestIOErrorCounter(AgentTestCase):
             restutil.IOErrorCounter._counts)
 
 
+class TestHttpConnectionPool(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        restutil.reset_connection_pool()
+
+    def tearDown(self):
+        restutil.reset_connection_pool()
+        AgentTestCase.tearDown(self)
+
+    @staticmethod
+    def _create_mock_connection(will_close=False, is_closed=True):
+        connection = MagicMock(sock=None)
+        connection.getresponse.side_effect = lambda: Mock(will_close=will_close, isclosed=Mock(return_value=is_closed))
+        return connection
+
+    def test_it_should_reuse_connections_after_the_response_is_read(self):
+        connection = self._create_mock_connection()
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", return_value=connection) as HTTPConnection:
+            restutil._http_request("GET", "foo", "/bar", 10)
+            restutil._http_request("PUT", "foo", "/bar", 10, data="data")
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertEqual(1, HTTPConnection.call_count, "A single connection should have been created")
+            self.assertEqual(3, connection.request.call_count, "All requests should have been issued on the same connection")
+            self.assertEqual(0, connection.close.call_count, "The connection should have been kept open")
+
+    def test_it_should_not_share_connections_across_servers(self):
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=lambda *_, **__: self._create_mock_connection()) as HTTPConnection:
+            restutil._http_request("GET", "foo", "/bar", 10)
+            restutil._http_request("GET", "foo", "/bar", 10, port=32526)
+            restutil._http_request("GET", "foo", "/bar", 10, proxy_host="proxy", proxy_port=3128)
+
+            self.assertEqual(3, HTTPConnection.call_count, "Each server should use its own connection")
+
+    def test_it_should_not_reuse_connections_while_the_response_is_being_read(self):
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=lambda *_, **__: self._create_mock_connection(is_closed=False)) as HTTPConnection:
+            restutil._http_request("GET", "foo", "/bar", 10)
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertEqual(2, HTTPConnection.call_count, "A connection with a pending response should not be reused")
+
+    def test_it_should_not_reuse_connections_the_server_will_close(self):
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=lambda *_, **__: self._create_mock_connection(will_close=True)) as HTTPConnection:
+            restutil._http_request("GET", "foo", "/bar", 10)
+            restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertEqual(2, HTTPConnection.call_count, "The connection should not have been reused")
+
+    def test_it_should_close_idle_connections(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            with patch("azurelinuxagent.common.utils.restutil._HttpConnectionPool.IDLE_TIMEOUT", -1):
+                restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertEqual(2, len(connections), "The idle connection should not have been reused")
+            self.assertEqual(1, connections[0].close.call_count, "The idle connection should have been closed")
+
+    def test_it_should_retry_on_a_new_connection_when_the_server_closed_an_idle_connection(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            connections[0].getresponse.side_effect = httpclient.BadStatusLine("''")
+
+            response = restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertIsNotNone(response)
+            self.assertEqual(2, len(connections), "A new connection should have been created")
+            self.assertEqual(1, connections[0].close.call_count, "The stale connection should have been closed")
+            self.assertEqual(1, connections[1].request.call_count, "The request should have been retried on the new connection")
+
+    def test_it_should_not_retry_other_errors_on_a_new_connection(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            connections[0].getresponse.side_effect = IOError("timed out")
+
+            with self.assertRaises(IOError):
+                restutil._http_request("GET", "foo", "/bar", 10)
+
+            self.assertEqual(1, len(connections), "No new connections should have been created")
+
+
+    def test_it_should_not_retry_non_idempotent_requests_after_they_were_sent(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            connections[0].getresponse.side_effect = httpclient.BadStatusLine("''")
+
+            with self.assertRaises(httpclient.BadStatusLine):
+                restutil._http_request("POST", "foo", "/bar", 10, data="data")
+
+            self.assertEqual(1, len(connections), "The request should not have been retried on a new connection")
+            self.assertEqual(1, connections[0].close.call_count, "The stale connection should have been closed")
+
+    def test_it_should_retry_non_idempotent_requests_when_the_connection_was_closed_while_sending_them(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            connections[0].request.side_effect = socket.error(errno.ECONNRESET, "Connection reset by peer")
+
+            response = restutil._http_request("POST", "foo", "/bar", 10, data="data")
+
+            self.assertIsNotNone(response)
+            self.assertEqual(2, len(connections), "A new connection should have been created")
+            self.assertEqual(1, connections[1].request.call_count, "The request should have been retried on the new connection")
+
+    def test_it_should_close_idle_connections_to_all_servers(self):
+        connections = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            return connections[-1]
+
+        with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+            restutil._http_request("GET", "foo", "/bar", 10)
+            with patch("azurelinuxagent.common.utils.restutil._HttpConnectionPool.IDLE_TIMEOUT", -1):
+                restutil._http_request("GET", "foo", "/bar", 10, port=32526)
+
+            self.assertEqual(1, connections[0].close.call_count, "The idle connection to the first server should have been closed")
+
+    def test_it_should_set_close_on_exec_on_the_sockets_of_pooled_connections(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            server.bind(("127.0.0.1", 0))
+            server.listen(1)
+            client = socket.create_connection(server.getsockname())
+            try:
+                flags = fcntl.fcntl(client.fileno(), fcntl.F_GETFD)
+                fcntl.fcntl(client.fileno(), fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+
+                connection = self._create_mock_connection()
+                connection.sock = client
+                with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", return_value=connection):
+                    restutil._http_request("GET", "foo", "/bar", 10)
+
+                self.assertTrue(fcntl.fcntl(client.fileno(), fcntl.F_GETFD) & fcntl.FD_CLOEXEC, "FD_CLOEXEC should have been set on the socket")
+            finally:
+                client.close()
+        finally:
+            server.close()
+
+    def test_it_should_stream_file_bodies_and_send_them_again_on_a_new_connection(self):
+        connections = []
+        bodies = []
+
+        def create_connection(*_, **__):
+            connections.append(self._create_mock_connection())
+            connections[-1].request.side_effect = lambda body, **__: bodies.append(body.read()) if body is not None else None
+            return connections[-1]
+
+        with open(os.path.join(self.tmp_dir, "body"), "wb") as body:
+            body.write(b"header-content")
+        with open(os.path.join(self.tmp_dir, "body"), "rb") as body:
+            body.seek(len(b"header-"))
+            with patch("azurelinuxagent.common.future.httpclient.HTTPConnection", side_effect=create_connection):
+                restutil._http_request("GET", "foo", "/bar", 10)
+
+                def request_on_stale_connection(body, **__):
+                    bodies.append(body.read())
+                    raise socket.error(errno.EPIPE, "Broken pipe")
+                connections[0].request.side_effect = request_on_stale_connection
+
+                restutil._http_request("PUT", "foo", "/bar", 10, data=body)
+
+        self.assertEqual([b"content", b"content"], bodies, "The file should have been sent from its initial position on both connections")
+        headers = connections[1].request.call_args[1]["headers"]
+        self.assertEqual(str(len(b"content")), headers["Content-Length"], "The length of the file body should have been set")
+
+
+
 class TestHttpOperations(AgentTestCase):
     def test_parse_url(self):
         test_uri = "http://abc.def/ghi#hash?jkl=mn"
@@ -359,7 +559,7 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -382,7 +582,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo", 443, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -406,7 +606,7 @@ class TestHttpOperations(AgentTestCase):
         ])
         HTTPSConnection.assert_not_called()
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="http://foo:80/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -539,7 +739,7 @@ class TestHttpOperations(AgentTestCase):
             call("foo.bar", 23333, timeout=10)
         ])
         mock_conn.request.assert_has_calls([
-            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT, 'Connection': 'close'})
+            call(method="GET", url="https://foo:443/bar", body=None, headers={'User-Agent': HTTP_USER_AGENT})
         ])
         self.assertEqual(1, mock_conn.getresponse.call_count)
         self.assertNotEqual(None, resp) 
@@ -582,6 +782,24 @@ class TestHttpOperations(AgentTestCase):
         self.assertEqual(2, _http_request.call_count)
         self.assertEqual(1, _sleep.call_count)
 
+    @patch("time.sleep")
+    @patch("azurelinuxagent.common.utils.restutil._http_request")
+    def test_http_request_sends_file_bodies_from_the_start_on_retries(self, _http_request, _sleep):
+        bodies = []
+
+        def http_request(*_, **kwargs):
+            bodies.append(kwargs["data"].read())
+            return Mock(status=httpclient.SERVICE_UNAVAILABLE if len(bodies) == 1 else httpclient.OK)
+
+        _http_request.side_effect = http_request
+
+        with open(os.path.join(self.tmp_dir, "body"), "wb") as body:
+            body.write(b"content")
+        with open(os.path.join(self.tmp_dir, "body"), "rb") as body:
+            restutil.http_put("https://foo.bar", body)
+
+        self.assertEqual([b"content", b"content"], bodies)
+
     @patch("time.sleep")
     @patch("azurelinuxagent.common.utils.restutil._http_request")
     def test_http_request_retries_passed_status_codes(self, _http_request, _sleep):
@@ -21,6 +21,7 @@ import subprocess
 import sys
 import tempfile
 import threading
+import time
 import unittest
 
 from azurelinuxagent.common.future import ustr
@@ -477,5 +478,49 @@ time.sleep(120)
                 thread.join(timeout=5)
 
 
+
+class WaitForProcessExitTestCase(AgentTestCase):
+    def _test_wait_for_process_exit(self):
+        process = subprocess.Popen([sys.executable, "-c", "import sys, time; time.sleep(0.2); sys.exit(3)"])
+        start_time = time.time()
+        self.assertEqual(3, shellutil.wait_for_process_exit(process, 10))
+        self.assertLess(time.time() - start_time, 1, "The exit of the process should have been detected immediately")
+
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        try:
+            self.assertIsNone(shellutil.wait_for_process_exit(process, 0.1), "The process should still be running")
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_wait_for_process_exit_should_return_the_exit_code_or_none_on_timeout(self):
+        self._test_wait_for_process_exit()
+
+    def test_wait_for_process_exit_should_return_the_exit_code_or_none_on_timeout_when_polling(self):
+        with patch("azurelinuxagent.common.utils.shellutil._open_pidfd", return_value=None):
+            self._test_wait_for_process_exit()
+
+    def _test_wait_for_process_exit_with_wakeup_fd(self):
+        process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        read_fd, write_fd = os.pipe()
+        try:
+            os.write(write_fd, b"x")
+            start_time = time.time()
+            self.assertIsNone(shellutil.wait_for_process_exit(process, 10, wakeup_fd=read_fd), "The process should still be running")
+            self.assertLess(time.time() - start_time, 1, "The wait should have ended when the wakeup fd became readable")
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+            process.kill()
+            process.wait()
+
+    def test_wait_for_process_exit_should_end_when_the_wakeup_fd_is_readable(self):
+        self._test_wait_for_process_exit_with_wakeup_fd()
+
+    def test_wait_for_process_exit_should_end_when_the_wakeup_fd_is_readable_when_polling(self):
+        with patch("azurelinuxagent.common.utils.shellutil._open_pidfd", return_value=None):
+            self._test_wait_for_process_exit_with_wakeup_fd()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import os
+import unittest
+
+from azurelinuxagent.common.utils.spoolutil import SegmentedSpool, read_segment, encode_record, decode_records, \
+    CLAIMED_SEGMENT_SUFFIX
+from tests.lib.tools import AgentTestCase, patch
+
+_EXTENSION = ".test.spool"
+
+
+class TestSegmentedSpool(AgentTestCase):
+    def _create_spool(self, **kwargs):
+        spool = SegmentedSpool(self.tmp_dir, _EXTENSION, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def _read_all(self, spool):
+        records = []
+        for segment in spool.claim_segments():
+            segment_records, _ = read_segment(segment)
+            records.extend(segment_records)
+            os.remove(segment)
+        return records
+
+    def test_it_should_read_the_records_in_the_order_they_were_appended(self):
+        spool = self._create_spool(max_records_per_segment=3)
+        expected = [u"record {0} \u05e2".format(i).encode("utf-8") for i in range(10)]
+        for record in expected:
+            spool.append(record)
+
+        self.assertEqual(4, len(os.listdir(self.tmp_dir)), "The records should have been written to 4 segments")
+        self.assertEqual(expected, self._read_all(spool))
+
+    def test_append_all_should_fill_the_current_segment_before_starting_a_new_one(self):
+        spool = self._create_spool(max_records_per_segment=4)
+        spool.append(b"first")
+        expected = [b"first"] + ["record {0}".format(i).encode("utf-8") for i in range(8)]
+
+        with patch("os.write", wraps=os.write) as write:
+            spool.append_all(expected[1:])
+
+        self.assertEqual(3, write.call_count, "Expected one write per segment")
+        self.assertEqual(3, len(os.listdir(self.tmp_dir)), "The records should have been written to 3 segments")
+        self.assertEqual(expected, self._read_all(spool))
+
+    def test_it_should_rotate_segments_by_size(self):
+        spool = self._create_spool(max_segment_size=50)
+        for _ in range(3):
+            spool.append(b"x" * 80)
+
+        self.assertEqual(3, len(os.listdir(self.tmp_dir)), "Each record should have been written to its own segment")
+
+    def test_it_should_remove_the_oldest_segments(self):
+        spool = self._create_spool(max_records_per_segment=1, max_segments=3)
+        for i in range(5):
+            spool.append("record {0}".format(i).encode("utf-8"))
+
+        self.assertEqual([b"record 2", b"record 3", b"record 4"], self._read_all(spool))
+
+    def test_it_should_start_a_new_segment_after_the_current_one_is_claimed(self):
+        spool = self._create_spool()
+        spool.append(b"record 0")
+
+        claimed = spool.claim_segments()
+        self.assertEqual(1, len(claimed))
+        self.assertTrue(claimed[0].endswith(CLAIMED_SEGMENT_SUFFIX))
+
+        spool.append(b"record 1")
+
+        self.assertEqual(([b"record 0"], 0), read_segment(claimed[0]))
+        self.assertEqual([b"record 0", b"record 1"], self._read_all(spool), "Segments claimed previously should be claimed again")
+
+    def test_decode_records_should_skip_incomplete_and_corrupt_records(self):
+        buffer = encode_record(b"first") + encode_record(b"second")
+
+        self.assertEqual(([b"first"], len(encode_record(b"second")) - 4), decode_records(buffer[:-4]), "The incomplete record should have been skipped")
+
+        corrupt = buffer[:-1] + b"X"
+        self.assertEqual(([b"first"], len(encode_record(b"second"))), decode_records(corrupt), "The corrupt record should have been skipped")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -28,7 +28,7 @@ import threading
 
 from azurelinuxagent.common import conf
 from azurelinuxagent.ga.cgroupcontroller import AGENT_NAME_TELEMETRY, MetricsCounter, MetricValue, MetricsCategory
-from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator, DisableCgroups
+from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator, DisableCgroups, ProcessSnapshot
 from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
 from azurelinuxagent.common.event import WALAEventOperation
 from azurelinuxagent.common.exception import CGroupsException, AgentMemoryExceededException
@@ -990,3 +990,71 @@ exit 0
 
         with self._get_cgroup_configurator_v2() as configurator:
             self.assertEqual(configurator.get_logcollector_unit_properties(), ["--property=CPUAccounting=yes", "--property=MemoryAccounting=yes", "--property=CPUQuota=5%", "--property=MemoryHigh=170M"])
+
+
+class ProcessSnapshotTestCase(AgentTestCase):
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.proc_root = os.path.join(self.tmp_dir, "proc")
+        os.mkdir(self.proc_root)
+
+    def _create_process(self, pid, ppid, comm, state="S", cmdline=None):
+        os.mkdir(os.path.join(self.proc_root, str(pid)))
+        with open(os.path.join(self.proc_root, str(pid), "stat"), "w") as stat_file:
+            stat_file.write("{0} ({1}) {2} {3} {0} {0} 0 -1 4194624 57736 64902 0 3\n".format(pid, comm, state, ppid))
+        with open(os.path.join(self.proc_root, str(pid), "cmdline"), "w") as cmdline_file:
+            cmdline_file.write(cmdline if cmdline is not None else comm + "\x00")
+
+    def test_it_should_parse_the_stat_of_the_processes(self):
+        self._create_process(100, 1, "python3")
+        self._create_process(101, 100, "my (weird) cmd", state="Z")
+        snapshot = ProcessSnapshot(self.proc_root)
+
+        self.assertEqual(1, snapshot.get_parent(100))
+        self.assertEqual("python3", snapshot.get_command(100))
+        self.assertFalse(snapshot.is_zombie(100))
+        self.assertEqual(100, snapshot.get_parent(101))
+        self.assertEqual("my (weird) cmd", snapshot.get_command(101))
+        self.assertTrue(snapshot.is_zombie(101))
+        self.assertEqual("python3\x00", snapshot.get_cmdline(100))
+
+        self.assertEqual(0, snapshot.get_parent(999))
+        self.assertEqual("UNKNOWN", snapshot.get_command(999))
+        self.assertFalse(snapshot.is_zombie(999))
+        self.assertIsNone(snapshot.get_cmdline(999))
+
+    def test_it_should_read_each_process_only_once(self):
+        # 200 -> 201 -> 202 -> 203, and 204 -> 203
+        self._create_process(200, 1, "bash")
+        self._create_process(201, 200, "bash")
+        self._create_process(202, 201, "bash")
+        self._create_process(203, 202, "sleep")
+        self._create_process(204, 203, "sleep")
+        self._create_process(300, 1, "other")
+        snapshot = ProcessSnapshot(self.proc_root)
+
+        original_open = open
+        opened = []
+
+        def mock_open(path, *args, **kwargs):
+            opened.append(path)
+            return original_open(path, *args, **kwargs)
+
+        with patch("azurelinuxagent.ga.cgroupconfigurator.open", side_effect=mock_open, create=True):
+            for _ in range(3):
+                self.assertTrue(snapshot.is_descendant_of_any(204, set([200])))
+                self.assertTrue(snapshot.is_descendant_of_any(202, set([200])))
+                self.assertTrue(snapshot.is_descendant_of_any(200, set([200])))
+                self.assertFalse(snapshot.is_descendant_of_any(300, set([200])))
+                self.assertFalse(snapshot.is_descendant_of_any(999, set([200])))
+            self.assertTrue(snapshot.is_descendant_of_any(300, set([300, 200])))
+
+        self.assertEqual(len(opened), len(set(opened)), "Some files were read more than once: {0}".format(opened))
+
+    def test_it_should_handle_loops_in_the_process_tree(self):
+        self._create_process(400, 401, "a")
+        self._create_process(401, 400, "b")
+        snapshot = ProcessSnapshot(self.proc_root)
+
+        self.assertFalse(snapshot.is_descendant_of_any(400, set([1])))
+        self.assertFalse(snapshot.is_descendant_of_any(401, set([1])))
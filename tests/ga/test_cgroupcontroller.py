@@ -19,9 +19,13 @@ from __future__ import print_function
 
 import os
 import random
+import shutil
 
-from azurelinuxagent.ga.cgroupcontroller import _CgroupController
-from tests.lib.tools import AgentTestCase, patch
+from azurelinuxagent.common.utils import fileutil
+from azurelinuxagent.ga.cgroupcontroller import _CgroupController, parse_stat_file
+from azurelinuxagent.ga.cpucontroller import CpuControllerV2
+from azurelinuxagent.ga.memorycontroller import MemoryControllerV2
+from tests.lib.tools import AgentTestCase, patch, data_dir
 
 
 def consume_cpu_time():
@@ -53,3 +57,41 @@ class TestCgroupController(AgentTestCase):
         test_metrics = _CgroupController("test_extension", os.path.join(self.tmp_dir, "cgroup.procs"))
         self.assertEqual(False, test_metrics.is_active())
         self.assertEqual(1, patch_periodic_warn.call_count)
+
+    def test_parse_stat_file(self):
+        counters = parse_stat_file("usage_usec 1990707\nuser_usec 1939858\ncore_sched.force_idle_usec 0\ninvalid line\nnot_a_number abc\n")
+        self.assertEqual({"usage_usec": 1990707, "user_usec": 1939858, "core_sched.force_idle_usec": 0}, counters)
+
+    def test_snapshot_should_read_each_stat_file_only_once(self):
+        for file_name in ["cpu.stat", "memory.stat", "memory.events", "memory.peak", "memory.swap.current"]:
+            shutil.copyfile(os.path.join(data_dir, "cgroups", "v2", file_name), os.path.join(self.tmp_dir, file_name))
+
+        original_read_file = fileutil.read_file
+        read_files = []
+
+        def read_file(path, **kwargs):
+            read_files.append(os.path.basename(path))
+            return original_read_file(path, **kwargs)
+
+        cpu_controller = CpuControllerV2("test_extension", self.tmp_dir)
+        memory_controller = MemoryControllerV2("test_extension", self.tmp_dir)
+        with patch("azurelinuxagent.common.utils.fileutil.read_file", side_effect=read_file):
+            cpu_controller.initialize_cpu_usage()
+            del read_files[:]
+            cpu_controller.get_tracked_metrics()
+            self.assertEqual(1, read_files.count("cpu.stat"), "cpu.stat should have been read only once. Files read: {0}".format(read_files))
+
+            memory_controller.get_tracked_metrics()
+            self.assertEqual(1, read_files.count("memory.stat"), "memory.stat should have been read only once. Files read: {0}".format(read_files))
+
+            # outside a snapshot, the file is read on each call
+            del read_files[:]
+            memory_controller.get_memory_usage()
+            self.assertEqual(2, read_files.count("memory.stat"), "memory.stat should have been read for each counter. Files read: {0}".format(read_files))
+
+            with memory_controller.snapshot():
+                self.assertEqual((17589300, 134553600), memory_controller.get_memory_usage())
+                with open(os.path.join(self.tmp_dir, "memory.stat"), "w") as memory_stat:
+                    memory_stat.write("anon 1\nfile 2\n")
+                self.assertEqual((17589300, 134553600), memory_controller.get_memory_usage(), "The counters should have been taken from the snapshot")
+            self.assertEqual((1, 2), memory_controller.get_memory_usage(), "The counters should have been read again after the snapshot")
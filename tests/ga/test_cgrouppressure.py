@@ -0,0 +1,106 @@
+# Copyright Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.6+ and Openssl 1.0+
+#
+import os
+
+from azurelinuxagent.ga.cgroupapi import CgroupV2
+from azurelinuxagent.ga.cgroupconfigurator import CGroupConfigurator
+from azurelinuxagent.ga.cgroupcontroller import MetricsCategory, MetricsCounter
+from azurelinuxagent.ga.cgrouppressure import CpuQuotaPolicy, get_pressure_metrics
+from tests.lib.tools import AgentTestCase, patch
+
+_CPU_PRESSURE = "some avg10=1.50 avg60=2.25 avg300=0.75 total=12345\nfull avg10=0.50 avg60=1.00 avg300=0.25 total=6789\n"
+_MEMORY_PRESSURE = "some avg10=0.00 avg60=0.10 avg300=0.00 total=10\nfull avg10=0.00 avg60=0.05 avg300=0.00 total=5\n"
+
+
+class CpuQuotaPolicyTestCase(AgentTestCase):
+    def test_it_should_tighten_the_quota_under_high_pressure_down_to_the_minimum(self):
+        policy = CpuQuotaPolicy()
+        self.assertEqual(20, policy.get_cpu_quota(40, 40, 50.0))
+        self.assertEqual(10, policy.get_cpu_quota(40, 20, 40.0))
+        self.assertEqual(8, policy.get_cpu_quota(40, 10, 90.0), "The quota should not go below 20% of the configured quota")
+        self.assertEqual(8, policy.get_cpu_quota(40, 8, 90.0))
+
+    def test_it_should_relax_the_quota_under_low_pressure_up_to_the_configured_quota(self):
+        policy = CpuQuotaPolicy()
+        self.assertEqual(12, policy.get_cpu_quota(40, 8, 5.0))
+        self.assertEqual(27, policy.get_cpu_quota(40, 18, 10.0))
+        self.assertEqual(40, policy.get_cpu_quota(40, 27, 0.0), "The quota should not go above the configured quota")
+
+    def test_it_should_not_change_the_quota_under_moderate_pressure(self):
+        policy = CpuQuotaPolicy()
+        self.assertEqual(20, policy.get_cpu_quota(40, 20, 25.0))
+
+
+class GetPressureMetricsTestCase(AgentTestCase):
+    def test_it_should_report_the_avg60_of_each_resource(self):
+        cgroup_path = os.path.join(self.tmp_dir, "azure-vmextensions.slice")
+        os.mkdir(cgroup_path)
+        with open(os.path.join(cgroup_path, "cpu.pressure"), "w") as f:
+            f.write(_CPU_PRESSURE)
+        with open(os.path.join(cgroup_path, "memory.pressure"), "w") as f:
+            f.write(_MEMORY_PRESSURE)
+        # no io.pressure: the io metrics should be skipped
+
+        metrics = get_pressure_metrics("vmextensions", CgroupV2("vmextensions", self.tmp_dir, cgroup_path, ["cpu", "memory"]))
+
+        self.assertEqual(
+            [
+                (MetricsCategory.CPU_CATEGORY, MetricsCounter.PRESSURE_SOME, "vmextensions", 2.25),
+                (MetricsCategory.CPU_CATEGORY, MetricsCounter.PRESSURE_FULL, "vmextensions", 1.0),
+                (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.PRESSURE_SOME, "vmextensions", 0.1),
+                (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.PRESSURE_FULL, "vmextensions", 0.05),
+            ],
+            [(m.category, m.counter, m.instance, m.value) for m in metrics])
+
+    def test_it_should_return_no_metrics_when_the_cgroup_does_not_exist(self):
+        self.assertEqual([], get_pressure_metrics("test", CgroupV2("test", self.tmp_dir, os.path.join(self.tmp_dir, "none"), [])))
+        self.assertEqual([], get_pressure_metrics("test", CgroupV2("test", "", "", [])))
+
+
+class CpuQuotaThrottlingTestCase(AgentTestCase):
+    @staticmethod
+    def _check_pressure(configurator, cpu_pressure):
+        pressure = {"some": {"avg10": cpu_pressure, "avg60": 0.0, "avg300": 0.0, "total": 0}}
+        with patch("azurelinuxagent.ga.cgroupconfigurator.conf.get_enable_cgroup_pressure_throttling", return_value=True):
+            with patch("azurelinuxagent.common.osutil.default.DefaultOSUtil.get_pressure_stall_information", return_value=pressure):
+                with patch("azurelinuxagent.ga.cgroupconfigurator.systemd.set_unit_run_time_property") as set_property:
+                    configurator.check_pressure()
+        return [args for args, _ in set_property.call_args_list]
+
+    def test_check_pressure_should_adjust_the_cpu_quota_of_the_extensions(self):
+        configurator = CGroupConfigurator._Impl()
+        with patch.object(configurator, "enabled", return_value=True):
+            with patch.object(configurator, "using_cgroup_v2", return_value=False):
+                configurator._set_configured_cpu_quota("extension.slice", "40%")
+                configurator._set_configured_cpu_quota("other.slice", "infinity")
+
+                self.assertEqual([("extension.slice", "CPUQuota", "20%")], self._check_pressure(configurator, 60.0))
+                self.assertEqual([("extension.slice", "CPUQuota", "10%")], self._check_pressure(configurator, 60.0))
+                self.assertEqual([], self._check_pressure(configurator, 25.0))
+                self.assertEqual([("extension.slice", "CPUQuota", "15%")], self._check_pressure(configurator, 1.0))
+
+                configurator._set_configured_cpu_quota("extension.slice", "infinity")
+                self.assertEqual([], self._check_pressure(configurator, 60.0), "The quota of an extension without a configured quota should not change")
+
+    def test_check_pressure_should_not_adjust_the_cpu_quota_when_throttling_is_disabled(self):
+        configurator = CGroupConfigurator._Impl()
+        with patch.object(configurator, "enabled", return_value=True):
+            with patch.object(configurator, "using_cgroup_v2", return_value=False):
+                configurator._set_configured_cpu_quota("extension.slice", "40%")
+                with patch("azurelinuxagent.ga.cgroupconfigurator.systemd.set_unit_run_time_property") as set_property:
+                    configurator.check_pressure()
+                self.assertEqual(0, set_property.call_count)
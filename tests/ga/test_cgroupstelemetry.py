@@ -19,8 +19,8 @@ import os
 import random
 import time
 
-from azurelinuxagent.ga.cgroupcontroller import MetricsCounter
-from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
+from azurelinuxagent.ga.cgroupcontroller import MetricsCounter, MetricValue
+from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry, MetricTimeSeries
 from azurelinuxagent.common.utils import fileutil
 from azurelinuxagent.ga.cpucontroller import CpuControllerV1
 from azurelinuxagent.ga.memorycontroller import MemoryControllerV1
@@ -254,7 +254,7 @@ class TestCGroupsTelemetry(AgentTestCase):
     @patch("azurelinuxagent.common.logger.periodic_warn")
     def test_telemetry_polling_to_generate_transient_logs_ioerror_permission_denied(self, patch_periodic_warn):
         num_extensions = 1
-        num_controllers = 1
+        num_controllers = 2
         is_active_check_per_controller = 2
         self._track_new_extension_cgroup_controllers(num_extensions)
 
@@ -267,7 +267,7 @@ class TestCGroupsTelemetry(AgentTestCase):
         with patch("azurelinuxagent.common.utils.fileutil.read_file", side_effect=io_error_3):
             poll_count = 1
             expected_count_per_call = num_controllers + is_active_check_per_controller
-            # get_cpu_usage cpu controller would generate a log statement, and each cgroup controller would invoke a
+            # the metrics of each cgroup controller would generate a log statement, and each cgroup controller would invoke a
             # is active check raising an exception
 
             for data_count in range(poll_count, 10):  # pylint: disable=unused-variable
@@ -282,7 +282,7 @@ class TestCGroupsTelemetry(AgentTestCase):
         # Trying to invoke IndexError during the getParameter call
         with patch("azurelinuxagent.common.utils.fileutil.read_file", return_value=''):
             with patch("azurelinuxagent.common.logger.periodic_warn") as patch_periodic_warn:
-                expected_call_count = 1  # 1 periodic warning for cpu
+                expected_call_count = 2  # 1 periodic warning for cpu and 1 for memory
                 for data_count in range(1, 10):  # pylint: disable=unused-variable
                     CGroupsTelemetry.poll_all_tracked()
                     self.assertEqual(expected_call_count, patch_periodic_warn.call_count)
@@ -337,6 +337,66 @@ class TestCGroupsTelemetry(AgentTestCase):
         self.assertFalse(CGroupsTelemetry.is_tracked("not_present_cpu_dummy_path"))
         self.assertFalse(CGroupsTelemetry.is_tracked("not_present_memory_dummy_path"))
 
+    def test_metric_time_series_should_summarize_the_samples(self):
+        time_series = MetricTimeSeries(100)
+        self.assertIsNone(time_series.summarize(), "An empty time series should not have a summary")
+
+        for value in range(1, 101):
+            time_series.add(value)
+        self.assertEqual((1, 100, 50.5, 95), time_series.summarize())
+        self.assertEqual(0, len(time_series), "The samples should have been cleared")
+
+        time_series.add(7)
+        self.assertEqual((7, 7, 7, 7), time_series.summarize())
+
+    def test_metric_time_series_should_keep_only_the_most_recent_samples(self):
+        time_series = MetricTimeSeries(4)
+        for value in range(1, 11):
+            time_series.add(value)
+
+        self.assertEqual(4, len(time_series))
+        self.assertEqual((7, 10, 8.5, 10), time_series.summarize())
+
+    def test_summarize_time_series_should_report_the_summary_of_the_samples_of_each_metric(self):
+        self._track_new_extension_cgroup_controllers(2)
+
+        with patch("azurelinuxagent.ga.cpucontroller.CpuControllerV1.get_sampled_metrics") as get_cpu_samples:
+            with patch("azurelinuxagent.ga.memorycontroller.MemoryControllerV1.get_sampled_metrics", return_value=[]):
+                for value in [10, 30, 20]:
+                    get_cpu_samples.side_effect = lambda v=value: [MetricValue("CPU", MetricsCounter.PROCESSOR_PERCENT_TIME, "ext", v)]
+                    CGroupsTelemetry.sample_all_tracked()
+
+        summaries = CGroupsTelemetry.summarize_time_series()
+
+        self.assertEqual(2 * 4, len(summaries), "Expected the min, max, avg and p95 for each CPU controller")
+        self.assertEqual(
+            [("% Processor Time - Min", 10), ("% Processor Time - Max", 30), ("% Processor Time - Avg", 20), ("% Processor Time - P95", 30)],
+            [(m.counter, m.value) for m in summaries[:4]])
+        self.assertEqual([], CGroupsTelemetry.summarize_time_series(), "The samples should have been cleared after the summary")
+
+    def test_sample_all_tracked_should_limit_the_number_of_time_series(self):
+        self._track_new_extension_cgroup_controllers(3)
+
+        with patch.object(CGroupsTelemetry, "_MAX_TIME_SERIES", 2):
+            with patch("azurelinuxagent.ga.cpucontroller.CpuControllerV1.get_sampled_metrics", return_value=[MetricValue("CPU", MetricsCounter.PROCESSOR_PERCENT_TIME, "ext", 1)]):
+                with patch("azurelinuxagent.ga.memorycontroller.MemoryControllerV1.get_sampled_metrics", return_value=[]):
+                    with patch("azurelinuxagent.common.logger.periodic_warn") as periodic_warn:
+                        CGroupsTelemetry.sample_all_tracked()
+
+        self.assertEqual(2, CGroupsTelemetry._get_time_series_count())
+        self.assertEqual(1, periodic_warn.call_count, "Expected a warning about the metric that was not sampled")
+
+    def test_summarize_time_series_should_remove_the_time_series_of_controllers_that_are_not_tracked(self):
+        controller = CpuControllerV1("ext", "/test/path")
+        CGroupsTelemetry._tracked[controller.path] = controller
+
+        with patch.object(controller, "get_sampled_metrics", return_value=[MetricValue("CPU", MetricsCounter.PROCESSOR_PERCENT_TIME, "ext", 1)]):
+            CGroupsTelemetry.sample_all_tracked()
+        CGroupsTelemetry.stop_tracking(controller)
+
+        self.assertEqual(4, len(CGroupsTelemetry.summarize_time_series()), "The samples taken before the controller stopped being tracked should be reported")
+        self.assertEqual({}, CGroupsTelemetry._time_series)
+
     @patch("azurelinuxagent.ga.memorycontroller.MemoryControllerV1.get_memory_usage", side_effect=raise_ioerror)
     def test_process_cgroup_metric_with_no_memory_cgroup_mounted(self, *args):  # pylint: disable=unused-argument
         num_extensions = 5
@@ -251,7 +251,7 @@ class TestCollectLogs(AgentTestCase, HttpRequestPredicates):
                 def http_put_handler(url, content, **__):
                     if self.is_host_plugin_put_logs_request(url):
                         http_put_handler.counter += 1
-                        http_put_handler.archive = content
+                        http_put_handler.archive = content.read()
                         return MockHttpResponse(status=200)
                     return None
 
@@ -267,6 +267,22 @@ class TestCollectLogs(AgentTestCase, HttpRequestPredicates):
                                  "The archive file should have {0} bytes, not {1}".format(archive_size,
                                                                                           len(http_put_handler.archive)))
 
+    def test_it_commits_the_incremental_state_only_when_the_upload_succeeds(self):
+        for status, expected_commits in [(200, 1), (500, 0)]:
+            with _create_collect_logs_handler() as collect_logs_handler:
+                with patch("azurelinuxagent.ga.collect_logs.shellutil.run_command", side_effect=lambda *_, **__: self._create_dummy_archive()):
+                    with patch("azurelinuxagent.ga.collect_logs.logcollector.commit_incremental_state") as commit_incremental_state:
+                        def http_put_handler(url, *_, **__):
+                            if self.is_host_plugin_put_logs_request(url):
+                                return MockHttpResponse(status=status)  # pylint: disable=cell-var-from-loop
+                            return None
+
+                        collect_logs_handler.get_mock_wire_protocol().set_http_handlers(http_put_handler=http_put_handler)
+                        collect_logs_handler.run_and_wait()
+
+                        self.assertEqual(expected_commits, commit_incremental_state.call_count,
+                                         "Unexpected number of commits when the upload returns {0}".format(status))
+
     def test_it_does_not_upload_logs_when_collection_is_unsuccessful(self):
         with _create_collect_logs_handler() as collect_logs_handler:
             with patch("azurelinuxagent.ga.collect_logs.shellutil.run_command",
@@ -390,8 +406,10 @@ class TestLogCollectorMonitorHandler(AgentTestCase):
                               MetricValue("Memory", MetricsCounter.SWAP_MEM_USAGE, "service", 0)]
             with patch("azurelinuxagent.ga.collect_logs.LogCollectorMonitorHandler._poll_resource_usage", return_value=cache_exceeded):
                 with patch("os._exit") as mock_exit:
-                    log_collector_monitor_handler.run_and_wait()
+                    with patch("azurelinuxagent.ga.collect_logs.logger.flush", side_effect=lambda: self.assertEqual(0, mock_exit.call_count, "The log should be flushed before exiting")) as mock_flush:
+                        log_collector_monitor_handler.run_and_wait()
                     self.assertEqual(mock_exit.call_count, 1)
+                    self.assertEqual(mock_flush.call_count, 1, "The log should have been flushed")
 
         with _create_log_collector_monitor_handler() as log_collector_monitor_handler:
             anon_exceeded = [MetricValue("Process", MetricsCounter.PROCESSOR_PERCENT_TIME, "service", 4.5),
@@ -250,6 +250,32 @@ class TestCpuControllerV2(AgentTestCase):
         system_usage_delta = 779218.68 - 777350.57
         self.assertEqual(cpu_usage, round(100.0 * cgroup_usage_delta/system_usage_delta, 3))
 
+    def test_get_sampled_metrics_v2_should_not_change_the_cpu_usage(self):
+        controller = CpuControllerV2("test", "/sys/fs/cgroup/cpu/system.slice/test")
+
+        def set_time(t):
+            TestCpuControllerV2.mock_read_file_map = {
+                "/proc/uptime": os.path.join(data_dir, "cgroups", "v2", "proc_uptime_{0}".format(t)),
+                os.path.join(controller.path, "cpu.stat"): os.path.join(data_dir, "cgroups", "v2", "cpu.stat_{0}".format(t))
+            }
+
+        set_time("t0")
+        controller.initialize_cpu_usage()
+        self.assertEqual([], controller.get_sampled_metrics(), "The first sample should not produce any metrics")
+
+        set_time("t1")
+        samples = controller.get_sampled_metrics()
+        self.assertEqual(1, len(samples))
+        self.assertEqual(MetricsCounter.PROCESSOR_PERCENT_TIME, samples[0].counter)
+        self.assertEqual(round(100.0 * ((819624087 / 1E6) - (817045397 / 1E6)) / (777350.57 - 776968.02), 3), samples[0].value)
+
+        set_time("t2")
+        cpu_usage = controller.get_cpu_usage()
+
+        cgroup_usage_delta = (822052295 / 1E6) - (817045397 / 1E6)
+        system_usage_delta = 779218.68 - 776968.02
+        self.assertEqual(cpu_usage, round(100.0 * cgroup_usage_delta/system_usage_delta, 3), "The CPU usage should be computed since initialize_cpu_usage(), not since the last sample")
+
     def test_initialize_cpu_usage_v2_should_set_the_cgroup_usage_to_0_when_the_cgroup_does_not_exist(self):
         controller = CpuControllerV2("test", "/sys/fs/cgroup/cpu/system.slice/test")
 
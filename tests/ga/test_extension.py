@@ -24,6 +24,7 @@ import re
 import shutil
 import subprocess
 import tempfile
+import threading
 import time
 import unittest
 
@@ -2525,6 +2526,107 @@ class TestExtensionSequencing(AgentTestCase):
         extensions_to_be_failed = ["G"]
         self._run_test(extensions_to_be_failed, expected_sequence, exthandlers_handler)
 
+    def _run_parallel_test(self, extensions_to_be_failed, exthandlers_handler, max_parallelism):
+        """
+        Same as _run_test, but processes the extensions on a worker pool and returns the extensions that were handled,
+        grouped by the number of extensions that were being handled concurrently when each of them started.
+        """
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+        started = threading.Event()
+
+        def handle_ext_handler(ext_handler_i, *_):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+                if running[0] >= min(max_parallelism, 2):
+                    started.set()
+            # give the other workers a chance to pick up their extensions
+            started.wait(1)
+            with lock:
+                running[0] -= 1
+            return ext_handler_i.ext_handler.name not in extensions_to_be_failed
+
+        def get_ext_handling_status(ext):
+            return "error" if ext.name in extensions_to_be_failed else "success"
+
+        with patch.object(exthandlers_handler, "handle_ext_handler", side_effect=handle_ext_handler) as mock_handle_ext_handler:
+            with patch("azurelinuxagent.common.conf.get_extensions_max_parallelism", return_value=max_parallelism):
+                with patch.object(ExtHandlerInstance, "get_ext_handling_status", side_effect=get_ext_handling_status):
+                    with patch.object(ExtHandlerInstance, "get_handler_status", ExtHandlerStatus):
+                        with patch('azurelinuxagent.ga.exthandlers._DEFAULT_EXT_TIMEOUT_MINUTES', 0.01):
+                            exthandlers_handler.run()
+
+        return [a[0].ext_handler.name for a, _ in mock_handle_ext_handler.call_args_list], max_running[0]
+
+    def test_handle_ext_handlers_should_process_extensions_of_the_same_dependency_level_in_parallel(self, *args):
+        exthandlers_handler = self._create_mock(*args)  # pylint: disable=no-value-for-parameter
+
+        self._set_dependency_levels([("A", 3), ("B", 2), ("C", 2), ("D", 1), ("E", 1), ("F", 1), ("G", 1)],
+                                    exthandlers_handler)
+
+        handled, max_running = self._run_parallel_test([], exthandlers_handler, max_parallelism=3)
+
+        self.assertEqual(["D", "E", "F", "G"], sorted(handled[0:4]), "Level 1 should be handled first")
+        self.assertEqual(["B", "C"], sorted(handled[4:6]), "Level 2 should be handled after level 1")
+        self.assertEqual(["A"], handled[6:], "Level 3 should be handled last")
+        self.assertTrue(1 < max_running <= 3, "Expected between 2 and 3 concurrent extensions; got {0}".format(max_running))
+
+    def test_handle_ext_handlers_should_skip_dependent_levels_when_a_parallel_extension_fails(self, *args):
+        exthandlers_handler = self._create_mock(*args)  # pylint: disable=no-value-for-parameter
+
+        self._set_dependency_levels([("A", 3), ("B", 2), ("C", 2), ("D", 1), ("E", 1), ("F", 1), ("G", 1)],
+                                    exthandlers_handler)
+
+        # Extensions in the same level do not depend on each other, so all of them are processed, but the
+        # following levels are skipped
+        handled, _ = self._run_parallel_test(["E"], exthandlers_handler, max_parallelism=4)
+        self.assertEqual(["D", "E", "F", "G"], sorted(handled))
+
+        handled, _ = self._run_parallel_test(["C"], exthandlers_handler, max_parallelism=4)
+        self.assertEqual(["D", "E", "F", "G"], sorted(handled[0:4]))
+        self.assertEqual(["B", "C"], sorted(handled[4:]))
+
+    def test_handle_ext_handlers_should_use_a_protocol_per_worker_thread(self, *args):
+        exthandlers_handler = self._create_mock(*args)  # pylint: disable=no-value-for-parameter
+
+        self._set_dependency_levels([("A", 1), ("B", 1), ("C", 1), ("D", 1)], exthandlers_handler)
+
+        lock = threading.Lock()
+        protocols = {}
+        goal_states = []
+
+        def handle_ext_handler(ext_handler_i, *_):
+            with lock:
+                protocols.setdefault(threading.current_thread().name, set()).add(id(ext_handler_i.protocol))
+                goal_states.append(ext_handler_i._get_goal_state())
+            time.sleep(0.1)  # give the other workers a chance to pick up their extensions
+            return True
+
+        with patch.object(exthandlers_handler, "handle_ext_handler", side_effect=handle_ext_handler):
+            with patch("azurelinuxagent.common.conf.get_extensions_max_parallelism", return_value=2):
+                with patch.object(ExtHandlerInstance, "get_ext_handling_status", return_value="success"):
+                    with patch.object(ExtHandlerInstance, "get_handler_status", ExtHandlerStatus):
+                        exthandlers_handler.run()
+
+        self.assertEqual(2, len(protocols), "Expected 2 worker threads; got {0}".format(protocols.keys()))
+        worker_protocols = [p for thread_protocols in protocols.values() for p in thread_protocols]
+        self.assertEqual(2, len(worker_protocols), "Each worker should have used a single protocol: {0}".format(protocols))
+        self.assertEqual(2, len(set(worker_protocols)), "The workers should not share their protocol")
+        self.assertNotIn(id(exthandlers_handler.protocol), worker_protocols, "The workers should not use the protocol of the main thread")
+        self.assertTrue(all(gs is exthandlers_handler.protocol.get_goal_state() for gs in goal_states), "The workers should process the goal state of the main thread")
+
+    def test_handle_ext_handlers_should_process_extensions_sequentially_by_default(self, *args):
+        exthandlers_handler = self._create_mock(*args)  # pylint: disable=no-value-for-parameter
+
+        self._set_dependency_levels([("A", 1), ("B", 1), ("C", 1), ("D", 1)], exthandlers_handler)
+
+        handled, max_running = self._run_parallel_test([], exthandlers_handler, max_parallelism=conf.get_extensions_max_parallelism())
+
+        self.assertEqual(["A", "B", "C", "D"], handled)
+        self.assertEqual(1, max_running, "Extensions should not be processed concurrently")
+
 
 class TestInVMArtifactsProfile(AgentTestCase):
     def test_it_should_parse_boolean_values(self):
@@ -22,7 +22,7 @@ import time
 import uuid
 
 from azurelinuxagent.common.agent_supported_feature import AgentSupportedFeature
-from azurelinuxagent.common.event import AGENT_EVENT_FILE_EXTENSION, WALAEventOperation
+from azurelinuxagent.common.event import AGENT_EVENT_FILE_EXTENSION, AGENT_EVENT_SPOOL_EXTENSION, WALAEventOperation
 from azurelinuxagent.common.exception import ExtensionError, ExtensionErrorCodes
 from azurelinuxagent.common.protocol.restapi import ExtensionStatus, ExtensionSettings, Extension
 from azurelinuxagent.common.protocol.util import ProtocolUtil
@@ -392,7 +392,7 @@ sys.stderr.write("{1}")
 
         def list_directory():
             base_dir = self.ext_handler_instance.get_base_dir()
-            return [i for i in os.listdir(base_dir) if not i.endswith(AGENT_EVENT_FILE_EXTENSION)] # ignore telemetry files
+            return [i for i in os.listdir(base_dir) if not i.endswith((AGENT_EVENT_FILE_EXTENSION, AGENT_EVENT_SPOOL_EXTENSION))] # ignore telemetry files
 
         files_before = list_directory()
 
@@ -431,7 +431,8 @@ with open("{2}", "w") as file:
 
 '''.format(stdout, stderr, signal_file))
 
-        # mock time.sleep to wait for the signal file (launch_command implements the time out using polling and sleep)
+        # mock time.sleep to wait for the signal file (launch_command implements the time out using polling and sleep when pidfds
+        # are not available, so we disable them)
         def sleep(seconds):
             if not os.path.exists(signal_file):
                 sleep.original_sleep(seconds)
@@ -443,8 +444,9 @@ with open("{2}", "w") as file:
 
         with patch("time.sleep", side_effect=sleep, autospec=True) as mock_sleep:  # pylint: disable=redefined-outer-name
 
-            with self.assertRaises(ExtensionError) as context_manager:
-                self.ext_handler_instance.launch_command(command, timeout=timeout, extension_error_code=extension_error_code)
+            with patch("azurelinuxagent.common.utils.shellutil._open_pidfd", return_value=None):
+                with self.assertRaises(ExtensionError) as context_manager:
+                    self.ext_handler_instance.launch_command(command, timeout=timeout, extension_error_code=extension_error_code)
 
             # the command name and its output should be part of the message
             message = str(context_manager.exception)
@@ -455,7 +457,7 @@ with open("{2}", "w") as file:
             self.assertEqual(context_manager.exception.code, extension_error_code)
 
             # the timeout period should have elapsed
-            self.assertGreaterEqual(mock_sleep.call_count, timeout)
+            self.assertGreaterEqual(sum(args[0] for args, _ in mock_sleep.call_args_list), timeout - 0.001)
 
             # The command should have been terminated.
             # The /proc file system may still include the process when we do this check so we try a few times after a short delay; note that we
@@ -806,3 +808,43 @@ print("Found Feature %s: %s" % ("{1}", found))
             self.assertIn(
                 "[stdout]\n{0} not found in environment".format(ExtCommandEnvVariable.ExtensionSupportedFeatures),
                 output, "Environment variable should not be found")
+
+
+class LaunchCommandWithOutputStreamingTestCase(LaunchCommandTestCase):
+    """
+    Runs the test cases for launch_command capturing the output of the commands through pipes
+    """
+    def setUp(self):
+        LaunchCommandTestCase.setUp(self)
+        self.mock_output_streaming = patch("azurelinuxagent.ga.exthandlers.conf.get_enable_extension_output_streaming", return_value=True)
+        self.mock_output_streaming.start()
+
+    def tearDown(self):
+        self.mock_output_streaming.stop()
+        LaunchCommandTestCase.tearDown(self)
+
+    def test_it_should_report_the_tail_of_large_outputs_and_stream_the_full_output_to_the_log(self):
+        os.makedirs(self.log_dir)
+
+        command = "produce_long_output.py"
+        self.create_script(os.path.join(self.ext_handler_instance.get_base_dir(), command), '''
+import sys
+
+sys.stdout.write("HEAD" + "O" * 5 * 1024 * 1024 + "STDOUT-TAIL")
+sys.stderr.write("HEAD" + "E" * 1024 * 1024 + "STDERR-TAIL")
+''')
+
+        with patch('azurelinuxagent.ga.extensionprocessutil.format_stdout_stderr', side_effect=format_stdout_stderr) as mock_format:
+            output = self.ext_handler_instance.launch_command(command)
+
+        args, _ = mock_format.call_args
+        for captured in args:
+            self.assertLessEqual(len(captured), TELEMETRY_MESSAGE_MAX_LEN, "The captured output should have been bounded")
+        self.assertTrue(output.rstrip().endswith("STDERR-TAIL"), "The output should include the tail of stderr: {0}".format(output[-100:]))
+        self.assertIn("STDOUT-TAIL", output)
+        self.assertNotIn("HEAD", output)
+
+        with open(os.path.join(self.log_dir, "CommandExecution_stdout.log"), "rb") as log:
+            self.assertEqual(4 + 5 * 1024 * 1024 + 11, len(log.read()))
+        with open(os.path.join(self.log_dir, "CommandExecution_stderr.log"), "rb") as log:
+            self.assertEqual(4 + 1024 * 1024 + 11, len(log.read()))
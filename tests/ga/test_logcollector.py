@@ -18,11 +18,13 @@
 #
 
 import os
+import re
 import shutil
 import tempfile
 import zipfile
 
-from azurelinuxagent.ga.logcollector import LogCollector
+from azurelinuxagent.ga.logcollector import LogCollector, commit_incremental_state
+from azurelinuxagent.common.future import ustr
 from azurelinuxagent.common.utils import fileutil
 from azurelinuxagent.common.utils.fileutil import rm_dirs, mkdir, rm_files
 from tests.lib.tools import AgentTestCase, is_python_version_26, patch, skip_if_predicate_true, data_dir
@@ -71,6 +73,16 @@ class TestLogCollector(AgentTestCase):
                                                  cls.compressed_archive_path)
         cls.mock_compressed_archive_path.start()
 
+        cls.incremental_state_path = os.path.join(cls.log_collector_dir, "incremental_state.json")
+        cls.mock_incremental_state_path = patch("azurelinuxagent.ga.logcollector.INCREMENTAL_STATE_PATH",
+                                                cls.incremental_state_path)
+        cls.mock_incremental_state_path.start()
+
+        cls.pending_incremental_state_path = os.path.join(cls.log_collector_dir, "incremental_state.pending.json")
+        cls.mock_pending_incremental_state_path = patch("azurelinuxagent.ga.logcollector.PENDING_INCREMENTAL_STATE_PATH",
+                                                        cls.pending_incremental_state_path)
+        cls.mock_pending_incremental_state_path.start()
+
     @classmethod
     def _mock_cgroup(cls):
         # CPU Cgroups compute usage based on /proc/stat and /sys/fs/cgroup/.../cpuacct.stat; use mock data for those
@@ -94,6 +106,8 @@ class TestLogCollector(AgentTestCase):
         cls.mock_truncated_files_dir.stop()
         cls.mock_output_results_file_path.stop()
         cls.mock_compressed_archive_path.stop()
+        cls.mock_incremental_state_path.stop()
+        cls.mock_pending_incremental_state_path.stop()
         cls._mock_read_cpu_cgroup_file.stop()
 
         shutil.rmtree(cls.tmp_dir)
@@ -106,7 +120,7 @@ class TestLogCollector(AgentTestCase):
 
     def tearDown(self):
         rm_dirs(self.root_collect_dir)
-        rm_files(self.compressed_archive_path)
+        rm_files(self.compressed_archive_path, self.incremental_state_path, self.pending_incremental_state_path)
         AgentTestCase.tearDown(self)
 
     @classmethod
@@ -508,5 +522,134 @@ copy,{0}
         no_files = self._get_number_of_files_in_archive()
         self.assertEqual(2, no_files, "Expected 2 files in archive, found {0}!".format(no_files))
 
-        truncated_files = os.listdir(self.truncated_files_dir)
-        self.assertEqual(0, len(truncated_files), "Uncollected truncated file waagent.log.1 should have been deleted!")
+        self.assertFalse(os.path.exists(self.truncated_files_dir), "Large files should be archived without making truncated copies")
+
+    def test_log_collector_should_archive_the_tail_of_large_text_files(self):
+        large_file = os.path.join(self.root_collect_dir, "waagent.log.1")
+        with open(large_file, "wb") as f:
+            for i in range(100000):
+                f.write("line {0}\n".format(i).encode("utf-8"))
+        with open(large_file, "rb") as f:
+            expected_contents = f.read()[-SMALL_FILE_SIZE:]
+
+        with patch("azurelinuxagent.ga.logcollector._FILE_SIZE_LIMIT", SMALL_FILE_SIZE):
+            log_collector = LogCollector()
+            archive, _ = log_collector.collect_logs_and_get_archive()
+
+        self._assert_archive_created(archive)
+        with zipfile.ZipFile(self.compressed_archive_path, "r") as archive:
+            self.assertIsNone(archive.testzip(), "The archive has corrupt members")
+            self.assertEqual(expected_contents, archive.read(self._truncated_path(large_file)))
+            self.assertEqual(SMALL_FILE_SIZE, len(archive.read(os.path.join(self.root_collect_dir, "waagent.log").lstrip(os.path.sep))))
+
+    def test_log_collector_should_use_the_configured_compression_level(self):
+        def get_compress_types():
+            with zipfile.ZipFile(self.compressed_archive_path, "r") as archive:
+                self.assertIsNone(archive.testzip(), "The archive has corrupt members")
+                return dict((info.filename, info.compress_type) for info in archive.infolist())
+
+        text_file = os.path.join(self.root_collect_dir, "waagent.log").lstrip(os.path.sep)
+        binary_file = os.path.join(self.root_collect_dir, "waagent.log.2.gz").lstrip(os.path.sep)
+
+        LogCollector().collect_logs_and_get_archive()
+        compress_types = get_compress_types()
+        self.assertEqual(zipfile.ZIP_DEFLATED, compress_types[text_file], "Text files should be compressed")
+        self.assertEqual(zipfile.ZIP_STORED, compress_types[binary_file], "Compressed files should be stored")
+        self.assertEqual(zipfile.ZIP_DEFLATED, compress_types["results.txt"], "The results file should be compressed")
+
+        with patch("azurelinuxagent.ga.logcollector.get_log_collector_compression_level", return_value=0):
+            LogCollector().collect_logs_and_get_archive()
+        compress_types = get_compress_types()
+        self.assertTrue(all(t == zipfile.ZIP_STORED for t in compress_types.values()), "No files should be compressed: {0}".format(compress_types))
+
+    def test_log_collector_should_record_the_compressed_archive_size_in_the_results_file(self):
+        LogCollector().collect_logs_and_get_archive()
+
+        with zipfile.ZipFile(self.compressed_archive_path, "r") as archive:
+            results = archive.read("results.txt").decode("utf-8")
+            results_offset = archive.getinfo("results.txt").header_offset
+        sizes = set(re.findall(r"Compressed archive size is (\d+) b", results))
+        self.assertEqual(set([ustr(results_offset)]), sizes, "The results file should record the size of the members collected before it")
+
+    def _get_archive_contents(self):
+        with zipfile.ZipFile(self.compressed_archive_path, "r") as archive:
+            self.assertIsNone(archive.testzip(), "The archive has corrupt members")
+            return dict((name, archive.read(name)) for name in archive.namelist() if name != "results.txt")
+
+    def test_incremental_log_collection_should_collect_only_new_data(self):
+        waagent_log = os.path.join(self.root_collect_dir, "waagent.log")
+
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        self.assertEqual(6, self._get_number_of_files_in_archive(), "The first collection should be a full collection")
+        commit_incremental_state()
+
+        with open(waagent_log, "ab") as f:
+            f.write(b"new data")
+        _, uncompressed_file_size = LogCollector(is_incremental=True).collect_logs_and_get_archive()
+
+        self.assertEqual({waagent_log.lstrip(os.path.sep): b"new data"}, self._get_archive_contents())
+        self.assertEqual(len(b"new data"), uncompressed_file_size)
+        with zipfile.ZipFile(self.compressed_archive_path, "r") as archive:
+            results = archive.read("results.txt").decode("utf-8")
+        self.assertIn("Incremental member {0}".format(waagent_log.lstrip(os.path.sep)), results, "The incremental member should have been marked in results.txt")
+        commit_incremental_state()
+
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        self.assertEqual({}, self._get_archive_contents(), "No files changed, the archive should be empty")
+
+    def test_incremental_log_collection_should_collect_the_same_data_again_if_the_archive_was_not_uploaded(self):
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        commit_incremental_state()
+
+        with open(os.path.join(self.root_collect_dir, "waagent.log"), "ab") as f:
+            f.write(b"new data")
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        self.assertEqual(1, self._get_number_of_files_in_archive())
+        # no commit, e.g. the upload failed
+
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        self.assertEqual(1, self._get_number_of_files_in_archive(), "The new data should have been collected again")
+
+    def test_incremental_log_collection_should_not_collect_rotated_files_again(self):
+        waagent_log = os.path.join(self.root_collect_dir, "waagent.log")
+        rotated_log = os.path.join(self.root_collect_dir, "waagent.log.4")
+
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        commit_incremental_state()
+
+        os.rename(waagent_log, rotated_log)
+        with open(waagent_log, "wb") as f:
+            f.write(b"new log")
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+
+        self.assertEqual({waagent_log.lstrip(os.path.sep): b"new log"}, self._get_archive_contents())
+
+    def test_incremental_log_collection_should_collect_in_full_files_replaced_using_the_same_inode(self):
+        waagent_log = os.path.join(self.root_collect_dir, "waagent.log")
+
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        commit_incremental_state()
+
+        # rewrite the file in place (so it keeps its inode) with more data, and with an older modification time
+        mtime = os.path.getmtime(waagent_log)
+        with open(waagent_log, "rb") as f:
+            contents = b"replaced " + f.read()
+        with open(waagent_log, "wb") as f:
+            f.write(contents)
+        os.utime(waagent_log, (mtime - 3600, mtime - 3600))
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+
+        self.assertEqual({waagent_log.lstrip(os.path.sep): contents}, self._get_archive_contents())
+
+    def test_incremental_log_collection_should_periodically_do_a_full_collection(self):
+        LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        commit_incremental_state()
+
+        with patch("azurelinuxagent.ga.logcollector.get_log_collector_full_collection_period", return_value=0):
+            LogCollector(is_incremental=True).collect_logs_and_get_archive()
+        self.assertEqual(6, self._get_number_of_files_in_archive(), "Expected a full collection")
+
+        # non-incremental collections always collect all the files
+        commit_incremental_state()
+        LogCollector().collect_logs_and_get_archive()
+        self.assertEqual(6, self._get_number_of_files_in_archive(), "Expected a full collection in non-incremental mode")
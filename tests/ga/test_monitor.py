@@ -21,7 +21,7 @@ import random
 import string
 
 from azurelinuxagent.common import event, logger
-from azurelinuxagent.ga.cgroupcontroller import MetricValue, _REPORT_EVERY_HOUR
+from azurelinuxagent.ga.cgroupcontroller import MetricValue, MetricsCategory, MetricsCounter, _REPORT_EVERY_HOUR
 from azurelinuxagent.ga.cgroupstelemetry import CGroupsTelemetry
 from azurelinuxagent.common.event import EVENTS_DIRECTORY
 from azurelinuxagent.common.protocol.healthservice import HealthService
@@ -29,9 +29,12 @@ from azurelinuxagent.common.protocol.util import ProtocolUtil
 from azurelinuxagent.common.protocol.wire import WireProtocol
 from azurelinuxagent.ga.cpucontroller import CpuControllerV1
 from azurelinuxagent.ga.memorycontroller import MemoryControllerV1
-from azurelinuxagent.ga.monitor import get_monitor_handler, PeriodicOperation, SendImdsHeartbeat, \
+from azurelinuxagent.ga.monitor import MonitorHandler, PeriodicOperation, SendImdsHeartbeat, \
     ResetPeriodicLogMessages, SendHostPluginHeartbeat, PollResourceUsage, \
-    ReportNetworkErrors, ReportNetworkConfigurationChanges, PollSystemWideResourceUsage
+    ReportNetworkErrors, ReportNetworkConfigurationChanges, PollSystemWideResourceUsage, SampleResourceUsage, \
+    PollCgroupPressure
+from azurelinuxagent.ga.periodic_operation import PeriodicOperationScheduler
+from tests.lib.miscellaneous_tools import wait_for
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
 from tests.lib.http_request_predicates import HttpRequestPredicates
 from tests.lib.wire_protocol_data import DATA_FILE
@@ -61,35 +64,43 @@ class MonitorHandlerTestCase(AgentTestCase):
             invoked_operations.append(self.__class__.__name__)
 
         with _mock_wire_protocol():
-            with patch("azurelinuxagent.ga.monitor.MonitorHandler.stopped", side_effect=[False, True, False, True]):
-                with patch("time.sleep"):
-                    with patch.object(PeriodicOperation, "run", side_effect=periodic_operation_run, autospec=True):
-                        with patch("azurelinuxagent.common.conf.get_monitor_network_configuration_changes") as monitor_network_changes:
-                            for network_changes in [True, False]:
-                                monitor_network_changes.return_value = network_changes
+            with patch.object(PeriodicOperation, "run", side_effect=periodic_operation_run, autospec=True):
+                with patch("azurelinuxagent.common.conf.get_monitor_network_configuration_changes") as monitor_network_changes:
+                    for network_changes in [True, False]:
+                        monitor_network_changes.return_value = network_changes
 
-                                invoked_operations = []
+                        invoked_operations = []
 
-                                monitor_handler = get_monitor_handler()
-                                monitor_handler.run()
-                                monitor_handler.join()
+                        expected_operations = [
+                            PollResourceUsage.__name__,
+                            PollCgroupPressure.__name__,
+                            PollSystemWideResourceUsage.__name__,
+                            ReportNetworkErrors.__name__,
+                            ResetPeriodicLogMessages.__name__,
+                            SampleResourceUsage.__name__,
+                            SendHostPluginHeartbeat.__name__,
+                            SendImdsHeartbeat.__name__,
+                        ]
 
-                                expected_operations = [
-                                    PollResourceUsage.__name__,
-                                    PollSystemWideResourceUsage.__name__,
-                                    ReportNetworkErrors.__name__,
-                                    ResetPeriodicLogMessages.__name__,
-                                    SendHostPluginHeartbeat.__name__,
-                                    SendImdsHeartbeat.__name__,
-                                ]
+                        if network_changes:
+                            expected_operations.append(ReportNetworkConfigurationChanges.__name__)
 
-                                if network_changes:
-                                    expected_operations.append(ReportNetworkConfigurationChanges.__name__)
+                        scheduler = PeriodicOperationScheduler()
+                        monitor_handler = MonitorHandler(scheduler)
+                        try:
+                            monitor_handler.run()
+                            self.assertTrue(monitor_handler.is_alive(), "The monitor handler should be running")
+                            wait_for(lambda invoked=invoked_operations, expected=expected_operations: len(invoked) >= len(expected))
+                        finally:
+                            monitor_handler.stop()
+                            scheduler.stop()
 
-                                invoked_operations.sort()
-                                expected_operations.sort()
+                        self.assertFalse(monitor_handler.is_alive(), "The monitor handler should not be running")
 
-                                self.assertEqual(invoked_operations, expected_operations, "The monitor thread did not invoke the expected operations")
+                        invoked_operations.sort()
+                        expected_operations.sort()
+
+                        self.assertEqual(invoked_operations, expected_operations, "The monitor thread did not invoke the expected operations")
 
 
 class SendHostPluginHeartbeatOperationTestCase(AgentTestCase, HttpRequestPredicates):
@@ -199,7 +210,7 @@ class TestExtensionMetricsDataTelemetry(AgentTestCase):
         CGroupsTelemetry.reset()
         self.get_protocol.stop()
 
-    @patch('azurelinuxagent.common.event.EventLogger.add_metric')
+    @patch('azurelinuxagent.common.event.EventLogger.add_metrics')
     @patch("azurelinuxagent.ga.cgroupstelemetry.CGroupsTelemetry.poll_all_tracked")
     def test_send_extension_metrics_telemetry(self, patch_poll_all_tracked,  # pylint: disable=unused-argument
                                               patch_add_metric, *args):
@@ -211,9 +222,32 @@ class TestExtensionMetricsDataTelemetry(AgentTestCase):
 
         PollResourceUsage().run()
         self.assertEqual(1, patch_poll_all_tracked.call_count)
-        self.assertEqual(4, patch_add_metric.call_count)  # Four metrics being sent.
-
-    @patch('azurelinuxagent.common.event.EventLogger.add_metric')
+        self.assertEqual(1, patch_add_metric.call_count)  # All metrics are sent in a single batch
+        self.assertEqual(4, len(patch_add_metric.call_args[0][0]))  # Four metrics being sent.
+
+    @patch('azurelinuxagent.common.event.EventLogger.add_metrics')
+    def test_send_extension_metrics_telemetry_should_include_the_summary_of_the_samples(self, patch_add_metrics, *_):
+        controller = MemoryControllerV1("service", "/test/path")
+        CGroupsTelemetry._tracked["/test/path"] = controller
+        with patch.object(controller, "get_tracked_metrics", return_value=[MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE, "service", 300)]):
+            with patch.object(controller, "get_sampled_metrics") as get_sampled_metrics:
+                for value in [100, 500, 200]:
+                    get_sampled_metrics.return_value = [MetricValue(MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE, "service", value)]
+                    SampleResourceUsage()._operation()
+
+                PollResourceUsage().run()
+
+        self.assertEqual(1, patch_add_metrics.call_count, "All the metrics should have been reported in a single batch")
+        reported = list(patch_add_metrics.call_args[0][0])
+        self.assertEqual([
+            (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE, "service", 300.0),
+            (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE + " - Min", "service", 100.0),
+            (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE + " - Max", "service", 500.0),
+            (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE + " - Avg", "service", 266.667),
+            (MetricsCategory.MEMORY_CATEGORY, MetricsCounter.TOTAL_MEM_USAGE + " - P95", "service", 500.0)
+        ], reported)
+
+    @patch('azurelinuxagent.common.event.EventLogger.add_metrics')
     @patch("azurelinuxagent.ga.cgroupstelemetry.CGroupsTelemetry.poll_all_tracked")
     def test_send_extension_metrics_telemetry_for_empty_cgroup(self, patch_poll_all_tracked,  # pylint: disable=unused-argument
                                                                patch_add_metric, *args):
@@ -223,7 +257,7 @@ class TestExtensionMetricsDataTelemetry(AgentTestCase):
         self.assertEqual(1, patch_poll_all_tracked.call_count)
         self.assertEqual(0, patch_add_metric.call_count)
 
-    @patch('azurelinuxagent.common.event.EventLogger.add_metric')
+    @patch('azurelinuxagent.common.event.EventLogger.add_metrics')
     @patch("azurelinuxagent.ga.memorycontroller.MemoryControllerV1.get_memory_usage")
     @patch('azurelinuxagent.common.logger.Logger.periodic_warn')
     def test_send_extension_metrics_telemetry_handling_memory_cgroup_exceptions_errno2(self, patch_periodic_warn,  # pylint: disable=unused-argument
@@ -239,7 +273,7 @@ class TestExtensionMetricsDataTelemetry(AgentTestCase):
         self.assertEqual(0, patch_periodic_warn.call_count)
         self.assertEqual(0, patch_add_metric.call_count)  # No metrics should be sent.
 
-    @patch('azurelinuxagent.common.event.EventLogger.add_metric')
+    @patch('azurelinuxagent.common.event.EventLogger.add_metrics')
     @patch("azurelinuxagent.ga.cpucontroller.CpuControllerV1.get_cpu_usage")
     @patch('azurelinuxagent.common.logger.Logger.periodic_warn')
     def test_send_extension_metrics_telemetry_handling_cpu_cgroup_exceptions_errno2(self, patch_periodic_warn,  # pylint: disable=unused-argument
@@ -15,8 +15,12 @@
 # Requires Python 2.6+ and Openssl 1.0+
 #
 import datetime
+import threading
 import time
+from azurelinuxagent.common.singletonperthread import SingletonPerThread
 from azurelinuxagent.ga.monitor import PeriodicOperation
+from azurelinuxagent.ga.periodic_operation import PeriodicOperationScheduler
+from tests.lib.miscellaneous_tools import wait_for
 from tests.lib.tools import AgentTestCase, patch, PropertyMock
 
 
@@ -154,3 +158,120 @@ class TestPeriodicOperation(AgentTestCase):
             self.assertAlmostEqual(mock_sleep.seconds, 10, 0, "did not sleep for the expected time")
 
 
+
+
+class TestPeriodicOperationScheduler(AgentTestCase):
+    class RecordRun(PeriodicOperation):
+        def __init__(self, name, runs, period=datetime.timedelta(hours=1), blocking=False, jitter=0, wait_for_event=None, duration=0):
+            super(TestPeriodicOperationScheduler.RecordRun, self).__init__(period, blocking=blocking, jitter=jitter)
+            self._name = name
+            self._runs = runs
+            self._wait_for_event = wait_for_event
+            self._duration = duration
+
+        def _operation(self):
+            self._runs.append((self._name, threading.current_thread().name))
+            if self._wait_for_event is not None:
+                self._wait_for_event.wait(10)
+            if self._duration > 0:
+                time.sleep(self._duration)
+
+    def setUp(self):
+        AgentTestCase.setUp(self)
+        self.scheduler = PeriodicOperationScheduler()
+
+    def tearDown(self):
+        self.scheduler.stop()
+        AgentTestCase.tearDown(self)
+
+    def test_it_should_run_the_operations_of_all_groups(self):
+        runs = []
+        self.scheduler.register("Group1", lambda: [self.RecordRun("op1", runs), self.RecordRun("op2", runs, blocking=True)])
+        self.scheduler.register("Group2", lambda: [self.RecordRun("op3", runs)])
+
+        self.assertTrue(wait_for(lambda: len(runs) >= 3), "Not all the operations were executed: {0}".format(runs))
+        self.assertTrue(self.scheduler.is_registered("Group1") and self.scheduler.is_registered("Group2"), "The groups should be registered")
+        threads = dict(runs)
+        self.assertEqual(PeriodicOperationScheduler.get_thread_name(), threads["op1"], "Non-blocking operations should run on the scheduler thread")
+        self.assertEqual(PeriodicOperationScheduler.get_thread_name(), threads["op3"], "Non-blocking operations should run on the scheduler thread")
+        self.assertTrue(threads["op2"].startswith("PeriodicOperationWorker"), "Blocking operations should run on a worker thread; got {0}".format(threads["op2"]))
+
+    def test_it_should_not_run_the_operations_of_a_group_concurrently(self):
+        runs = []
+        event = threading.Event()
+        self.scheduler.register("Group1", lambda: [self.RecordRun("blocking", runs, blocking=True, wait_for_event=event), self.RecordRun("op1", runs)])
+        self.scheduler.register("Group2", lambda: [self.RecordRun("op2", runs)])
+
+        try:
+            self.assertTrue(wait_for(lambda: ("op2", PeriodicOperationScheduler.get_thread_name()) in runs), "The operations of other groups should not be blocked")
+            self.assertNotIn("op1", [name for name, _ in runs], "The operation should wait for the blocking operation of its group")
+        finally:
+            event.set()
+
+        self.assertTrue(wait_for(lambda: "op1" in [name for name, _ in runs]), "The operation should run once the blocking operation completes")
+
+    def test_it_should_create_each_group_on_its_own_thread(self):
+        class PerThreadObject(SingletonPerThread):
+            pass
+
+        objects = {}
+
+        def create_operations(name):
+            objects[name] = (PerThreadObject(), threading.current_thread().name)
+            return [self.RecordRun("op", [])]
+
+        self.scheduler.register("Group1", lambda: create_operations("Group1"))
+        self.scheduler.register("Group2", lambda: create_operations("Group2"))
+
+        self.assertTrue(wait_for(lambda: len(objects) == 2), "The operations of all groups should have been created")
+        self.assertEqual("Group1", objects["Group1"][1], "The operations should have been created on a thread named after the group")
+        self.assertEqual("Group2", objects["Group2"][1], "The operations should have been created on a thread named after the group")
+        self.assertIsNot(objects["Group1"][0], objects["Group2"][0], "Each group should have its own per-thread objects")
+
+    def test_it_should_report_groups_that_cannot_be_created_as_not_registered(self):
+        def create_operations():
+            raise Exception("Cannot create operations")
+
+        runs = []
+        with patch("azurelinuxagent.ga.periodic_operation.logger.error") as error:
+            self.scheduler.register("Group1", create_operations)
+            self.scheduler.register("Group2", lambda: [self.RecordRun("op1", runs)])
+
+            self.assertTrue(wait_for(lambda: len(runs) > 0), "The operations of other groups should be executed")
+            self.assertFalse(self.scheduler.is_registered("Group1"), "The group should not be reported as registered")
+            self.assertTrue(self.scheduler.is_registered("Group2"), "The group should be registered")
+            self.assertTrue(any("Cannot create operations" in args[2] for args, _ in error.call_args_list), "The error should have been logged")
+
+    def test_it_should_stop_running_the_operations_of_unregistered_groups(self):
+        runs = []
+        self.scheduler.register("Group1", lambda: [self.RecordRun("op1", runs, period=0, duration=0.01)])
+        self.assertTrue(wait_for(lambda: len(runs) > 1), "The operation should have run repeatedly")
+
+        self.scheduler.unregister("Group1")
+        self.assertFalse(self.scheduler.is_registered("Group1"), "The group should not be registered")
+        count = len(runs)
+        time.sleep(0.1)
+        self.assertEqual(count, len(runs), "The operation should not run after its group is unregistered")
+
+    def test_it_should_add_the_jitter_to_the_next_run(self):
+        runs = []
+        self.scheduler.register("Group1", lambda: [self.RecordRun("op1", runs, period=0, jitter=3600), self.RecordRun("op2", runs, period=0)])
+        self.assertTrue(wait_for(lambda: len([r for r in runs if r[0] == "op2"]) > 3), "The operation without jitter should have run repeatedly")
+        self.assertEqual(1, len([r for r in runs if r[0] == "op1"]), "The operation with jitter should have run only once")
+
+    def test_it_should_keep_statistics_about_the_operations(self):
+        runs = []
+        self.scheduler.register("Group1", lambda: [
+            self.RecordRun("op1", runs, period=datetime.timedelta(milliseconds=10), duration=0.05),
+            self.RecordRun("op2", runs)])
+        self.assertTrue(wait_for(lambda: len([r for r in runs if r[0] == "op1"]) >= 2), "The operation should have run repeatedly")
+        self.scheduler.stop()
+
+        statistics = dict((s.operation, s) for s in self.scheduler.get_statistics())
+        self.assertEqual(set(["op1", "op2"]), set(statistics.keys()))
+        self.assertEqual("Group1", statistics["op1"].group)
+        self.assertGreaterEqual(statistics["op1"].runs, 2)
+        self.assertEqual(statistics["op1"].runs, statistics["op1"].overruns, "All the runs of op1 take longer than its period")
+        self.assertGreaterEqual(statistics["op1"].max_time, 0.05)
+        self.assertEqual(1, statistics["op2"].runs)
+        self.assertEqual(0, statistics["op2"].overruns)
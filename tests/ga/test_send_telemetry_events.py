@@ -284,6 +284,37 @@ class TestSendTelemetryEventsHandler(AgentTestCase, HttpRequestPredicates):
 
         self._setup_and_assert_bad_request_scenarios(http_post_handler, expected_msgs)
 
+    def test_it_should_complete_events_once_they_are_processed(self):
+        def http_post_handler(url, _, **__):
+            if self.is_telemetry_request(url):
+                http_post_handler.call_count += 1
+                if http_post_handler.call_count == 1:
+                    return MockHttpResponse(restutil.httpclient.SERVICE_UNAVAILABLE)
+                return MockHttpResponse(status=200)
+            return None
+        http_post_handler.call_count = 0
+
+        completed = []
+
+        with self._create_send_telemetry_events_handler() as telemetry_handler:
+            telemetry_handler.get_mock_wire_protocol().set_http_handlers(http_post_handler=http_post_handler)
+
+            with patch("azurelinuxagent.common.event.add_event"):
+                telemetry_handler.enqueue_event(TelemetryEvent(), on_complete=lambda sent: completed.append(("first", sent)))
+                self._stop_handler(telemetry_handler, timeout=1)
+
+        self.assertEqual([("first", False)], completed, "The event should have been completed as not sent")
+
+        completed = []
+        http_post_handler.call_count = 1
+
+        with self._create_send_telemetry_events_handler() as telemetry_handler:
+            telemetry_handler.get_mock_wire_protocol().set_http_handlers(http_post_handler=http_post_handler)
+            telemetry_handler.enqueue_event(TelemetryEvent(), on_complete=lambda sent: completed.append(("second", sent)))
+            self._stop_handler(telemetry_handler, timeout=1)
+
+        self.assertEqual([("second", True)], completed, "The event should have been completed as sent")
+
     def test_send_telemetry_events_should_add_event_on_unexpected_errors(self):
 
         with self._create_send_telemetry_events_handler(timeout=0.1) as telemetry_handler:
@@ -11,6 +11,7 @@ import random
 import re
 import shutil
 import stat
+import subprocess
 import sys
 import tempfile
 import time
@@ -42,7 +43,8 @@ from azurelinuxagent.ga.exthandlers import ExtHandlersHandler, ExtHandlerInstanc
 from azurelinuxagent.ga.update import  \
     get_update_handler, ORPHAN_POLL_INTERVAL, ORPHAN_WAIT_INTERVAL, \
     CHILD_LAUNCH_RESTART_MAX, CHILD_HEALTH_INTERVAL, GOAL_STATE_PERIOD_EXTENSIONS_DISABLED, UpdateHandler, \
-    READONLY_FILE_GLOBS, ExtensionsSummary
+    READONLY_FILE_GLOBS, ExtensionsSummary, GoalStatePollScheduler, AGENT_UPGRADE_EXIT_FILE, \
+    _HANDOVER_FD_ENV_VARIABLE, _HANDOVER_PID_ENV_VARIABLE, StartupProfile
 from tests.lib.mock_firewall_command import MockIpTables, MockFirewallCmd
 from tests.lib.mock_update_handler import mock_update_handler
 from tests.lib.mock_wire_protocol import mock_wire_protocol, MockHttpResponse
@@ -647,17 +649,19 @@ class TestUpdate(UpdateTestCase):
         if mock_time is None:
             mock_time = TimeMock()
 
+        # the mock child does not have a pidfd, so run_latest polls it
         with patch('azurelinuxagent.ga.update.subprocess.Popen', return_value=mock_child) as mock_popen:
-            with patch('time.time', side_effect=mock_time.time):
-                with patch('time.sleep', side_effect=mock_time.sleep):
-                    self.update_handler.run_latest(child_args=child_args)
-                    agent_calls = [args[0] for (args, _) in mock_popen.call_args_list if
-                                   "run-exthandlers" in ''.join(args[0])]
-                    self.assertEqual(1, len(agent_calls),
-                                     "Expected a single call to the latest agent; got: {0}. All mocked calls: {1}".format(
-                                         agent_calls, mock_popen.call_args_list))
-
-                    return mock_popen.call_args
+            with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+                with patch('time.time', side_effect=mock_time.time):
+                    with patch('time.sleep', side_effect=mock_time.sleep):
+                        self.update_handler.run_latest(child_args=child_args)
+                        agent_calls = [args[0] for (args, _) in mock_popen.call_args_list if
+                                       "run-exthandlers" in ''.join(args[0])]
+                        self.assertEqual(1, len(agent_calls),
+                                         "Expected a single call to the latest agent; got: {0}. All mocked calls: {1}".format(
+                                             agent_calls, mock_popen.call_args_list))
+
+                        return mock_popen.call_args
 
     def test_run_latest(self):
         self.prepare_agents()
@@ -693,7 +697,7 @@ class TestUpdate(UpdateTestCase):
         mock_child = ChildMock(return_value=None)
         mock_time = TimeMock(time_increment=CHILD_HEALTH_INTERVAL / 3)
         self._test_run_latest(mock_child=mock_child, mock_time=mock_time)
-        self.assertEqual(2, mock_child.poll.call_count)
+        self.assertAlmostEqual(CHILD_HEALTH_INTERVAL, sum(mock_time.sleep_intervals), places=3)
         self.assertEqual(1, mock_child.wait.call_count)
 
     def test_run_latest_polling_stops_at_success(self):
@@ -711,17 +715,164 @@ class TestUpdate(UpdateTestCase):
         self.assertEqual(0, mock_child.wait.call_count)
 
     def test_run_latest_polls_frequently_if_installed_is_latest(self):
-        mock_child = ChildMock(return_value=0)  # pylint: disable=unused-variable
+        mock_child = ChildMock()
+        mock_child.poll = Mock(side_effect=[None, None, None, 0])
         mock_time = TimeMock(time_increment=CHILD_HEALTH_INTERVAL / 2)
-        self._test_run_latest(mock_time=mock_time)
-        self.assertEqual(1, mock_time.sleep_interval)
+        self._test_run_latest(mock_child=mock_child, mock_time=mock_time)
+        self.assertEqual([0.01, 0.02, 0.04], mock_time.sleep_intervals)
 
-    def test_run_latest_polls_every_second_if_installed_not_latest(self):
+    def test_run_latest_polls_frequently_if_installed_not_latest(self):
         self.prepare_agents()
 
+        mock_child = ChildMock()
+        mock_child.poll = Mock(side_effect=[None, None, None, 0])
         mock_time = TimeMock(time_increment=CHILD_HEALTH_INTERVAL / 2)
-        self._test_run_latest(mock_time=mock_time)
-        self.assertEqual(1, mock_time.sleep_interval)
+        self._test_run_latest(mock_child=mock_child, mock_time=mock_time)
+        self.assertEqual([0.01, 0.02, 0.04], mock_time.sleep_intervals)
+
+    def test_run_latest_detects_the_exit_of_the_child_immediately(self):
+        def create_child(*_, **__):
+            return original_popen([sys.executable, "-c", "import time; time.sleep(0.2)"])
+        original_popen = subprocess.Popen
+
+        with patch('azurelinuxagent.ga.update.subprocess.Popen', side_effect=create_child):
+            start_time = time.time()
+            self.update_handler.run_latest()
+            elapsed = time.time() - start_time
+
+        self.assertTrue(elapsed < 1, "The exit of the child should have been detected immediately; run_latest took {0} seconds".format(elapsed))
+        self.assertIsNone(self.update_handler.child_process)
+
+    def test_run_latest_relaunches_without_reporting_failures_when_the_child_exits_to_update_the_agent(self):
+        def create_child(*_, **__):
+            # the child writes the reason for the update before exiting (see UpdateHandler.run)
+            self.update_handler._set_agent_upgrade_exit_reason("Agent update found, exiting current process to update to the new Agent version 9.9.9.9")
+            return ChildMock(return_value=0)
+
+        with patch('azurelinuxagent.ga.update.add_event') as mock_add_event:
+            with patch('azurelinuxagent.ga.update.subprocess.Popen', side_effect=create_child):
+                with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+                    self.update_handler.run_latest()
+                    self.update_handler.run_latest()
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir, AGENT_UPGRADE_EXIT_FILE)), "The upgrade exit file should have been removed")
+        enable_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.Enable]
+        self.assertEqual([], enable_events, "The exit to update the agent should not be reported as the result of the launch")
+        restart_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.AgentUpgrade]
+        self.assertEqual(1, len(restart_events), "Expected one event for the relaunch of the agent. Events: {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(restart_events[0]["message"], r"launched \d+ ms after the previous ext-handler exited to update the agent \(Agent update found")
+
+    def test_run_latest_reports_the_restart_latency_of_the_child(self):
+        with patch('azurelinuxagent.ga.update.add_event') as mock_add_event:
+            with patch('azurelinuxagent.ga.update.subprocess.Popen', return_value=ChildMock(return_value=1)):
+                with patch('azurelinuxagent.common.utils.shellutil._open_pidfd', return_value=None):
+                    self.update_handler.run_latest()
+                    self.update_handler.run_latest()
+
+        restart_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.ExtHandlerRestart]
+        self.assertEqual(1, len(restart_events), "Expected one restart event. Events: {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(restart_events[0]["message"], r"launched \d+ ms after the previous ext-handler exited$")
+
+    def test_run_latest_launches_the_new_agent_when_the_child_requests_a_handover(self):
+        children = []
+        environments = []
+
+        def create_child(*_, **kwargs):
+            environments.append(kwargs["env"])
+            if len(children) == 0:
+                # the first child requests a handover (see UpdateHandler._request_handover) and keeps running
+                script = "import os, time; os.write(int(os.environ['{0}']), b'handover\\n'); time.sleep(60)".format(_HANDOVER_FD_ENV_VARIABLE)
+            else:
+                script = "pass"
+            children.append(original_popen([sys.executable, "-c", script], **kwargs))
+            return children[-1]
+        original_popen = subprocess.Popen
+
+        try:
+            with patch("azurelinuxagent.common.conf.get_enable_agent_handover", return_value=True):
+                with patch('azurelinuxagent.ga.update.add_event') as mock_add_event:
+                    with patch('azurelinuxagent.ga.update.subprocess.Popen', side_effect=create_child):
+                        start_time = time.time()
+                        self.update_handler.run_latest()
+                        elapsed = time.time() - start_time
+
+                        self.assertTrue(elapsed < 5, "The handover should have been detected immediately; run_latest took {0} seconds".format(elapsed))
+                        self.assertIsNone(children[0].poll(), "The previous child should still be running")
+                        self.assertEqual(children[0].pid, self.update_handler._handover_pid)
+
+                        self.update_handler.run_latest()
+        finally:
+            for child in children:
+                if child.poll() is None:
+                    child.kill()
+
+        self.assertNotIn(_HANDOVER_PID_ENV_VARIABLE, environments[0])
+        self.assertEqual(ustr(children[0].pid), environments[1].get(_HANDOVER_PID_ENV_VARIABLE), "The PID of the previous child should have been passed to the new agent")
+        self.assertIsNone(self.update_handler._handover_pid)
+        restart_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.AgentUpgrade]
+        self.assertEqual(1, len(restart_events), "Expected one event for the relaunch of the agent. Events: {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(restart_events[0]["message"], r"launched \d+ ms after the previous ext-handler requested a handover to update the agent \(handover requested\)")
+
+    def test_request_handover_should_notify_the_daemon(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            with patch.dict(os.environ, {_HANDOVER_FD_ENV_VARIABLE: ustr(write_fd)}):
+                self.update_handler._handover_fd = UpdateHandler._get_handover_fd()
+                self.assertNotIn(_HANDOVER_FD_ENV_VARIABLE, os.environ, "The handover fd should have been removed from the environment")
+
+            self.update_handler._request_handover()
+
+            self.assertIsNone(self.update_handler._handover_fd)
+            self.assertEqual(b"handover\n", os.read(read_fd, 64))
+            self.assertEqual(b"", os.read(read_fd, 64), "The handover pipe should have been closed")
+        finally:
+            os.close(read_fd)
+
+    def test_new_agent_should_wait_for_the_previous_agent_before_initializing_the_goal_state_and_firewall(self):
+        calls = []
+
+        def record(name):
+            return lambda *_, **__: calls.append(name)
+
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            with mock_update_handler(protocol) as update_handler:
+                with patch.object(update_handler, "_ensure_no_orphans", side_effect=record("wait")):
+                    with patch.object(update_handler, "_initialize_goal_state", side_effect=record("goal_state")):
+                        with patch.object(update_handler, "_initialize_firewall", side_effect=record("firewall")):
+                            with patch('azurelinuxagent.ga.update.add_event') as mock_add_event:
+                                with patch.dict(os.environ, {_HANDOVER_PID_ENV_VARIABLE: "1234"}):
+                                    update_handler.run()
+
+        self.assertEqual(["wait", "goal_state", "firewall"], calls, "The new agent should have waited for the previous agent only once, before initializing the goal state and firewall")
+        handover_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.AgentUpgrade]
+        self.assertEqual(1, len(handover_events), "Expected one event for the handover. Events: {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(handover_events[0]["message"], r"Completed the handover from the previous agent \(PID 1234\); waited \d+ ms for it to exit")
+
+    def test_new_agent_should_report_the_status_of_extensions_after_a_handover_on_an_unchanged_goal_state(self):
+        with mock_wire_protocol(DATA_FILE) as protocol:
+            # the previous agent processes the goal state and then requests a handover
+            with mock_update_handler(protocol) as previous_agent:
+                previous_agent.run()
+            read_fd, previous_agent._handover_fd = os.pipe()
+            try:
+                previous_agent._request_handover()
+            finally:
+                os.close(read_fd)
+            protocol.mock_wire_data.status_blobs = []
+
+            # the new agent starts on the same goal state; the previous agent is this process, so skip waiting for it
+            exthandlers_handler = ExtHandlersHandler(protocol)
+            with patch.object(exthandlers_handler, "run", wraps=exthandlers_handler.run) as exthandlers_handler_run:
+                with mock_update_handler(protocol, exthandlers_handler=exthandlers_handler) as new_agent:
+                    with patch.object(new_agent, "_ensure_no_orphans"):
+                        with patch.dict(os.environ, {_HANDOVER_PID_ENV_VARIABLE: ustr(os.getpid())}):
+                            new_agent.run()
+
+            self.assertEqual(1, exthandlers_handler_run.call_count, "The new agent should have run the extension handlers")
+            self.assertEqual(1, len(protocol.mock_wire_data.status_blobs), "The new agent should have reported status")
+            handler_aggregate_status = json.loads(protocol.mock_wire_data.status_blobs[0])["aggregateStatus"]["handlerAggregateStatus"]
+            self.assertEqual(["OSTCExtensions.ExampleHandlerLinux"], [h["handlerName"] for h in handler_aggregate_status],
+                             "The status of the extensions should have been reported after the handover")
 
     def test_run_latest_defaults_to_current(self):
         self.assertEqual(None, self.update_handler.get_latest_agent_greater_than_daemon())
@@ -1311,6 +1462,34 @@ class UpdateHandlerRunTestCase(AgentTestCase):
         update_handler = self._test_run(emit_restart_event=Mock())
         self.assertEqual(1, update_handler._emit_restart_event.call_count)
 
+    def test_run_reports_the_startup_profile(self):
+        with patch('azurelinuxagent.ga.update.add_event') as mock_add_event:
+            self._test_run()
+
+        startup_events = [kw for _, kw in mock_add_event.call_args_list if kw.get("op") == WALAEventOperation.StartupProfile]
+        self.assertEqual(1, len(startup_events), "Expected one startup profile event. Events: {0}".format(mock_add_event.call_args_list))
+        self.assertRegex(
+            startup_events[0]["message"],
+            r"^Startup profile: (load: \d+ ms, )?protocol: \d+ ms, goal_state: \d+ ms, os_info: \d+ ms, firewall: \d+ ms, handlers: \d+ ms, "
+            r"orphans: \d+ ms, initialization: \d+ ms, first_goal_state: \d+ ms; time to first goal state: \d+ ms$")
+
+
+class StartupProfileTestCase(AgentTestCase):
+    def test_it_should_include_the_time_since_the_start_of_the_process(self):
+        phases = StartupProfile().get_phases()
+        self.assertEqual(1, len(phases))
+        self.assertEqual("load", phases[0][0])
+        self.assertGreater(phases[0][1], 0)
+
+    def test_it_should_record_the_duration_of_each_phase(self):
+        with patch("azurelinuxagent.ga.update.StartupProfile._get_process_age", return_value=None):
+            with patch("time.time", side_effect=[100, 101, 103]):
+                profile = StartupProfile()
+                profile.mark("protocol")
+                profile.mark("goal_state")
+
+        self.assertEqual([("protocol", 1), ("goal_state", 2)], profile.get_phases())
+
 
 class TestAgentUpgrade(UpdateTestCase):
 
@@ -1383,6 +1562,8 @@ class TestAgentUpgrade(UpdateTestCase):
         self.assertEqual(1, len(upgrade_event_msgs),
                          "Did not find the event indicating that the agent was upgraded. Got: {0}".format(
                              mock_telemetry.call_args_list))
+        # the reason for the upgrade is left for the daemon, which relaunches the new agent right away
+        self.assertEqual(upgrade_event_msgs[0], fileutil.read_file(os.path.join(conf.get_lib_dir(), AGENT_UPGRADE_EXIT_FILE)))
 
     def __assert_agent_directories_available(self, versions):
         for version in versions:
@@ -1969,10 +2150,10 @@ class TimeMock(Mock):
         self.time_call_count = 0
         self.time_increment = time_increment
 
-        self.sleep_interval = None
+        self.sleep_intervals = []
 
     def sleep(self, n):
-        self.sleep_interval = n
+        self.sleep_intervals.append(n)
 
     def time(self):
         self.time_call_count += 1
@@ -2471,6 +2652,69 @@ class GoalStateIntervalTestCase(AgentTestCase):
                     self.assertEqual(goal_state_period, update_handler._goal_state_period, "Expected the regular goal state period when the goal state does not converge")
 
 
+    def test_goal_state_poll_scheduler_should_back_off_after_the_goal_state_converges(self):
+        scheduler = GoalStatePollScheduler()
+        with patch('azurelinuxagent.common.conf.get_max_goal_state_period', return_value=30):
+            self.assertEqual(6, scheduler.get_next_period(6, converged=False, changed=True), "Expected the goal state period on a new goal state")
+            self.assertEqual(6, scheduler.get_next_period(6, converged=False, changed=False), "Expected the goal state period while extensions are transitioning")
+            self.assertEqual(12, scheduler.get_next_period(6, converged=True, changed=False), "Expected the period to back off once the goal state converged")
+            self.assertEqual(24, scheduler.get_next_period(6, converged=True, changed=False), "Expected the period to back off once the goal state converged")
+            self.assertEqual(30, scheduler.get_next_period(6, converged=True, changed=False), "Expected the period to be capped")
+            self.assertEqual(30, scheduler.get_next_period(6, converged=True, changed=False), "Expected the period to be capped")
+            self.assertEqual(6, scheduler.get_next_period(6, converged=True, changed=True), "Expected the goal state period after a change")
+
+    def test_goal_state_poll_scheduler_should_not_reduce_the_goal_state_period(self):
+        scheduler = GoalStatePollScheduler()
+        with patch('azurelinuxagent.common.conf.get_max_goal_state_period', return_value=30):
+            for _ in range(3):
+                self.assertEqual(GOAL_STATE_PERIOD_EXTENSIONS_DISABLED, scheduler.get_next_period(GOAL_STATE_PERIOD_EXTENSIONS_DISABLED, converged=True, changed=False))
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _capture_goal_state_periods():
+        periods = []
+        original_get_next_period = GoalStatePollScheduler.get_next_period
+
+        def get_next_period(self, *args, **kwargs):
+            periods.append(original_get_next_period(self, *args, **kwargs))
+            return periods[-1]
+
+        with patch.object(GoalStatePollScheduler, "get_next_period", get_next_period):
+            yield periods
+
+    def test_update_handler_should_poll_at_the_goal_state_period_while_extensions_are_transitioning(self):
+        with _mock_exthandlers_handler([ExtensionStatusValue.transitioning] * 5) as exthandlers_handler:
+            with mock_update_handler(exthandlers_handler.protocol, iterations=5, exthandlers_handler=exthandlers_handler) as update_handler:
+                with self._capture_goal_state_periods() as periods:
+                    update_handler.run(debug=True)
+
+                self.assertEqual([update_handler._goal_state_period] * 5, periods, "Expected the goal state period on all iterations")
+
+    def test_update_handler_should_back_off_when_the_goal_state_converged(self):
+        with _mock_exthandlers_handler() as exthandlers_handler:
+            with patch('azurelinuxagent.common.conf.get_max_goal_state_period', return_value=30):
+                with mock_update_handler(exthandlers_handler.protocol, iterations=5, exthandlers_handler=exthandlers_handler) as update_handler:
+                    with self._capture_goal_state_periods() as periods:
+                        update_handler.run(debug=True)
+
+                    period = update_handler._goal_state_period
+                    self.assertEqual([period, min(2 * period, 30), min(4 * period, 30), min(8 * period, 30), min(16 * period, 30)], periods, "Expected an exponential back off")
+
+    def test_update_handler_should_use_the_goal_state_period_after_a_new_goal_state(self):
+        def on_new_iteration(iteration):
+            if iteration == 4:
+                exthandlers_handler.protocol.mock_wire_data.set_incarnation(999)
+
+        with _mock_exthandlers_handler() as exthandlers_handler:
+            with patch('azurelinuxagent.common.conf.get_max_goal_state_period', return_value=1000):
+                with mock_update_handler(exthandlers_handler.protocol, iterations=5, on_new_iteration=on_new_iteration, exthandlers_handler=exthandlers_handler) as update_handler:
+                    with self._capture_goal_state_periods() as periods:
+                        update_handler.run(debug=True)
+
+                    period = update_handler._goal_state_period
+                    self.assertEqual([period, 2 * period, 4 * period, period, 2 * period], periods, "Expected the goal state period after the new goal state")
+
+
 class ExtensionsSummaryTestCase(AgentTestCase):
     @staticmethod
     def _create_extensions_summary(extension_statuses):
@@ -18,6 +18,7 @@
 import os
 import platform
 import azurelinuxagent.common.event as event
+from azurelinuxagent.common.utils.spoolutil import read_segment
 from azurelinuxagent.common.version import DISTRO_NAME, DISTRO_VERSION, DISTRO_CODE_NAME
 import tests.lib.tools as tools
 from tests.lib import wire_protocol_data
@@ -57,6 +58,23 @@ class EventLoggerTools(object):
             with tools.patch("azurelinuxagent.common.event.get_imds_client", return_value=mock_imds_client):
                 event.initialize_event_logger_vminfo_common_parameters_and_protocol(mock_protocol)
 
+    @staticmethod
+    def get_saved_events(event_dir):
+        """
+        Returns the text of the events saved in the given directory, both in the event spool and in event files, in
+        the order they were saved. The events are not removed from the directory.
+        """
+        saved_events = []
+        for name in sorted(os.listdir(event_dir)):
+            path = os.path.join(event_dir, name)
+            if name.endswith(event.AGENT_EVENT_SPOOL_EXTENSION):
+                records, _ = read_segment(path)
+                saved_events.extend([r.decode("utf-8") for r in records])
+            elif event.EVENT_FILE_REGEX.search(name) is not None:
+                with open(path, "rb") as event_file:
+                    saved_events.append(event_file.read().decode("utf-8"))
+        return saved_events
+
     @staticmethod
     def get_expected_os_version():
         """
@@ -45,14 +45,24 @@ Debug.CgroupCheckPeriod = 300
 Debug.CgroupDisableOnProcessCheckFailure = True
 Debug.CgroupDisableOnQuotaCheckFailure = True
 Debug.CgroupLogMetrics = False
+Debug.CgroupSamplingPeriod = 15
+Debug.EnableAgentHandover = False
 Debug.EnableAgentMemoryUsageCheck = False
+Debug.EnableCgroupPressureThrottling = False
 Debug.EnableCgroupV2ResourceLimiting = False
+Debug.EnableExtensionOutputStreaming = False
 Debug.EnableExtensionPolicy = True
 Debug.EnableFastTrack = True
 Debug.EnableGAVersioning = True
+Debug.EnableIncrementalLogCollection = False
 Debug.EtpCollectionPeriod = 300
+Debug.ExtensionsMaxParallelism = 1
 Debug.FirewallRulesLogPeriod = 86400
+Debug.LogCollectorCompressionLevel = 6
+Debug.LogCollectorFullCollectionPeriod = 86400
 Debug.LogCollectorInitialDelay = 300
+Debug.MaxGoalStatePeriod = 30
+Debug.StatusHeartbeatPeriod = 60
 DetectScvmmEnv = False
 EnableOverProvisioning = True
 Extension.LogDir = /var/log/azure